@@ -0,0 +1,207 @@
+"""
+Benchmarks the stages of the transmit pipeline offline: preprocess, inference, NMS, annotate and encode,
+on synthetic frames or on frames read from a video or a folder of images, writing to a null or file sink
+instead of the RTSP server.
+
+Every combination of --weights (one per backend), --imgsz, --threads and --batch-size is measured and
+reported as the FPS and the p50/p95/p99 latency of each stage. The results can be saved as JSON and
+compared against the results of a previous run, failing if any run regressed more than --max-regression.
+
+Usage:
+    $ python benchmark.py --weights yolov5s.pt yolov5s.onnx --imgsz 320 640 --threads 2 4 --output results.json
+    $ python benchmark.py --weights yolov5s.pt --source video.mp4 --sink file:///tmp/out.mp4
+    $ python benchmark.py --weights yolov5s.pt --baseline results.json --max-regression 0.1
+"""
+
+import argparse
+import itertools
+import logging
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from utils.augmentations import letterbox
+from utils.dataloaders import IMG_FORMATS
+from utils.general import Profile, check_img_size, non_max_suppression, print_args
+
+from src.image_processor.benchmark_report import compare, load_results, save_results, summarize_run
+from transmit import annotate_detections, build_streamer, load_model
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('preprocess', 'inference', 'nms', 'annotate', 'encode_write')
+
+
+def load_frames(source, limit, width, height, seed=0):
+    """
+    Returns the frames cycled through by the benchmark, at most limit of them.
+    Without a source they are random noise of width x height, otherwise they are read
+    from a folder of images or a video file.
+    """
+    if source is None:
+        rng = np.random.default_rng(seed)
+        return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(limit)]
+    path = Path(source)
+    if path.is_dir():
+        frames = [cv2.imread(str(p)) for p in sorted(path.iterdir()) if p.suffix[1:].lower() in IMG_FORMATS]
+        frames = frames[:limit]
+    else:
+        frames = []
+        cap = cv2.VideoCapture(str(path))
+        while len(frames) < limit:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        raise FileNotFoundError(f'No frames found in {source}')
+    return frames
+
+
+def benchmark(model, names, frames, imgsz, batch_size, warmup, measured, sink, stream_queue_size,
+              conf_thres, iou_thres, max_det):
+    """
+    Runs warmup + measured batches through the stages of the transmit pipeline in order.
+    Returns the number of measured frames, the measured wall time and the latencies of each stage per frame.
+    """
+    height, width = frames[0].shape[:2]
+    streamer = build_streamer(sink, width, height, 30, stream_queue_size)
+    streamer.start_stream()
+    samples = {stage: [] for stage in STAGES}
+    frame_cycle = itertools.cycle(frames)
+    dt = {stage: Profile() for stage in STAGES}
+    measured_frames, started = 0, None
+    try:
+        for i in range(warmup + measured):
+            if i == warmup:
+                samples = {stage: [] for stage in STAGES}
+                started = time.perf_counter()
+            batch = [next(frame_cycle) for _ in range(batch_size)]
+
+            with dt['preprocess']:
+                im = np.stack([letterbox(frame, imgsz, stride=model.stride, auto=False)[0] for frame in batch])
+                im = np.ascontiguousarray(im.transpose((0, 3, 1, 2))[:, ::-1])  # BHWC to BCHW, BGR to RGB
+                im = torch.from_numpy(im).to(model.device)
+                im = im.half() if model.fp16 else im.float()
+                im /= 255
+            with dt['inference']:
+                pred = model(im)
+            with dt['nms']:
+                pred = non_max_suppression(pred, conf_thres, iou_thres, max_det=max_det)
+            # Each stage is reported per frame, as in the workers
+            for stage in ('preprocess', 'inference', 'nms'):
+                samples[stage].extend([dt[stage].dt / batch_size] * batch_size)
+
+            for det, frame in zip(pred, batch):
+                with dt['annotate']:
+                    im0, _ = annotate_detections(det, im.shape[2:], frame.copy(), names)
+                samples['annotate'].append(dt['annotate'].dt)
+                with dt['encode_write']:
+                    streamer.next_frame(im0)
+                samples['encode_write'].append(dt['encode_write'].dt)
+            if i >= warmup:
+                measured_frames += batch_size
+    finally:
+        streamer.stop_stream()
+    return measured_frames, time.perf_counter() - started, samples
+
+
+@torch.no_grad()
+def run(
+        weights=('yolov5s.pt',),
+        source=None,
+        imgsz=(640,),
+        threads=(0,),
+        batch_size=(1,),
+        frame_size=(1280, 720),
+        frames=100,
+        warmup=10,
+        measured=100,
+        sink='null://',
+        stream_queue_size=2,
+        device='',
+        half=False,
+        dnn=False,
+        data=None,
+        conf_thres=0.25,
+        iou_thres=0.45,
+        max_det=1000,
+        output=None,
+        baseline=None,
+        max_regression=0.1,
+):
+    source_frames = load_frames(source, frames, *frame_size)
+    results = []
+    for weights_path in weights:
+        # The model is loaded once per backend, its input size is given on each call
+        model, _ = load_model(weights_path, device, dnn, data, half, max(imgsz))
+        for size, n_threads, bs in itertools.product(imgsz, threads, batch_size):
+            size = check_img_size(size, s=model.stride)
+            if n_threads > 0:
+                torch.set_num_threads(n_threads)
+            config = {
+                'weights': Path(weights_path).name,
+                'imgsz': size,
+                'threads': torch.get_num_threads(),
+                'batch_size': bs,
+                'half': half,
+                'sink': sink.split(':')[0],
+            }
+            n, elapsed, samples = benchmark(model, model.names, source_frames, (size, size), bs, warmup, measured,
+                                            sink, stream_queue_size, conf_thres, iou_thres, max_det)
+            result = summarize_run(config, n, elapsed, samples)
+            logger.info('%s: %.1f FPS, %s', config, result['fps'], ', '.join(
+                f"{stage} p50/p95/p99 {s['p50']:.1f}/{s['p95']:.1f}/{s['p99']:.1f}ms"
+                for stage, s in result['stages'].items()))
+            results.append(result)
+
+    if output is not None:
+        save_results(output, results)
+    if baseline is None:
+        return results, []
+    comparisons = compare(results, load_results(baseline), max_regression)
+    for comparison in comparisons:
+        logger.info('%s %s: %.2fx FPS, p95 %s', 'REGRESSED' if comparison['regressed'] else 'ok',
+                    comparison['config'], comparison['fps_ratio'],
+                    {stage: round(ratio, 2) for stage, ratio in comparison['p95_ratios'].items()})
+    return results, [comparison for comparison in comparisons if comparison['regressed']]
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', nargs='+', type=str, default=['yolov5s.pt'], help='models, one per backend')
+    parser.add_argument('--source', type=str, default=None, help='video or folder of images, synthetic if unset')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[640], help='inference sizes')
+    parser.add_argument('--threads', nargs='+', type=int, default=[0], help='torch threads, 0 keeps the default')
+    parser.add_argument('--batch-size', nargs='+', type=int, default=[1], help='frames per inference')
+    parser.add_argument('--frame-size', nargs=2, type=int, default=[1280, 720], help='synthetic frames width height')
+    parser.add_argument('--frames', type=int, default=100, help='distinct frames cycled through')
+    parser.add_argument('--warmup', type=int, default=10, help='batches run before measuring')
+    parser.add_argument('--measured', type=int, default=100, help='batches measured')
+    parser.add_argument('--sink', type=str, default='null://', help='null:// or file://<path> of the encoded video')
+    parser.add_argument('--stream-queue-size', type=int, default=2,
+                        help='frames buffered for the sink writer thread, 0 to encode in the benchmark thread')
+    parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
+    parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
+    parser.add_argument('--data', type=str, default=None, help='dataset.yaml path of the class names')
+    parser.add_argument('--conf-thres', type=float, default=0.25, help='confidence threshold')
+    parser.add_argument('--iou-thres', type=float, default=0.45, help='NMS IoU threshold')
+    parser.add_argument('--max-det', type=int, default=1000, help='maximum detections per image')
+    parser.add_argument('--output', type=str, default=None, help='where to save the results as JSON')
+    parser.add_argument('--baseline', type=str, default=None, help='results of a previous run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help='FPS drop or p95 growth tolerated against the baseline')
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    _, regressions = run(**vars(parse_opt()))
+    sys.exit(1 if regressions else 0)
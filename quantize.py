@@ -0,0 +1,237 @@
+"""
+Quantizes an ONNX export of YOLOv5 to INT8 with ONNX Runtime static quantization,
+calibrating the activations over a folder of sample frames, and compares the
+INT8 model against the FP32 weights on the same frames.
+
+The comparison reports the person count agreement and the mAP delta, the frames can have
+YOLO format labels in <frames>/labels/<frame name>.txt, without them the FP32 detections are
+used as the ground truth, so map50_fp32 is 1 and map50_delta measures how far INT8 drifts from FP32.
+
+Usage:
+    $ python quantize.py --weights yolov5s.pt --onnx yolov5s.onnx --output yolov5s_int8.onnx \
+                         --frames calibration/ --imgsz 640 --report comparison.json
+    $ python quantize.py --weights yolov5s.pt --output yolov5s_int8.onnx --frames frames/ --compare-only
+"""
+
+import argparse
+import json
+import logging
+import re
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
+from utils.dataloaders import IMG_FORMATS
+from utils.general import non_max_suppression, print_args, scale_boxes, xywhn2xyxy
+from utils.metrics import ap_per_class
+from utils.torch_utils import select_device
+from val import process_batch
+
+logger = logging.getLogger(__name__)
+
+PERSON_CLASS = 0
+
+
+def load_frame_paths(frames_dir, limit=None):
+    """Returns the sorted image files of frames_dir, at most limit of them."""
+    frame_paths = sorted(
+        path for path in Path(frames_dir).iterdir()
+        if path.suffix[1:].lower() in IMG_FORMATS
+    )
+    if not frame_paths:
+        raise FileNotFoundError(f'No frames found in {frames_dir}')
+    return frame_paths[:limit] if limit else frame_paths
+
+
+def preprocess(frame, imgsz, stride=32):
+    """Letterboxes a BGR frame to imgsz and returns it as a 1x3xHxW float32 RGB array."""
+    im = letterbox(frame, imgsz, stride=stride, auto=False)[0]
+    im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+    return np.ascontiguousarray(im, dtype=np.float32)[None] / 255
+
+
+def detect_head_nodes(onnx_path):
+    """
+    Returns the nodes of the Detect module, the last module of the model.
+    They decode the box coordinates and lose too much precision when quantized.
+    """
+    import onnx
+
+    names = [node.name for node in onnx.load(str(onnx_path)).graph.node]
+    modules = [int(match.group(1)) for name in names for match in [re.search(r'/model\.(\d+)/', name)] if match]
+    if not modules:
+        return []
+    head = f'/model.{max(modules)}/'
+    return [name for name in names if head in name]
+
+
+def quantize(onnx_path, output_path, frame_paths, imgsz, per_channel=True):
+    """Statically quantizes the FP32 ONNX model, calibrating over frame_paths."""
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnxruntime.InferenceSession(
+        str(onnx_path), providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class FrameCalibrationReader(CalibrationDataReader):
+
+        def __init__(self):
+            self.frames = iter(frame_paths)
+
+        def get_next(self):
+            path = next(self.frames, None)
+            if path is None:
+                return None
+            return {input_name: preprocess(cv2.imread(str(path)), imgsz)}
+
+    logger.info('Calibrating %s over %d frames', onnx_path, len(frame_paths))
+    quantize_static(
+        str(onnx_path),
+        str(output_path),
+        FrameCalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=per_channel,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        nodes_to_exclude=detect_head_nodes(onnx_path)
+    )
+    logger.info('INT8 model saved to %s', output_path)
+
+
+def load_labels(frame_path, shape):
+    """Returns the labels of a frame as (class, x1, y1, x2, y2) in pixels, None if it has none."""
+    label_path = frame_path.parent / 'labels' / f'{frame_path.stem}.txt'
+    if not label_path.is_file():
+        return None
+    labels = np.loadtxt(label_path, ndmin=2, dtype=np.float32).reshape(-1, 5)
+    labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w=shape[1], h=shape[0])
+    return torch.from_numpy(labels)
+
+
+def detect(weights, frame_paths, imgsz, device, conf_thres, iou_thres, classes):
+    """
+    Runs the model over the frames.
+    Returns the detections of each frame in pixels of the frame and the mean inference time in ms.
+    """
+    model = DetectMultiBackend(weights, device=device)
+    model.warmup(imgsz=(1, 3, *imgsz))
+    detections, seconds = [], 0.0
+    for path in frame_paths:
+        frame = cv2.imread(str(path))
+        im = torch.from_numpy(preprocess(frame, imgsz, model.stride)).to(model.device)
+        started = time.perf_counter()
+        pred = model(im)
+        seconds += time.perf_counter() - started
+        det = non_max_suppression(pred, conf_thres, iou_thres, classes)[0].cpu()
+        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], frame.shape).round()
+        detections.append(det)
+    return detections, seconds / len(frame_paths) * 1E3
+
+
+def map50(detections, labels):
+    """Returns the mAP@0.5 of the detections against the labels."""
+    iouv = torch.linspace(0.5, 0.95, 10)
+    stats = []
+    for det, frame_labels in zip(detections, labels):
+        correct = process_batch(det, frame_labels, iouv) if len(det) else torch.zeros(0, iouv.numel(), dtype=torch.bool)
+        stats.append((correct, det[:, 4], det[:, 5], frame_labels[:, 0]))
+    tp, conf, pred_cls, target_cls = (torch.cat(x, 0).numpy() for x in zip(*stats))
+    if not len(target_cls):
+        return 1.0 if not len(tp) else 0.0
+    ap = ap_per_class(tp, conf, pred_cls, target_cls)[5]
+    return float(ap[:, 0].mean()) if len(ap) else 0.0
+
+
+def person_count(det):
+    return int((det[:, 5] == PERSON_CLASS).sum())
+
+
+def compare(reference, candidate, labels):
+    """
+    Compares the candidate detections against the reference ones.
+    Without labels the reference detections are the ground truth.
+    """
+    if labels is None:
+        labels = [torch.cat((det[:, 5:6], det[:, :4]), 1) for det in reference]
+    reference_counts = np.array([person_count(det) for det in reference])
+    candidate_counts = np.array([person_count(det) for det in candidate])
+    reference_map = map50(reference, labels)
+    candidate_map = map50(candidate, labels)
+    return {
+        'frames': len(reference),
+        'count_agreement': float((reference_counts == candidate_counts).mean()),
+        'mean_count_error': float(np.abs(reference_counts - candidate_counts).mean()),
+        'map50_fp32': reference_map,
+        'map50_int8': candidate_map,
+        'map50_delta': candidate_map - reference_map,
+    }
+
+
+def run(
+        weights='yolov5s.pt',  # FP32 reference weights
+        onnx=None,  # FP32 ONNX export to quantize
+        output='yolov5s_int8.onnx',  # INT8 model path
+        frames='calibration',  # folder of sample frames
+        imgsz=(640, 640),  # inference size (height, width)
+        calibration_frames=300,  # maximum frames used to calibrate
+        conf_thres=0.25,  # confidence threshold
+        iou_thres=0.45,  # NMS IoU threshold
+        classes=(PERSON_CLASS,),  # filter by class
+        per_channel=True,  # quantize the weights per channel
+        compare_only=False,  # only compare an existing INT8 model
+        report=None,  # where to save the comparison as JSON
+):
+    frame_paths = load_frame_paths(frames)
+    if not compare_only:
+        quantize(onnx, output, frame_paths[:calibration_frames], imgsz, per_channel)
+
+    device = select_device('cpu')
+    reference, fp32_ms = detect(weights, frame_paths, imgsz, device, conf_thres, iou_thres, classes)
+    candidate, int8_ms = detect(output, frame_paths, imgsz, device, conf_thres, iou_thres, classes)
+
+    labels = [load_labels(path, cv2.imread(str(path)).shape) for path in frame_paths]
+    labeled = all(label is not None for label in labels)
+    comparison = compare(reference, candidate, labels if labeled else None)
+    comparison.update({
+        'labeled': labeled,
+        'fp32_ms': fp32_ms,
+        'int8_ms': int8_ms,
+        'speedup': fp32_ms / int8_ms if int8_ms else 0.0,
+    })
+    logger.info('INT8 comparison: %s', comparison)
+    if report is not None:
+        with open(report, 'w') as report_file:
+            json.dump(comparison, report_file, indent=2)
+    return comparison
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='yolov5s.pt', help='FP32 reference weights')
+    parser.add_argument('--onnx', type=str, default=None, help='FP32 ONNX export to quantize')
+    parser.add_argument('--output', type=str, default='yolov5s_int8.onnx', help='INT8 model path')
+    parser.add_argument('--frames', type=str, default='calibration', help='folder of sample frames')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[640], help='inference size h,w')
+    parser.add_argument('--calibration-frames', type=int, default=300, help='maximum frames used to calibrate')
+    parser.add_argument('--conf-thres', type=float, default=0.25, help='confidence threshold')
+    parser.add_argument('--iou-thres', type=float, default=0.45, help='NMS IoU threshold')
+    parser.add_argument('--classes', nargs='+', type=int, default=[PERSON_CLASS], help='filter by class')
+    parser.add_argument('--no-per-channel', dest='per_channel', action='store_false',
+                        help='quantize the weights per tensor')
+    parser.add_argument('--compare-only', action='store_true', help='only compare an existing INT8 model')
+    parser.add_argument('--report', type=str, default=None, help='where to save the comparison as JSON')
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    if not opt.compare_only and opt.onnx is None:
+        parser.error('--onnx is required to quantize')
+    print_args(vars(opt))
+    return opt
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    run(**vars(parse_opt()))
@@ -8,11 +8,20 @@ from src.config import (
 )
 from src.docker_manager.docker_init import ProcessingMode
 from src.config.app import get_app_config
-from src.rabbitmq.rabbit_init import consume_control_messages
+from src.rabbitmq.rabbit_init import consume_control_messages, consume_metric_events
 from src.instance_manager.instance.instance_dao import InstanceDAOFactory
 from src.instance_manager.instance.instance_service import InstanceService
+from src.instance_manager.operation.operation_dao import OperationDAOFactory
+from src.instance_manager.operation.operation_service import OperationService
 from src.docker_manager.docker_api import DockerApi
-from psycopg_pool import AsyncConnectionPool
+from src.docker_manager.model_cache import ModelCache
+from src.docker_manager.stream_assigner import StreamAssigner
+from src.docker_manager.warm_pool import WarmWorkerPool
+from src.database.datasource import DataSource
+from src.database.metric_partitions import MetricPartitionMaintainer
+from src.database.metric_rollups import MetricRollupJob
+from src.database.migrator import apply_migrations
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 import asyncio
 import logging
 import docker
@@ -35,6 +44,10 @@ async def main():
         f"@{database_cfg['host']}:{database_cfg['port']}"
     )
 
+    with DataSource(database_url).get_connection() as connection:
+        applied = apply_migrations(connection)
+    logging.info(f"Applied {len(applied)} database migrations")
+
     # if no file at /docker/models/yolov5s.pt download it
     logging.info("Checking if yolov5s.pt exists")
     if not os.path.isfile('./docker/models/yolov5s.pt'):
@@ -52,20 +65,99 @@ async def main():
     docker_processing_mode = ProcessingMode[hardware_accel_mode]
     # TODO: Fazer constante para o min_size
 
+    worker_cfg = app_cfg["worker"]
+    model_settings = docker_init.model_settings(hardware_acceleration_cfg)
+    model_cache = ModelCache(
+        hardware_acceleration_cfg["model_cache_dir"],
+        './docker/models/yolov5s.pt',
+        docker_build_args["tag"],
+        calibration_dir=hardware_acceleration_cfg["calibration_dir"],
+        min_count_agreement=hardware_acceleration_cfg[
+            "int8_min_count_agreement"
+        ]
+    )
+    # Multi-stream workers infer a batch with a frame of each device
+    exported_model = model_cache.select(
+        model_settings["backends"],
+        model_settings["imgsz"],
+        dynamic=worker_cfg["streams_per_container"] > 1
+    )
+    logging.info(f"Workers will use the {exported_model.backend.name} model")
+
+    docker_api = DockerApi(
+        docker_build_args["tag"],
+        docker_processing_mode,
+        worker_cfg["control_dir"],
+        exported_model,
+        model_cache.cache_dir,
+        worker_cfg["output_mode"],
+        worker_cfg["metric_spool_dir"],
+        worker_cfg["metric_transport"]
+    )
+    stream_assigner = None
+    if worker_cfg["warm_pool_size"] > 0:
+        # Devices are assigned to idle workers that already loaded the model
+        stream_assigner = WarmWorkerPool(
+            docker_api,
+            worker_cfg["streams_per_container"],
+            worker_cfg["warm_pool_size"],
+            worker_cfg["warm_pool_min_size"],
+            worker_cfg["warm_pool_idle_timeout"]
+        )
+        await stream_assigner.start()
+    elif worker_cfg["streams_per_container"] > 1:
+        stream_assigner = StreamAssigner(
+            docker_api,
+            worker_cfg["streams_per_container"]
+        )
+
     async with AsyncConnectionPool(database_url, min_size=5) as conn_manager:
         instance_service = InstanceService(
             conn_manager,
             InstanceDAOFactory(),
             ProcessedStreamDAOFactory(),
-            DockerApi(
-                docker_build_args["tag"],
-                docker_processing_mode
-            )
+            docker_api,
+            stream_assigner
         )
-        await consume_control_messages(
-            app_cfg["rabbitmq"],
-            instance_service
+        metric_storage_cfg = app_cfg["metric_storage"]
+        metric_partitions = MetricPartitionMaintainer(
+            conn_manager,
+            metric_storage_cfg["retention_days"],
+            metric_storage_cfg["premake_days"],
+            metric_storage_cfg["maintenance_interval"]
         )
+        metric_rollup_cfg = app_cfg["metric_rollup"]
+        metric_rollups = MetricRollupJob(
+            conn_manager,
+            metric_rollup_cfg["interval"],
+            metric_rollup_cfg["lag"],
+            metric_rollup_cfg["max_step_hours"],
+            metric_rollup_cfg["minute_retention_days"],
+            metric_rollup_cfg["hour_retention_days"],
+            metric_rollup_cfg["day_retention_days"]
+        )
+        operation_service = OperationService(conn_manager, OperationDAOFactory())
+        consumers = [consume_control_messages(
+            app_cfg["rabbitmq"],
+            instance_service,
+            operation_service
+        ), metric_partitions.run(), metric_rollups.run()]
+        ingest_pool = None
+        if worker_cfg["metric_transport"] == "broker":
+            # The only connections the metrics of all the workers are written with
+            ingest_pool = ConnectionPool(database_url, min_size=1, max_size=2)
+            consumers.append(consume_metric_events(
+                app_cfg["rabbitmq"],
+                app_cfg["metric_ingest"],
+                ingest_pool
+            ))
+        try:
+            await asyncio.gather(*consumers)
+        finally:
+            if isinstance(stream_assigner, WarmWorkerPool):
+                await stream_assigner.stop()
+            if ingest_pool is not None:
+                ingest_pool.close()
 
 
 if __name__ == "__main__":
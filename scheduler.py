@@ -8,6 +8,7 @@ from src.config.app import get_app_config
 from src.docker_manager.docker_api import DockerApi
 from src.docker_manager.docker_init import ProcessingMode
 from src.docker_manager.scheduler.service import SchedulerService
+from src.docker_manager.stream_assigner import StreamAssigner
 from src.instance_manager.instance.exceptions import InternalError
 from src.instance_manager.instance.instance_service import InstanceService
 from src.instance_manager.instance.instance_dao import InstanceDAOFactory
@@ -80,14 +81,23 @@ async def main():
     rabbit_url = f"amqp://{rbt_user}:{rbt_pass}@{rbt_host}:{rbt_port}/"
     logger.debug(f"RabbitMQ Built URL: {rabbit_url}")
 
+    worker_cfg = app_cfg["worker"]
+
     async with AsyncConnectionPool(database_url) as connection_manager:
-        docker_api = DockerApi(None, ProcessingMode.CPU)
+        docker_api = DockerApi(None, ProcessingMode.CPU, worker_cfg["control_dir"])
+        stream_assigner = None
+        if worker_cfg["streams_per_container"] > 1:
+            stream_assigner = StreamAssigner(
+                docker_api,
+                worker_cfg["streams_per_container"]
+            )
 
         instance_service = InstanceService(
             connection_manager,
             InstanceDAOFactory(),
             ProcessedStreamDAOFactory(),
-            docker_api
+            docker_api,
+            stream_assigner
         )
 
         rb_connection_manager = AsyncRabbitMQManager(rabbit_url)
@@ -98,7 +108,8 @@ async def main():
             InstanceDAOFactory(),
             docker_api,
             rabbit_client,
-            rbt_scheduler_notification_queue_name
+            rbt_scheduler_notification_queue_name,
+            stream_assigner
         )
 
         scheduler = Scheduler(
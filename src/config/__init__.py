@@ -13,11 +13,60 @@ from src.config.constants import (
     RABBITMQ_CONTROLLER_QUEUE_KEY,
     RABBITMQ_ACK_STATUS_QUEUE_KEY,
     RABBITMQ_SCHEDULER_NOTIFICATION_KEY,
+    RABBITMQ_METRICS_EXCHANGE_KEY,
+    RABBITMQ_METRICS_QUEUE_KEY,
+    RABBITMQ_COMMAND_CONCURRENCY_KEY,
+    RABBITMQ_COMMAND_PREFETCH_KEY,
+    RABBITMQ_COMMAND_TTL_KEY,
+    RABBITMQ_CONTROL_CONCURRENCY_KEY,
+    METRIC_INGEST_SECTION,
+    METRIC_INGEST_BATCH_SIZE_KEY,
+    METRIC_INGEST_FLUSH_INTERVAL_KEY,
+    METRIC_INGEST_MAX_BATCH_FAILURES_KEY,
+    METRIC_INGEST_MAX_FAILURE_SECONDS_KEY,
+    METRIC_STORAGE_SECTION,
+    METRIC_STORAGE_RETENTION_DAYS_KEY,
+    METRIC_STORAGE_PREMAKE_DAYS_KEY,
+    METRIC_STORAGE_MAINTENANCE_INTERVAL_KEY,
+    METRIC_ROLLUP_SECTION,
+    METRIC_ROLLUP_INTERVAL_KEY,
+    METRIC_ROLLUP_LAG_KEY,
+    METRIC_ROLLUP_MAX_STEP_HOURS_KEY,
+    METRIC_ROLLUP_MINUTE_RETENTION_DAYS_KEY,
+    METRIC_ROLLUP_HOUR_RETENTION_DAYS_KEY,
+    METRIC_ROLLUP_DAY_RETENTION_DAYS_KEY,
     HARDWARE_ACCELERATION_SECTION,
     HARDWARE_ACCELERATION_PROCESSING_MODE_KEY,
     HARDWARE_ACCELERATION_CUDA_VERSION_KEY,
+    HARDWARE_ACCELERATION_MODEL_BACKEND_KEY,
+    HARDWARE_ACCELERATION_MODEL_IMGSZ_KEY,
+    HARDWARE_ACCELERATION_MODEL_CACHE_DIR_KEY,
+    HARDWARE_ACCELERATION_CALIBRATION_DIR_KEY,
+    HARDWARE_ACCELERATION_INT8_MIN_AGREEMENT_KEY,
     MEDIA_SERVER_SECTION,
     MEDIA_SERVER_DESTINATION_HOST_KEY,
     MEDIA_SERVER_WRITE_USER_KEY,
-    MEDIA_SERVER_WRITE_PASSWORD_KEY
+    MEDIA_SERVER_WRITE_PASSWORD_KEY,
+    METADATA_CHANNEL_SECTION,
+    METADATA_CHANNEL_HOST_KEY,
+    METADATA_CHANNEL_PORT_KEY,
+    METRIC_WRITER_SECTION,
+    METRIC_WRITER_FLUSH_INTERVAL_KEY,
+    METRIC_WRITER_MAX_PENDING_KEY,
+    METRIC_WRITER_OVERFLOW_POLICY_KEY,
+    METRIC_WRITER_SPOOL_MAX_BYTES_KEY,
+    METRIC_WRITER_SPOOL_SEGMENT_BYTES_KEY,
+    METRIC_SMOOTHING_SECTION,
+    METRIC_SMOOTHING_MODE_KEY,
+    METRIC_SMOOTHING_WINDOW_KEY,
+    METRIC_SMOOTHING_MIN_DWELL_KEY,
+    WORKER_SECTION,
+    WORKER_STREAMS_PER_CONTAINER_KEY,
+    WORKER_CONTROL_DIR_KEY,
+    WORKER_OUTPUT_MODE_KEY,
+    WORKER_WARM_POOL_SIZE_KEY,
+    WORKER_WARM_POOL_MIN_SIZE_KEY,
+    WORKER_WARM_POOL_IDLE_TIMEOUT_KEY,
+    WORKER_METRIC_SPOOL_DIR_KEY,
+    WORKER_METRIC_TRANSPORT_KEY
 )
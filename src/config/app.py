@@ -1,4 +1,9 @@
-from config.constants import MEDIA_SERVER_RTSPS_PORT_KEY, MEDIA_SERVER_SECURE_KEY, MEDIA_SERVER_RTSP_PORT_KEY
+from config.constants import (
+    MEDIA_SERVER_RTSPS_PORT_KEY,
+    MEDIA_SERVER_SECURE_KEY,
+    MEDIA_SERVER_RTSP_PORT_KEY,
+    MEDIA_SERVER_API_URL_KEY
+)
 from src.config import (
     DATABASE_SECTION,
     DATABASE_USER_KEY,
@@ -13,13 +18,62 @@ from src.config import (
     RABBITMQ_CONTROLLER_QUEUE_KEY,
     RABBITMQ_ACK_STATUS_QUEUE_KEY,
     RABBITMQ_SCHEDULER_NOTIFICATION_KEY,
+    RABBITMQ_METRICS_EXCHANGE_KEY,
+    RABBITMQ_METRICS_QUEUE_KEY,
+    RABBITMQ_COMMAND_CONCURRENCY_KEY,
+    RABBITMQ_COMMAND_PREFETCH_KEY,
+    RABBITMQ_COMMAND_TTL_KEY,
+    RABBITMQ_CONTROL_CONCURRENCY_KEY,
+    METRIC_INGEST_SECTION,
+    METRIC_INGEST_BATCH_SIZE_KEY,
+    METRIC_INGEST_FLUSH_INTERVAL_KEY,
+    METRIC_INGEST_MAX_BATCH_FAILURES_KEY,
+    METRIC_INGEST_MAX_FAILURE_SECONDS_KEY,
+    METRIC_STORAGE_SECTION,
+    METRIC_STORAGE_RETENTION_DAYS_KEY,
+    METRIC_STORAGE_PREMAKE_DAYS_KEY,
+    METRIC_STORAGE_MAINTENANCE_INTERVAL_KEY,
+    METRIC_ROLLUP_SECTION,
+    METRIC_ROLLUP_INTERVAL_KEY,
+    METRIC_ROLLUP_LAG_KEY,
+    METRIC_ROLLUP_MAX_STEP_HOURS_KEY,
+    METRIC_ROLLUP_MINUTE_RETENTION_DAYS_KEY,
+    METRIC_ROLLUP_HOUR_RETENTION_DAYS_KEY,
+    METRIC_ROLLUP_DAY_RETENTION_DAYS_KEY,
     HARDWARE_ACCELERATION_SECTION,
     HARDWARE_ACCELERATION_PROCESSING_MODE_KEY,
     HARDWARE_ACCELERATION_CUDA_VERSION_KEY,
+    HARDWARE_ACCELERATION_MODEL_BACKEND_KEY,
+    HARDWARE_ACCELERATION_MODEL_IMGSZ_KEY,
+    HARDWARE_ACCELERATION_MODEL_CACHE_DIR_KEY,
+    HARDWARE_ACCELERATION_CALIBRATION_DIR_KEY,
+    HARDWARE_ACCELERATION_INT8_MIN_AGREEMENT_KEY,
     MEDIA_SERVER_SECTION,
     MEDIA_SERVER_DESTINATION_HOST_KEY,
     MEDIA_SERVER_WRITE_USER_KEY,
     MEDIA_SERVER_WRITE_PASSWORD_KEY,
+    METADATA_CHANNEL_SECTION,
+    METADATA_CHANNEL_HOST_KEY,
+    METADATA_CHANNEL_PORT_KEY,
+    METRIC_WRITER_SECTION,
+    METRIC_WRITER_FLUSH_INTERVAL_KEY,
+    METRIC_WRITER_MAX_PENDING_KEY,
+    METRIC_WRITER_OVERFLOW_POLICY_KEY,
+    METRIC_WRITER_SPOOL_MAX_BYTES_KEY,
+    METRIC_WRITER_SPOOL_SEGMENT_BYTES_KEY,
+    METRIC_SMOOTHING_SECTION,
+    METRIC_SMOOTHING_MODE_KEY,
+    METRIC_SMOOTHING_WINDOW_KEY,
+    METRIC_SMOOTHING_MIN_DWELL_KEY,
+    WORKER_SECTION,
+    WORKER_STREAMS_PER_CONTAINER_KEY,
+    WORKER_CONTROL_DIR_KEY,
+    WORKER_OUTPUT_MODE_KEY,
+    WORKER_WARM_POOL_SIZE_KEY,
+    WORKER_WARM_POOL_MIN_SIZE_KEY,
+    WORKER_WARM_POOL_IDLE_TIMEOUT_KEY,
+    WORKER_METRIC_SPOOL_DIR_KEY,
+    WORKER_METRIC_TRANSPORT_KEY,
 )
 from src.config.constants import RABBITMQ_SCHEDULER_NOTIFICATION_KEY
 
@@ -55,6 +109,113 @@ def get_app_config(config_parser):
         "instance_scheduler_notification": config_parser.get(
             RABBITMQ_SECTION,
             RABBITMQ_SCHEDULER_NOTIFICATION_KEY
+        ),
+        "metrics_exchange": config_parser.get(
+            RABBITMQ_SECTION,
+            RABBITMQ_METRICS_EXCHANGE_KEY,
+            fallback="metrics_exchange"
+        ),
+        "metrics_queue": config_parser.get(
+            RABBITMQ_SECTION,
+            RABBITMQ_METRICS_QUEUE_KEY,
+            fallback="metrics_ingest"
+        ),
+        "command_concurrency": config_parser.getint(
+            RABBITMQ_SECTION,
+            RABBITMQ_COMMAND_CONCURRENCY_KEY,
+            fallback=10
+        ),
+        "command_prefetch": config_parser.getint(
+            RABBITMQ_SECTION,
+            RABBITMQ_COMMAND_PREFETCH_KEY,
+            fallback=50
+        ),
+        "command_ttl": config_parser.getfloat(
+            RABBITMQ_SECTION,
+            RABBITMQ_COMMAND_TTL_KEY,
+            fallback=0
+        ),
+        "control_concurrency": config_parser.getint(
+            RABBITMQ_SECTION,
+            RABBITMQ_CONTROL_CONCURRENCY_KEY,
+            fallback=10
+        )
+    }
+
+    # Ingest of the metrics published by the workers to the exchange
+    config["metric_ingest"] = {
+        "batch_size": config_parser.getint(
+            METRIC_INGEST_SECTION,
+            METRIC_INGEST_BATCH_SIZE_KEY,
+            fallback=1000
+        ),
+        "flush_interval": config_parser.getfloat(
+            METRIC_INGEST_SECTION,
+            METRIC_INGEST_FLUSH_INTERVAL_KEY,
+            fallback=1.0
+        ),
+        "max_batch_failures": config_parser.getint(
+            METRIC_INGEST_SECTION,
+            METRIC_INGEST_MAX_BATCH_FAILURES_KEY,
+            fallback=3
+        ),
+        "max_failure_seconds": config_parser.getfloat(
+            METRIC_INGEST_SECTION,
+            METRIC_INGEST_MAX_FAILURE_SECONDS_KEY,
+            fallback=30.0
+        )
+    }
+
+    # Daily partitions of the METRIC table
+    config["metric_storage"] = {
+        "retention_days": config_parser.getint(
+            METRIC_STORAGE_SECTION,
+            METRIC_STORAGE_RETENTION_DAYS_KEY,
+            fallback=0
+        ),
+        "premake_days": config_parser.getint(
+            METRIC_STORAGE_SECTION,
+            METRIC_STORAGE_PREMAKE_DAYS_KEY,
+            fallback=3
+        ),
+        "maintenance_interval": config_parser.getfloat(
+            METRIC_STORAGE_SECTION,
+            METRIC_STORAGE_MAINTENANCE_INTERVAL_KEY,
+            fallback=3600
+        )
+    }
+
+    # Minute, hour and day rollups of the METRIC table
+    config["metric_rollup"] = {
+        "interval": config_parser.getfloat(
+            METRIC_ROLLUP_SECTION,
+            METRIC_ROLLUP_INTERVAL_KEY,
+            fallback=60
+        ),
+        "lag": config_parser.getfloat(
+            METRIC_ROLLUP_SECTION,
+            METRIC_ROLLUP_LAG_KEY,
+            fallback=300
+        ),
+        "max_step_hours": config_parser.getfloat(
+            METRIC_ROLLUP_SECTION,
+            METRIC_ROLLUP_MAX_STEP_HOURS_KEY,
+            fallback=24
+        ),
+        "minute_retention_days": config_parser.getint(
+            METRIC_ROLLUP_SECTION,
+            METRIC_ROLLUP_MINUTE_RETENTION_DAYS_KEY,
+            fallback=30
+        ),
+        "hour_retention_days": config_parser.getint(
+            METRIC_ROLLUP_SECTION,
+            METRIC_ROLLUP_HOUR_RETENTION_DAYS_KEY,
+            fallback=365
+        ),
+        "day_retention_days": config_parser.getint(
+            METRIC_ROLLUP_SECTION,
+            METRIC_ROLLUP_DAY_RETENTION_DAYS_KEY,
+            fallback=0
         )
     }
 
@@ -68,6 +229,75 @@ def get_app_config(config_parser):
             HARDWARE_ACCELERATION_SECTION,
             HARDWARE_ACCELERATION_CUDA_VERSION_KEY,
             fallback=None
+        ),
+        "model_backend": config_parser.get(
+            HARDWARE_ACCELERATION_SECTION,
+            HARDWARE_ACCELERATION_MODEL_BACKEND_KEY,
+            fallback="AUTO"
+        ),
+        "model_imgsz": config_parser.get(
+            HARDWARE_ACCELERATION_SECTION,
+            HARDWARE_ACCELERATION_MODEL_IMGSZ_KEY,
+            fallback="640"
+        ),
+        "model_cache_dir": config_parser.get(
+            HARDWARE_ACCELERATION_SECTION,
+            HARDWARE_ACCELERATION_MODEL_CACHE_DIR_KEY,
+            fallback="./docker/models/cache"
+        ),
+        "calibration_dir": config_parser.get(
+            HARDWARE_ACCELERATION_SECTION,
+            HARDWARE_ACCELERATION_CALIBRATION_DIR_KEY,
+            fallback="./docker/models/calibration"
+        ),
+        "int8_min_count_agreement": config_parser.getfloat(
+            HARDWARE_ACCELERATION_SECTION,
+            HARDWARE_ACCELERATION_INT8_MIN_AGREEMENT_KEY,
+            fallback=0.95
+        )
+    }
+
+    # Worker containers configuration
+    config["worker"] = {
+        "streams_per_container": config_parser.getint(
+            WORKER_SECTION,
+            WORKER_STREAMS_PER_CONTAINER_KEY,
+            fallback=1
+        ),
+        "control_dir": config_parser.get(
+            WORKER_SECTION,
+            WORKER_CONTROL_DIR_KEY,
+            fallback="./docker/run"
+        ),
+        "output_mode": config_parser.get(
+            WORKER_SECTION,
+            WORKER_OUTPUT_MODE_KEY,
+            fallback="annotated"
+        ),
+        "warm_pool_size": config_parser.getint(
+            WORKER_SECTION,
+            WORKER_WARM_POOL_SIZE_KEY,
+            fallback=0
+        ),
+        "warm_pool_min_size": config_parser.getint(
+            WORKER_SECTION,
+            WORKER_WARM_POOL_MIN_SIZE_KEY,
+            fallback=0
+        ),
+        "warm_pool_idle_timeout": config_parser.getfloat(
+            WORKER_SECTION,
+            WORKER_WARM_POOL_IDLE_TIMEOUT_KEY,
+            fallback=300
+        ),
+        "metric_spool_dir": config_parser.get(
+            WORKER_SECTION,
+            WORKER_METRIC_SPOOL_DIR_KEY,
+            fallback=None
+        ),
+        "metric_transport": config_parser.get(
+            WORKER_SECTION,
+            WORKER_METRIC_TRANSPORT_KEY,
+            fallback="database"
         )
     }
 
@@ -92,6 +322,102 @@ def get_worker_config(config_parser):
         "secure" : config_parser.get(MEDIA_SERVER_SECTION,MEDIA_SERVER_SECURE_KEY,fallback=False),
         "rtsps_port" : config_parser.get(MEDIA_SERVER_SECTION,MEDIA_SERVER_RTSPS_PORT_KEY,fallback=8322),
         "rtsp_port" : config_parser.get(MEDIA_SERVER_SECTION,MEDIA_SERVER_RTSP_PORT_KEY, fallback=8554),
+        "api_url": config_parser.get(
+            MEDIA_SERVER_SECTION,
+            MEDIA_SERVER_API_URL_KEY,
+            fallback=None
+        ),
+    }
+
+    # Side channel of the detections of the passthrough streams
+    config["METADATA_CHANNEL"] = {
+        "host": config_parser.get(
+            METADATA_CHANNEL_SECTION,
+            METADATA_CHANNEL_HOST_KEY,
+            fallback="127.0.0.1"
+        ),
+        "port": config_parser.getint(
+            METADATA_CHANNEL_SECTION,
+            METADATA_CHANNEL_PORT_KEY,
+            fallback=5005
+        ),
+    }
+
+    # Background writer of the detection metrics
+    config["METRIC_WRITER"] = {
+        "flush_interval": config_parser.getfloat(
+            METRIC_WRITER_SECTION,
+            METRIC_WRITER_FLUSH_INTERVAL_KEY,
+            fallback=1.0
+        ),
+        "max_pending": config_parser.getint(
+            METRIC_WRITER_SECTION,
+            METRIC_WRITER_MAX_PENDING_KEY,
+            fallback=10000
+        ),
+        "overflow_policy": config_parser.get(
+            METRIC_WRITER_SECTION,
+            METRIC_WRITER_OVERFLOW_POLICY_KEY,
+            fallback="keep_latest"
+        ),
+        "spool_max_bytes": config_parser.getint(
+            METRIC_WRITER_SECTION,
+            METRIC_WRITER_SPOOL_MAX_BYTES_KEY,
+            fallback=64 << 20
+        ),
+        "spool_segment_bytes": config_parser.getint(
+            METRIC_WRITER_SECTION,
+            METRIC_WRITER_SPOOL_SEGMENT_BYTES_KEY,
+            fallback=1 << 20
+        ),
+    }
+
+    # Broker the metrics are published to with the broker transport
+    config["RABBITMQ"] = {
+        "host": config_parser.get(
+            RABBITMQ_SECTION,
+            RABBITMQ_HOST_KEY,
+            fallback="localhost"
+        ),
+        "port": config_parser.getint(
+            RABBITMQ_SECTION,
+            RABBITMQ_PORT_KEY,
+            fallback=5672
+        ),
+        "user": config_parser.get(
+            RABBITMQ_SECTION,
+            RABBITMQ_USER_KEY,
+            fallback="guest"
+        ),
+        "password": config_parser.get(
+            RABBITMQ_SECTION,
+            RABBITMQ_PASSWORD_KEY,
+            fallback="guest"
+        ),
+        "metrics_exchange": config_parser.get(
+            RABBITMQ_SECTION,
+            RABBITMQ_METRICS_EXCHANGE_KEY,
+            fallback="metrics_exchange"
+        ),
+    }
+
+    # Smoothing of the people counts before they are saved
+    config["METRIC_SMOOTHING"] = {
+        "mode": config_parser.get(
+            METRIC_SMOOTHING_SECTION,
+            METRIC_SMOOTHING_MODE_KEY,
+            fallback="none"
+        ),
+        "window": config_parser.getfloat(
+            METRIC_SMOOTHING_SECTION,
+            METRIC_SMOOTHING_WINDOW_KEY,
+            fallback=5.0
+        ),
+        "min_dwell": config_parser.getfloat(
+            METRIC_SMOOTHING_SECTION,
+            METRIC_SMOOTHING_MIN_DWELL_KEY,
+            fallback=3.0
+        ),
     }
 
     return config
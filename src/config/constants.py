@@ -6,6 +6,21 @@ MEDIA_SERVER_WRITE_PASSWORD_KEY = "WRITE_PASSWORD"
 MEDIA_SERVER_SECURE_KEY = "SECURE"
 MEDIA_SERVER_RTSPS_PORT_KEY = "RTSPS_PORT"
 MEDIA_SERVER_RTSP_PORT_KEY = "RTSP_PORT"
+MEDIA_SERVER_API_URL_KEY = "API_URL"
+
+METADATA_CHANNEL_SECTION = "METADATA_CHANNEL"
+METADATA_CHANNEL_HOST_KEY = "HOST"
+METADATA_CHANNEL_PORT_KEY = "PORT"
+METRIC_WRITER_SECTION = "METRIC_WRITER"
+METRIC_WRITER_FLUSH_INTERVAL_KEY = "FLUSH_INTERVAL"
+METRIC_WRITER_MAX_PENDING_KEY = "MAX_PENDING"
+METRIC_WRITER_OVERFLOW_POLICY_KEY = "OVERFLOW_POLICY"
+METRIC_WRITER_SPOOL_MAX_BYTES_KEY = "SPOOL_MAX_BYTES"
+METRIC_WRITER_SPOOL_SEGMENT_BYTES_KEY = "SPOOL_SEGMENT_BYTES"
+METRIC_SMOOTHING_SECTION = "METRIC_SMOOTHING"
+METRIC_SMOOTHING_MODE_KEY = "MODE"
+METRIC_SMOOTHING_WINDOW_KEY = "WINDOW"
+METRIC_SMOOTHING_MIN_DWELL_KEY = "MIN_DWELL"
 DATABASE_USER_KEY = "USER"
 DATABASE_PASSWORD_KEY = "PASSWORD"
 DATABASE_HOST_KEY = "HOST"
@@ -18,6 +33,42 @@ RABBITMQ_PASSWORD_KEY = "PASSWORD"
 RABBITMQ_CONTROLLER_QUEUE_KEY = "INSTANCE_CONTROLLER_QUEUE"
 RABBITMQ_ACK_STATUS_QUEUE_KEY = "ACK_DEVICE_STATUS_QUEUE"
 RABBITMQ_SCHEDULER_NOTIFICATION_KEY = "SCHEDULER_NOTIFICATION_QUEUE"
+RABBITMQ_METRICS_EXCHANGE_KEY = "METRICS_EXCHANGE"
+RABBITMQ_METRICS_QUEUE_KEY = "METRICS_QUEUE"
+RABBITMQ_COMMAND_CONCURRENCY_KEY = "COMMAND_CONCURRENCY"
+RABBITMQ_COMMAND_PREFETCH_KEY = "COMMAND_PREFETCH"
+RABBITMQ_COMMAND_TTL_KEY = "COMMAND_TTL"
+RABBITMQ_CONTROL_CONCURRENCY_KEY = "CONTROL_CONCURRENCY"
+METRIC_INGEST_SECTION = "METRIC_INGEST"
+METRIC_INGEST_BATCH_SIZE_KEY = "BATCH_SIZE"
+METRIC_INGEST_FLUSH_INTERVAL_KEY = "FLUSH_INTERVAL"
+METRIC_INGEST_MAX_BATCH_FAILURES_KEY = "MAX_BATCH_FAILURES"
+METRIC_INGEST_MAX_FAILURE_SECONDS_KEY = "MAX_FAILURE_SECONDS"
+METRIC_STORAGE_SECTION = "METRIC_STORAGE"
+METRIC_STORAGE_RETENTION_DAYS_KEY = "RETENTION_DAYS"
+METRIC_STORAGE_PREMAKE_DAYS_KEY = "PREMAKE_DAYS"
+METRIC_STORAGE_MAINTENANCE_INTERVAL_KEY = "MAINTENANCE_INTERVAL"
+METRIC_ROLLUP_SECTION = "METRIC_ROLLUP"
+METRIC_ROLLUP_INTERVAL_KEY = "INTERVAL"
+METRIC_ROLLUP_LAG_KEY = "LAG"
+METRIC_ROLLUP_MAX_STEP_HOURS_KEY = "MAX_STEP_HOURS"
+METRIC_ROLLUP_MINUTE_RETENTION_DAYS_KEY = "MINUTE_RETENTION_DAYS"
+METRIC_ROLLUP_HOUR_RETENTION_DAYS_KEY = "HOUR_RETENTION_DAYS"
+METRIC_ROLLUP_DAY_RETENTION_DAYS_KEY = "DAY_RETENTION_DAYS"
 HARDWARE_ACCELERATION_SECTION = "HARDWARE_ACCELERATION"
 HARDWARE_ACCELERATION_PROCESSING_MODE_KEY = "PROCESSING_MODE"
 HARDWARE_ACCELERATION_CUDA_VERSION_KEY = "CUDA_VERSION"
+HARDWARE_ACCELERATION_MODEL_BACKEND_KEY = "MODEL_BACKEND"
+HARDWARE_ACCELERATION_MODEL_IMGSZ_KEY = "MODEL_IMGSZ"
+HARDWARE_ACCELERATION_MODEL_CACHE_DIR_KEY = "MODEL_CACHE_DIR"
+HARDWARE_ACCELERATION_CALIBRATION_DIR_KEY = "CALIBRATION_FRAMES_DIR"
+HARDWARE_ACCELERATION_INT8_MIN_AGREEMENT_KEY = "INT8_MIN_COUNT_AGREEMENT"
+WORKER_SECTION = "WORKER"
+WORKER_STREAMS_PER_CONTAINER_KEY = "STREAMS_PER_CONTAINER"
+WORKER_CONTROL_DIR_KEY = "CONTROL_DIR"
+WORKER_OUTPUT_MODE_KEY = "OUTPUT_MODE"
+WORKER_WARM_POOL_SIZE_KEY = "WARM_POOL_SIZE"
+WORKER_WARM_POOL_MIN_SIZE_KEY = "WARM_POOL_MIN_SIZE"
+WORKER_WARM_POOL_IDLE_TIMEOUT_KEY = "WARM_POOL_IDLE_TIMEOUT"
+WORKER_METRIC_SPOOL_DIR_KEY = "METRIC_SPOOL_DIR"
+WORKER_METRIC_TRANSPORT_KEY = "METRIC_TRANSPORT"
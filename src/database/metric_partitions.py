@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from psycopg_pool import AsyncConnectionPool
+
+from src.database.transaction import transaction
+
+"""
+Upkeep of the daily partitions of the METRIC table, created by the
+migrations: the partitions of the next days are made ahead of the inserts
+and the ones past the retention dropped.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class MetricPartitionMaintainer:
+    """
+        Runs metric_maintain_partitions every interval seconds.
+        Partitions with an interval still open are never dropped.
+    """
+
+    def __init__(
+            self,
+            conn_manager: AsyncConnectionPool,
+            retention_days: int = 0,
+            premake_days: int = 3,
+            interval: float = 3600
+    ):
+        """
+            Parameters:
+                retention_days: days the metrics are kept, forever if 0.
+                premake_days: days the partitions are created ahead.
+        """
+        self.conn_manager = conn_manager
+        self.retention_days = retention_days
+        self.premake_days = premake_days
+        self.interval = interval
+
+    async def maintain(self) -> int:
+        """
+            Returns:
+                The number of partitions dropped.
+        """
+        retention = None
+        if self.retention_days > 0:
+            retention = timedelta(days=self.retention_days)
+        async with transaction(self.conn_manager) as cursor:
+            await cursor.execute(
+                "SELECT metric_maintain_partitions(%s, %s)",
+                (retention, self.premake_days)
+            )
+            row = await cursor.fetchone()
+        return row[0]
+
+    async def run(self):
+        while True:
+            try:
+                dropped = await self.maintain()
+                if dropped:
+                    logger.info(f"Dropped {dropped} expired metric partitions")
+            except Exception as e:
+                logger.error(f"Error maintaining the metric partitions: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from psycopg_pool import AsyncConnectionPool
+
+from src.database.transaction import transaction
+
+"""
+Incremental upkeep of the minute, hour and day rollups of the METRIC
+table, created by the migrations. Only the intervals closed after the
+watermark are read, so each run costs the new intervals, not the history.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def retention(days: int):
+    return timedelta(days=days) if days > 0 else None
+
+
+class MetricRollupJob:
+    """
+        Every interval seconds, rolls up the intervals closed until lag
+        seconds ago, max_step_hours of them per transaction, then deletes
+        the buckets past the retention of their unit.
+        The watermark follows the time the intervals were closed in the
+        database, so the ones a worker spool or the broker writes late are
+        still rolled up. The lag leaves time to the transactions closing
+        intervals to commit.
+    """
+
+    def __init__(
+            self,
+            conn_manager: AsyncConnectionPool,
+            interval: float = 60,
+            lag: float = 300,
+            max_step_hours: float = 24,
+            minute_retention_days: int = 30,
+            hour_retention_days: int = 365,
+            day_retention_days: int = 0
+    ):
+        """
+            Parameters:
+                *_retention_days: days the buckets of the unit are kept,
+                                  forever if 0.
+        """
+        self.conn_manager = conn_manager
+        self.interval = interval
+        self.lag = timedelta(seconds=lag)
+        self.max_step = timedelta(hours=max_step_hours)
+        self.retentions = (
+            retention(minute_retention_days),
+            retention(hour_retention_days),
+            retention(day_retention_days)
+        )
+
+    async def advance(self) -> bool:
+        """
+            Rolls up the next step of closed intervals.
+            Returns:
+                True once they are rolled up until lag seconds ago.
+        """
+        async with transaction(self.conn_manager) as cursor:
+            await cursor.execute(
+                "SELECT metric_rollup_advance(%s, %s)",
+                (self.lag, self.max_step)
+            )
+            row = await cursor.fetchone()
+        return row[0]
+
+    async def expire(self) -> int:
+        """
+            Returns:
+                The number of deleted buckets.
+        """
+        async with transaction(self.conn_manager) as cursor:
+            await cursor.execute(
+                "SELECT metric_rollup_expire(%s, %s, %s)",
+                self.retentions
+            )
+            row = await cursor.fetchone()
+        return row[0]
+
+    async def run_once(self):
+        steps = 1
+        # The first run after a pause catches up step by step
+        while not await self.advance():
+            steps += 1
+        if steps > 1:
+            logger.info(f"Rolled up {steps} steps of metric intervals")
+        expired = await self.expire()
+        if expired:
+            logger.info(f"Deleted {expired} expired metric rollups")
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Error rolling up the metrics: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,121 @@
+-- METRIC partitioned by day of start_time, so the queries of the workers
+-- only touch the recent partitions and old days are dropped as a whole.
+
+DO $$
+BEGIN
+    -- Nested, the cast fails on a database without the table
+    IF to_regclass('metric') IS NOT NULL THEN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_partitioned_table
+            WHERE partrelid = to_regclass('metric')
+        ) THEN
+            ALTER TABLE metric RENAME TO metric_unpartitioned;
+        END IF;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS metric (
+    deviceid INTEGER NOT NULL,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP,
+    peoplecount INTEGER NOT NULL
+) PARTITION BY RANGE (start_time);
+
+-- Rows of a day without partition, a worker clock far off, are never refused
+CREATE TABLE IF NOT EXISTS metric_default PARTITION OF metric DEFAULT;
+
+-- Key of the updates closing an interval
+CREATE INDEX IF NOT EXISTS metric_device_start_idx
+    ON metric (deviceid, start_time);
+
+-- The open interval of a device, a few rows among the whole history
+CREATE INDEX IF NOT EXISTS metric_open_idx
+    ON metric (deviceid, start_time DESC) WHERE end_time IS NULL;
+
+CREATE OR REPLACE FUNCTION metric_create_partition(day DATE) RETURNS BOOLEAN AS $$
+DECLARE
+    partition_name TEXT := 'metric_p' || to_char(day, 'YYYYMMDD');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    -- The rows of the day in the default partition would make the creation fail
+    CREATE TEMP TABLE IF NOT EXISTS metric_moved (LIKE metric) ON COMMIT DROP;
+    WITH moved AS (
+        DELETE FROM metric_default
+        WHERE start_time >= day AND start_time < day + 1
+        RETURNING *
+    )
+    INSERT INTO metric_moved SELECT * FROM moved;
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF metric FOR VALUES FROM (%L) TO (%L)',
+        partition_name, day, day + 1
+    );
+    INSERT INTO metric SELECT * FROM metric_moved;
+    TRUNCATE metric_moved;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION metric_drop_partitions(retention INTERVAL) RETURNS INTEGER AS $$
+DECLARE
+    cutoff TIMESTAMP := (now() AT TIME ZONE 'UTC') - retention;
+    partition_name TEXT;
+    has_open BOOLEAN;
+    dropped INTEGER := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'metric'::regclass
+          AND child.relname ~ '^metric_p[0-9]{8}$'
+        ORDER BY child.relname
+    LOOP
+        EXIT WHEN to_date(substr(partition_name, 9), 'YYYYMMDD') + 1 > cutoff;
+        -- An interval still open is still being counted
+        EXECUTE format(
+            'SELECT EXISTS (SELECT 1 FROM %I WHERE end_time IS NULL)',
+            partition_name
+        ) INTO has_open;
+        IF NOT has_open THEN
+            EXECUTE format('DROP TABLE %I', partition_name);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    DELETE FROM metric_default WHERE end_time < cutoff;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Creates the partitions of today and of the next premake days (UTC), and
+-- drops the ones older than the retention, unless it is NULL.
+-- Returns the number of dropped partitions.
+CREATE OR REPLACE FUNCTION metric_maintain_partitions(
+    retention INTERVAL,
+    premake INTEGER
+) RETURNS INTEGER AS $$
+DECLARE
+    today DATE := (now() AT TIME ZONE 'UTC')::date;
+BEGIN
+    PERFORM metric_create_partition(today + offset_days)
+    FROM generate_series(0, premake) AS offset_days;
+    IF retention IS NULL THEN
+        RETURN 0;
+    END IF;
+    RETURN metric_drop_partitions(retention);
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF to_regclass('metric_unpartitioned') IS NOT NULL THEN
+        PERFORM metric_create_partition(day)
+        FROM (SELECT DISTINCT start_time::date AS day FROM metric_unpartitioned) AS days;
+        INSERT INTO metric (deviceid, start_time, end_time, peoplecount)
+        SELECT deviceid, start_time, end_time, peoplecount FROM metric_unpartitioned;
+        DROP TABLE metric_unpartitioned;
+    END IF;
+END $$;
+
+SELECT metric_maintain_partitions(NULL, 3);
@@ -0,0 +1,175 @@
+-- Per device minute, hour and day aggregates of the closed METRIC intervals,
+-- so dashboards do not scan and split the raw intervals.
+-- The averages are weighted by the seconds each count lasted in the bucket.
+
+CREATE TABLE IF NOT EXISTS metric_rollup_minute (
+    deviceid INTEGER NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    count_seconds DOUBLE PRECISION NOT NULL,
+    covered_seconds DOUBLE PRECISION NOT NULL,
+    occupied_seconds DOUBLE PRECISION NOT NULL,
+    max_count INTEGER NOT NULL,
+    min_count INTEGER NOT NULL,
+    avg_count DOUBLE PRECISION
+        GENERATED ALWAYS AS (count_seconds / NULLIF(covered_seconds, 0)) STORED,
+    PRIMARY KEY (deviceid, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS metric_rollup_hour (LIKE metric_rollup_minute INCLUDING ALL);
+
+CREATE TABLE IF NOT EXISTS metric_rollup_day (LIKE metric_rollup_minute INCLUDING ALL);
+
+-- The closed intervals are rolled up by end_time
+CREATE INDEX IF NOT EXISTS metric_end_idx ON metric (end_time);
+
+-- Intervals closed up to the watermark are in the rollups
+CREATE TABLE IF NOT EXISTS metric_rollup_watermark (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    watermark TIMESTAMP NOT NULL
+);
+
+INSERT INTO metric_rollup_watermark (watermark) VALUES ('-infinity')
+ON CONFLICT DO NOTHING;
+
+-- Adds the intervals closed in (since, upto] to the buckets of the unit,
+-- one of minute, hour or day, they overlap.
+CREATE OR REPLACE FUNCTION metric_rollup_range(
+    unit TEXT,
+    since TIMESTAMP,
+    upto TIMESTAMP
+) RETURNS VOID AS $$
+BEGIN
+    EXECUTE format($query$
+        INSERT INTO %I AS rollup (
+            deviceid, bucket, count_seconds, covered_seconds,
+            occupied_seconds, max_count, min_count
+        )
+        SELECT
+            metric.deviceid,
+            buckets.bucket,
+            sum(metric.peoplecount * overlap.seconds),
+            sum(overlap.seconds),
+            coalesce(sum(overlap.seconds) FILTER (WHERE metric.peoplecount > 0), 0),
+            max(metric.peoplecount),
+            min(metric.peoplecount)
+        FROM metric
+        CROSS JOIN LATERAL generate_series(
+            date_trunc(%L, metric.start_time), metric.end_time, %L::interval
+        ) AS buckets(bucket)
+        CROSS JOIN LATERAL (
+            SELECT extract(epoch FROM
+                least(metric.end_time, buckets.bucket + %L::interval)
+                - greatest(metric.start_time, buckets.bucket)
+            )::double precision AS seconds
+        ) AS overlap
+        WHERE metric.end_time > $1 AND metric.end_time <= $2
+          AND overlap.seconds > 0
+        GROUP BY metric.deviceid, buckets.bucket
+        ON CONFLICT (deviceid, bucket) DO UPDATE SET
+            count_seconds = rollup.count_seconds + excluded.count_seconds,
+            covered_seconds = rollup.covered_seconds + excluded.covered_seconds,
+            occupied_seconds = rollup.occupied_seconds + excluded.occupied_seconds,
+            max_count = greatest(rollup.max_count, excluded.max_count),
+            min_count = least(rollup.min_count, excluded.min_count)
+    $query$, 'metric_rollup_' || unit, unit, '1 ' || unit, '1 ' || unit)
+    USING since, upto;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rolls up the intervals closed after the watermark, up to lag ago and
+-- max_step after the watermark at most, and moves the watermark.
+-- Intervals written with an end_time older than lag are never rolled up.
+-- Returns TRUE once the watermark reached lag ago.
+CREATE OR REPLACE FUNCTION metric_rollup_advance(
+    lag INTERVAL,
+    max_step INTERVAL
+) RETURNS BOOLEAN AS $$
+DECLARE
+    horizon TIMESTAMP := (now() AT TIME ZONE 'UTC') - lag;
+    since TIMESTAMP;
+    upto TIMESTAMP;
+BEGIN
+    -- Locked, so the intervals are rolled up once by concurrent managers
+    SELECT watermark INTO since FROM metric_rollup_watermark FOR UPDATE;
+    IF since = '-infinity' THEN
+        SELECT min(end_time) - interval '1 microsecond' INTO since FROM metric;
+        IF since IS NULL THEN
+            RETURN TRUE;
+        END IF;
+    END IF;
+    upto := least(horizon, since + max_step);
+    IF upto <= since THEN
+        RETURN TRUE;
+    END IF;
+    PERFORM metric_rollup_range('minute', since, upto);
+    PERFORM metric_rollup_range('hour', since, upto);
+    PERFORM metric_rollup_range('day', since, upto);
+    UPDATE metric_rollup_watermark SET watermark = upto;
+    RETURN upto = horizon;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deletes the buckets older than the retention of their unit, a NULL
+-- retention keeps them forever. Returns the number of deleted buckets.
+CREATE OR REPLACE FUNCTION metric_rollup_expire(
+    minute_retention INTERVAL,
+    hour_retention INTERVAL,
+    day_retention INTERVAL
+) RETURNS INTEGER AS $$
+DECLARE
+    today TIMESTAMP := now() AT TIME ZONE 'UTC';
+    deleted INTEGER := 0;
+    expired INTEGER;
+BEGIN
+    IF minute_retention IS NOT NULL THEN
+        DELETE FROM metric_rollup_minute WHERE bucket < today - minute_retention;
+        GET DIAGNOSTICS expired = ROW_COUNT;
+        deleted := deleted + expired;
+    END IF;
+    IF hour_retention IS NOT NULL THEN
+        DELETE FROM metric_rollup_hour WHERE bucket < today - hour_retention;
+        GET DIAGNOSTICS expired = ROW_COUNT;
+        deleted := deleted + expired;
+    END IF;
+    IF day_retention IS NOT NULL THEN
+        DELETE FROM metric_rollup_day WHERE bucket < today - day_retention;
+        GET DIAGNOSTICS expired = ROW_COUNT;
+        deleted := deleted + expired;
+    END IF;
+    RETURN deleted;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The raw intervals past the retention of METRIC are only dropped once
+-- they are in the rollups.
+CREATE OR REPLACE FUNCTION metric_drop_partitions(retention INTERVAL) RETURNS INTEGER AS $$
+DECLARE
+    cutoff TIMESTAMP := (now() AT TIME ZONE 'UTC') - retention;
+    rolled_up TIMESTAMP := (SELECT watermark FROM metric_rollup_watermark);
+    partition_name TEXT;
+    has_pending BOOLEAN;
+    dropped INTEGER := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'metric'::regclass
+          AND child.relname ~ '^metric_p[0-9]{8}$'
+        ORDER BY child.relname
+    LOOP
+        EXIT WHEN to_date(substr(partition_name, 9), 'YYYYMMDD') + 1 > cutoff;
+        -- An interval still open is still being counted
+        EXECUTE format(
+            'SELECT EXISTS (SELECT 1 FROM %I WHERE end_time IS NULL OR end_time > $1)',
+            partition_name
+        ) INTO has_pending USING rolled_up;
+        IF NOT has_pending THEN
+            EXECUTE format('DROP TABLE %I', partition_name);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    DELETE FROM metric_default WHERE end_time < cutoff AND end_time <= rolled_up;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,18 @@
+-- Commands acknowledged before they ran, START is answered once accepted
+-- and again once the instance is ready or failed.
+-- The ACCEPTED operations left by a stopped instance manager are resumed
+-- or failed when it starts again.
+
+CREATE TABLE IF NOT EXISTS operation (
+    id BIGSERIAL PRIMARY KEY,
+    device_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    stream_url TEXT,
+    status TEXT NOT NULL CHECK (status IN ('ACCEPTED', 'READY', 'FAILED')),
+    message TEXT,
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS operation_accepted_idx ON operation (id)
+WHERE status = 'ACCEPTED';
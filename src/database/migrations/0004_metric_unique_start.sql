@@ -0,0 +1,17 @@
+-- An interval is identified by its device and start, so the batch a
+-- crashed writer writes again updates the rows it already inserted
+-- instead of duplicating them.
+
+-- The duplicates already written, the rows of a key are in the same partition
+DELETE FROM metric AS duplicate
+USING metric AS kept
+WHERE duplicate.deviceid = kept.deviceid
+  AND duplicate.start_time = kept.start_time
+  AND duplicate.tableoid = kept.tableoid
+  AND duplicate.ctid > kept.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS metric_device_start_key
+    ON metric (deviceid, start_time);
+
+-- Replaced by the unique index
+DROP INDEX IF EXISTS metric_device_start_idx;
@@ -0,0 +1,147 @@
+-- The rollup watermark follows the time an interval was closed in the
+-- database instead of its end_time, so the intervals a worker spool or the
+-- broker writes late, with an end_time behind the watermark, are still
+-- rolled up, added to the buckets already rolled up.
+
+ALTER TABLE metric ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP;
+
+-- The intervals closed before are rolled up by end_time, as until now
+UPDATE metric SET closed_at = end_time
+WHERE end_time IS NOT NULL AND closed_at IS NULL;
+
+-- A closed interval is final, it may already be in the rollups: a start or
+-- a close written again does not change it. The rows moved between
+-- partitions keep their closed_at.
+CREATE OR REPLACE FUNCTION metric_set_closed_at() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.end_time IS NOT NULL THEN
+        NEW.end_time := OLD.end_time;
+        NEW.closed_at := OLD.closed_at;
+    ELSIF NEW.end_time IS NOT NULL AND NEW.closed_at IS NULL THEN
+        NEW.closed_at := clock_timestamp() AT TIME ZONE 'UTC';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_closed_at ON metric;
+CREATE TRIGGER metric_closed_at
+    BEFORE INSERT OR UPDATE OF end_time ON metric
+    FOR EACH ROW EXECUTE FUNCTION metric_set_closed_at();
+
+CREATE INDEX IF NOT EXISTS metric_closed_idx ON metric (closed_at);
+
+-- Replaced by metric_closed_idx
+DROP INDEX IF EXISTS metric_end_idx;
+
+-- Adds the intervals closed in (since, upto] to the buckets of the unit,
+-- one of minute, hour or day, they overlap.
+CREATE OR REPLACE FUNCTION metric_rollup_range(
+    unit TEXT,
+    since TIMESTAMP,
+    upto TIMESTAMP
+) RETURNS VOID AS $$
+BEGIN
+    EXECUTE format($query$
+        INSERT INTO %I AS rollup (
+            deviceid, bucket, count_seconds, covered_seconds,
+            occupied_seconds, max_count, min_count
+        )
+        SELECT
+            metric.deviceid,
+            buckets.bucket,
+            sum(metric.peoplecount * overlap.seconds),
+            sum(overlap.seconds),
+            coalesce(sum(overlap.seconds) FILTER (WHERE metric.peoplecount > 0), 0),
+            max(metric.peoplecount),
+            min(metric.peoplecount)
+        FROM metric
+        CROSS JOIN LATERAL generate_series(
+            date_trunc(%L, metric.start_time), metric.end_time, %L::interval
+        ) AS buckets(bucket)
+        CROSS JOIN LATERAL (
+            SELECT extract(epoch FROM
+                least(metric.end_time, buckets.bucket + %L::interval)
+                - greatest(metric.start_time, buckets.bucket)
+            )::double precision AS seconds
+        ) AS overlap
+        WHERE metric.closed_at > $1 AND metric.closed_at <= $2
+          AND overlap.seconds > 0
+        GROUP BY metric.deviceid, buckets.bucket
+        ON CONFLICT (deviceid, bucket) DO UPDATE SET
+            count_seconds = rollup.count_seconds + excluded.count_seconds,
+            covered_seconds = rollup.covered_seconds + excluded.covered_seconds,
+            occupied_seconds = rollup.occupied_seconds + excluded.occupied_seconds,
+            max_count = greatest(rollup.max_count, excluded.max_count),
+            min_count = least(rollup.min_count, excluded.min_count)
+    $query$, 'metric_rollup_' || unit, unit, '1 ' || unit, '1 ' || unit)
+    USING since, upto;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rolls up the intervals closed after the watermark, up to lag ago and
+-- max_step after the watermark at most, and moves the watermark.
+-- The lag leaves time to the transactions closing intervals to commit.
+-- Returns TRUE once the watermark reached lag ago.
+CREATE OR REPLACE FUNCTION metric_rollup_advance(
+    lag INTERVAL,
+    max_step INTERVAL
+) RETURNS BOOLEAN AS $$
+DECLARE
+    horizon TIMESTAMP := (now() AT TIME ZONE 'UTC') - lag;
+    since TIMESTAMP;
+    upto TIMESTAMP;
+BEGIN
+    -- Locked, so the intervals are rolled up once by concurrent managers
+    SELECT watermark INTO since FROM metric_rollup_watermark FOR UPDATE;
+    IF since = '-infinity' THEN
+        SELECT min(closed_at) - interval '1 microsecond' INTO since FROM metric;
+        IF since IS NULL THEN
+            RETURN TRUE;
+        END IF;
+    END IF;
+    upto := least(horizon, since + max_step);
+    IF upto <= since THEN
+        RETURN TRUE;
+    END IF;
+    PERFORM metric_rollup_range('minute', since, upto);
+    PERFORM metric_rollup_range('hour', since, upto);
+    PERFORM metric_rollup_range('day', since, upto);
+    UPDATE metric_rollup_watermark SET watermark = upto;
+    RETURN upto = horizon;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The raw intervals past the retention of METRIC are only dropped once
+-- they are in the rollups.
+CREATE OR REPLACE FUNCTION metric_drop_partitions(retention INTERVAL) RETURNS INTEGER AS $$
+DECLARE
+    cutoff TIMESTAMP := (now() AT TIME ZONE 'UTC') - retention;
+    rolled_up TIMESTAMP := (SELECT watermark FROM metric_rollup_watermark);
+    partition_name TEXT;
+    has_pending BOOLEAN;
+    dropped INTEGER := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'metric'::regclass
+          AND child.relname ~ '^metric_p[0-9]{8}$'
+        ORDER BY child.relname
+    LOOP
+        EXIT WHEN to_date(substr(partition_name, 9), 'YYYYMMDD') + 1 > cutoff;
+        -- An interval still open is still being counted
+        EXECUTE format(
+            'SELECT EXISTS (SELECT 1 FROM %I WHERE closed_at IS NULL OR closed_at > $1)',
+            partition_name
+        ) INTO has_pending USING rolled_up;
+        IF NOT has_pending THEN
+            EXECUTE format('DROP TABLE %I', partition_name);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    DELETE FROM metric_default WHERE end_time < cutoff AND closed_at <= rolled_up;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
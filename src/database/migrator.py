@@ -0,0 +1,96 @@
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import List
+
+import psycopg
+
+"""
+Versioned schema migrations, applied by the instance manager on startup.
+Each migration is a SQL file of the migrations directory named
+<version>_<name>.sql, applied once, in the order of the versions.
+"""
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+# Key of the advisory lock taken while migrating, so managers starting
+# together do not race
+MIGRATION_LOCK = 51530001
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """
+        Returns:
+            The migrations of the directory sorted by version.
+        Throws:
+            ValueError: if two migrations have the same version.
+    """
+    migrations = {}
+    for file_name in os.listdir(directory):
+        match = MIGRATION_FILE.match(file_name)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(
+                f"Duplicated migration version {version}: {file_name}")
+        with open(os.path.join(directory, file_name)) as file:
+            migrations[version] = Migration(
+                version, match.group(2), file.read())
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def apply_migrations(
+        connection: psycopg.Connection,
+        migrations: List[Migration] = None
+) -> List[Migration]:
+    """
+        Applies the migrations not applied yet, each in its own transaction,
+        and records them in the schema_migrations table.
+        Returns:
+            The migrations applied.
+    """
+    if migrations is None:
+        migrations = load_migrations()
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK,))
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC')
+        )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied_versions = {row[0] for row in cursor.fetchall()}
+        applied = []
+        for migration in migrations:
+            if migration.version in applied_versions:
+                continue
+            logger.info(
+                f"Applying migration {migration.version} {migration.name}...")
+            with connection.transaction():
+                # Without parameters, so the file can have several statements
+                cursor.execute(migration.sql)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) "
+                    "VALUES (%s, %s)",
+                    (migration.version, migration.name)
+                )
+            applied.append(migration)
+        return applied
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+        cursor.close()
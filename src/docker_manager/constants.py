@@ -2,3 +2,12 @@ DOCKERFILE_CPU = "docker/CPU"
 DOCKERFILE_GPU = "docker/GPU"
 TAG_CPU = "image-processor-cpu"
 TAG_GPU = "image-processor-gpu"
+WORKER_CONTROL_MOUNT = "/run/sensiflow"
+# Socket of the control directory where the workers report their stages
+READINESS_SOCKET = ".readiness.sock"
+WORKER_ROLE_LABEL = "sensiflow.role"
+WORKER_ROLE = "worker"
+MODEL_CACHE_MOUNT = "/models/cache"
+METRIC_SPOOL_MOUNT = "/var/spool/sensiflow"
+CALIBRATION_MOUNT = "/models/calibration"
+YOLOV5_VERSION = "v7.0"
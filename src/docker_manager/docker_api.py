@@ -1,18 +1,32 @@
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import functools
+import os
 from datetime import datetime
 
 import docker
 import logging
 from docker.errors import APIError, DockerException, NotFound
 from docker import types
+from src.docker_manager.constants import (
+    MODEL_CACHE_MOUNT,
+    METRIC_SPOOL_MOUNT,
+    READINESS_SOCKET,
+    WORKER_CONTROL_MOUNT,
+    WORKER_ROLE,
+    WORKER_ROLE_LABEL
+)
 from src.docker_manager.exceptions import (
     ContainerExitedError,
     ContainerGoalTimeout,
     ContainerNotFound
 )
-from docker_manager.docker_init import ProcessingMode
+from src.docker_manager.model_cache import ExportedModel
+from src.docker_manager.readiness_server import ReadinessServer
+from src.docker_manager.worker_client import WorkerControlClient
+from src.image_processor.readiness import WorkerStage
+from src.image_processor.worker_control import WorkerCommand
+from src.docker_manager.docker_init import ProcessingMode
 
 logger = logging.getLogger(__name__)
 
@@ -23,13 +37,26 @@ class DockerApi:
     """
     restart_policy = {"Name": "on-failure", "MaximumRetryCount": 1}
     network_mode = "host"
+    # Seconds between checks that a starting container did not exit
+    container_poll_seconds = 2
+    # Goal logged by transmit.py on each final stage, scanned without a
+    # control directory
+    log_goals = {
+        WorkerStage.STREAMING_STARTED: 4,
+        WorkerStage.WORKER_READY: 2
+    }
     # TODO: mudar para uma constante o nome do ficheiro
-    entrypoint = ["poetry", "run", "python",
-                  "transmit.py", "--weights", "yolov5s.pt", "--class" ,"0"]
+    entrypoint = ["poetry", "run", "python", "transmit.py", "--class", "0"]
     #TODO: to easily add support for other types of detection it is possible to change the class parameter
 
     def __init__(self, processor_image: str,
-                 processing_mode: ProcessingMode):
+                 processing_mode: ProcessingMode,
+                 control_dir: str = None,
+                 model: ExportedModel = None,
+                 model_cache_dir: str = None,
+                 output_mode: str = "annotated",
+                 metric_spool_dir: str = None,
+                 metric_transport: str = "database"):
         self.client = docker.from_env()
         self.processor_image = processor_image
         self.api_pool = ThreadPoolExecutor(max_workers=5)
@@ -38,13 +65,50 @@ class DockerApi:
         self.device_requests = self._get_device_requests()
         self.ipc_mode = "host"
         self.environment = {"ENVIRONMENT": "worker"}
+        self.volumes = {}
+        self.control_client = None
+        self.readiness = None
+        if control_dir is not None:
+            os.makedirs(control_dir, exist_ok=True)
+            self.volumes[os.path.abspath(control_dir)] = {
+                "bind": WORKER_CONTROL_MOUNT,
+                "mode": "rw"
+            }
+            self.control_client = WorkerControlClient(control_dir)
+            self.readiness = ReadinessServer(
+                os.path.join(os.path.abspath(control_dir), READINESS_SOCKET)
+            )
+        self.model_args = ["--weights", "yolov5s.pt"]
+        if model is not None:
+            self.model_args = [
+                "--weights", model.weights,
+                "--imgsz", str(model.imgsz[0]), str(model.imgsz[1])
+            ]
+        self.output_args = ["--output-mode", output_mode]
+        if model_cache_dir is not None:
+            self.volumes[os.path.abspath(model_cache_dir)] = {
+                "bind": MODEL_CACHE_MOUNT,
+                "mode": "ro"
+            }
+        self.metric_args = []
+        if metric_spool_dir is not None:
+            # Kept on the host, the metrics of a crashed worker are written
+            # by the next one
+            os.makedirs(metric_spool_dir, exist_ok=True)
+            self.volumes[os.path.abspath(metric_spool_dir)] = {
+                "bind": METRIC_SPOOL_MOUNT,
+                "mode": "rw"
+            }
+            self.metric_args = ["--metric-spool", METRIC_SPOOL_MOUNT]
+        # With the broker, the workers publish the metrics instead of
+        # connecting to the database
+        self.metric_args += ["--metric-transport", metric_transport]
 
     def _get_device_requests(self):
-        if ProcessingMode[self.processing_mode.name] == ProcessingMode.CPU:
-            return []
         if ProcessingMode[self.processing_mode.name] == ProcessingMode.GPU:
             # cont -1 is ALL GPUs
             return [types.DeviceRequest(count=-1, capabilities=[["gpu"]])]
+        return []
 
     async def check_health(self):
         """
@@ -192,30 +256,85 @@ class DockerApi:
             DockerException: Error while fetching server API version.
             APIError: If the server returns an error.
         """
+        metrics_args = []
+        if self.control_client is not None:
+            # Single stream workers answer the METRICS command on the socket
+            # a multi-stream worker would receive its control commands on
+            metrics_args = [
+                "--metrics-socket",
+                f"{WORKER_CONTROL_MOUNT}/{container_name}.sock"
+            ]
+        await self.__create_container(
+            container_name, list(extra_args) + metrics_args)
+
+    async def run_worker(self, container_name: str, max_streams: int):
+        """
+        Runs a multi-stream worker container with the given name.
+        The worker starts without streams, they are assigned
+        through its control socket.
+        Parameters:
+            container_name: the name of the container to run
+            max_streams: the maximum number of streams served by the worker
+        Throws:
+            DockerException: Error while fetching server API version.
+            APIError: If the server returns an error.
+        """
+        await self.__create_container(
+            container_name,
+            [
+                "--max-streams", str(max_streams),
+                "--control-socket",
+                f"{WORKER_CONTROL_MOUNT}/{container_name}.sock"
+            ],
+            labels={WORKER_ROLE_LABEL: WORKER_ROLE},
+            final_stage=WorkerStage.WORKER_READY
+        )
+
+    async def __create_container(
+            self,
+            container_name: str,
+            extra_args: list,
+            labels=None,
+            final_stage=WorkerStage.STREAMING_STARTED
+    ):
         logger.info(f"Creating container {container_name}")
         # run dockerfile with name
         try:
-            if ProcessingMode[self.processing_mode.name] == ProcessingMode.CPU:
-                args = ["--device", "cpu"]
-            else:
+            if ProcessingMode[self.processing_mode.name] == ProcessingMode.GPU:
                 args = ["--device", "0"]
+            else:
+                args = ["--device", "cpu"]
 
-            docker_args = args + list(extra_args)
+            docker_args = (
+                args + self.model_args + self.output_args + self.metric_args
+                + extra_args
+            )
+            if self.readiness is not None:
+                await self.readiness.start()
+                self.readiness.reset(container_name)
+                docker_args += [
+                    "--readiness-socket",
+                    f"{WORKER_CONTROL_MOUNT}/{READINESS_SOCKET}",
+                    "--readiness-id", container_name
+                ]
 
             container = await self.loop.run_in_executor(
                 self.api_pool,
-                self.__run_container,
-                container_name,
-                *docker_args,
+                functools.partial(
+                    self.__run_container,
+                    container_name,
+                    *docker_args,
+                    labels=labels
+                )
             )
 
-            await self.__wait_goals(container)
+            await self.__wait_goals(container, final_stage=final_stage)
 
         except (DockerException, APIError) as e:
             logger.error("Error starting container")
             raise e
 
-    def __run_container(self, container_name: str, *args):
+    def __run_container(self, container_name: str, *args, labels=None):
         # Add ENVIRONMENT= to args
         return self.client.containers.run(
             name=container_name,
@@ -227,46 +346,168 @@ class DockerApi:
             device_requests=self.device_requests,
             ipc_mode=self.ipc_mode,
             command=args,
-            environment=self.environment
+            environment=self.environment,
+            volumes=self.volumes,
+            labels=labels or {}
         )
 
-    async def __wait_goals(self, container, timeout_seconds=60):
+    async def list_workers(self):
         """
-         Scans container logs for goal messages
-         returns when the final goal is reached
+        Lists the running multi-stream worker containers
+        Returns:
+            the names of the worker containers
+        Throws:
+            DockerException: Error while fetching server API version
+            APIError: If the server returns an error.
+        """
+        containers = await self.loop.run_in_executor(
+            self.api_pool,
+            functools.partial(
+                self.client.containers.list,
+                filters={"label": f"{WORKER_ROLE_LABEL}={WORKER_ROLE}"}
+            )
+        )
+        return [container.name for container in containers]
 
-         Parameters:
-            container: the name of the container to scan
-            timeout_seconds: the maximum time to wait for the final goal
+    async def get_worker_status(self, container_name: str) -> dict:
+        """
+        Gets the streams served by the given worker
+        Returns:
+            a dictionary with the max_streams and the device_ids served
+        Throws:
+            WorkerCommandError: if the worker could not be reached
+        """
+        return await self.control_client.send(
+            container_name, WorkerCommand.STATUS
+        )
 
-         Throws:
-            GoalTimeout: if the timeout is reached
-            before the final goal is reached
+    async def get_worker_metrics(self, container_name: str) -> dict:
         """
-        logger.info(f"Waiting for goals in container {container.name}")
+        Gets the stage latency histograms and frame counters of the
+        streams served by the given container
+        Returns:
+            a dictionary with the metrics of each stream by device id
+        Throws:
+            WorkerCommandError: if the worker could not be reached
+        """
+        response = await self.control_client.send(
+            container_name, WorkerCommand.METRICS
+        )
+        return response["metrics"]
 
-        def goal_reached(container):
+    async def assign_stream(
+            self,
+            container_name: str,
+            device_id: int,
+            stream_url: str,
+            options: dict = None
+    ):
+        """
+        Assigns the stream of a device to the given worker
+        Parameters:
+            container_name: the name of the worker container
+            device_id: the id of the device
+            stream_url: the url of the device stream
+            options: per device settings overriding the worker defaults,
+                     e.g. motion_threshold, motion_pixel_threshold
+                     and motion_max_skip
+        Throws:
+            WorkerCommandError: if the worker could not be reached
+                                or refused the stream
+        """
+        logger.info(f"Assigning device {device_id} to {container_name}")
+        await self.control_client.send(
+            container_name,
+            WorkerCommand.ASSIGN,
+            device_id=device_id,
+            source=stream_url,
+            options=options or {}
+        )
 
-            for line in container.logs(stream=True, follow=True, tail=5): # We only care about the last 10 lines
-                decodedLine = line.decode("utf-8")
-                logger.info(decodedLine)
+    async def retarget_stream(
+            self,
+            container_name: str,
+            device_id: int,
+            stream_url: str,
+            new_device_id: int = None,
+            options: dict = None
+    ):
+        """
+        Switches a device served by the given worker to another stream,
+        and optionally to another device id, keeping the loaded model,
+        the database pool and, when possible, the ffmpeg encoder
+        Parameters:
+            container_name: the name of the worker container
+            device_id: the id of the served device
+            stream_url: the url of the new stream
+            new_device_id: the id the stream is served under from now on,
+                           the same device if None
+            options: the new per device settings, the current ones if None
+        Throws:
+            WorkerCommandError: if the worker could not be reached
+                                or was not serving the device
+        """
+        logger.info(
+            f"Retargeting device {device_id} on {container_name} "
+            f"to {stream_url}"
+        )
+        await self.control_client.send(
+            container_name,
+            WorkerCommand.RETARGET,
+            device_id=device_id,
+            source=stream_url,
+            new_device_id=new_device_id,
+            options=options
+        )
 
-                if b"[ERROR" in line:
-                    error = decodedLine.split("]")[1]
-                    logger.error(error)
-                    return (False,error)
+    async def release_stream(self, container_name: str, device_id: int):
+        """
+        Stops serving the stream of a device on the given worker
+        Throws:
+            WorkerCommandError: if the worker could not be reached
+                                or was not serving the device
+        """
+        logger.info(f"Releasing device {device_id} from {container_name}")
+        await self.control_client.send(
+            container_name,
+            WorkerCommand.RELEASE,
+            device_id=device_id
+        )
 
-                if b"[SUCCESS 4]" in line:
-                    logger.info("Started Streaming")
-                    return (True, "")
+    async def __wait_goals(
+            self,
+            container,
+            timeout_seconds=60,
+            final_stage=WorkerStage.STREAMING_STARTED
+    ):
+        """
+         Waits for the worker in the container to report the final stage
+         on the readiness socket, or scans the container logs for the goal
+         messages if there is no control directory to share the socket in.
 
-            return (False, "Did not reach final goal")
+         Parameters:
+            container: the container to wait for
+            timeout_seconds: the maximum time to wait for the final stage
+            final_stage: the stage the worker is ready at
 
-        task = self.loop.run_in_executor(
-            self.api_pool,
-            goal_reached,
-            container
-        )
+         Throws:
+            ContainerExitedError: if the worker failed or exited
+            before reaching the final stage
+            ContainerGoalTimeout: if the timeout is reached
+            before the final stage is reached
+        """
+        logger.info(f"Waiting for goals in container {container.name}")
+        if self.readiness is not None:
+            task = asyncio.ensure_future(
+                self.__wait_readiness(container, final_stage)
+            )
+        else:
+            task = self.loop.run_in_executor(
+                self.api_pool,
+                self.__scan_goals,
+                container,
+                self.log_goals[final_stage]
+            )
         try:
             (success,error) = await asyncio.wait_for(task, timeout_seconds)
             if not success:
@@ -277,6 +518,47 @@ class DockerApi:
             await self.remove_container(container.name, force=True)
             raise ContainerGoalTimeout(container.name)
 
+    async def __wait_readiness(self, container, final_stage):
+        waiter = asyncio.ensure_future(
+            self.readiness.wait(container.name, final_stage)
+        )
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {waiter}, timeout=self.container_poll_seconds
+                )
+                if done:
+                    return waiter.result()
+                # A worker that crashes before connecting never reports
+                await self.loop.run_in_executor(
+                    self.api_pool, container.reload
+                )
+                if container.status in ("exited", "dead"):
+                    return (False, f"Container {container.status} before "
+                                   f"reaching {final_stage.name}")
+        finally:
+            waiter.cancel()
+
+    @staticmethod
+    def __scan_goals(container, final_goal):
+        final_goal_message = f"[SUCCESS {final_goal}]".encode()
+
+        # We only care about the last 10 lines
+        for line in container.logs(stream=True, follow=True, tail=5):
+            decodedLine = line.decode("utf-8")
+            logger.info(decodedLine)
+
+            if b"[ERROR" in line:
+                error = decodedLine.split("]")[1]
+                logger.error(error)
+                return (False, error)
+
+            if final_goal_message in line:
+                logger.info("Started Streaming")
+                return (True, "")
+
+        return (False, "Did not reach final goal")
+
     async def pause_container(self, container_name: str):
         """
         Pauses the container with the given name
@@ -332,12 +614,18 @@ class DockerApi:
         """
         try:
             container = await self.get_container(container_name)
+            final_stage = WorkerStage.STREAMING_STARTED
+            if container.labels.get(WORKER_ROLE_LABEL) == WORKER_ROLE:
+                final_stage = WorkerStage.WORKER_READY
+            if self.readiness is not None:
+                await self.readiness.start()
+                self.readiness.reset(container_name)
             await self.loop.run_in_executor(
                 self.api_pool,
                 container.start
             )
 
-            await self.__wait_goals(container)
+            await self.__wait_goals(container, final_stage=final_stage)
         except (DockerException, APIError) as e:
             logger.error(f"Error starting container {container_name}")
             raise e
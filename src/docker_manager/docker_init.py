@@ -5,11 +5,17 @@ from src.docker_manager.constants import (
     DOCKERFILE_CPU,
     DOCKERFILE_GPU,
     TAG_CPU,
-    TAG_GPU
+    TAG_GPU,
+    YOLOV5_VERSION
+)
+from src.docker_manager.model_cache import (
+    CPU_BACKEND_PREFERENCE,
+    ModelBackend
 )
 from src.config import (
     HARDWARE_ACCELERATION_PROCESSING_MODE_KEY,
-    HARDWARE_ACCELERATION_CUDA_VERSION_KEY
+    HARDWARE_ACCELERATION_CUDA_VERSION_KEY,
+    HARDWARE_ACCELERATION_MODEL_BACKEND_KEY
 )
 import logging
 
@@ -19,12 +25,13 @@ logger = logging.getLogger(__name__)
 class ProcessingMode(Enum):
     CPU = auto()
     GPU = auto()
+    CPU_INT8 = auto()  # CPU with an INT8 quantized model
 
 
 def validate_worker_config(hardware_acceleration_cfg: dict):
     processing_mode_value = hardware_acceleration_cfg["processing_mode"]
     mode = ProcessingMode[processing_mode_value]
-    if mode == ProcessingMode.CPU:
+    if mode in (ProcessingMode.CPU, ProcessingMode.CPU_INT8):
         return {
             "processing_mode": mode,
         }
@@ -41,9 +48,57 @@ def validate_worker_config(hardware_acceleration_cfg: dict):
         }
 
 
+def model_settings(hardware_acceleration_cfg: dict):
+    """
+        Returns the model backends to try, fastest first,
+        and the inference size of the exported models.
+        Throws:
+            IncompatibleConfigVariables: if the backend can not be used
+                                         in the processing mode.
+    """
+    mode = ProcessingMode[hardware_acceleration_cfg["processing_mode"]]
+    backend_value = hardware_acceleration_cfg["model_backend"].upper()
+    imgsz = [
+        int(size)
+        for size in hardware_acceleration_cfg["model_imgsz"].split(",")
+    ]
+    if len(imgsz) == 1:
+        imgsz *= 2
+
+    if mode == ProcessingMode.CPU_INT8:
+        if backend_value not in ("AUTO", ModelBackend.ONNX_INT8.name):
+            raise IncompatibleConfigVariables(
+                HARDWARE_ACCELERATION_PROCESSING_MODE_KEY,
+                HARDWARE_ACCELERATION_MODEL_BACKEND_KEY
+            )
+        # Falls back to the fastest FP32 model if INT8 is not accurate enough
+        backends = [ModelBackend.ONNX_INT8] + CPU_BACKEND_PREFERENCE
+    elif backend_value == "AUTO":
+        if mode == ProcessingMode.CPU:
+            backends = CPU_BACKEND_PREFERENCE
+        else:
+            backends = [ModelBackend.PYTORCH]
+    else:
+        backend = ModelBackend[backend_value]
+        if mode == ProcessingMode.GPU and backend in (
+                ModelBackend.OPENVINO,
+                ModelBackend.ONNX_INT8
+        ):
+            raise IncompatibleConfigVariables(
+                HARDWARE_ACCELERATION_PROCESSING_MODE_KEY,
+                HARDWARE_ACCELERATION_MODEL_BACKEND_KEY
+            )
+        backends = [backend]
+
+    return {
+        "backends": backends,
+        "imgsz": tuple(imgsz[:2])
+    }
+
+
 def build_settings(hardware_acceleration_cfg: dict):
     valid_cfg = validate_worker_config(hardware_acceleration_cfg)
-    if valid_cfg["processing_mode"] == ProcessingMode.CPU:
+    if valid_cfg["processing_mode"] != ProcessingMode.GPU:
         return {
             "path": DOCKERFILE_CPU,
             "tag": TAG_CPU
@@ -67,7 +122,8 @@ def build_images(build_args: dict):
         rm=True,
         dockerfile=build_args["path"] + "/Dockerfile",
         buildargs={
-            "CUDA_VERSION": build_args.get("cuda_version", None)
+            "CUDA_VERSION": build_args.get("cuda_version", None),
+            "YOLOV5_VERSION": YOLOV5_VERSION
         }
     )
     logger.info(f"Image built with tag {build_args['tag']}")
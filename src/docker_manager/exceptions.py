@@ -33,3 +33,27 @@ class ContainerNotFound(Exception):
             does not exist.
         """
         super().__init__(self.message)
+
+
+class ModelExportError(Exception):
+    """
+    Raised when the weights can not be exported to a model backend
+    """
+
+    def __init__(self, backend, error_message):
+        self.message = f"""
+            Model export to {backend} failed, error: {error_message}
+        """
+        super().__init__(self.message)
+
+
+class WorkerCommandError(Exception):
+    """
+    Raised when a worker can not be reached or refuses a control command
+    """
+
+    def __init__(self, container_name, error_message):
+        self.message = f"""
+            Worker {container_name} failed the command, error: {error_message}
+        """
+        super().__init__(self.message)
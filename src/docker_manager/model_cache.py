@@ -0,0 +1,358 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum, auto
+from typing import List, Optional, Tuple
+
+import docker
+from docker.errors import APIError, ContainerError, DockerException
+
+from src.docker_manager.constants import (
+    CALIBRATION_MOUNT,
+    MODEL_CACHE_MOUNT,
+    YOLOV5_VERSION
+)
+from src.docker_manager.exceptions import ModelExportError
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+COMPARISON_FILE = "comparison.json"
+
+
+class ModelBackend(Enum):
+    PYTORCH = auto()
+    TORCHSCRIPT = auto()
+    ONNX = auto()
+    OPENVINO = auto()
+    ONNX_INT8 = auto()
+
+
+# yolov5 export.py --include value and the name of the exported model
+EXPORT_FORMATS = {
+    ModelBackend.TORCHSCRIPT: ("torchscript", "{stem}.torchscript"),
+    ModelBackend.ONNX: ("onnx", "{stem}.onnx"),
+    ModelBackend.OPENVINO: ("openvino", "{stem}_openvino_model"),
+    # Quantized from the ONNX export by quantize.py
+    ModelBackend.ONNX_INT8: ("onnx", "{stem}_int8.onnx"),
+}
+
+# TorchScript traces the model with a fixed batch size
+DYNAMIC_BATCH_BACKENDS = {
+    ModelBackend.PYTORCH,
+    ModelBackend.ONNX,
+    ModelBackend.OPENVINO,
+    ModelBackend.ONNX_INT8
+}
+
+# Fastest first
+CPU_BACKEND_PREFERENCE = [
+    ModelBackend.OPENVINO,
+    ModelBackend.ONNX,
+    ModelBackend.TORCHSCRIPT,
+    ModelBackend.PYTORCH
+]
+
+
+@dataclass(frozen=True)
+class ExportedModel:
+    backend: ModelBackend
+    weights: str  # path of the model inside the worker container
+    imgsz: Tuple[int, int]
+
+
+def is_compatible_version(version: str, other_version: str) -> bool:
+    """Exports of the same yolov5 major release can be used interchangeably."""
+    return version.split(".")[0] == other_version.split(".")[0]
+
+
+class ModelCache:
+    """
+        Content addressed cache of models exported to optimized formats.
+        Entries are keyed by the hash of the weights, the inference size,
+        the backend and the batch mode, and are built once by running
+        yolov5's export.py in the worker image.
+        INT8 entries are also keyed by the calibration frames and are only
+        used if they count people like the FP32 model on those frames.
+    """
+
+    def __init__(
+            self,
+            cache_dir: str,
+            weights_path: str,
+            processor_image: str,
+            yolov5_version: str = YOLOV5_VERSION,
+            calibration_dir: str = None,
+            min_count_agreement: float = 0
+    ):
+        """
+            Parameters:
+                calibration_dir: sample frames used to calibrate and
+                                 check the INT8 model.
+                min_count_agreement: fraction of the calibration frames
+                                     where the INT8 model must count the
+                                     same people as the FP32 model.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.weights_path = weights_path
+        self.weights_name = os.path.basename(weights_path)
+        self.processor_image = processor_image
+        self.yolov5_version = yolov5_version
+        self.calibration_dir = calibration_dir
+        self.min_count_agreement = min_count_agreement
+        self._weights_hash = None
+        self._calibration_hash = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def weights_hash(self) -> str:
+        if self._weights_hash is None:
+            sha256 = hashlib.sha256()
+            with open(self.weights_path, "rb") as weights:
+                for chunk in iter(lambda: weights.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+            self._weights_hash = sha256.hexdigest()
+        return self._weights_hash
+
+    @property
+    def calibration_hash(self) -> str:
+        if self._calibration_hash is None:
+            sha256 = hashlib.sha256()
+            for name in sorted(os.listdir(self.calibration_dir)):
+                path = os.path.join(self.calibration_dir, name)
+                if not os.path.isfile(path):
+                    continue
+                sha256.update(name.encode())
+                with open(path, "rb") as frame:
+                    sha256.update(frame.read())
+            self._calibration_hash = sha256.hexdigest()
+        return self._calibration_hash
+
+    def key_prefix(
+            self,
+            backend: ModelBackend,
+            imgsz: Tuple[int, int],
+            dynamic: bool
+    ) -> str:
+        batch_mode = "dynamic" if dynamic else "static"
+        prefix = (
+            f"{self.weights_hash[:16]}-{imgsz[0]}x{imgsz[1]}"
+            f"-{backend.name.lower()}-{batch_mode}"
+        )
+        if backend == ModelBackend.ONNX_INT8:
+            prefix += f"-{self.calibration_hash[:8]}"
+        return prefix
+
+    def lookup(
+            self,
+            backend: ModelBackend,
+            imgsz: Tuple[int, int],
+            dynamic: bool
+    ) -> Optional[ExportedModel]:
+        """
+            Finds an export made by a compatible yolov5 version.
+            Returns:
+                The exported model, None if there is no compatible export.
+        """
+        prefix = self.key_prefix(backend, imgsz, dynamic)
+        for entry in sorted(os.listdir(self.cache_dir)):
+            if not entry.startswith(prefix):
+                continue
+            manifest = self.__read_manifest(entry)
+            if manifest is None or manifest["weights_sha256"] \
+                    != self.weights_hash:
+                continue
+            if not is_compatible_version(
+                    manifest["yolov5_version"],
+                    self.yolov5_version
+            ):
+                continue
+            if backend == ModelBackend.ONNX_INT8:
+                self.__check_comparison(manifest["comparison"])
+            return self.__to_exported_model(entry, backend, imgsz)
+        return None
+
+    def build(
+            self,
+            backend: ModelBackend,
+            imgsz: Tuple[int, int],
+            dynamic: bool
+    ) -> ExportedModel:
+        """
+            Exports the weights to the given backend in the worker image.
+            Throws:
+                ModelExportError: if the export failed or the INT8 model
+                                  does not count people like the FP32 one.
+        """
+        include, _ = EXPORT_FORMATS[backend]
+        volumes = {self.cache_dir: {"bind": MODEL_CACHE_MOUNT, "mode": "rw"}}
+        if backend == ModelBackend.ONNX_INT8:
+            volumes[os.path.abspath(self.calibration_dir)] = {
+                "bind": CALIBRATION_MOUNT,
+                "mode": "ro"
+            }
+        entry = (
+            f"{self.key_prefix(backend, imgsz, dynamic)}-{self.yolov5_version}"
+        )
+        build_entry = f".build-{entry}"
+        build_dir = os.path.join(self.cache_dir, build_entry)
+        shutil.rmtree(build_dir, ignore_errors=True)
+        os.makedirs(build_dir)
+
+        container_weights = f"{MODEL_CACHE_MOUNT}/{build_entry}/" \
+                            f"{self.weights_name}"
+        export_command = " ".join([
+            "python", "export.py",
+            "--weights", container_weights,
+            "--imgsz", str(imgsz[0]), str(imgsz[1]),
+            "--include", include,
+            "--device", "cpu",
+            *(["--dynamic"] if dynamic else [])
+        ])
+        if backend == ModelBackend.ONNX_INT8:
+            build_path = f"{MODEL_CACHE_MOUNT}/{build_entry}"
+            export_command += " && " + " ".join([
+                "python", "quantize.py",
+                "--weights", container_weights,
+                "--onnx", os.path.splitext(container_weights)[0] + ".onnx",
+                "--output", f"{build_path}/{self.__exported_name(backend)}",
+                "--frames", CALIBRATION_MOUNT,
+                "--imgsz", str(imgsz[0]), str(imgsz[1]),
+                "--report", f"{build_path}/{COMPARISON_FILE}"
+            ])
+        logger.info(
+            f"Exporting {self.weights_name} to {backend.name} "
+            f"at {imgsz}, please wait, this may take a while..."
+        )
+        try:
+            docker.from_env().containers.run(
+                image=self.processor_image,
+                entrypoint=[
+                    "sh", "-c",
+                    f"cp {self.weights_name} {container_weights} && "
+                    f"{export_command} && rm {container_weights}"
+                ],
+                volumes=volumes,
+                remove=True
+            )
+        except (ContainerError, DockerException, APIError) as e:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise ModelExportError(backend.name, e)
+
+        if not os.path.exists(
+                os.path.join(build_dir, self.__exported_name(backend))):
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise ModelExportError(backend.name, "export produced no model")
+
+        manifest_content = {
+            "weights": self.weights_name,
+            "weights_sha256": self.weights_hash,
+            "imgsz": list(imgsz),
+            "backend": backend.name,
+            "dynamic": dynamic,
+            "yolov5_version": self.yolov5_version,
+            "created_at": datetime.utcnow().isoformat()
+        }
+        if backend == ModelBackend.ONNX_INT8:
+            with open(os.path.join(build_dir, COMPARISON_FILE)) as comparison:
+                manifest_content["comparison"] = json.load(comparison)
+        with open(os.path.join(build_dir, MANIFEST_FILE), "w") as manifest:
+            json.dump(manifest_content, manifest)
+        entry_dir = os.path.join(self.cache_dir, entry)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(build_dir, entry_dir)
+        logger.info(f"Exported model cached at {entry_dir}")
+        if backend == ModelBackend.ONNX_INT8:
+            self.__check_comparison(manifest_content["comparison"])
+        return self.__to_exported_model(entry, backend, imgsz)
+
+    def get_or_build(
+            self,
+            backend: ModelBackend,
+            imgsz: Tuple[int, int],
+            dynamic: bool = False
+    ) -> ExportedModel:
+        """
+            Returns the cached export of the model, building it if missing.
+            Throws:
+                ModelExportError: if the export failed.
+        """
+        if dynamic and backend not in DYNAMIC_BATCH_BACKENDS:
+            raise ModelExportError(
+                backend.name,
+                "the backend does not support a dynamic batch size"
+            )
+        if backend == ModelBackend.ONNX_INT8 and (
+                self.calibration_dir is None
+                or not os.path.isdir(self.calibration_dir)
+        ):
+            raise ModelExportError(
+                backend.name,
+                f"no calibration frames at {self.calibration_dir}"
+            )
+        if backend == ModelBackend.PYTORCH:
+            return ExportedModel(backend, self.weights_name, imgsz)
+
+        exported_model = self.lookup(backend, imgsz, dynamic)
+        if exported_model is not None:
+            logger.info(f"Using cached {backend.name} model")
+            return exported_model
+        return self.build(backend, imgsz, dynamic)
+
+    def select(
+            self,
+            backends: List[ModelBackend],
+            imgsz: Tuple[int, int],
+            dynamic: bool = False
+    ) -> ExportedModel:
+        """
+            Returns the first of the given backends that can be exported,
+            falling back to the PyTorch weights.
+        """
+        for backend in backends:
+            try:
+                return self.get_or_build(backend, imgsz, dynamic)
+            except ModelExportError as e:
+                logger.warning(e.message)
+        return self.get_or_build(ModelBackend.PYTORCH, imgsz)
+
+    def __check_comparison(self, comparison: dict):
+        """
+            Throws:
+                ModelExportError: if the INT8 model counts people differently
+                                  from the FP32 model too often.
+        """
+        logger.info(
+            f"INT8 model against FP32 on {comparison['frames']} frames: "
+            f"person count agreement {comparison['count_agreement']:.3f}, "
+            f"mAP@0.5 delta {comparison['map50_delta']:+.3f}, "
+            f"{comparison['fp32_ms']:.1f}ms -> {comparison['int8_ms']:.1f}ms"
+        )
+        if comparison["count_agreement"] < self.min_count_agreement:
+            raise ModelExportError(
+                ModelBackend.ONNX_INT8.name,
+                f"person count agreement {comparison['count_agreement']:.3f} "
+                f"is below {self.min_count_agreement}"
+            )
+
+    def __exported_name(self, backend: ModelBackend) -> str:
+        _, name = EXPORT_FORMATS[backend]
+        return name.format(stem=os.path.splitext(self.weights_name)[0])
+
+    def __to_exported_model(self, entry, backend, imgsz) -> ExportedModel:
+        return ExportedModel(
+            backend,
+            f"{MODEL_CACHE_MOUNT}/{entry}/{self.__exported_name(backend)}",
+            imgsz
+        )
+
+    def __read_manifest(self, entry) -> Optional[dict]:
+        manifest_path = os.path.join(self.cache_dir, entry, MANIFEST_FILE)
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path) as manifest:
+            return json.load(manifest)
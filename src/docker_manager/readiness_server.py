@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+from src.image_processor.readiness import WorkerStage
+from src.image_processor.worker_control import decode_message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WorkerReadiness:
+    """Stages reported by a worker since it was last (re)started."""
+    stages: Set[WorkerStage] = field(default_factory=set)
+    error: Optional[str] = None
+    disconnected: bool = False
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class ReadinessServer:
+    """
+        Unix socket server receiving the stage events of the workers,
+        shared by every worker through the control directory.
+        Runs on the event loop of the manager, so waiting for a worker
+        does not hold any thread.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.workers: Dict[str, WorkerReadiness] = {}
+        self._server = None
+
+    async def start(self):
+        """Starts listening, does nothing if already started."""
+        if self._server is not None:
+            return
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(
+            self.__handle_connection, self.socket_path
+        )
+        logger.info(f"Listening for worker readiness on {self.socket_path}")
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def reset(self, worker_id: str):
+        """Forgets the stages of a worker that is about to (re)start."""
+        previous = self.workers.get(worker_id)
+        self.workers[worker_id] = WorkerReadiness()
+        if previous is not None:
+            previous.changed.set()
+
+    async def wait(
+            self,
+            worker_id: str,
+            final_stage: WorkerStage
+    ) -> Tuple[bool, str]:
+        """
+            Waits until the worker reaches the given stage or fails.
+            Returns:
+                (True, "") if the stage was reached,
+                (False, error) if the worker reported a fatal error
+                or disconnected before reaching it.
+        """
+        readiness = self.workers.setdefault(worker_id, WorkerReadiness())
+        while True:
+            if final_stage in readiness.stages:
+                return True, ""
+            if readiness.error is not None:
+                return False, readiness.error
+            if readiness.disconnected:
+                return (
+                    False,
+                    f"Worker exited before reaching {final_stage.name}"
+                )
+            readiness.changed.clear()
+            await readiness.changed.wait()
+            # The worker may have been reset while waiting
+            readiness = self.workers[worker_id]
+
+    async def __handle_connection(self, reader, writer):
+        # Only the stages of this run are affected when the connection closes
+        readiness = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    event = decode_message(line)
+                    stage = WorkerStage[event["stage"]]
+                    worker_id = event["worker"]
+                except (KeyError, json.decoder.JSONDecodeError):
+                    logger.warning("Invalid readiness event. Discarding...")
+                    continue
+                readiness = self.__update(
+                    worker_id, stage, event.get("message", ""))
+        finally:
+            writer.close()
+            if readiness is not None:
+                readiness.disconnected = True
+                readiness.changed.set()
+
+    def __update(
+            self,
+            worker_id: str,
+            stage: WorkerStage,
+            message: str
+    ) -> WorkerReadiness:
+        logger.info(
+            f"Worker {worker_id} reached {stage.name} {message}".rstrip()
+        )
+        readiness = self.workers.setdefault(worker_id, WorkerReadiness())
+        if stage == WorkerStage.FATAL_ERROR:
+            # The first error is the cause, the next ones its consequences
+            if readiness.error is None:
+                readiness.error = message or "Unknown error"
+        else:
+            readiness.stages.add(stage)
+        readiness.changed.set()
+        return readiness
@@ -19,6 +19,7 @@ from rabbitmq.message_handler import MessageHandler
 from src.docker_manager.exceptions import ContainerNotFound
 from src.docker_manager.scheduler.scheduler_notification import SchedulerNotification
 from src.docker_manager.scheduler.scheduler_notification_message import SchedulerNotificationMessage
+from src.docker_manager.stream_assigner import StreamAssigner
 from src.instance_manager.message import InputMessage
 from src.instance_manager.message.output_message import CtlAcknowledgeMessage
 from src.rabbitmq.rabbitmq_client import AsyncRabbitMQClient
@@ -32,7 +33,8 @@ class SchedulerService:
             instance_dao_factory: InstanceDAOFactory,
             docker_api: DockerApi,
             rabbitmq_client: AsyncRabbitMQClient,
-            queue_to_push_messages: str
+            queue_to_push_messages: str,
+            stream_assigner: StreamAssigner = None
     ):
         self.async_conn_manager = async_conn_manager
         self.instance_dao_factory = instance_dao_factory
@@ -40,6 +42,7 @@ class SchedulerService:
         self.rabbitmq_client = rabbitmq_client
         self.status_queue_name = queue_to_push_messages
         self.instance_ack_exchange_name = "instance_ack_exchange"
+        self.stream_assigner = stream_assigner
 
     async def check_every_container_consistency(self):
         """
@@ -56,6 +59,10 @@ class SchedulerService:
                 logging.error("Error while checking every container consistency: %s", e)
 
     async def __check_instance_status(self, instance, updated_instances, removed_instances, cursor):
+        if self.stream_assigner is not None:
+            await self.__check_shared_instance_status(
+                instance, updated_instances, cursor)
+            return
         try:
             docker_id = InstanceService.build_instance_name(instance.id)
             container = await self.docker_api.get_container(docker_id)
@@ -71,6 +78,18 @@ class SchedulerService:
             logging.error(type(e))
             raise e
 
+    async def __check_shared_instance_status(
+            self, instance, updated_instances, cursor):
+        """
+            Marks as inactive the active instances that are not
+            being served by any multi-stream worker.
+        """
+        if instance.status.value != InstanceStatus.ACTIVE.value:
+            return
+        if await self.stream_assigner.find_worker(instance.id) is None:
+            await self.__instance_exited(instance.id, cursor)
+            updated_instances.append(instance.id)
+
     async def __make_instance_consistent(self, instances, cursor):
         """
             Proves if the instance is consistent with the database.
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from src.docker_manager.docker_api import DockerApi
+from src.docker_manager.exceptions import ContainerNotFound, WorkerCommandError
+
+logger = logging.getLogger(__name__)
+
+
+class StreamAssigner:
+    """
+        Places device streams on multi-stream worker containers,
+        starting a new worker only when every running one is full.
+    """
+
+    def __init__(self, docker_api: DockerApi, streams_per_worker: int):
+        self.docker_api = docker_api
+        self.streams_per_worker = streams_per_worker
+        self._lock = asyncio.Lock()
+
+    async def assign(
+            self,
+            device_id: int,
+            stream_url: str,
+            options: dict = None
+    ) -> str:
+        """
+            Assigns the device to the least loaded worker with a free slot.
+            Parameters:
+                device_id: the id of the device to assign.
+                stream_url: the url of the device stream.
+                options: per device settings sent to the worker.
+            Returns:
+                The name of the worker serving the device.
+            Throws:
+                WorkerCommandError: if the worker refused the stream.
+                DockerException: Error while fetching server API version.
+                APIError: If the server returns an error.
+        """
+        async with self._lock:
+            statuses = await self._get_worker_statuses()
+
+            current_worker = self.__find_worker(statuses, device_id)
+            if current_worker is not None:
+                logger.info(
+                    f"Device {device_id} already served by {current_worker}")
+                if self.__find_source(statuses, current_worker, device_id) \
+                        != stream_url:
+                    await self.docker_api.retarget_stream(
+                        current_worker, device_id, stream_url, options=options)
+                return current_worker
+
+            available_workers = [
+                (len(status["device_ids"]), name)
+                for name, status in statuses.items()
+                if len(status["device_ids"]) < status["max_streams"]
+            ]
+            if available_workers:
+                worker_name = self._choose_worker(available_workers)
+            else:
+                worker_name = self.build_worker_name()
+                await self.docker_api.run_worker(
+                    worker_name,
+                    self.streams_per_worker
+                )
+
+            await self.docker_api.assign_stream(
+                worker_name,
+                device_id,
+                stream_url,
+                options
+            )
+            return worker_name
+
+    async def release(self, device_id: int):
+        """
+            Stops serving the device, removing its worker if it becomes empty.
+            Parameters:
+                device_id: the id of the device to release.
+            Throws:
+                ContainerNotFound: if no worker is serving the device.
+                WorkerCommandError: if the worker could not be reached.
+        """
+        async with self._lock:
+            statuses = await self._get_worker_statuses()
+            worker_name = self.__find_worker(statuses, device_id)
+            if worker_name is None:
+                raise ContainerNotFound(f"serving device {device_id}")
+
+            await self.docker_api.release_stream(worker_name, device_id)
+
+            if len(statuses[worker_name]["device_ids"]) == 1:
+                await self._on_worker_emptied(worker_name)
+
+    async def retarget(self, device_id: int, stream_url: str) -> bool:
+        """
+            Switches a served device to another stream on its worker.
+            Parameters:
+                device_id: the id of the device.
+                stream_url: the url of the new stream.
+            Returns:
+                False if the device is not served or already
+                served with the given stream.
+            Throws:
+                WorkerCommandError: if the worker refused the stream.
+        """
+        async with self._lock:
+            statuses = await self._get_worker_statuses()
+            worker_name = self.__find_worker(statuses, device_id)
+            if worker_name is None or self.__find_source(
+                    statuses, worker_name, device_id) == stream_url:
+                return False
+            await self.docker_api.retarget_stream(
+                worker_name, device_id, stream_url)
+            return True
+
+    async def find_worker(self, device_id: int) -> Optional[str]:
+        """
+            Returns:
+                The name of the worker serving the device,
+                None if the device is not being served.
+        """
+        statuses = await self._get_worker_statuses()
+        return self.__find_worker(statuses, device_id)
+
+    def _choose_worker(self, available_workers: List[Tuple[int, str]]) -> str:
+        """
+            Parameters:
+                available_workers: (number of streams, name) of the
+                                   workers with a free slot.
+            Returns:
+                The name of the worker the device is assigned to,
+                the least loaded one.
+        """
+        _, worker_name = min(available_workers)
+        return worker_name
+
+    async def _on_worker_emptied(self, worker_name: str):
+        """Called with the lock held when a worker serves no more devices."""
+        logger.info(f"Worker {worker_name} is empty, removing it")
+        await self.docker_api.remove_container(worker_name, force=True)
+
+    async def _get_worker_statuses(self) -> Dict[str, dict]:
+        worker_names = await self.docker_api.list_workers()
+
+        async def get_status(worker_name):
+            try:
+                return await self.docker_api.get_worker_status(worker_name)
+            except WorkerCommandError:
+                logger.warning(f"Worker {worker_name} is not responding")
+                return None
+
+        statuses = await asyncio.gather(
+            *[get_status(worker_name) for worker_name in worker_names]
+        )
+        return {
+            worker_name: status
+            for worker_name, status in zip(worker_names, statuses)
+            if status is not None
+        }
+
+    @staticmethod
+    def __find_worker(statuses: Dict[str, dict], device_id: int):
+        for worker_name, status in statuses.items():
+            if device_id in status["device_ids"]:
+                return worker_name
+        return None
+
+    @staticmethod
+    def __find_source(statuses: Dict[str, dict], worker_name, device_id):
+        return statuses[worker_name].get("sources", {}).get(str(device_id))
+
+    @staticmethod
+    def build_worker_name() -> str:
+        return f"worker-{uuid.uuid4().hex[:8]}"
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+from docker.errors import APIError, DockerException
+
+from src.docker_manager.docker_api import DockerApi
+from src.docker_manager.exceptions import (
+    ContainerExitedError,
+    ContainerGoalTimeout
+)
+from src.docker_manager.stream_assigner import StreamAssigner
+
+logger = logging.getLogger(__name__)
+
+
+class WarmWorkerPool(StreamAssigner):
+    """
+        StreamAssigner that keeps idle workers running with the model
+        already loaded, so assigning a device only opens its stream.
+        The pool is refilled in the background after each claim, and
+        shrinks to min_size once no device was claimed for idle_timeout
+        seconds.
+    """
+
+    def __init__(
+            self,
+            docker_api: DockerApi,
+            streams_per_worker: int,
+            size: int,
+            min_size: int = 0,
+            idle_timeout: float = 300,
+            refill_interval: float = 5
+    ):
+        """
+            Parameters:
+                size: idle workers kept ready while devices are claimed.
+                min_size: idle workers kept ready after idle_timeout
+                          seconds without claims.
+                idle_timeout: seconds without claims before the pool
+                              shrinks, and before a surplus idle worker
+                              is removed.
+                refill_interval: seconds between checks of the pool.
+        """
+        super().__init__(docker_api, streams_per_worker)
+        self.size = size
+        self.min_size = min(min_size, size)
+        self.idle_timeout = idle_timeout
+        self.refill_interval = refill_interval
+        self.claims = 0
+        self._last_claim = time.monotonic()
+        self._idle_since: Dict[str, float] = {}
+        self._claimed = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        """Starts filling and resizing the pool in the background."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.__maintain())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def assign(
+            self,
+            device_id: int,
+            stream_url: str,
+            options: dict = None
+    ) -> str:
+        started = time.monotonic()
+        worker_name = await super().assign(device_id, stream_url, options)
+        self.claims += 1
+        self._last_claim = time.monotonic()
+        self._claimed.set()
+        logger.info(
+            f"Device {device_id} claimed {worker_name} "
+            f"in {self._last_claim - started:.2f}s"
+        )
+        return worker_name
+
+    def target_size(self) -> int:
+        """
+            Returns:
+                The number of idle workers the pool should have now.
+        """
+        if time.monotonic() - self._last_claim < self.idle_timeout:
+            return self.size
+        return self.min_size
+
+    def _choose_worker(self, available_workers: List[Tuple[int, str]]) -> str:
+        # Fills the started workers first, keeping the idle ones warm
+        _, worker_name = max(available_workers)
+        return worker_name
+
+    async def _on_worker_emptied(self, worker_name: str):
+        # Kept as an idle worker, removed by the pool if it is not needed
+        logger.info(f"Worker {worker_name} is empty, returning it to the pool")
+
+    async def __maintain(self):
+        while True:
+            try:
+                await self.__resize()
+            except (DockerException, APIError) as e:
+                logger.error(f"Error resizing the warm worker pool: {e}")
+            # Unlike wait_for, wait never swallows the cancellation of stop
+            claimed = asyncio.ensure_future(self._claimed.wait())
+            try:
+                await asyncio.wait({claimed}, timeout=self.refill_interval)
+            finally:
+                claimed.cancel()
+            self._claimed.clear()
+
+    async def __resize(self):
+        async with self._lock:
+            statuses = await self._get_worker_statuses()
+            now = time.monotonic()
+            idle_workers = [
+                name for name, status in statuses.items()
+                if not status["device_ids"]
+            ]
+            self._idle_since = {
+                name: self._idle_since.get(name, now)
+                for name in idle_workers
+            }
+
+            target = self.target_size()
+            # The workers idle for the longest are removed first
+            surplus = sorted(idle_workers, key=self._idle_since.get)
+            surplus = surplus[:max(0, len(idle_workers) - target)]
+            for worker_name in surplus:
+                if now - self._idle_since[worker_name] < self.idle_timeout:
+                    continue
+                logger.info(f"Removing idle worker {worker_name}")
+                await self.docker_api.remove_container(worker_name, force=True)
+                idle_workers.remove(worker_name)
+                del self._idle_since[worker_name]
+
+        missing = target - len(idle_workers)
+        if missing > 0:
+            logger.info(f"Starting {missing} workers for the warm pool")
+            await asyncio.gather(
+                *[self.__start_worker() for _ in range(missing)]
+            )
+
+    async def __start_worker(self):
+        worker_name = self.build_worker_name()
+        try:
+            await self.docker_api.run_worker(
+                worker_name,
+                self.streams_per_worker
+            )
+        except (
+                ContainerExitedError,
+                ContainerGoalTimeout,
+                DockerException,
+                APIError
+        ) as e:
+            logger.error(f"Could not start pool worker {worker_name}: {e}")
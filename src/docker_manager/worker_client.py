@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+
+from src.docker_manager.exceptions import WorkerCommandError
+from src.image_processor.worker_control import (
+    WorkerCommand,
+    decode_message,
+    encode_message
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerControlClient:
+    """
+        Sends control commands to the workers through the unix sockets
+        they create in the shared control directory.
+    """
+
+    def __init__(self, control_dir: str, timeout_seconds=10):
+        self.control_dir = os.path.abspath(control_dir)
+        self.timeout_seconds = timeout_seconds
+
+    def socket_path(self, container_name: str) -> str:
+        return os.path.join(self.control_dir, f"{container_name}.sock")
+
+    async def send(
+            self,
+            container_name: str,
+            command: WorkerCommand,
+            **payload
+    ) -> dict:
+        """
+            Sends a command to the worker running in the given container.
+            Parameters:
+                container_name: the name of the worker container.
+                command: the command to send.
+                payload: the arguments of the command.
+            Returns:
+                The response of the worker.
+            Throws:
+                WorkerCommandError: if the worker could not be reached
+                                    or refused the command.
+        """
+        try:
+            return await asyncio.wait_for(
+                self.__send(container_name, command, payload),
+                self.timeout_seconds
+            )
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            logger.error(f"Could not reach worker {container_name}: {e}")
+            raise WorkerCommandError(container_name, str(e))
+
+    async def __send(self, container_name, command, payload):
+        reader, writer = await asyncio.open_unix_connection(
+            self.socket_path(container_name)
+        )
+        try:
+            writer.write(encode_message({"command": command.name, **payload}))
+            await writer.drain()
+            response = decode_message(await reader.readline())
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+        if not response.get("ok"):
+            raise WorkerCommandError(container_name, response.get("error"))
+        return response
@@ -0,0 +1,115 @@
+import json
+from typing import Dict, List
+
+"""
+Summaries of the benchmark runs of benchmark.py and their comparison
+against a saved baseline.
+"""
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    """Returns the q percentile (0-100) of sorted samples, interpolating
+    between the closest ranks."""
+    if not sorted_samples:
+        return 0.0
+    rank = (len(sorted_samples) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    spread = sorted_samples[upper] - sorted_samples[lower]
+    return sorted_samples[lower] + spread * (rank - lower)
+
+
+def summarize_latencies(samples: List[float]) -> dict:
+    """
+        Parameters:
+            samples: latencies in seconds.
+        Returns:
+            The mean and percentiles of the samples in milliseconds.
+    """
+    samples_ms = sorted(sample * 1E3 for sample in samples)
+    summary = {
+        "mean": sum(samples_ms) / len(samples_ms) if samples_ms else 0.0,
+        "count": len(samples_ms)
+    }
+    for q in PERCENTILES:
+        summary[f"p{q}"] = percentile(samples_ms, q)
+    return summary
+
+
+def summarize_run(
+        config: dict,
+        frames: int,
+        elapsed_seconds: float,
+        stage_samples: Dict[str, List[float]]
+) -> dict:
+    """
+        Parameters:
+            config: the settings of the run, used to match it with
+                    the baseline runs.
+            frames: frames processed while measuring.
+            elapsed_seconds: wall time spent processing them.
+            stage_samples: latencies in seconds by stage.
+    """
+    return {
+        "config": config,
+        "frames": frames,
+        "fps": frames / elapsed_seconds if elapsed_seconds > 0 else 0.0,
+        "stages": {
+            stage: summarize_latencies(samples)
+            for stage, samples in stage_samples.items()
+        }
+    }
+
+
+def run_key(config: dict) -> str:
+    return json.dumps(config, sort_keys=True)
+
+
+def compare(
+    results: List[dict],
+    baseline: List[dict],
+    max_regression: float = 0.1
+) -> List[dict]:
+    """
+        Compares the runs with the baseline runs of the same config.
+        Parameters:
+            max_regression: fraction the FPS can drop, or the p95
+                            latency of a stage can grow, before the run
+                            counts as a regression.
+        Returns:
+            A comparison per run found in the baseline, with the FPS
+            ratio, the p95 ratio per stage and whether it regressed.
+    """
+    baseline_runs = {run_key(run["config"]): run for run in baseline}
+    comparisons = []
+    for run in results:
+        reference = baseline_runs.get(run_key(run["config"]))
+        if reference is None:
+            continue
+        fps_ratio = run["fps"] / reference["fps"] if reference["fps"] else 0.0
+        p95_ratios = {
+            stage: summary["p95"] / reference["stages"][stage]["p95"]
+            for stage, summary in run["stages"].items()
+            if reference["stages"].get(stage, {}).get("p95")
+        }
+        comparisons.append({
+            "config": run["config"],
+            "fps_ratio": fps_ratio,
+            "p95_ratios": p95_ratios,
+            "regressed": fps_ratio < 1 - max_regression or any(
+                ratio > 1 + max_regression for ratio in p95_ratios.values()
+            )
+        })
+    return comparisons
+
+
+def save_results(path: str, results: List[dict]):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path: str) -> List[dict]:
+    with open(path) as file:
+        return json.load(file)
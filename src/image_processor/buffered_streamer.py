@@ -0,0 +1,167 @@
+import logging
+import queue
+import subprocess
+import threading
+import time
+
+from src.image_processor.pipeline import DropPolicy, StageQueue
+from src.image_processor.streamer_rtsp import StreamerRTSP
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedStreamerRTSP(StreamerRTSP):
+    """
+        StreamerRTSP that never blocks the caller: the frames are queued
+        and written to ffmpeg by a writer thread, dropping the oldest
+        queued frames when the encoder falls behind.
+        If ffmpeg exits or its pipe breaks, it is restarted with an
+        exponential backoff, reset once a process stayed up min_uptime
+        seconds.
+    """
+
+    def __init__(self,
+                 destination_uri: str,
+                 width: int, height: int,
+                 framerate: int = 30,
+                 queue_size: int = 2,
+                 min_backoff: float = 0.5,
+                 max_backoff: float = 30,
+                 min_uptime: float = 10):
+        """
+            Parameters:
+                queue_size: frames waiting to be encoded before the oldest
+                            ones are dropped.
+                min_backoff: seconds waited before the first restart
+                             of ffmpeg, doubled on each failed restart.
+                max_backoff: maximum seconds waited between restarts.
+                min_uptime: seconds ffmpeg must stay up writing frames
+                            before the backoff is reset, so an ffmpeg
+                            dying right after its first frames is not
+                            restarted at the minimum backoff forever.
+        """
+        super().__init__(destination_uri, width, height, framerate)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.min_uptime = min_uptime
+        self.written = 0
+        self.restarts = 0
+        self._frames = StageQueue(queue_size, DropPolicy.KEEP_LATEST)
+        self._backoff = min_backoff
+        self._started_at = None
+        self._stop_event = threading.Event()
+        self._writer = None
+
+    @property
+    def dropped(self) -> int:
+        return self._frames.dropped
+
+    def start_stream(self):
+        super().start_stream()
+        self._started_at = time.monotonic()
+        self._writer = threading.Thread(
+            target=self._write_frames,
+            name=f"streamer-{self.destination_uri}",
+            daemon=True
+        )
+        self._writer.start()
+
+    def next_frame(self, frame):
+        """Queues the frame to be sent to the streaming process."""
+        if self.isClosed:
+            raise Exception("Streamer already closed")
+        if self._writer is None:
+            raise Exception("Streamer not started")
+
+        self._frames.put(frame)
+
+    def stop_stream(self):
+        if self.isClosed:
+            raise Exception("Streamer already closed")
+        if self._writer is None:
+            raise Exception("Streamer not started")
+
+        self.isClosed = True
+        self._stop_event.set()
+        self._frames.close()
+        self._writer.join(timeout=5)
+        if self._writer.is_alive():
+            # Stuck writing to a stalled ffmpeg
+            self.proc.kill()
+            self._writer.join(timeout=5)
+        self.__close_process()
+        logger.info(
+            f"Streamer to {self.destination_uri} stopped: "
+            f"{self.written} frames written, {self.dropped} dropped, "
+            f"{self.restarts} restarts"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "restarts": self.restarts
+        }
+
+    def _write_frames(self):
+        while not self._stop_event.is_set():
+            try:
+                frame = self._frames.get(timeout=0.5)
+            except queue.Empty:
+                frame = None
+
+            if self.proc.poll() is not None:
+                logger.warning(
+                    f"ffmpeg streaming to {self.destination_uri} exited "
+                    f"with code {self.proc.returncode}"
+                )
+                self.__restart()
+                continue
+            if frame is None:
+                continue
+
+            try:
+                # Writes the frame memory as is, tobytes would copy it
+                self.pipe.write(
+                    frame.data if frame.flags.c_contiguous
+                    else frame.tobytes()
+                )
+                self.pipe.flush()
+                self.written += 1
+                if time.monotonic() - self._started_at >= self.min_uptime:
+                    self._backoff = self.min_backoff
+            except (BrokenPipeError, OSError, ValueError) as e:
+                if self._stop_event.is_set():
+                    return
+                logger.warning(
+                    f"Error writing to ffmpeg streaming to "
+                    f"{self.destination_uri}: {e}"
+                )
+                self.__restart()
+
+    def __restart(self):
+        self.__close_process()
+        if self._stop_event.wait(self._backoff):
+            return
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+        self.restarts += 1
+        logger.info(
+            f"Restarting ffmpeg streaming to {self.destination_uri}, "
+            f"restart {self.restarts}"
+        )
+        try:
+            self._open()
+            self._started_at = time.monotonic()
+        except OSError as e:
+            # Retried with a longer backoff as the old process is still dead
+            logger.error(f"Could not restart ffmpeg: {e}")
+
+    def __close_process(self):
+        try:
+            self.pipe.close()
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Hashable
+
+"""
+Dispatcher running the callbacks of a stream away from the frame loop.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingDispatcher:
+    """
+        Runs callbacks on a background thread, started on the first call.
+        Callbacks given to submit run once each, in order, like in a
+        single thread executor. Callbacks given to submit_latest only keep
+        their latest arguments per key, which run at most once per interval,
+        so a slow callback never makes the calls pile up.
+    """
+
+    def __init__(self, interval: float = 1, name: str = "callbacks"):
+        """
+            Parameters:
+                interval: minimum seconds between two runs of the same key.
+        """
+        self.interval = interval
+        self.name = name
+        self.executed = 0
+        self.coalesced = 0
+        self._tasks = deque()
+        self._latest = OrderedDict()
+        self._last_run = {}
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._thread = None
+
+    def submit(self, callback: Callable, *args):
+        """Runs the callback once, after the ones submitted before."""
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit after shutdown")
+            self._tasks.append((callback, args))
+            self.__ensure_thread()
+            self._condition.notify()
+
+    def submit_latest(self, key: Hashable, callback: Callable, *args):
+        """
+            Runs the callback with these arguments unless newer ones are
+            submitted for the same key before it runs.
+        """
+        with self._condition:
+            if self._shutdown:
+                return
+            if key in self._latest:
+                self.coalesced += 1
+            self._latest[key] = (callback, args)
+            self.__ensure_thread()
+            self._condition.notify()
+
+    def shutdown(self, wait: bool = True):
+        """Stops the thread once the pending callbacks ran."""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+            thread = self._thread
+        if wait and thread is not None:
+            thread.join()
+
+    def stats(self) -> dict:
+        return {"executed": self.executed, "coalesced": self.coalesced}
+
+    def __ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run,
+                name=self.name,
+                daemon=True
+            )
+            self._thread.start()
+
+    def __next_call(self):
+        """
+            Returns:
+                The next callback and arguments to run, None when shut down
+                without pending calls. Waits while none is due.
+        """
+        with self._condition:
+            while True:
+                if self._tasks:
+                    return self._tasks.popleft()
+                now = time.monotonic()
+                wait = None
+                for key in self._latest:
+                    # Pending calls run right away on shutdown
+                    last_run = self._last_run.get(key, float("-inf"))
+                    due = last_run + self.interval
+                    if due <= now or self._shutdown:
+                        self._last_run[key] = now
+                        return self._latest.pop(key)
+                    wait = due - now if wait is None else min(wait, due - now)
+                if self._shutdown:
+                    return None
+                self._condition.wait(wait)
+
+    def _run(self):
+        while True:
+            call = self.__next_call()
+            if call is None:
+                return
+            callback, args = call
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Error running callback {callback}: {e}")
+            self.executed += 1
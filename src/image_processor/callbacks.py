@@ -1,5 +1,4 @@
 import logging
-import time
 from src.image_processor.metric.metrics_service import DetectionMetricsService
 
 """
@@ -18,8 +17,8 @@ def get_on_metric_received_callback(metrics_service: DetectionMetricsService):
         except Exception as e:
             logger.error("Error saving metric: %s", e)
 
-
-    return ThrottledCallback(on_metric_received, 1)
+    # Called at most once per second by the coalescing dispatcher of the worker
+    return on_metric_received
 
 
 def get_on_stream_started_callback(processed_stream_service, stream_url):
@@ -32,18 +31,11 @@ def get_on_stream_started_callback(processed_stream_service, stream_url):
     return on_stream_started
 
 
-
-class ThrottledCallback:
-    def __init__(self, callback, interval_seconds):
-        self.callback = callback
-        self.interval_seconds = interval_seconds
-        self.last_called = None
-
-    def __call__(self, *args, **kwargs):
-        current_time = time.time()
-        if self.last_called is None or current_time - self.last_called >= self.interval_seconds:
-            if self.last_called is not None:
-                logging.info("Current time: %s", current_time - self.last_called)
-                logging.info("Interval: %s", self.interval_seconds)
-            self.callback(*args, **kwargs)
-            self.last_called = current_time
+def get_on_stream_stopped_callback(processed_stream_service):
+    def on_stream_stopped():
+        try:
+            logger.info("Stream stopped")
+            processed_stream_service.save_processed_stream(None)
+        except Exception as e:
+            logger.error("Error removing processed stream: %s" % e)
+    return on_stream_stopped
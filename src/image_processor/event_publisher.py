@@ -0,0 +1,195 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Tuple
+
+import aio_pika
+
+from src.image_processor.metric.detection_metric import DetectionMetric
+from src.image_processor.metric.metric_spool import encode_event
+
+"""
+Events a worker publishes to the message broker instead of writing them to
+the database, so the worker needs no database connection. They are written
+in batches by the metric ingest of the instance manager.
+"""
+
+logger = logging.getLogger(__name__)
+
+METRICS_EVENT = "metrics"
+PROCESSED_STREAM_EVENT = "processed_stream"
+
+
+def metrics_event(
+        starts: Dict[Tuple[int, datetime], DetectionMetric],
+        closes: Dict[Tuple[int, datetime], DetectionMetric],
+        stale: Dict[int, datetime]
+) -> dict:
+    """Encodes the intervals of a flush of a MetricWriter as spool events."""
+    return {
+        "type": METRICS_EVENT,
+        # Stale first, as they are written before the inserts
+        "events": [
+            encode_event(
+                "stale", DetectionMetric(device_id, None, end_time, 0))
+            for device_id, end_time in stale.items()
+        ] + [
+            encode_event("start", metric) for metric in starts.values()
+        ] + [
+            encode_event("close", metric) for metric in closes.values()
+        ]
+    }
+
+
+def processed_stream_event(device_id: int, stream_url: str) -> dict:
+    return {
+        "type": PROCESSED_STREAM_EVENT,
+        "device_id": device_id,
+        "stream_url": stream_url
+    }
+
+
+class BrokerEventPublisher:
+    """
+        Publishes JSON events to a durable topic exchange from any thread.
+        The connection is made on the first event, by an event loop of its
+        own, and each publish waits for the broker to confirm the event, so
+        an event whose publish raised may not have been delivered.
+    """
+
+    def __init__(
+            self,
+            rabbit_url: str,
+            exchange_name: str,
+            timeout: float = 10
+    ):
+        self.rabbit_url = rabbit_url
+        self.exchange_name = exchange_name
+        self.timeout = timeout
+        self.published = 0
+        self._loop = None
+        self._thread = None
+        self._connection = None
+        self._exchange = None
+        self._lock = threading.Lock()
+
+    def publish(self, routing_key: str, event: dict):
+        """
+            Throws:
+                Exception: if the broker did not confirm the event in time.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.__publish(routing_key, event),
+            self.__event_loop()
+        )
+        try:
+            future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+        self.published += 1
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self.__close(), loop).result(self.timeout)
+        except Exception as e:
+            logger.error(f"Error closing the broker connection: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+
+    def __event_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="event-publisher",
+                    daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    async def __get_exchange(self):
+        if self._exchange is None:
+            # Reconnects by itself once connected
+            self._connection = await aio_pika.connect_robust(self.rabbit_url)
+            try:
+                # Publisher confirms are enabled by default
+                channel = await self._connection.channel()
+                self._exchange = await channel.declare_exchange(
+                    self.exchange_name,
+                    aio_pika.ExchangeType.TOPIC,
+                    durable=True
+                )
+            except Exception:
+                await self.__close()
+                raise
+        return self._exchange
+
+    async def __publish(self, routing_key: str, event: dict):
+        exchange = await self.__get_exchange()
+        await exchange.publish(
+            aio_pika.Message(
+                body=json.dumps(event, separators=(",", ":")).encode(),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            routing_key
+        )
+
+    async def __close(self):
+        connection = self._connection
+        self._connection, self._exchange = None, None
+        if connection is not None:
+            await connection.close()
+
+
+class BrokerMetricSink:
+    """
+        Sink of a MetricWriter publishing the intervals of a flush as one
+        event.
+    """
+
+    def __init__(self, publisher: BrokerEventPublisher):
+        self.publisher = publisher
+
+    def write(
+            self,
+            starts: Dict[Tuple[int, datetime], DetectionMetric],
+            closes: Dict[Tuple[int, datetime], DetectionMetric],
+            stale: Dict[int, datetime]
+    ):
+        self.publisher.publish(
+            METRICS_EVENT, metrics_event(starts, closes, stale))
+
+
+class BrokerProcessedStreamService:
+    """ProcessedStreamService publishing the processed stream of the device."""
+
+    def __init__(
+            self,
+            publisher: BrokerEventPublisher,
+            device_id: int
+    ) -> None:
+        self.publisher = publisher
+        self.device_id = device_id
+
+    def save_processed_stream(self, stream_url: str):
+        logger.info(
+            "Publishing processed stream: %s | device: %s",
+            stream_url,
+            self.device_id
+        )
+        self.publisher.publish(
+            PROCESSED_STREAM_EVENT,
+            processed_stream_event(self.device_id, stream_url)
+        )
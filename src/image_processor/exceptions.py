@@ -0,0 +1,19 @@
+from src.exceptions import AppError
+
+
+class WorkerCapacityExceeded(AppError):
+    def __init__(self, max_streams):
+        self.message = f"Worker is already serving {max_streams} streams"
+        super().__init__(self.message)
+
+
+class StreamAlreadyAssigned(AppError):
+    def __init__(self, device_id):
+        self.message = f"Device {device_id} is already assigned to the worker"
+        super().__init__(self.message)
+
+
+class StreamNotAssigned(AppError):
+    def __init__(self, device_id):
+        self.message = f"Device {device_id} is not assigned to the worker"
+        super().__init__(self.message)
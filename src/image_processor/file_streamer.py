@@ -0,0 +1,44 @@
+from src.image_processor.buffered_streamer import BufferedStreamerRTSP
+from src.image_processor.streamer_interface import StreamerInterface
+from src.image_processor.streamer_rtsp import StreamerRTSP
+
+"""
+Sinks replacing the RTSP output, so the workers can run offline,
+e.g. in benchmarks, with destination urls like null:// or file:///out.mp4.
+"""
+
+
+class NullStreamer(StreamerInterface):
+    """Discards the frames, only counting them."""
+
+    def __init__(self, *args, **kwargs):
+        self.frames = 0
+
+    def start_stream(self):
+        pass
+
+    def next_frame(self, frame):
+        self.frames += 1
+
+    def stop_stream(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"written": self.frames}
+
+
+class FileStreamer(StreamerRTSP):
+    """
+        Encodes the frames like StreamerRTSP but into a video file,
+        as fast as they arrive instead of at the framerate.
+    """
+
+    def _command(self):
+        return [arg for arg in super()._command() if arg != '-re']
+
+    def _output_args(self):
+        return ['-y', self.destination_uri]
+
+
+class BufferedFileStreamer(FileStreamer, BufferedStreamerRTSP):
+    """FileStreamer encoding from its own writer thread."""
@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+class FrameGrabber:
+    """
+        Reads frames from a video source in a background thread,
+        keeping only the most recent one.
+        Each frame is tagged with a sequence number so consumers can tell
+        if a frame was already processed.
+    """
+
+    def __init__(self, source: str, reconnect_delay: float = 1.0):
+        self.source = source
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._frame = None
+        self._sequence = -1
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            raise Exception("Frame grabber already started")
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"grabber-{self.source}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.reconnect_delay + 5)
+
+    def latest(self):
+        """
+            Returns the latest frame read from the source.
+            Returns:
+                A (sequence, frame) tuple, frame is None if no frame
+                was read yet.
+        """
+        with self._lock:
+            return self._sequence, self._frame
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            capture = cv2.VideoCapture(self.source)
+            if not capture.isOpened():
+                logger.warning(f"Could not open source {self.source}")
+                capture.release()
+                time.sleep(self.reconnect_delay)
+                continue
+
+            while not self._stop_event.is_set():
+                success, frame = capture.read()
+                if not success:
+                    logger.warning(f"Lost feed from source {self.source}")
+                    break
+                with self._lock:
+                    self._frame = frame
+                    self._sequence += 1
+
+            capture.release()
+            if not self._stop_event.is_set():
+                time.sleep(self.reconnect_delay)
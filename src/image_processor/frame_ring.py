@@ -0,0 +1,280 @@
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+"""
+Shared memory ring of frames written by a decoder process, so decoding runs
+outside of the inference process GIL and frames are read without copies.
+"""
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT = 64
+EMPTY_SLOT = -1
+
+
+def _aligned(size: int) -> int:
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class FrameRing:
+    """
+        Fixed number of preallocated frame slots in a shared memory block.
+        Frame n is written to slot n % slots, each slot is tagged with the
+        sequence number of its frame, so readers can tell which frame
+        a slot holds and if it was overwritten while being read.
+        There must be a single writer.
+    """
+
+    def __init__(
+            self,
+            shape: Tuple[int, int, int],
+            slots: int,
+            name: str = None
+    ):
+        """
+            Parameters:
+                shape: (height, width, channels) of the frames.
+                slots: number of frames kept. The writer never waits for
+                       the readers, so a frame read from the ring is only
+                       valid for about slots frame intervals, a reader
+                       holding it longer must copy it and check is_current.
+                name: name of an existing ring to attach to, a new ring
+                      is created if None.
+        """
+        if slots < 2:
+            raise ValueError("A frame ring needs at least 2 slots")
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_size = int(np.prod(self.shape))
+        # Header: latest committed sequence, then the sequence of each slot
+        header_size = _aligned(8 * (1 + slots))
+        size = header_size + slots * _aligned(frame_size)
+        self._memory = shared_memory.SharedMemory(
+            name=name,
+            create=name is None,
+            size=size if name is None else 0
+        )
+        self.owner = name is None
+        header = np.ndarray(
+            (1 + slots,),
+            dtype=np.int64,
+            buffer=self._memory.buf
+        )
+        self._latest = header[:1]
+        self._sequences = header[1:]
+        self._frames = np.ndarray(
+            (slots, *self.shape),
+            dtype=np.uint8,
+            buffer=self._memory.buf,
+            offset=header_size,
+            strides=(
+                _aligned(frame_size),
+                *np.empty(self.shape, np.uint8).strides
+            )
+        )
+        if self.owner:
+            self._latest[0] = EMPTY_SLOT
+            self._sequences[:] = EMPTY_SLOT
+        self._next_sequence = int(self._latest[0]) + 1
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def acquire(self) -> Tuple[int, np.ndarray]:
+        """
+            Returns the sequence number and the slot of the next frame,
+            the slot must be filled and then committed.
+        """
+        sequence = self._next_sequence
+        slot = sequence % self.slots
+        self._sequences[slot] = EMPTY_SLOT
+        return sequence, self._frames[slot]
+
+    def commit(self, sequence: int):
+        """Publishes the frame written to the slot of sequence."""
+        self._sequences[sequence % self.slots] = sequence
+        self._latest[0] = sequence
+        self._next_sequence = sequence + 1
+
+    def latest(self) -> Tuple[int, Optional[np.ndarray]]:
+        """
+            Returns:
+                A (sequence, frame) tuple of the latest committed frame,
+                the frame is a view of its slot, None if no frame was
+                written yet.
+        """
+        while True:
+            sequence = int(self._latest[0])
+            if sequence == EMPTY_SLOT:
+                return EMPTY_SLOT, None
+            slot = sequence % self.slots
+            frame = self._frames[slot]
+            if self._sequences[slot] == sequence:
+                return sequence, frame
+            # The writer lapped the ring between both reads
+
+    def is_current(self, sequence: int) -> bool:
+        """
+            Returns:
+                False if the slot of sequence was overwritten since
+                the frame was read.
+        """
+        return self._sequences[sequence % self.slots] == sequence
+
+    def close(self):
+        self._latest = self._sequences = self._frames = None
+        if self.owner:
+            self._memory.unlink()
+        try:
+            self._memory.close()
+        except BufferError:
+            # Frames are still referenced, the memory is released with them
+            pass
+
+
+def _fit(frame, slot):
+    """Writes frame to slot, resizing it if its resolution changed."""
+    if frame.shape == slot.shape:
+        if frame.ctypes.data != slot.ctypes.data:
+            np.copyto(slot, frame)
+    else:
+        cv2.resize(frame, (slot.shape[1], slot.shape[0]), dst=slot)
+
+
+def decode(source, slots, connection, stop_event, reconnect_delay):
+    """
+        Decoder process: reads the frames of source into a frame ring.
+        The ring is created by the reader once the decoder sends it
+        the resolution of the source, and its name is sent back.
+    """
+    ring = None
+    try:
+        while not stop_event.is_set():
+            capture = cv2.VideoCapture(source)
+            if not capture.isOpened():
+                logger.warning(f"Could not open source {source}")
+                capture.release()
+                stop_event.wait(reconnect_delay)
+                continue
+
+            while not stop_event.is_set():
+                if ring is None:
+                    success, frame = capture.read()
+                    if success:
+                        connection.send(frame.shape)
+                        ring = FrameRing(frame.shape, slots, connection.recv())
+                        sequence, slot = ring.acquire()
+                        _fit(frame, slot)
+                        ring.commit(sequence)
+                else:
+                    sequence, slot = ring.acquire()
+                    # Decodes straight into the slot when the size matches
+                    success, frame = capture.read(slot)
+                    if success:
+                        _fit(frame, slot)
+                        ring.commit(sequence)
+                if not success:
+                    logger.warning(f"Lost feed from source {source}")
+                    break
+
+            capture.release()
+            stop_event.wait(reconnect_delay)
+    except (EOFError, BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        if ring is not None:
+            ring.close()
+
+
+def own_frame(grabber, sequence: int, frame):
+    """
+        Returns:
+            A copy of a frame of the grabber that stays valid once the ring
+            laps its slot, None if the slot was already reused. The frames
+            of grabbers without a ring are returned as they are.
+    """
+    is_current = getattr(grabber, "is_current", None)
+    if is_current is None:
+        return frame
+    copied = frame.copy()
+    # Checked after the copy, the writer empties the sequence of a slot
+    # before writing it
+    return copied if is_current(sequence) else None
+
+
+class SharedFrameGrabber:
+    """
+        Same interface as FrameGrabber, but decodes the source in another
+        process and returns views of the frames in a shared memory ring.
+        The frames must not be used after the ring laps them,
+        is_current tells if a frame is still valid.
+    """
+
+    def __init__(
+            self,
+            source: str,
+            slots: int = 8,
+            reconnect_delay: float = 1.0
+    ):
+        self.source = source
+        self.slots = slots
+        self.reconnect_delay = reconnect_delay
+        self._context = multiprocessing.get_context()
+        self._stop_event = self._context.Event()
+        self._connection = None
+        self._process = None
+        self._ring = None
+
+    def start(self):
+        if self._process is not None:
+            raise Exception("Frame grabber already started")
+        self._connection, decoder_connection = self._context.Pipe()
+        self._process = self._context.Process(
+            target=decode,
+            args=(
+                self.source,
+                self.slots,
+                decoder_connection,
+                self._stop_event,
+                self.reconnect_delay
+            ),
+            name=f"decoder-{self.source}",
+            daemon=True
+        )
+        self._process.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._process is not None:
+            self._process.join(timeout=self.reconnect_delay + 5)
+            if self._process.is_alive():
+                self._process.terminate()
+        if self._connection is not None:
+            self._connection.close()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+    def latest(self):
+        """
+            Returns the latest frame read from the source.
+            Returns:
+                A (sequence, frame) tuple, frame is None if no frame
+                was read yet.
+        """
+        if self._ring is None:
+            if self._connection is None or not self._connection.poll():
+                return EMPTY_SLOT, None
+            # The decoder sent the resolution of the source
+            self._ring = FrameRing(self._connection.recv(), self.slots)
+            self._connection.send(self._ring.name)
+        return self._ring.latest()
+
+    def is_current(self, sequence: int) -> bool:
+        return self._ring is not None and self._ring.is_current(sequence)
@@ -0,0 +1,96 @@
+import json
+import logging
+import socket
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Keys of the metadata messages, kept short as one is sent per frame
+DEVICE_ID = "d"
+SEQUENCE = "s"
+TIMESTAMP = "t"
+WIDTH = "w"
+HEIGHT = "h"
+DETECTIONS = "b"
+CLASS_NAMES = "n"
+
+
+def build_metadata(
+        device_id: int,
+        sequence: int,
+        timestamp_ms: int,
+        frame_shape,
+        detections: List[List[float]],
+        names: Dict[int, str]
+) -> dict:
+    """
+        Builds the metadata of a frame.
+        Parameters:
+            detections: rows of x1, y1, x2, y2, confidence, class in
+                        pixels of the source frame.
+            names: class names by class index.
+        Returns:
+            The message, each detection as [x1, y1, x2, y2, class,
+            confidence in thousandths].
+    """
+    classes = sorted({int(row[5]) for row in detections})
+    return {
+        DEVICE_ID: device_id,
+        SEQUENCE: sequence,
+        TIMESTAMP: timestamp_ms,
+        WIDTH: frame_shape[1],
+        HEIGHT: frame_shape[0],
+        DETECTIONS: [
+            [
+                int(row[0]), int(row[1]), int(row[2]), int(row[3]),
+                int(row[5]), int(round(row[4] * 1000))
+            ]
+            for row in detections
+        ],
+        CLASS_NAMES: {str(c): names[c] for c in classes}
+    }
+
+
+def encode_metadata(metadata: dict) -> bytes:
+    return json.dumps(metadata, separators=(",", ":")).encode()
+
+
+def decode_metadata(data: bytes) -> dict:
+    return json.loads(data)
+
+
+class MetadataPublisher(ABC):
+    """Side channel where the detections of each frame are published."""
+
+    @abstractmethod
+    def publish(self, metadata: dict):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class UdpMetadataPublisher(MetadataPublisher):
+    """
+        Sends the metadata of each frame in a UDP datagram.
+        Lost datagrams are not resent, a late overlay is useless anyway.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self.sent = 0
+        self.failed = 0
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def publish(self, metadata: dict):
+        try:
+            self._socket.sendto(encode_metadata(metadata), self.address)
+            self.sent += 1
+        except OSError as e:
+            self.failed += 1
+            logger.debug(f"Could not send metadata to {self.address}: {e}")
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,160 @@
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from enum import Enum, auto
+from typing import Optional
+
+"""
+Smoothing of the people counts before they are saved, so detections
+flickering between two counts do not open a new metric interval each time.
+"""
+
+
+class SmoothingMode(Enum):
+    NONE = auto()  # every change of count is saved
+    DWELL = auto()  # a new count is saved once it lasted min_dwell seconds
+    MAJORITY = auto()  # the most frequent count of the window is saved
+    MAX = auto()  # the highest count of the window is saved
+
+
+class CountSmoother(ABC):
+    """
+        Turns the raw counts of a device into the counts to save,
+        counting the changes of both.
+    """
+
+    def __init__(self):
+        self.raw_transitions = 0
+        self.emitted_transitions = 0
+        self._last_raw = None
+        self._last_emitted = None
+
+    def update(self, count: int, now: float = None) -> int:
+        """
+            Parameters:
+                count: the raw count of the latest frame.
+                now: the monotonic time of the count, the current one by
+                    default.
+            Returns:
+                The count to save.
+        """
+        now = time.monotonic() if now is None else now
+        if self._last_raw is not None and count != self._last_raw:
+            self.raw_transitions += 1
+        self._last_raw = count
+        emitted = self._smooth(count, now, self._last_emitted)
+        if self._last_emitted is not None and emitted != self._last_emitted:
+            self.emitted_transitions += 1
+        self._last_emitted = emitted
+        return emitted
+
+    def stats(self) -> dict:
+        return {
+            "raw_transitions": self.raw_transitions,
+            "emitted_transitions": self.emitted_transitions
+        }
+
+    @abstractmethod
+    def _smooth(self, count: int, now: float, current: Optional[int]) -> int:
+        """
+            Parameters:
+                current: the count saved last, None before the first one.
+        """
+        pass
+
+
+class PassthroughSmoother(CountSmoother):
+
+    def _smooth(self, count: int, now: float, current: Optional[int]) -> int:
+        return count
+
+
+class DwellSmoother(CountSmoother):
+    """Keeps the saved count until a new one lasts min_dwell seconds."""
+
+    def __init__(self, min_dwell: float):
+        super().__init__()
+        self.min_dwell = min_dwell
+        self._candidate = None
+        self._candidate_since = None
+
+    def _smooth(self, count: int, now: float, current: Optional[int]) -> int:
+        if current is None or count == current:
+            self._candidate = None
+            return count
+        if count != self._candidate:
+            self._candidate = count
+            self._candidate_since = now
+        if now - self._candidate_since >= self.min_dwell:
+            self._candidate = None
+            return count
+        return current
+
+
+class WindowSmoother(CountSmoother, ABC):
+    """Smoother over the counts of the last window seconds."""
+
+    def __init__(self, window: float):
+        super().__init__()
+        self.window = window
+        self._samples = deque()
+
+    def _smooth(self, count: int, now: float, current: Optional[int]) -> int:
+        self._samples.append((now, count))
+        # The latest count is always kept
+        samples = self._samples
+        while len(samples) > 1 and samples[0][0] <= now - self.window:
+            samples.popleft()
+        return self._reduce([sample for _, sample in samples], current)
+
+    @abstractmethod
+    def _reduce(self, counts: list, current: Optional[int]) -> int:
+        pass
+
+
+class MajoritySmoother(WindowSmoother):
+    """
+        Saves the most frequent count of the window. On a tie the saved
+        count is kept if it is one of the most frequent, otherwise the
+        highest of them is saved.
+    """
+
+    def _reduce(self, counts: list, current: Optional[int]) -> int:
+        frequencies = Counter(counts)
+        highest = max(frequencies.values())
+        most_frequent = [c for c, n in frequencies.items() if n == highest]
+        if current in most_frequent:
+            return current
+        return max(most_frequent)
+
+
+class MaxSmoother(WindowSmoother):
+    """Saves the highest count of the window, the peak occupancy."""
+
+    def _reduce(self, counts: list, current: Optional[int]) -> int:
+        return max(counts)
+
+
+def build_count_smoother(
+        mode: SmoothingMode,
+        window: float = 5,
+        min_dwell: float = 3
+) -> CountSmoother:
+    """
+        Parameters:
+            window: seconds of counts considered by MAJORITY and MAX.
+            min_dwell: seconds a new count must last with DWELL.
+        Throws:
+            ValueError: if window is not positive or min_dwell is negative.
+    """
+    if window <= 0:
+        raise ValueError(f"The smoothing window must be positive: {window}")
+    if min_dwell < 0:
+        raise ValueError(f"The minimum dwell can not be negative: {min_dwell}")
+    if mode == SmoothingMode.DWELL:
+        return DwellSmoother(min_dwell)
+    if mode == SmoothingMode.MAJORITY:
+        return MajoritySmoother(window)
+    if mode == SmoothingMode.MAX:
+        return MaxSmoother(window)
+    return PassthroughSmoother()
@@ -1,3 +1,5 @@
+from typing import List
+
 from src.image_processor.metric.detection_metric import DetectionMetric
 
 
@@ -16,7 +18,9 @@ class MetricDAO:
     def start_metric(self, metric: DetectionMetric):
         query = """
         INSERT INTO METRIC (deviceid, start_time, end_time, peoplecount)
-        VALUES (%s, %s, %s, %s);
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (deviceid, start_time)
+        DO UPDATE SET end_time = EXCLUDED.end_time;
         """
         self.cursor.execute(
             query,
@@ -42,6 +46,71 @@ class MetricDAO:
             )
         )
 
+    def start_metrics(self, metrics: List[DetectionMetric]):
+        """
+            Inserts several metrics with a single COPY.
+            The metrics already inserted, by a batch written again, are
+            updated instead.
+        """
+        if not metrics:
+            return
+        # COPY can not skip the conflicts, the rows are staged first
+        self.cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS metric_staging
+        (LIKE METRIC INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+        """)
+        query = """
+        COPY metric_staging (deviceid, start_time, end_time, peoplecount)
+        FROM STDIN
+        """
+        with self.cursor.copy(query) as copy:
+            for metric in metrics:
+                copy.write_row((
+                    metric.deviceid,
+                    metric.start_time,
+                    metric.end_time,
+                    metric.count
+                ))
+        self.cursor.execute("""
+        WITH staged AS (
+            DELETE FROM metric_staging
+            RETURNING deviceid, start_time, end_time, peoplecount
+        )
+        INSERT INTO METRIC (deviceid, start_time, end_time, peoplecount)
+        SELECT deviceid, start_time, end_time, peoplecount FROM staged
+        ON CONFLICT (deviceid, start_time)
+        DO UPDATE SET end_time = EXCLUDED.end_time;
+        """)
+
+    def close_metrics(self, metrics: List[DetectionMetric]):
+        """Closes several metrics, pipelined in a single round trip."""
+        if not metrics:
+            return
+        query = """
+        UPDATE METRIC SET end_time = %s
+        WHERE deviceid = %s and start_time = %s;
+        """
+        self.cursor.executemany(
+            query,
+            [
+                (metric.end_time, metric.deviceid, metric.start_time)
+                for metric in metrics
+            ]
+        )
+
+    def close_unfinished_metrics(self, device_id: int, end_time):
+        query = """
+        UPDATE METRIC SET end_time = %s
+        WHERE deviceid = %s AND end_time IS NULL;
+        """
+        self.cursor.execute(
+            query,
+            (
+                end_time,
+                device_id,
+            )
+        )
+
     def get_latest_unfinished_metric(self, device_id: int):
         query = """
         SELECT deviceid, start_time, end_time, peoplecount
@@ -0,0 +1,408 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from psycopg_pool import ConnectionPool
+
+from src.image_processor.metric.detection_metric import DetectionMetric
+from src.image_processor.metric.metric_dao import MetricDAOFactory
+from src.image_processor.metric.metric_writer import MetricWriter, metric_key
+
+"""
+Durable spool of the metric events of a worker.
+Each device appends its events to segment files, read back in order and
+written to the METRIC table once the database accepts them, so an outage
+of the database loses no metric and holds no memory.
+"""
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_FILE = "checkpoint"
+
+# (segment number, offset) of the first event not written yet
+Position = Tuple[int, int]
+
+
+def encode_line(event: dict) -> bytes:
+    return (json.dumps(event, separators=(",", ":")) + "\n").encode()
+
+
+class MetricSpool:
+    """
+        Append-only segments of JSON lines, one directory per device.
+        A checkpoint per device keeps the position of the first event not
+        consumed yet, the segments before it are deleted.
+        Once the events of a device take more than max_bytes, they are
+        compacted by the given compactor, which drops events until they fit.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            segment_bytes: int = 1 << 20,
+            max_bytes: int = 64 << 20
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._files = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def devices(self) -> List[int]:
+        return sorted(
+            int(name) for name in os.listdir(self.directory)
+            if name.isdigit()
+        )
+
+    def append(self, device_id: int, event: dict):
+        line = encode_line(event)
+        with self._lock:
+            file = self.__segment_file(device_id)
+            file.write(line)
+            # Reaches the OS, so it survives the worker
+            file.flush()
+
+    def sync(self):
+        """Makes the appended events survive the host."""
+        with self._lock:
+            for file in self._files.values():
+                os.fsync(file.fileno())
+
+    def size(self, device_id: int) -> int:
+        """Returns the bytes taken by the events not consumed yet."""
+        with self._lock:
+            segment, offset = self.__checkpoint(device_id)
+            return sum(
+                os.path.getsize(self.__segment_path(device_id, number))
+                for number in self.__segments(device_id) if number >= segment
+            ) - offset
+
+    def read(
+            self,
+            max_events: int,
+            device_ids: List[int] = None
+    ) -> Tuple[List[Tuple[int, dict]], Dict[int, Position]]:
+        """
+            Reads the oldest events not consumed yet, in the order each
+            device appended them.
+            Parameters:
+                device_ids: the devices read, all of them if None.
+            Returns:
+                The (device id, event) pairs read and the position after
+                the last of them by device, to commit once they are written.
+        """
+        events, positions = [], {}
+        if device_ids is None:
+            device_ids = self.devices()
+        for device_id in sorted(device_ids):
+            if len(events) >= max_events:
+                break
+            with self._lock:
+                device_events, position = self.__read_device(
+                    device_id, max_events - len(events))
+            events += [(device_id, event) for event in device_events]
+            if device_events:
+                positions[device_id] = position
+        return events, positions
+
+    def commit(self, positions: Dict[int, Position]):
+        """Consumes the events before the given positions."""
+        with self._lock:
+            for device_id, (segment, offset) in positions.items():
+                self.__write_checkpoint(device_id, segment, offset)
+                for number in self.__segments(device_id):
+                    if number < segment:
+                        os.remove(self.__segment_path(device_id, number))
+
+    def compact(
+            self,
+            device_id: int,
+            compactor: Callable[[List[dict], int], Tuple[List[dict], int]]
+    ):
+        """
+            Rewrites the events of the device not consumed yet as the
+            ones returned by the compactor, into a new segment.
+            Parameters:
+                compactor: given the events and max_bytes, returns the
+                           events to keep and the number of dropped ones.
+        """
+        with self._lock:
+            events, _ = self.__read_device(device_id, None)
+            compacted, dropped = compactor(events, self.max_bytes)
+            self.dropped += dropped
+            lines = [encode_line(event) for event in compacted]
+
+            self.__close_file(device_id)
+            old_segments = self.__segments(device_id)
+            segment = old_segments[-1] + 1 if old_segments else 0
+            with open(self.__segment_path(device_id, segment), "wb") as file:
+                file.writelines(lines)
+                os.fsync(file.fileno())
+            self.__write_checkpoint(device_id, segment, 0)
+            for number in old_segments:
+                os.remove(self.__segment_path(device_id, number))
+        logger.info(
+            f"Compacted the metric spool of device {device_id} "
+            f"from {len(events)} to {len(lines)} events"
+        )
+
+    def close(self):
+        with self._lock:
+            for device_id in list(self._files):
+                self.__close_file(device_id)
+
+    def __read_device(
+            self,
+            device_id: int,
+            max_events
+    ) -> Tuple[List[dict], Position]:
+        segment, offset = self.__checkpoint(device_id)
+        events = []
+        for number in self.__segments(device_id):
+            if number < segment:
+                continue
+            if number > segment:
+                segment, offset = number, 0
+            with open(self.__segment_path(device_id, number), "rb") as file:
+                file.seek(offset)
+                for line in file:
+                    if max_events is not None and len(events) >= max_events:
+                        return events, (segment, offset)
+                    # The end of a line being appended
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    try:
+                        events.append(json.loads(line))
+                    except json.decoder.JSONDecodeError:
+                        logger.warning(
+                            "Invalid spooled metric event. Discarding...")
+        return events, (segment, offset)
+
+    def __segment_file(self, device_id: int):
+        file = self._files.get(device_id)
+        if file is not None and file.tell() < self.segment_bytes:
+            return file
+        segments = self.__segments(device_id)
+        if file is not None:
+            self.__close_file(device_id)
+            segment = segments[-1] + 1
+        elif segments and os.path.getsize(
+                self.__segment_path(device_id, segments[-1])
+        ) < self.segment_bytes:
+            # Left by a previous worker of the device
+            segment = segments[-1]
+        else:
+            segment = segments[-1] + 1 if segments else 0
+        file = open(self.__segment_path(device_id, segment), "ab")
+        self._files[device_id] = file
+        return file
+
+    def __close_file(self, device_id: int):
+        file = self._files.pop(device_id, None)
+        if file is not None:
+            file.close()
+
+    def __device_dir(self, device_id: int) -> str:
+        path = os.path.join(self.directory, str(device_id))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def __segment_path(self, device_id: int, number: int) -> str:
+        return os.path.join(
+            self.__device_dir(device_id), f"{number:010d}{SEGMENT_SUFFIX}"
+        )
+
+    def __segments(self, device_id: int) -> List[int]:
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.__device_dir(device_id))
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def __checkpoint(self, device_id: int) -> Position:
+        path = os.path.join(self.__device_dir(device_id), CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path) as file:
+            segment, offset = file.read().split()
+        return int(segment), int(offset)
+
+    def __write_checkpoint(self, device_id: int, segment: int, offset: int):
+        path = os.path.join(self.__device_dir(device_id), CHECKPOINT_FILE)
+        with open(path + ".tmp", "w") as file:
+            file.write(f"{segment} {offset}")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+
+def encode_event(kind: str, metric: DetectionMetric) -> dict:
+    return {
+        "e": kind,
+        "d": metric.deviceid,
+        "s": metric.start_time.isoformat() if metric.start_time else None,
+        "t": metric.end_time.isoformat() if metric.end_time else None,
+        "c": metric.count
+    }
+
+
+def decode_metric(event: dict) -> DetectionMetric:
+    return DetectionMetric(
+        deviceid=event["d"],
+        start_time=datetime.fromisoformat(event["s"]) if event["s"] else None,
+        end_time=datetime.fromisoformat(event["t"]) if event["t"] else None,
+        count=event["c"]
+    )
+
+
+def coalesce_events(events: List[dict]) -> Tuple[
+    Dict[Tuple[int, datetime], DetectionMetric],
+    Dict[Tuple[int, datetime], DetectionMetric],
+    Dict[int, datetime]
+]:
+    """
+        Merges the events of the spool into the intervals to insert, the
+        intervals to close and the devices whose open intervals must be
+        closed, as MetricWriter keeps them.
+    """
+    starts, closes, stale = OrderedDict(), OrderedDict(), {}
+    for event in events:
+        metric = decode_metric(event)
+        key = metric_key(metric)
+        if event["e"] == "stale":
+            # Also closes the intervals of the device not written yet
+            for start_key, start in starts.items():
+                if start_key[0] == metric.deviceid and start.end_time is None:
+                    start.end_time = metric.end_time
+            stale.setdefault(metric.deviceid, metric.end_time)
+        elif event["e"] == "start":
+            starts[key] = metric
+        elif key in starts:
+            starts[key] = metric
+        else:
+            closes[key] = metric
+    return starts, closes, stale
+
+
+def compact_events(
+        events: List[dict],
+        max_bytes: int = None
+) -> Tuple[List[dict], int]:
+    """
+        Returns the fewest events with the same effect as the given ones,
+        and the number of intervals dropped so they take max_bytes at most.
+        The oldest intervals are dropped first, closed intervals before
+        the open ones, and the intervals left open by a previous worker
+        are always closed.
+    """
+    starts, closes, stale = coalesce_events(events)
+    stale_events = [
+        encode_event("stale", DetectionMetric(device_id, None, end_time, 0))
+        for device_id, end_time in stale.items()
+    ]
+    interval_events = [
+        encode_event("start", metric) for metric in starts.values()
+    ] + [
+        encode_event("close", metric) for metric in closes.values()
+    ]
+    dropped = 0
+    if max_bytes is not None:
+        size = sum(
+            len(encode_line(event))
+            for event in stale_events + interval_events
+        )
+        while interval_events and size > max_bytes:
+            closed = [
+                i for i, event in enumerate(interval_events)
+                if event["t"] is not None
+            ]
+            dropped_event = interval_events.pop(closed[0] if closed else 0)
+            size -= len(encode_line(dropped_event))
+            dropped += 1
+    return stale_events + interval_events, dropped
+
+
+class SpooledMetricWriter(MetricWriter):
+    """
+        MetricWriter keeping the metric events in a MetricSpool instead of
+        in memory. The events are written in the order they were spooled,
+        max_pending at most per transaction, and consumed once written.
+        A crash between the commit of the database and the one of the spool
+        writes the last batch again, which updates the intervals it inserted
+        instead of duplicating them.
+        Only the devices the writer spooled events for are written, so the
+        workers can share the spool directory, and the events left by a
+        previous worker of a device are written with its first new event.
+    """
+
+    def __init__(
+            self,
+            conn_manager: ConnectionPool,
+            dao_factory: MetricDAOFactory,
+            spool: MetricSpool,
+            flush_interval: float = 1,
+            max_pending: int = 10000,
+            sink=None
+    ):
+        super().__init__(
+            conn_manager, dao_factory, flush_interval, max_pending, sink=sink)
+        self.spool = spool
+        self._devices = set()
+
+    def stop(self):
+        super().stop()
+        self.spool.close()
+
+    def pending(self) -> int:
+        """Returns the bytes of the events not written yet."""
+        return sum(
+            self.spool.size(device_id) for device_id in list(self._devices)
+        )
+
+    def close_stale(self, device_id: int, end_time: datetime):
+        self.__append(device_id, encode_event(
+            "stale", DetectionMetric(device_id, None, end_time, 0)))
+
+    def start_metric(self, metric: DetectionMetric):
+        self.__append(metric.deviceid, encode_event("start", metric))
+
+    def close_metric(self, metric: DetectionMetric):
+        self.__append(metric.deviceid, encode_event("close", metric))
+
+    def __append(self, device_id: int, event: dict):
+        self._devices.add(device_id)
+        self.spool.append(device_id, event)
+
+    def flush(self) -> bool:
+        """
+            Writes the spooled events until none is left.
+            Returns:
+                True if they were written, False if the rest is kept
+                in the spool for the next flush.
+        """
+        self.spool.sync()
+        device_ids = list(self._devices)
+        for device_id in device_ids:
+            if self.spool.size(device_id) > self.spool.max_bytes:
+                self.spool.compact(device_id, compact_events)
+        while True:
+            events, positions = self.spool.read(self.max_pending, device_ids)
+            if not events:
+                return True
+            try:
+                self._write(*coalesce_events([event for _, event in events]))
+            except Exception as e:
+                logger.error(
+                    f"Error writing {len(events)} spooled metrics, "
+                    f"retrying: {e}")
+                return False
+            self.spool.commit(positions)
+            self.written += len(events)
@@ -0,0 +1,216 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Tuple
+
+from psycopg_pool import ConnectionPool
+
+from src.database.transaction import transaction_sync
+from src.image_processor.metric.detection_metric import DetectionMetric
+from src.image_processor.metric.metric_dao import MetricDAOFactory
+from src.image_processor.pipeline import DropPolicy
+
+"""
+Write-behind persistence of the detection metrics.
+The services queue the intervals they open and close, and a background
+thread writes them in bulk, so saving a metric never waits on the database.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def metric_key(metric: DetectionMetric) -> Tuple[int, datetime]:
+    return metric.deviceid, metric.start_time
+
+
+class DatabaseMetricSink:
+    """
+        Writes the intervals of a flush in a single transaction:
+        the new intervals with COPY and the closed ones as a batch of updates.
+    """
+
+    def __init__(
+            self,
+            conn_manager: ConnectionPool,
+            dao_factory: MetricDAOFactory
+    ):
+        self.conn_manager = conn_manager
+        self.dao_factory = dao_factory
+
+    def write(
+            self,
+            starts: Dict[Tuple[int, datetime], DetectionMetric],
+            closes: Dict[Tuple[int, datetime], DetectionMetric],
+            stale: Dict[int, datetime]
+    ):
+        with transaction_sync(self.conn_manager) as cursor:
+            metrics_dao = self.dao_factory.create_dao(cursor)
+            # Before the inserts, which could be closed too otherwise
+            for device_id, end_time in stale.items():
+                metrics_dao.close_unfinished_metrics(device_id, end_time)
+            metrics_dao.start_metrics(list(starts.values()))
+            metrics_dao.close_metrics(list(closes.values()))
+
+
+class MetricWriter:
+    """
+        Buffers the metric intervals of every device of a worker and
+        writes them every flush_interval seconds to the sink, in a single
+        transaction of the database unless another sink is given.
+        An interval closed before it was written is inserted already closed.
+        Once max_pending intervals are waiting, the drop policy decides
+        whether the oldest waiting one or the incoming one is discarded.
+        Intervals that could not be written are retried on the next flush.
+    """
+
+    def __init__(
+            self,
+            conn_manager: ConnectionPool,
+            dao_factory: MetricDAOFactory,
+            flush_interval: float = 1,
+            max_pending: int = 10000,
+            drop_policy: DropPolicy = DropPolicy.KEEP_LATEST,
+            sink=None
+    ):
+        """
+            Parameters:
+                sink: object whose write(starts, closes, stale) saves the
+                      intervals of a flush, raising if they were not saved.
+        """
+        if drop_policy == DropPolicy.BLOCK:
+            raise ValueError("Saving a metric must never block")
+        if max_pending < 1:
+            raise ValueError("At least one pending metric must fit")
+        self.conn_manager = conn_manager
+        self.dao_factory = dao_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.drop_policy = drop_policy
+        if sink is None:
+            sink = DatabaseMetricSink(conn_manager, dao_factory)
+        self.sink = sink
+        self.dropped = 0
+        self.written = 0
+        self._starts: Dict[Tuple[int, datetime], DetectionMetric] = (
+            OrderedDict()
+        )
+        self._closes: Dict[Tuple[int, datetime], DetectionMetric] = (
+            OrderedDict()
+        )
+        # Devices whose intervals left open by a previous worker must be closed
+        self._stale: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            raise Exception("Metric writer already started")
+        self._thread = threading.Thread(
+            target=self._run,
+            name="metric-writer",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread, writing the pending intervals."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 30)
+            self._thread = None
+        self.flush()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._starts) + len(self._closes)
+
+    def close_stale(self, device_id: int, end_time: datetime):
+        """Closes the intervals of the device still open in the database."""
+        with self._lock:
+            self._stale[device_id] = end_time
+
+    def start_metric(self, metric: DetectionMetric):
+        with self._lock:
+            if self.__make_room():
+                self._starts[metric_key(metric)] = metric
+
+    def close_metric(self, metric: DetectionMetric):
+        key = metric_key(metric)
+        with self._lock:
+            if key in self._starts:
+                self._starts[key] = metric
+            elif self.__make_room():
+                self._closes[key] = metric
+
+    def flush(self) -> bool:
+        """
+            Writes the pending intervals.
+            Returns:
+                True if they were written, False if they were queued again.
+        """
+        with self._lock:
+            starts, self._starts = self._starts, OrderedDict()
+            closes, self._closes = self._closes, OrderedDict()
+            stale, self._stale = self._stale, {}
+        if not starts and not closes and not stale:
+            return True
+        try:
+            self._write(starts, closes, stale)
+        except Exception as e:
+            logger.error(
+                "Error writing %s metrics, retrying: %s",
+                len(starts) + len(closes), e
+            )
+            self.__requeue(starts, closes, stale)
+            return False
+        self.written += len(starts) + len(closes)
+        return True
+
+    def _write(
+            self,
+            starts: Dict[Tuple[int, datetime], DetectionMetric],
+            closes: Dict[Tuple[int, datetime], DetectionMetric],
+            stale: Dict[int, datetime]
+    ):
+        self.sink.write(starts, closes, stale)
+
+    def __requeue(
+            self,
+            starts: Dict[Tuple[int, datetime], DetectionMetric],
+            closes: Dict[Tuple[int, datetime], DetectionMetric],
+            stale: Dict[int, datetime]
+    ):
+        with self._lock:
+            # The intervals queued meanwhile are newer, so they stay last
+            for key, metric in self._starts.items():
+                starts[key] = metric
+            for key, metric in self._closes.items():
+                if key in starts:
+                    starts[key] = metric
+                else:
+                    closes[key] = metric
+            stale.update(self._stale)
+            self._starts, self._closes, self._stale = starts, closes, stale
+            while len(self._starts) + len(self._closes) > self.max_pending:
+                self.__drop_oldest()
+
+    def __make_room(self) -> bool:
+        if len(self._starts) + len(self._closes) < self.max_pending:
+            return True
+        if self.drop_policy == DropPolicy.DROP_INCOMING:
+            self.dropped += 1
+            return False
+        self.__drop_oldest()
+        return True
+
+    def __drop_oldest(self):
+        # Losing a past interval is better than leaving one open forever
+        pending = self._starts if self._starts else self._closes
+        pending.popitem(last=False)
+        self.dropped += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
@@ -4,19 +4,43 @@ from src.image_processor.metric.detection_metric import DetectionMetric
 from src.database.transaction import transaction_sync
 from psycopg_pool import AsyncConnectionPool, ConnectionPool
 from src.image_processor.metric.metric_dao import MetricDAOFactory
+from src.image_processor.metric.metric_writer import MetricWriter
+from src.image_processor.metric.count_smoother import CountSmoother
+from src.image_processor.worker_metrics import StreamMetrics
 
 
 class DetectionMetricsService:
 
     def __init__(self, conn_manager: ConnectionPool,
-                 dao_factory: MetricDAOFactory, device_id: int) -> None:
+                 dao_factory: MetricDAOFactory, device_id: int,
+                 writer: MetricWriter = None,
+                 smoother: CountSmoother = None,
+                 stream_metrics: StreamMetrics = None) -> None:
+        """
+            Parameters:
+                writer: writes the metrics in the background. Without it
+                        each metric is saved in its own transaction.
+                smoother: smooths the counts before they are saved.
+                stream_metrics: where the raw and saved count changes
+                                of the device are counted.
+        """
         self.conn_manager = conn_manager
         self.logger = logging.getLogger(__name__)
         self.dao_factory = dao_factory
         self.device_id = device_id
+        self.writer = writer
+        self.smoother = smoother
+        self.stream_metrics = stream_metrics
+        # The interval of this device still open, known once written
+        self.open_metric = None
         pass
 
     def save_metric(self, count: int):
+        if self.smoother is not None:
+            count = self.__smooth(count)
+        if self.writer is not None:
+            self.__queue_metric(count)
+            return
         self.logger.info("Saving metric: %s | device: %s",
                          count, self.device_id)
         with transaction_sync(self.conn_manager) as cursor:
@@ -50,3 +74,41 @@ class DetectionMetricsService:
             metrics_dao.close_metric(updated_previous_metric)
             if is_new_metric:
                 _new_metric()
+
+    def __smooth(self, count: int) -> int:
+        raw_transitions = self.smoother.raw_transitions
+        emitted_transitions = self.smoother.emitted_transitions
+        count = self.smoother.update(count)
+        if self.stream_metrics is not None:
+            self.stream_metrics.increment(
+                "count_changes",
+                self.smoother.raw_transitions - raw_transitions)
+            self.stream_metrics.increment(
+                "count_changes_saved",
+                self.smoother.emitted_transitions - emitted_transitions)
+        return count
+
+    def __queue_metric(self, count: int):
+        # The open interval is kept in memory, so only its changes are written
+        if self.open_metric is not None and self.open_metric.count == count:
+            return
+        now = datetime.utcnow()
+        if self.open_metric is None:
+            # Left open by a previous worker of this device
+            self.writer.close_stale(self.device_id, now)
+        else:
+            self.writer.close_metric(DetectionMetric(
+                deviceid=self.device_id,
+                count=self.open_metric.count,
+                start_time=self.open_metric.start_time,
+                end_time=now,
+            ))
+        self.logger.info("Saving metric: %s | device: %s",
+                         count, self.device_id)
+        self.open_metric = DetectionMetric(
+            deviceid=self.device_id,
+            count=count,
+            start_time=now,
+            end_time=None,
+        )
+        self.writer.start_metric(self.open_metric)
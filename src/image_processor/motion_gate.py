@@ -0,0 +1,93 @@
+import threading
+
+import cv2
+
+
+class MotionGate:
+    """
+        Cheap check run before inference that tells if a frame changed
+        enough from the last inferred frame to be worth running the detector.
+        The frames are compared downscaled and in grayscale.
+    """
+
+    def __init__(
+            self,
+            threshold: float = 0.01,
+            pixel_threshold: int = 25,
+            max_skipped_frames: int = 30,
+            downscale_width: int = 64
+    ):
+        """
+            Parameters:
+                threshold: fraction of changed pixels needed to infer,
+                           0 disables the gate.
+                pixel_threshold: minimum grayscale difference (0-255)
+                                 for a pixel to count as changed.
+                max_skipped_frames: a full inference is forced at least
+                                    every max_skipped_frames frames.
+                downscale_width: width the frames are reduced to before
+                                 being compared.
+        """
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.max_skipped_frames = max_skipped_frames
+        self.downscale_width = downscale_width
+        self.executed = 0
+        self.skipped = 0
+        self._reference = None
+        self._skipped_in_row = 0
+        self._lock = threading.Lock()
+
+    def should_infer(self, frame) -> bool:
+        """
+            Returns:
+                True if the detector must run on the frame,
+                False if the last detections can be reused.
+        """
+        if self.threshold <= 0:
+            with self._lock:
+                self.executed += 1
+            return True
+
+        small_frame = self.__downscale(frame)
+        with self._lock:
+            if self._reference is None \
+                    or self._reference.shape != small_frame.shape \
+                    or self._skipped_in_row >= self.max_skipped_frames \
+                    or self.__changed_fraction(small_frame) >= self.threshold:
+                self._reference = small_frame
+                self._skipped_in_row = 0
+                self.executed += 1
+                return True
+
+            self._skipped_in_row += 1
+            self.skipped += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"executed": self.executed, "skipped": self.skipped}
+
+    def __downscale(self, frame):
+        height, width = frame.shape[:2]
+        size = (
+            self.downscale_width,
+            max(1, round(height * self.downscale_width / width))
+        )
+        gray = cv2.cvtColor(
+            cv2.resize(frame, size, interpolation=cv2.INTER_AREA),
+            cv2.COLOR_BGR2GRAY
+        )
+        return cv2.GaussianBlur(gray, (3, 3), 0)
+
+    def __changed_fraction(self, small_frame) -> float:
+        difference = cv2.absdiff(small_frame, self._reference)
+        changed = cv2.countNonZero(
+            cv2.threshold(
+                difference,
+                self.pixel_threshold,
+                255,
+                cv2.THRESH_BINARY
+            )[1]
+        )
+        return changed / difference.size
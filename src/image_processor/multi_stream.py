@@ -0,0 +1,439 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.image_processor.callback_dispatcher import CoalescingDispatcher
+from src.image_processor.exceptions import (
+    StreamAlreadyAssigned,
+    StreamNotAssigned,
+    WorkerCapacityExceeded
+)
+from src.image_processor.frame_ring import own_frame
+from src.image_processor.streamer_interface import StreamerInterface
+from src.image_processor.streamer_rtsp import StreamerRTSP
+from src.image_processor.worker_control import WorkerCommand
+from src.image_processor.worker_metrics import StreamMetrics, WorkerMetrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeviceStream:
+    """
+        State of a single device stream hosted by a multi-stream worker.
+        The grabber must expose start(), stop() and latest().
+        The motion gate, when given, must expose should_infer() and stats().
+        The viewer watcher, when given, must expose start(), stop()
+        and should_render().
+        A streamer given upfront does not depend on the frames, such as
+        a passthrough relay, and is started with the stream.
+        With a metadata publisher, the detections are published on it
+        instead of being drawn on the frames.
+        The metrics, when given, are a StreamMetrics the stage latencies
+        and frame counters of the stream are recorded in.
+    """
+    device_id: int
+    source: str
+    destination_stream_url: str
+    grabber: object
+    on_metric_detected: Optional[Callable] = None
+    on_stream_started: Optional[Callable] = None
+    on_stream_stopped: Optional[Callable] = None
+    options: dict = field(default_factory=dict)
+    motion_gate: Optional[object] = None
+    viewer_watcher: Optional[object] = None
+    metadata_publisher: Optional[object] = None
+    metrics: Optional[StreamMetrics] = None
+    last_detections: Optional[object] = None
+    streamer: Optional[StreamerInterface] = None
+    last_sequence: int = -1
+    closed: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    callback_executor: CoalescingDispatcher = field(
+        default_factory=CoalescingDispatcher
+    )
+
+
+class MultiStreamWorker:
+    """
+        Hosts several device streams in the same process so that
+        their frames can share the same model and be inferred in one batch.
+    """
+
+    def __init__(
+            self,
+            max_streams: int,
+            stream_factory: Callable[[int, str, dict], DeviceStream],
+            state_file: str = None,
+            framerate: int = 30,
+            streamer_factory: Callable = StreamerRTSP,
+            metrics: WorkerMetrics = None
+    ):
+        """
+            Parameters:
+                max_streams: maximum number of streams served at once.
+                stream_factory: builds a DeviceStream for a device id,
+                                a source url and the stream options.
+                state_file: file where the assigned streams are saved,
+                            so they are restored if the worker restarts.
+                framerate: framerate of the processed streams.
+                streamer_factory: builds the streamer of a device for
+                                  a destination url, width, height and
+                                  framerate.
+                metrics: where the metrics of every stream are kept,
+                         served by the METRICS command.
+        """
+        self.max_streams = max_streams
+        self.stream_factory = stream_factory
+        self.state_file = state_file
+        self.framerate = framerate
+        self.streamer_factory = streamer_factory
+        self.metrics = metrics
+        self.streams: Dict[int, DeviceStream] = {}
+        self._lock = threading.Lock()
+
+    def add_stream(self, device_id: int, source: str, options: dict = None):
+        """
+            Starts serving the given device.
+            Parameters:
+                device_id: the id of the device.
+                source: the url of the device stream.
+                options: per device settings, such as the motion gate
+                         thresholds, overriding the worker defaults.
+            Throws:
+                StreamAlreadyAssigned: if the device is already served.
+                WorkerCapacityExceeded: if the worker has no free slots.
+        """
+        with self._lock:
+            if device_id in self.streams:
+                raise StreamAlreadyAssigned(device_id)
+            if len(self.streams) >= self.max_streams:
+                raise WorkerCapacityExceeded(self.max_streams)
+
+            stream = self.stream_factory(device_id, source, options or {})
+            if self.metrics is not None:
+                stream.metrics = self.metrics.for_device(device_id)
+            self.__start_stream(stream)
+            self.streams[device_id] = stream
+            self.__save_state()
+        logger.info(f"Assigned device {device_id} with source {source}")
+
+    def retarget_stream(
+            self,
+            device_id: int,
+            source: str,
+            new_device_id: int = None,
+            options: dict = None
+    ):
+        """
+            Switches a served device to another source, and optionally
+            to another device id, without releasing its slot.
+            The streamer is kept if the processed stream url and the frame
+            size do not change, so its ffmpeg process is not restarted.
+            Parameters:
+                device_id: the id of the served device.
+                source: the url of the new stream.
+                new_device_id: the id the stream is served under from now
+                               on, the same device if None.
+                options: the new stream options, the current ones if None.
+            Throws:
+                StreamNotAssigned: if the device is not served.
+                StreamAlreadyAssigned: if the new device id is already served.
+        """
+        if new_device_id is None:
+            new_device_id = device_id
+        with self._lock:
+            old_stream = self.streams.get(device_id)
+            if old_stream is None:
+                raise StreamNotAssigned(device_id)
+            if new_device_id != device_id and new_device_id in self.streams:
+                raise StreamAlreadyAssigned(new_device_id)
+
+            stream = self.stream_factory(
+                new_device_id,
+                source,
+                old_stream.options if options is None else options
+            )
+            if self.metrics is not None:
+                # A device keeps its metrics, the stream factory may use them
+                if new_device_id != device_id:
+                    self.metrics.remove(device_id)
+                stream.metrics = self.metrics.for_device(new_device_id)
+
+            old_stream.grabber.stop()
+            if old_stream.viewer_watcher is not None:
+                old_stream.viewer_watcher.stop()
+            with old_stream.lock:
+                old_stream.closed = True
+                # Streamers given upfront depend on the source, such as relays
+                keep_streamer = old_stream.streamer is not None \
+                    and stream.streamer is None \
+                    and old_stream.destination_stream_url \
+                    == stream.destination_stream_url
+                if keep_streamer:
+                    stream.streamer = old_stream.streamer
+                elif old_stream.streamer is not None:
+                    old_stream.streamer.stop_stream()
+                if old_stream.on_stream_stopped is not None \
+                        and (not keep_streamer or new_device_id != device_id):
+                    old_stream.callback_executor.submit(
+                        old_stream.on_stream_stopped)
+            old_stream.callback_executor.shutdown(wait=False)
+
+            if keep_streamer:
+                stream.grabber.start()
+                if stream.viewer_watcher is not None:
+                    stream.viewer_watcher.start()
+                if new_device_id != device_id \
+                        and stream.on_stream_started is not None:
+                    stream.callback_executor.submit(stream.on_stream_started)
+            else:
+                self.__start_stream(stream)
+
+            del self.streams[device_id]
+            self.streams[new_device_id] = stream
+            self.__save_state()
+        logger.info(
+            f"Retargeted device {device_id} to device {new_device_id} "
+            f"with source {source}, "
+            f"{'kept' if keep_streamer else 'restarted'} its streamer"
+        )
+
+    def remove_stream(self, device_id: int):
+        """
+            Stops serving the given device.
+            Throws:
+                StreamNotAssigned: if the device is not served by the worker.
+        """
+        with self._lock:
+            stream = self.streams.pop(device_id, None)
+            if stream is None:
+                raise StreamNotAssigned(device_id)
+            self.__save_state()
+
+        self.__close_stream(stream)
+        if self.metrics is not None:
+            self.metrics.remove(device_id)
+        logger.info(f"Released device {device_id}")
+
+    def close(self):
+        with self._lock:
+            streams = list(self.streams.values())
+            self.streams.clear()
+        for stream in streams:
+            self.__close_stream(stream)
+
+    def restore(self):
+        """Assigns again the streams saved in the state file."""
+        if self.state_file is None or not os.path.isfile(self.state_file):
+            return
+        with open(self.state_file) as state:
+            saved_streams = json.load(state)
+        for device_id, saved_stream in saved_streams.items():
+            logger.info(f"Restoring device {device_id}")
+            self.add_stream(
+                int(device_id),
+                saved_stream["source"],
+                saved_stream["options"]
+            )
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "max_streams": self.max_streams,
+                "device_ids": list(self.streams.keys()),
+                "sources": {
+                    str(device_id): stream.source
+                    for device_id, stream in self.streams.items()
+                },
+                "motion_gate": {
+                    str(device_id): stream.motion_gate.stats()
+                    for device_id, stream in self.streams.items()
+                    if stream.motion_gate is not None
+                },
+                "streamer": {
+                    str(device_id): stream.streamer.stats()
+                    for device_id, stream in self.streams.items()
+                    if hasattr(stream.streamer, "stats")
+                },
+                "callbacks": {
+                    str(device_id): stream.callback_executor.stats()
+                    for device_id, stream in self.streams.items()
+                }
+            }
+
+    def next_batch(self) -> List[Tuple[DeviceStream, int, object]]:
+        """
+            Collects the frames of every stream that were not processed yet.
+            Returns:
+                A list of (stream, sequence, frame) tuples, the frames of a
+                frame ring are views of its slots, see own_frame.
+        """
+        with self._lock:
+            streams = list(self.streams.values())
+
+        batch = []
+        for stream in streams:
+            sequence, frame = stream.grabber.latest()
+            if frame is None or sequence == stream.last_sequence:
+                continue
+            stream.last_sequence = sequence
+            batch.append((stream, sequence, frame))
+        return batch
+
+    def own_frame(self, stream: DeviceStream, sequence: int, frame):
+        """
+            Returns:
+                The frame, copied if it is a view of a frame ring slot so it
+                can be drawn on and queued to the streamer, None if the slot
+                was reused since the frame was read.
+        """
+        return own_frame(stream.grabber, sequence, frame)
+
+    def is_current(self, stream: DeviceStream, sequence: int) -> bool:
+        """
+            Returns:
+                False if the frame ring slot of the frame was reused since
+                it was read.
+        """
+        is_current = getattr(stream.grabber, "is_current", None)
+        return is_current is None or is_current(sequence)
+
+    def needs_inference(self, stream: DeviceStream, frame) -> bool:
+        """
+            Returns:
+                False if the scene of the stream did not change
+                and its last detections can be reused.
+        """
+        if stream.motion_gate is None:
+            return True
+        return stream.motion_gate.should_infer(frame) \
+            or stream.last_detections is None
+
+    def should_render(self, stream: DeviceStream) -> bool:
+        """
+            Returns:
+                False if the frame of the stream does not need to be
+                annotated and encoded as nobody is watching it.
+        """
+        if stream.viewer_watcher is None:
+            return True
+        return stream.viewer_watcher.should_render()
+
+    def publish(self, stream: DeviceStream, frame, detections_info: dict):
+        """
+            Sends the processed frame and detections of a device.
+            Parameters:
+                frame: the annotated frame, None if it was not rendered.
+        """
+        with stream.lock:
+            if stream.closed:
+                # Released while the batch was being inferred
+                return
+
+            if frame is not None:
+                if stream.streamer is not None and (
+                        getattr(stream.streamer, "width", frame.shape[1]),
+                        getattr(stream.streamer, "height", frame.shape[0])
+                ) != (frame.shape[1], frame.shape[0]):
+                    # Retargeted to a source with another frame size
+                    stream.streamer.stop_stream()
+                    stream.streamer = None
+                if stream.streamer is None:
+                    stream.streamer = self.streamer_factory(
+                        stream.destination_stream_url,
+                        frame.shape[1],
+                        frame.shape[0],
+                        self.framerate
+                    )
+                    stream.streamer.start_stream()
+                    if stream.on_stream_started is not None:
+                        stream.callback_executor.submit(
+                            stream.on_stream_started)
+                started = time.perf_counter()
+                stream.streamer.next_frame(frame)
+                if stream.metrics is not None:
+                    stream.metrics.observe(
+                        "encode_write", time.perf_counter() - started)
+                    stream.metrics.increment("streamed")
+            if stream.on_metric_detected is not None:
+                callback = stream.on_metric_detected
+                if stream.metrics is not None:
+                    callback = stream.metrics.timed("callback", callback)
+                # Only the latest detections are saved, at most once per
+                # interval
+                stream.callback_executor.submit_latest(
+                    "metric", callback, detections_info)
+
+    def handlers(self) -> dict:
+        """Control command handlers served by this worker."""
+        def assign(request):
+            self.add_stream(
+                request["device_id"],
+                request["source"],
+                request.get("options")
+            )
+            return self.status()
+
+        def retarget(request):
+            self.retarget_stream(
+                request["device_id"],
+                request["source"],
+                request.get("new_device_id"),
+                request.get("options")
+            )
+            return self.status()
+
+        def release(request):
+            self.remove_stream(request["device_id"])
+            return self.status()
+
+        return {
+            WorkerCommand.ASSIGN: assign,
+            WorkerCommand.RELEASE: release,
+            WorkerCommand.RETARGET: retarget,
+            WorkerCommand.STATUS: lambda request: self.status(),
+            WorkerCommand.METRICS: lambda request: {
+                "metrics": self.metrics.snapshot() if self.metrics else {}
+            }
+        }
+
+    def __start_stream(self, stream: DeviceStream):
+        stream.grabber.start()
+        if stream.viewer_watcher is not None:
+            stream.viewer_watcher.start()
+        if stream.streamer is not None:
+            stream.streamer.start_stream()
+            if stream.on_stream_started is not None:
+                stream.callback_executor.submit(stream.on_stream_started)
+
+    def __close_stream(self, stream: DeviceStream):
+        stream.grabber.stop()
+        if stream.viewer_watcher is not None:
+            stream.viewer_watcher.stop()
+        with stream.lock:
+            stream.closed = True
+            if stream.streamer is not None:
+                stream.streamer.stop_stream()
+            if stream.on_stream_stopped is not None:
+                stream.callback_executor.submit(stream.on_stream_stopped)
+        stream.callback_executor.shutdown(wait=True)
+
+    def __save_state(self):
+        if self.state_file is None:
+            return
+        with open(self.state_file, "w") as state:
+            json.dump(
+                {
+                    str(device_id): {
+                        "source": stream.source,
+                        "options": stream.options
+                    }
+                    for device_id, stream in self.streams.items()
+                },
+                state
+            )
@@ -0,0 +1,92 @@
+import logging
+import subprocess
+import threading
+
+from src.image_processor.streamer_interface import StreamerInterface
+
+logger = logging.getLogger(__name__)
+
+
+class PassthroughStreamer(StreamerInterface):
+    """
+        Relays the source stream to the processed stream url without
+        decoding it, so the processed stream url stays usable while the
+        detections are sent on a metadata channel.
+        ffmpeg is restarted with an exponential backoff if it exits.
+    """
+
+    def __init__(self,
+                 source_uri: str,
+                 destination_uri: str,
+                 min_backoff: float = 0.5,
+                 max_backoff: float = 30):
+        self.source_uri = source_uri
+        self.destination_uri = destination_uri
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.restarts = 0
+        self.proc = None
+        self._stop_event = threading.Event()
+        self._monitor = None
+
+    def start_stream(self):
+        if self.proc is not None:
+            raise Exception("Streamer already started")
+        self._open()
+        self._monitor = threading.Thread(
+            target=self._watch,
+            name=f"passthrough-{self.destination_uri}",
+            daemon=True
+        )
+        self._monitor.start()
+
+    def _command(self):
+        return [
+            'ffmpeg',
+            '-rtsp_transport', 'tcp',
+            '-i', self.source_uri,
+            '-c', 'copy',  # no decoding nor encoding
+            '-f', 'rtsp',
+            '-rtsp_transport', 'tcp',
+            self.destination_uri
+        ]
+
+    def _open(self):
+        self.proc = subprocess.Popen(self._command(), stdin=subprocess.DEVNULL)
+
+    def next_frame(self, frame):
+        """The frames are not used, the source is relayed as is."""
+        pass
+
+    def stop_stream(self):
+        if self.proc is None:
+            raise Exception("Streamer not started")
+        self._stop_event.set()
+        self._monitor.join(timeout=5)
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+    def stats(self) -> dict:
+        return {"restarts": self.restarts}
+
+    def _watch(self):
+        backoff = self.min_backoff
+        while not self._stop_event.wait(1):
+            if self.proc.poll() is None:
+                backoff = self.min_backoff
+                continue
+            logger.warning(
+                f"ffmpeg relaying to {self.destination_uri} exited "
+                f"with code {self.proc.returncode}"
+            )
+            if self._stop_event.wait(backoff):
+                return
+            backoff = min(backoff * 2, self.max_backoff)
+            self.restarts += 1
+            try:
+                self._open()
+            except OSError as e:
+                logger.error(f"Could not restart ffmpeg: {e}")
@@ -0,0 +1,257 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from enum import Enum, auto
+from typing import Callable, Iterable, List, Optional
+
+"""
+Threaded pipeline used by the workers to run capture, inference and encoding
+concurrently, so a slow stage does not stall the others.
+"""
+
+logger = logging.getLogger(__name__)
+
+END_OF_STREAM = object()
+
+
+class DropPolicy(Enum):
+    KEEP_LATEST = auto()  # discard the oldest queued item to make room
+    DROP_INCOMING = auto()  # discard the item being added
+    BLOCK = auto()  # wait until there is room
+
+
+class StageQueue:
+    """Bounded queue between two stages, applying a drop policy when full."""
+
+    def __init__(
+            self,
+            maxsize: int = 1,
+            drop_policy: DropPolicy = DropPolicy.KEEP_LATEST
+    ):
+        if maxsize < 1:
+            raise ValueError("Queue size must be at least 1")
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, item, force: bool = False) -> bool:
+        """
+            Adds an item to the queue.
+            Parameters:
+                item: the item to add.
+                force: adds the item even if the queue is full.
+            Returns:
+                True if the item was queued, False if it was dropped.
+        """
+        with self._condition:
+            while not force and len(self._items) >= self.maxsize:
+                if self._closed:
+                    return False
+                if self.drop_policy == DropPolicy.BLOCK:
+                    self._condition.wait(0.1)
+                elif self.drop_policy == DropPolicy.KEEP_LATEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return False
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout: float = None):
+        """
+            Removes the oldest item of the queue.
+            Throws:
+                queue.Empty: if no item arrived within the timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items, timeout):
+                raise queue.Empty()
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """Releases the producers blocked on a full queue."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+
+class StageStats:
+    """Throughput counters of a pipeline stage."""
+
+    def __init__(self):
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_processed = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.processed += 1
+            self._window_processed += 1
+            self.busy_seconds += seconds
+
+    def throughput(self) -> float:
+        """
+            Returns the items processed per second since the last call.
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            rate = self._window_processed / elapsed if elapsed > 0 else 0.0
+            self._window_start = now
+            self._window_processed = 0
+            return rate
+
+    def average_ms(self) -> float:
+        with self._lock:
+            if self.processed == 0:
+                return 0.0
+            return self.busy_seconds / self.processed * 1E3
+
+
+class PipelineStage:
+    """
+        Runs a step of the pipeline in its own thread.
+        A stage either reads its items from an iterable (source stage)
+        or from an input queue, and sends the non None results
+        of process to the output queue.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            process: Callable = None,
+            input_queue: Optional[StageQueue] = None,
+            output_queue: Optional[StageQueue] = None,
+            source: Optional[Iterable] = None
+    ):
+        if (source is None) == (input_queue is None):
+            raise ValueError("A stage needs either a source or an input queue")
+        self.name = name
+        self.process = process
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.source = source
+        self.stats = StageStats()
+        self.error = None
+        self._stop_event = None
+        self._thread = None
+
+    def start(self, stop_event: threading.Event):
+        self._stop_event = stop_event
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"stage-{self.name}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def join(self, timeout: float = None):
+        self._thread.join(timeout)
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def dropped(self) -> int:
+        return self.input_queue.dropped if self.input_queue else 0
+
+    def _items(self):
+        if self.source is not None:
+            yield from self.source
+            return
+
+        while not self._stop_event.is_set():
+            try:
+                item = self.input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is END_OF_STREAM:
+                return
+            yield item
+
+    def _run(self):
+        try:
+            for item in self._items():
+                if self._stop_event.is_set():
+                    break
+                started = time.perf_counter()
+                result = self.process(item) if self.process else item
+                self.stats.record(time.perf_counter() - started)
+                if result is not None and self.output_queue is not None:
+                    self.output_queue.put(result)
+        except Exception as e:
+            logger.exception(f"Error in pipeline stage {self.name}")
+            self.error = e
+            self._stop_event.set()
+        finally:
+            if self.output_queue is not None:
+                self.output_queue.put(END_OF_STREAM, force=True)
+
+
+class Pipeline:
+    """Starts the stages and periodically reports their throughput."""
+
+    def __init__(
+            self,
+            stages: List[PipelineStage],
+            report_interval: float = 10,
+            stop_event: threading.Event = None
+    ):
+        self.stages = stages
+        self.report_interval = report_interval
+        self.stop_event = stop_event or threading.Event()
+
+    def run(self):
+        """
+            Blocks until every stage finishes.
+            Throws:
+                The first error raised by a stage.
+        """
+        for stage in self.stages:
+            stage.start(self.stop_event)
+        try:
+            while self.stages[-1].is_alive():
+                self.stages[-1].join(self.report_interval)
+                if self.stop_event.is_set():
+                    self.__close_queues()
+                self.report()
+        finally:
+            self.stop()
+
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def stop(self):
+        self.stop_event.set()
+        self.__close_queues()
+        for stage in self.stages:
+            stage.join(timeout=5)
+
+    def report(self):
+        for stage in self.stages:
+            logger.info(
+                f"Stage {stage.name}: {stage.stats.throughput():.1f} items/s, "
+                f"{stage.stats.average_ms():.1f}ms per item, "
+                f"{stage.dropped} dropped at input"
+            )
+
+    def __close_queues(self):
+        for stage in self.stages:
+            if stage.output_queue is not None:
+                stage.output_queue.close()
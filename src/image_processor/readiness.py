@@ -0,0 +1,75 @@
+import logging
+import socket
+import threading
+from enum import Enum, auto
+
+from src.image_processor.worker_control import encode_message
+
+"""
+Readiness channel from a worker to the instance manager.
+The worker connects to a unix socket served by the manager and sends one
+line of JSON per stage it reaches, so the manager does not scan its logs.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerStage(Enum):
+    MODEL_LOADED = auto()
+    INPUT_OPENED = auto()
+    STREAMING_STARTED = auto()  # ready, single stream worker
+    WORKER_READY = auto()  # ready, multi-stream worker
+    FATAL_ERROR = auto()
+
+
+class ReadinessReporter:
+    """
+        Reports the stages reached by the worker to the manager.
+        Reporting never fails the worker, if the manager can not be reached
+        the event is dropped and the connection is retried on the next one.
+        Without a socket path nothing is reported.
+    """
+
+    def __init__(
+        self,
+        socket_path: str = None,
+        worker_id: str = None,
+        timeout: float = 1
+    ):
+        self.socket_path = socket_path
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def report(self, stage: WorkerStage, message: str = ""):
+        if self.socket_path is None:
+            return
+        event = encode_message({
+            "worker": self.worker_id,
+            "stage": stage.name,
+            "message": message
+        })
+        with self._lock:
+            try:
+                if self._socket is None:
+                    self._socket = socket.socket(
+                        socket.AF_UNIX, socket.SOCK_STREAM
+                    )
+                    self._socket.settimeout(self.timeout)
+                    self._socket.connect(self.socket_path)
+                self._socket.sendall(event)
+            except OSError as e:
+                logger.warning(
+                    f"Could not report {stage.name} to {self.socket_path}: {e}"
+                )
+                self.__disconnect()
+
+    def close(self):
+        with self._lock:
+            self.__disconnect()
+
+    def __disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
@@ -20,7 +20,10 @@ class StreamerRTSP(StreamerInterface):
     def start_stream(self):
         if self.proc is not None:
             raise Exception("Streamer already started")
-        command = [
+        self._open()
+
+    def _command(self):
+        return [
             'ffmpeg',
             '-stats',
             '-re',
@@ -34,11 +37,18 @@ class StreamerRTSP(StreamerInterface):
             '-i', '-',
             '-c', 'libx264',  # https://trac.ffmpeg.org/wiki/Encode/H.264
             '-preset', 'ultrafast',
+        ] + self._output_args()
+
+    def _output_args(self):
+        return [
             '-f', 'rtsp',
             '-rtsp_transport', 'tcp',
             self.destination_uri
         ]
-        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def _open(self):
+        """Starts the ffmpeg process encoding the frames."""
+        self.proc = subprocess.Popen(self._command(), stdin=subprocess.PIPE)
         self.pipe = self.proc.stdin
 
     def next_frame(self, frame):
@@ -48,7 +58,9 @@ class StreamerRTSP(StreamerInterface):
         if not self.has_started:
             raise Exception("Streamer not started")
 
-        self.pipe.write(frame.tobytes())
+        # Writes the frame memory as is, tobytes would copy it
+        self.pipe.write(
+            frame.data if frame.flags.c_contiguous else frame.tobytes())
         self.pipe.flush()
 
     def stop_stream(self):
@@ -0,0 +1,134 @@
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+
+class ViewerProbe(ABC):
+    """Tells if a processed stream is being watched."""
+
+    @abstractmethod
+    def has_viewers(self, path: str) -> bool:
+        """
+            Parameters:
+                path: the path of the stream on the media server.
+            Throws:
+                Exception: if the viewers could not be checked.
+        """
+        pass
+
+
+class AlwaysWatchedProbe(ViewerProbe):
+    """Probe used when the media server can not be asked for viewers."""
+
+    def has_viewers(self, path: str) -> bool:
+        return True
+
+
+class MediaServerViewerProbe(ViewerProbe):
+    """
+        Asks the MediaMTX control API for the readers of a path.
+        A path that is not published has no viewers.
+    """
+
+    def __init__(self, api_url: str, timeout: float = 2):
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+
+    def has_viewers(self, path: str) -> bool:
+        url = f"{self.api_url}/v3/paths/get/{urllib.parse.quote(path)}"
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return len(json.load(response).get("readers") or []) > 0
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+
+
+class ViewerWatcher:
+    """
+        Polls a viewer probe in a background thread, so the workers can
+        skip annotating and encoding the frames of unwatched streams.
+        While unwatched, a frame is still rendered every 1 / idle_fps
+        seconds, keeping the stream published so viewers can connect.
+    """
+
+    def __init__(
+            self,
+            probe: ViewerProbe,
+            path: str,
+            interval: float = 2,
+            idle_fps: float = 1
+    ):
+        """
+            Parameters:
+                probe: the probe asked for viewers.
+                path: the path of the stream on the media server.
+                interval: seconds between probes.
+                idle_fps: frames rendered per second without viewers,
+                          0 renders no frame.
+        """
+        self.probe = probe
+        self.path = path
+        self.interval = interval
+        self.idle_period = 1 / idle_fps if idle_fps > 0 else None
+        # Watched until proven otherwise, so a failing probe changes nothing
+        self.watched = True
+        self._last_render = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            raise Exception("Viewer watcher already started")
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"viewers-{self.path}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+
+    def should_render(self) -> bool:
+        """
+            Returns:
+                True if the current frame must be annotated and encoded.
+        """
+        now = time.monotonic()
+        if not self.watched:
+            if self.idle_period is None:
+                return False
+            if self._last_render is not None \
+                    and now - self._last_render < self.idle_period:
+                return False
+        self._last_render = now
+        return True
+
+    def poll(self):
+        try:
+            watched = self.probe.has_viewers(self.path)
+        except Exception as e:
+            logger.warning(f"Could not check the viewers of {self.path}: {e}")
+            watched = True
+        if watched != self.watched:
+            logger.info(
+                f"Stream {self.path} is "
+                f"{'now watched' if watched else 'no longer watched'}"
+            )
+        self.watched = watched
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.poll()
+            self._stop_event.wait(self.interval)
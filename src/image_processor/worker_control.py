@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+from enum import Enum, auto
+
+from src.exceptions import AppError
+
+"""
+Control channel between the instance manager and a running worker.
+Each request and response is a single line of JSON sent over a unix socket.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCommand(Enum):
+    ASSIGN = auto()
+    RELEASE = auto()
+    STATUS = auto()
+    METRICS = auto()
+    RETARGET = auto()
+
+
+def encode_message(message: dict) -> bytes:
+    return json.dumps(message).encode() + b"\n"
+
+
+def decode_message(line: bytes) -> dict:
+    return json.loads(line.decode())
+
+
+class WorkerControlServer:
+    """
+        Unix socket server that dispatches the received commands
+        to the given handlers.
+        Each handler receives the request dictionary and returns a dictionary
+        that is merged into the response.
+    """
+
+    def __init__(self, socket_path: str, handlers: dict):
+        self.socket_path = socket_path
+        self.handlers = handlers
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        dispatch = self.dispatch
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                self.wfile.write(encode_message(dispatch(line)))
+
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path,
+            RequestHandler
+        )
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name="worker-control",
+            daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Listening for control commands on {self.socket_path}")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def dispatch(self, line: bytes) -> dict:
+        """
+            Runs the handler of the command in the given request line.
+            Returns:
+                The response to send back to the client.
+        """
+        try:
+            request = decode_message(line)
+            command = WorkerCommand[request["command"]]
+            logger.info(f"Received control command: {request}")
+            result = self.handlers[command](request)
+            return {"ok": True, **(result or {})}
+        except (KeyError, json.decoder.JSONDecodeError):
+            logger.warning("Invalid control command. Discarding...")
+            return {"ok": False, "error": "Invalid command"}
+        except AppError as e:
+            return {"ok": False, "error": e.message}
+        except Exception as e:
+            logger.exception("Unexpected error handling control command")
+            return {"ok": False, "error": str(e)}
@@ -0,0 +1,305 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Tuple
+
+"""
+Latency histograms and counters of the frames processed by a worker,
+kept per device and exposed in the Prometheus text format.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in milliseconds
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+STAGES = (
+    "decode_wait",  # waiting for a new frame of the source
+    "preprocess",
+    "inference",
+    "nms",
+    "annotate",  # drawing or counting the detections
+    "encode_write",  # handing the frame to the streamer
+    "callback"  # saving the metrics of the frame
+)
+
+COUNTERS = {
+    "frames_in": "Frames received from the source.",
+    "inferred": "Frames run through the model.",
+    "dropped": "Frames dropped by a full pipeline queue.",
+    "stale": "Frames dropped as the decoder reused their ring slot.",
+    "streamed": "Frames handed to the streamer.",
+    "count_changes": "Changes of the detected people count.",
+    "count_changes_saved": "Changes of the people count saved after smoothing."
+}
+
+METRIC_PREFIX = "sensiflow_worker"
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets."""
+
+    def __init__(self, buckets_ms: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1E3
+        self.counts[bisect_left(self.buckets_ms, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+    def quantile(self, q: float) -> float:
+        """
+            Returns:
+                The upper bound in milliseconds of the bucket holding
+                the q quantile, infinity if it is above the last bucket.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets_ms, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": list(self.buckets_ms),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum_ms": self.sum_ms
+        }
+
+
+class StreamMetrics:
+    """Stage latencies and frame counters of a single device stream."""
+
+    def __init__(
+            self,
+            device_id: int,
+            buckets_ms: Tuple[float, ...] = DEFAULT_BUCKETS_MS
+    ):
+        self.device_id = device_id
+        self.histograms = {
+            stage: LatencyHistogram(buckets_ms) for stage in STAGES
+        }
+        self.counters = {counter: 0 for counter in COUNTERS}
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self.histograms[stage].observe(seconds)
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def timed(self, stage: str, function: Callable) -> Callable:
+        """
+            Returns:
+                A function calling the given one and observing
+                its duration in the given stage.
+        """
+        def timed_function(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(stage, time.perf_counter() - started)
+        return timed_function
+
+    def track_queues(self, **queues):
+        """
+            Reports the depth of the given queues, their dropped items
+            are added to the dropped counter.
+            Parameters:
+                queues: objects with a len() and a dropped attribute,
+                        by name.
+        """
+        self._queues.update(queues)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {
+                stage: histogram.snapshot()
+                for stage, histogram in self.histograms.items()
+            }
+        counters["dropped"] += sum(q.dropped for q in self._queues.values())
+        return {
+            "counters": counters,
+            "queue_depth": {name: len(q) for name, q in self._queues.items()},
+            "latency": histograms
+        }
+
+
+class WorkerMetrics:
+    """Metrics of every device stream served by a worker."""
+
+    def __init__(self, buckets_ms: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.streams: Dict[int, StreamMetrics] = {}
+        self._lock = threading.Lock()
+
+    def for_device(self, device_id: int) -> StreamMetrics:
+        with self._lock:
+            if device_id not in self.streams:
+                self.streams[device_id] = StreamMetrics(
+                    device_id, self.buckets_ms)
+            return self.streams[device_id]
+
+    def remove(self, device_id: int):
+        with self._lock:
+            self.streams.pop(device_id, None)
+
+    def snapshot(self) -> dict:
+        """
+            Returns:
+                The snapshot of each stream by device id.
+        """
+        with self._lock:
+            streams = list(self.streams.values())
+        return {str(stream.device_id): stream.snapshot() for stream in streams}
+
+
+def aggregate(snapshots: Iterable[dict]) -> dict:
+    """
+        Sums the counters and histograms of several stream snapshots,
+        e.g. to get the totals of a worker container.
+        The histograms must share the same buckets.
+    """
+    total = {"counters": {}, "queue_depth": {}, "latency": {}}
+    for snapshot in snapshots:
+        for name, value in snapshot["counters"].items():
+            total["counters"][name] = total["counters"].get(name, 0) + value
+        depths = total["queue_depth"]
+        for name, value in snapshot["queue_depth"].items():
+            depths[name] = depths.get(name, 0) + value
+        for stage, histogram in snapshot["latency"].items():
+            summed = total["latency"].setdefault(stage, {
+                "buckets": histogram["buckets"],
+                "counts": [0] * len(histogram["counts"]),
+                "count": 0,
+                "sum_ms": 0.0
+            })
+            summed["counts"] = [
+                a + b for a, b in zip(summed["counts"], histogram["counts"])
+            ]
+            summed["count"] += histogram["count"]
+            summed["sum_ms"] += histogram["sum_ms"]
+    return total
+
+
+def render_prometheus(snapshot: dict) -> str:
+    """
+        Renders a WorkerMetrics snapshot in the Prometheus text format,
+        every sample labelled with its device_id.
+    """
+    lines = []
+    families = set()
+
+    def header(name, kind, help_text):
+        if name not in families:
+            families.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for device_id, stream in snapshot.items():
+        label = f'device_id="{device_id}"'
+        for counter, value in stream["counters"].items():
+            name = f"{METRIC_PREFIX}_{counter}_total"
+            header(name, "counter", COUNTERS.get(
+                counter, f"Frames counted as {counter}."))
+            lines.append(f"{name}{{{label}}} {value}")
+        for queue_name, depth in stream["queue_depth"].items():
+            name = f"{METRIC_PREFIX}_queue_depth"
+            header(name, "gauge", "Items waiting in a pipeline queue.")
+            lines.append(f'{name}{{{label},queue="{queue_name}"}} {depth}')
+        for stage, histogram in stream["latency"].items():
+            name = f"{METRIC_PREFIX}_{stage}_seconds"
+            header(name, "histogram", f"Latency of the {stage} stage.")
+            cumulative = 0
+            buckets = zip(histogram["buckets"], histogram["counts"])
+            for bound, count in buckets:
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{{label},le="{bound / 1E3:g}"}} '
+                    f'{cumulative}'
+                )
+            lines.append(
+                f'{name}_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+            lines.append(
+                f"{name}_sum{{{label}}} {histogram['sum_ms'] / 1E3:g}")
+            lines.append(f"{name}_count{{{label}}} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHttpServer:
+    """
+        Serves the worker metrics on /metrics in the Prometheus text
+        format and on /metrics.json as a snapshot.
+    """
+
+    def __init__(
+            self,
+            metrics: WorkerMetrics,
+            port: int,
+            host: str = "0.0.0.0"
+    ):
+        self.metrics = metrics
+        self.address = (host, port)
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        metrics = self.metrics
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = render_prometheus(metrics.snapshot()).encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(self.address, RequestHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name="worker-metrics",
+            daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Serving metrics on port {self.port}")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
@@ -13,6 +13,15 @@ class InstanceAlreadyExists(AppError):
         super().__init__(self.message)
 
 
+class CommandExpired(AppError):
+    def __init__(self, instance_id, age):
+        self.message = (
+            f"Command of instance {instance_id} expired, "
+            f"sent {age:.0f} seconds ago."
+        )
+        super().__init__(self.message)
+
+
 class EndMessageProcessing(AppError):
     def __int__(self):
         self.message = "End message processing"
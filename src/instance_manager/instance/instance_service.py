@@ -1,10 +1,13 @@
 import asyncio
 
-from image_processor.processed_stream.processed_stream_dao import ProcessedStreamDAOFactory
+from src.image_processor.processed_stream.processed_stream_dao import (
+    ProcessedStreamDAOFactory
+)
 from src.database.transaction import transaction
 from src.instance_manager.instance.instance import Instance, InstanceStatus
 from src.instance_manager.instance.instance_dao import InstanceDAOFactory
 from src.docker_manager.docker_api import DockerApi
+from src.docker_manager.stream_assigner import StreamAssigner
 from docker.errors import APIError, DockerException
 from psycopg_pool import AsyncConnectionPool
 import logging
@@ -15,7 +18,8 @@ from src.instance_manager.instance.exceptions import (
 )
 from src.docker_manager.exceptions import (
     ContainerExitedError,
-    ContainerNotFound
+    ContainerNotFound,
+    WorkerCommandError
 )
 from datetime import datetime
 
@@ -28,12 +32,20 @@ class InstanceService:
             async_conn_manager: AsyncConnectionPool,
             instance_dao_factory: InstanceDAOFactory,
             processed_stream_dao_factory : ProcessedStreamDAOFactory,
-            docker_api: DockerApi
+            docker_api: DockerApi,
+            stream_assigner: StreamAssigner = None
     ):
+        """
+            Parameters:
+                stream_assigner: when given, the devices are assigned to
+                                 shared multi-stream workers instead of
+                                 running a container per instance.
+        """
         self.processed_stream_dao_factory = processed_stream_dao_factory
         self.async_conn_manager = async_conn_manager
         self.dao_factory = instance_dao_factory
         self.docker_api = docker_api
+        self.stream_assigner = stream_assigner
 
     async def start_instance(
             self,
@@ -65,10 +77,11 @@ class InstanceService:
                 else:
                     instance_id = await self.__start_instance(
                         instance_dao,
-                        stored_instance
+                        stored_instance,
+                        stream_url
                     )
                 return instance_id
-            except (DockerException, APIError) as e:
+            except (DockerException, APIError, WorkerCommandError) as e:
                 raise InternalError(e)
             # TODO: Make an error for each GOAL case and catch them
             # here converting to the correct application error
@@ -89,6 +102,10 @@ class InstanceService:
 
         logger.info(f"Created instance {instance_id}")
 
+        if self.stream_assigner is not None:
+            await self.stream_assigner.assign(instance_id, stream_url)
+            return instance_id
+
         await self.docker_api.run_container(
             self.build_instance_name(instance_id),
             "--source",
@@ -101,13 +118,22 @@ class InstanceService:
     async def __start_instance(
             self,
             instance_dao,
-            stored_instance
+            stored_instance,
+            stream_url
     ):
         """
         Starts an instance in the database and
         starts/resumes a docker container.
         """
         if stored_instance.status.value == InstanceStatus.ACTIVE.value:
+            # A new stream url is switched to by the worker serving the device
+            if self.stream_assigner is not None \
+                    and await self.stream_assigner.retarget(
+                        stored_instance.id, stream_url):
+                logger.info(
+                    f"Retargeted instance {stored_instance.id} "
+                    f"to {stream_url}")
+                return stored_instance.id
             raise InstanceAlreadyExists(stored_instance.id)
 
         instance = Instance(
@@ -117,7 +143,12 @@ class InstanceService:
             updated_at=datetime.utcnow()
         )
 
-        if stored_instance.status.value == InstanceStatus.INACTIVE.value:
+        if self.stream_assigner is not None:
+            logger.info(f"Assigning instance {instance.id} to a worker")
+            await instance_dao.update_instance(instance)
+            await self.stream_assigner.assign(instance.id, stream_url)
+
+        elif stored_instance.status.value == InstanceStatus.INACTIVE.value:
             logger.info(f"Starting instance {instance.id}")
             await instance_dao.update_instance(instance)
             await self.docker_api.start_container(
@@ -153,13 +184,17 @@ class InstanceService:
 
                 await instance_dao.delete_instance(instance_id)
 
+                if self.stream_assigner is not None:
+                    await self.__release_stream(instance)
+                    return
+
                 await self.docker_api.remove_container(
                     self.build_instance_name(instance_id),
                     force=True
                 )
             except ContainerNotFound:
                 raise InstanceNotFound(instance_id)
-            except (DockerException, APIError) as e:
+            except (DockerException, APIError, WorkerCommandError) as e:
                 raise InternalError(e)
 
     async def stop_instance(self, instance_id: int):
@@ -197,13 +232,17 @@ class InstanceService:
 
                 await processed_stream_dao.delete_processed_stream(instance_id)
 
+                if self.stream_assigner is not None:
+                    await self.__release_stream(stored_instance)
+                    return
+
                 await self.docker_api.remove_container(
                     self.build_instance_name(instance_id),
                     force=True
                 )
             except ContainerNotFound:
                 raise InstanceNotFound(instance_id)
-            except (DockerException, APIError) as e:
+            except (DockerException, APIError, WorkerCommandError) as e:
                 raise InternalError(e)
 
     async def pause_instance(self, instance_id: int):
@@ -237,12 +276,17 @@ class InstanceService:
                 )
                 await instance_dao.update_instance(instance)
 
+                if self.stream_assigner is not None:
+                    # A shared worker can not be paused for a single device
+                    await self.__release_stream(stored_instance)
+                    return
+
                 await self.docker_api.pause_container(
                     self.build_instance_name(instance_id)
                 )
             except ContainerNotFound:
                 raise InstanceNotFound(instance_id)
-            except (DockerException, APIError) as e:
+            except (DockerException, APIError, WorkerCommandError) as e:
                 raise InternalError(e)
 
     async def manage_not_active_instances(self):
@@ -260,8 +304,9 @@ class InstanceService:
                     logger.info(
                         f"Stopping instance {instance.id} was paused for {datetime.utcnow() - instance.updated_at}"
                     )
-                    instance_name = self.build_instance_name(instance.id)
-                    await self.docker_api.stop_container(instance_name)
+                    if self.stream_assigner is None:
+                        instance_name = self.build_instance_name(instance.id)
+                        await self.docker_api.stop_container(instance_name)
                     await instance_dao.update_instance(
                         Instance(
                             id=instance.id,
@@ -275,8 +320,10 @@ class InstanceService:
                     logger.info(
                         f"Removing instance {instance.id} was inactive for {datetime.utcnow() - instance.updated_at}"
                     )
-                    instance_name = self.build_instance_name(instance.id)
-                    await self.docker_api.remove_container(instance_name, force=True)
+                    if self.stream_assigner is None:
+                        instance_name = self.build_instance_name(instance.id)
+                        await self.docker_api.remove_container(
+                            instance_name, force=True)
                     await instance_dao.delete_instance(instance.id)
 
                 stop_task = asyncio.gather(
@@ -293,7 +340,7 @@ class InstanceService:
                 )
 
                 await asyncio.gather(stop_task, remove_task)
-            except (DockerException, APIError) as e:
+            except (DockerException, APIError, WorkerCommandError) as e:
                 raise InternalError(e)
 
     async def validate_instance(self, instance_id: int):
@@ -304,12 +351,27 @@ class InstanceService:
             Returns:
                 True if the instance exists, False otherwise.
         """
+        if self.stream_assigner is not None:
+            if await self.stream_assigner.find_worker(instance_id) is not None:
+                return True
+            # Paused and inactive instances are not served by any worker
+            async with transaction(self.async_conn_manager) as cursor:
+                instance_dao = self.dao_factory.create_dao(cursor)
+                return await instance_dao.get_instance(instance_id) is not None
         try:
             await self.docker_api.get_container(self.build_instance_name(instance_id))
             return True
         except ContainerNotFound:
             return False
 
+    async def __release_stream(self, stored_instance):
+        """
+            Releases the device of an instance from its shared worker.
+            Paused and inactive instances are not served by any worker.
+        """
+        if stored_instance.status.value != InstanceStatus.ACTIVE.value:
+            return
+        await self.stream_assigner.release(stored_instance.id)
 
     @staticmethod
     def build_instance_name(instance_id: int) -> str:
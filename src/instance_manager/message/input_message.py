@@ -1,5 +1,7 @@
 from enum import Enum, auto
 from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
 
 
 class Action(Enum):
@@ -14,3 +16,5 @@ class InputMessage:
     action: Action
     device_id: int
     device_stream_url: str
+    # When the controller sent it, None when the message does not say
+    sent_at: Optional[datetime] = None
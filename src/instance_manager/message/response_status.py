@@ -8,3 +8,6 @@ class ResponseStatus(Enum):
     InternalError = auto()
     Conflict = auto()
     InconsistentContainerState = auto()
+    Superseded = auto()
+    Expired = auto()
+    Accepted = auto()
@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum, auto
+from typing import Optional
+
+
+class OperationStatus(Enum):
+    ACCEPTED = auto()
+    READY = auto()
+    FAILED = auto()
+
+
+@dataclass(frozen=True)
+class Operation:
+    """A command acknowledged before it ran, tracked until it did."""
+    id: Optional[int]
+    device_id: int
+    action: str
+    stream_url: Optional[str]
+    status: OperationStatus
+    created_at: datetime
+    updated_at: datetime
+    message: Optional[str] = None
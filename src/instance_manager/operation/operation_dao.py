@@ -0,0 +1,86 @@
+from datetime import datetime
+from typing import List, Optional
+
+from src.instance_manager.operation.operation import Operation, OperationStatus
+
+
+class OperationDAOFactory:
+    """Factory for creating OperationDAO objects."""
+
+    def create_dao(self, cursor):
+        return OperationDAO(cursor)
+
+
+class OperationDAO:
+    """Data Access Object for the Operation entity."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def create_operation(self, operation: Operation) -> int:
+        query = """
+        INSERT INTO operation
+        (device_id, action, stream_url, status, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id;
+        """
+        await self.cursor.execute(
+            query,
+            (
+                operation.device_id,
+                operation.action,
+                operation.stream_url,
+                operation.status.name,
+                operation.created_at,
+                operation.updated_at,
+            )
+        )
+        result = await self.cursor.fetchone()
+        return result[0]
+
+    async def finish_operation(
+            self,
+            operation_id: int,
+            status: OperationStatus,
+            message: Optional[str],
+            updated_at: datetime
+    ) -> int:
+        # An operation is only finished once
+        query = """
+        UPDATE operation SET
+        status = %s, message = %s, updated_at = %s
+        WHERE id = %s AND status = 'ACCEPTED'
+        """
+        await self.cursor.execute(
+            query,
+            (status.name, message, updated_at, operation_id)
+        )
+        return self.cursor.rowcount
+
+    async def get_operations_by_status(
+            self, status: OperationStatus) -> List[Operation]:
+        query = """
+            SELECT id, device_id, action, stream_url, status,
+                   created_at, updated_at, message
+            FROM operation
+            WHERE status = %s
+            ORDER BY id
+        """
+        await self.cursor.execute(query, (status.name,))
+        rows = await self.cursor.fetchall()
+        operations = []
+        for row in rows:
+            operation_id, device_id, action, stream_url, status_name, \
+                created_at, updated_at, message = row
+            operations.append(
+                Operation(
+                    id=operation_id,
+                    device_id=device_id,
+                    action=action,
+                    stream_url=stream_url,
+                    status=OperationStatus[status_name],
+                    created_at=created_at,
+                    updated_at=updated_at,
+                    message=message
+                )
+            )
+        return operations
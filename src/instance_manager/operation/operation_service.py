@@ -0,0 +1,95 @@
+from dataclasses import replace
+from datetime import datetime
+import logging
+from typing import List, Optional
+
+from psycopg_pool import AsyncConnectionPool
+
+from src.database.transaction import transaction
+from src.instance_manager.message.input_message import InputMessage
+from src.instance_manager.operation.operation import Operation, OperationStatus
+from src.instance_manager.operation.operation_dao import OperationDAOFactory
+
+logger = logging.getLogger(__name__)
+
+
+class OperationService:
+    """
+        Persists the commands acknowledged before they ran, so a restarted
+        instance manager knows which ones never finished.
+    """
+
+    def __init__(
+            self,
+            async_conn_manager: AsyncConnectionPool,
+            operation_dao_factory: OperationDAOFactory
+    ):
+        self.async_conn_manager = async_conn_manager
+        self.dao_factory = operation_dao_factory
+
+    async def accept(self, message: InputMessage) -> Operation:
+        """
+            Stores the command as an accepted operation.
+            Parameters:
+                message: The command to track.
+            Returns:
+                The stored operation.
+            Throws:
+                InternalError
+        """
+        accepted_at = datetime.utcnow()
+        operation = Operation(
+            id=None,
+            device_id=message.device_id,
+            action=message.action.name,
+            stream_url=message.device_stream_url,
+            status=OperationStatus.ACCEPTED,
+            created_at=accepted_at,
+            updated_at=accepted_at
+        )
+        async with transaction(self.async_conn_manager) as cursor:
+            operation_dao = self.dao_factory.create_dao(cursor)
+            operation_id = await operation_dao.create_operation(operation)
+        logger.info(
+            f"Accepted operation {operation_id} of device {message.device_id}")
+        return replace(operation, id=operation_id)
+
+    async def finish(
+            self,
+            operation: Operation,
+            status: OperationStatus,
+            message: Optional[str] = None
+    ) -> bool:
+        """
+            Records the outcome of an accepted operation.
+            Parameters:
+                operation: The accepted operation.
+                status: READY or FAILED.
+                message: What happened.
+            Returns:
+                False if the operation was already finished.
+            Throws:
+                InternalError
+        """
+        async with transaction(self.async_conn_manager) as cursor:
+            operation_dao = self.dao_factory.create_dao(cursor)
+            updated = await operation_dao.finish_operation(
+                operation.id,
+                status,
+                message,
+                datetime.utcnow()
+            )
+        return updated > 0
+
+    async def get_accepted_operations(self) -> List[Operation]:
+        """
+            Returns:
+                The operations not finished yet, oldest first.
+            Throws:
+                InternalError
+        """
+        async with transaction(self.async_conn_manager) as cursor:
+            operation_dao = self.dao_factory.create_dao(cursor)
+            return await operation_dao.get_operations_by_status(
+                OperationStatus.ACCEPTED
+            )
@@ -1 +1,5 @@
-QUEUE_PREFIX = 'im'
\ No newline at end of file
+QUEUE_PREFIX = 'im'
+
+# Dispatcher lanes of the device commands
+START_LANE = 'start'
+CONTROL_LANE = 'control'
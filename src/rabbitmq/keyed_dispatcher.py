@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+"""
+Dispatcher of the commands received from RabbitMQ, ordered per device.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANE = "default"
+
+
+@dataclass
+class DispatchEntry:
+    job: Callable[..., Awaitable]
+    args: Tuple
+    submitted_at: float = field(default_factory=time.monotonic)
+    lane: Hashable = DEFAULT_LANE
+
+
+@dataclass
+class KeyStats:
+    depth: int = 0
+    running: bool = False
+    executed: int = 0
+    superseded: int = 0
+    last_wait: float = 0
+    max_wait: float = 0
+
+
+@dataclass
+class LaneStats:
+    concurrency: int
+    running: int = 0
+    executed: int = 0
+    last_wait: float = 0
+    max_wait: float = 0
+    total_wait: float = 0
+    last_run: float = 0
+    max_run: float = 0
+    total_run: float = 0
+
+
+class KeyedDispatcher:
+    """
+        Runs the jobs of the same key one at a time, in the order they were
+        submitted, and the jobs of different keys concurrently, up to
+        max_concurrency at once.
+        Each key with pending jobs has a task draining its queue, tracked
+        until it ends, so the jobs never pile up as loose tasks: the
+        consumer acknowledges a message once its job ran, and the prefetch
+        of the channel bounds the pending jobs.
+        When supersedes is given, a submitted job drops the jobs of its key
+        not started yet that supersedes(submitted, pending) is true for,
+        and on_superseded is run for each of them instead of their job.
+        When lanes are given, lane_of tells the lane of each job and every
+        lane runs its own number of jobs at once, so the jobs of a lane
+        never wait for a slot held by the jobs of another. The jobs of a
+        key still run in order, whatever their lane.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 10,
+            supersedes: Optional[
+                Callable[[DispatchEntry, DispatchEntry], bool]
+            ] = None,
+            on_superseded: Optional[
+                Callable[[DispatchEntry], Awaitable]
+            ] = None,
+            lanes: Optional[Dict[Hashable, int]] = None,
+            lane_of: Optional[Callable[[DispatchEntry], Hashable]] = None
+    ):
+        """
+            Parameters:
+                max_concurrency: jobs run at once when no lanes are given.
+                lanes: jobs run at once by lane.
+                lane_of: the lane of a job, the only lane by default.
+        """
+        lanes = dict(lanes) if lanes else {DEFAULT_LANE: max_concurrency}
+        if min(lanes.values()) < 1:
+            raise ValueError("At least one job must run at once")
+        self.max_concurrency = max_concurrency
+        self.lanes = lanes
+        self.lane_of = lane_of
+        self.supersedes = supersedes
+        self.on_superseded = on_superseded
+        self._queues: Dict[Hashable, deque] = {}
+        self._stats: Dict[Hashable, KeyStats] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._notifications: Set[asyncio.Task] = set()
+        self._lane_stats: Dict[Hashable, LaneStats] = {
+            lane: LaneStats(concurrency) for lane, concurrency in lanes.items()
+        }
+        self._slots: Dict[Hashable, asyncio.Semaphore] = {}
+
+    def submit(self, key: Hashable, job: Callable[..., Awaitable], *args):
+        """Queues the job, run once the earlier jobs of the key ran."""
+        entry = DispatchEntry(job, args)
+        if self.lane_of is not None:
+            entry.lane = self.lane_of(entry)
+            if entry.lane not in self.lanes:
+                raise ValueError(f"Unknown lane {entry.lane}")
+        queue = self._queues.setdefault(key, deque())
+        stats = self._stats.setdefault(key, KeyStats())
+        if self.supersedes is not None and queue:
+            self.__supersede(key, queue, stats, entry)
+        queue.append(entry)
+        stats.depth += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.get_running_loop().create_task(
+                self.__drain(key))
+
+    def depth(self, key: Hashable) -> int:
+        """Returns the jobs of the key not started yet."""
+        return len(self._queues.get(key, ()))
+
+    def stats(self) -> Dict[Hashable, dict]:
+        """
+            Returns:
+                By key, the jobs waiting, whether one is running, the jobs
+                executed and the last and longest seconds a job waited.
+        """
+        return {
+            key: {
+                "depth": stats.depth,
+                "running": stats.running,
+                "executed": stats.executed,
+                "superseded": stats.superseded,
+                "last_wait": stats.last_wait,
+                "max_wait": stats.max_wait
+            }
+            for key, stats in self._stats.items()
+        }
+
+    def lane_stats(self) -> Dict[Hashable, dict]:
+        """
+            Returns:
+                By lane, the jobs it runs at once, the jobs running and
+                executed, and the last, longest and average seconds a job
+                waited to start and ran.
+        """
+        return {
+            lane: {
+                "concurrency": stats.concurrency,
+                "running": stats.running,
+                "executed": stats.executed,
+                "last_wait": stats.last_wait,
+                "max_wait": stats.max_wait,
+                "avg_wait": (
+                    stats.total_wait / stats.executed if stats.executed else 0
+                ),
+                "last_run": stats.last_run,
+                "max_run": stats.max_run,
+                "avg_run": (
+                    stats.total_run / stats.executed if stats.executed else 0
+                )
+            }
+            for lane, stats in self._lane_stats.items()
+        }
+
+    async def join(self):
+        """Waits until every submitted job ran or was superseded."""
+        while self._tasks or self._notifications:
+            await asyncio.gather(
+                *list(self._tasks.values()),
+                *list(self._notifications),
+                return_exceptions=True
+            )
+
+    async def close(self):
+        """Cancels the pending and running jobs."""
+        tasks = list(self._tasks.values()) + list(self._notifications)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def report(self, interval: float = 60):
+        """
+            Logs the keys with waiting jobs and the latency of the lanes
+            every interval seconds.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            waiting = {
+                key: stats for key, stats in self.stats().items()
+                if stats["depth"] > 0
+            }
+            if waiting:
+                logger.info(f"Commands waiting by device: {waiting}")
+            logger.info(f"Command lanes: {self.lane_stats()}")
+
+    def __slot(self, lane: Hashable) -> asyncio.Semaphore:
+        # Made in the running loop
+        if lane not in self._slots:
+            self._slots[lane] = asyncio.Semaphore(self.lanes[lane])
+        return self._slots[lane]
+
+    def __supersede(
+            self,
+            key: Hashable,
+            queue: deque,
+            stats: KeyStats,
+            entry: DispatchEntry
+    ):
+        # Only the jobs not started yet are in the queue, the drain task
+        # holds the same deque so it is changed in place
+        kept, superseded = [], []
+        for pending in queue:
+            if self.supersedes(entry, pending):
+                superseded.append(pending)
+            else:
+                kept.append(pending)
+        if not superseded:
+            return
+        queue.clear()
+        queue.extend(kept)
+        stats.depth -= len(superseded)
+        stats.superseded += len(superseded)
+        logger.info(f"{len(superseded)} commands of {key} superseded")
+        if self.on_superseded is None:
+            return
+        loop = asyncio.get_running_loop()
+        for pending in superseded:
+            task = loop.create_task(self.__notify(key, pending))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+
+    async def __notify(self, key: Hashable, entry: DispatchEntry):
+        try:
+            await self.on_superseded(entry)
+        except Exception:
+            logger.exception(f"Error notifying a superseded command of {key}")
+
+    async def __drain(self, key: Hashable):
+        queue = self._queues[key]
+        stats = self._stats[key]
+        try:
+            while queue:
+                lane = queue[0].lane
+                async with self.__slot(lane):
+                    if not queue or queue[0].lane != lane:
+                        # The job waiting for the slot was superseded by a
+                        # job of another lane
+                        continue
+                    entry = queue.popleft()
+                    stats.depth -= 1
+                    lane_stats = self._lane_stats[lane]
+                    started_at = time.monotonic()
+                    wait = started_at - entry.submitted_at
+                    stats.last_wait = lane_stats.last_wait = wait
+                    stats.max_wait = max(stats.max_wait, wait)
+                    lane_stats.max_wait = max(lane_stats.max_wait, wait)
+                    lane_stats.total_wait += wait
+                    stats.running = True
+                    lane_stats.running += 1
+                    try:
+                        await entry.job(*entry.args)
+                    except Exception:
+                        logger.exception(f"Error running a command of {key}")
+                    finally:
+                        run = time.monotonic() - started_at
+                        lane_stats.last_run = run
+                        lane_stats.max_run = max(lane_stats.max_run, run)
+                        lane_stats.total_run += run
+                        lane_stats.running -= 1
+                        lane_stats.executed += 1
+                        stats.running = False
+                        stats.executed += 1
+        finally:
+            # The jobs left by a cancellation are dropped
+            del self._tasks[key]
+            del self._queues[key]
+            stats.depth = 0
@@ -1,18 +1,23 @@
 from dataclasses import asdict
+from datetime import datetime, timezone
 import json
-from typing import Callable, Awaitable
+from typing import Callable, Awaitable, Optional, Tuple
 
 from src.exceptions import AppError
 from src.instance_manager.instance.exceptions import (
     InstanceAlreadyExists,
-    InstanceNotFound, EndMessageProcessing
+    InstanceNotFound, EndMessageProcessing, CommandExpired, InternalError
 )
 from src.instance_manager.message import message_dispatcher
 from src.instance_manager.message.input_message import InputMessage
 from src.instance_manager.message.response_status import ResponseStatus
 import logging
 from src.instance_manager.message.output_message import CtlAcknowledgeMessage
-from instance_manager.message import Action
+from src.instance_manager.message import Action
+from src.instance_manager.operation.operation import Operation, OperationStatus
+from src.instance_manager.operation.operation_service import OperationService
+from src.rabbitmq.constants import CONTROL_LANE, START_LANE
+from src.rabbitmq.keyed_dispatcher import DispatchEntry, KeyedDispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -23,12 +28,24 @@ class MessageHandler:
             status_queue_name,
             controller_queue_name,
             rabbitmq_client,
-            instance_service
+            instance_service,
+            command_ttl: float = 0,
+            operation_service: Optional[OperationService] = None
     ):
+        """
+            Parameters:
+                command_ttl: seconds after being sent a command is dropped
+                    instead of run, 0 to never drop them.
+                operation_service: when given, a START is answered as
+                    accepted and acknowledged before the instance starts,
+                    and answered again once it is ready or failed.
+        """
         self.status_queue_name = status_queue_name
         self.controller_queue_name = controller_queue_name
         self.rabbitmq_client = rabbitmq_client
         self.instance_service = instance_service
+        self.command_ttl = command_ttl
+        self.operation_service = operation_service
         self.instance_ack_exchange_name = "instance_ack_exchange"
 
     async def send(
@@ -64,11 +81,12 @@ class MessageHandler:
     async def __process_unique_message(
             self,
             input_message: InputMessage,
+            onACK: Callable[[], Awaitable[None]]
     ):
         """
             Function use for processing messages that are unique to an instance.
         """
-        await message_dispatcher(input_message, self.instance_service)
+        await self.__run_command(input_message, onACK)
 
     async def __process_shared_message(
             self,
@@ -85,7 +103,241 @@ class MessageHandler:
             await onACK()
             raise EndMessageProcessing()
 
-        await message_dispatcher(input_message, self.instance_service)
+        await self.__run_command(input_message, onACK)
+
+    async def __run_command(
+            self,
+            input_message: InputMessage,
+            onACK: Callable[[], Awaitable[None]]
+    ):
+        """
+            Runs the command, a START in two phases when operations are
+            tracked.
+            Throws:
+                EndMessageProcessing: If the START was answered and
+                    acknowledged.
+        """
+        self.__check_expiry(input_message)
+        if (input_message.action != Action.START
+                or self.operation_service is None):
+            await message_dispatcher(input_message, self.instance_service)
+            return
+
+        operation = await self.operation_service.accept(input_message)
+        await self.send(
+            response_status=ResponseStatus.Accepted,
+            response_message=f"Accepted as operation {operation.id}",
+            device_id=input_message.device_id,
+            action=input_message.action
+        )
+        # The message is not held while the container boots
+        await onACK()
+        await self.run_operation(operation)
+        raise EndMessageProcessing()
+
+    async def run_operation(self, operation: Operation):
+        """
+            Starts the instance of an accepted operation and answers whether
+            it is ready or failed.
+            Parameters:
+                operation: the accepted START.
+        """
+        input_message = InputMessage(
+            action=Action.START,
+            device_id=operation.device_id,
+            device_stream_url=operation.stream_url
+        )
+        try:
+            await message_dispatcher(input_message, self.instance_service)
+            status, response_message = ResponseStatus.Ok, "Ready"
+        except (AppError, InternalError) as e:
+            status = self.__app_error_status_mapper(e)
+            response_message = str(e.message)
+        except Exception as e:
+            logger.exception(
+                f"Unexpected error running operation {operation.id}.")
+            status, response_message = ResponseStatus.InternalError, str(e)
+        try:
+            await self.__finish_operation(operation, status, response_message)
+        except Exception:
+            # Still ACCEPTED, it is resumed once the instance manager restarts
+            logger.exception(f"Error finishing operation {operation.id}.")
+
+    async def resume_operations(self, dispatcher: KeyedDispatcher):
+        """
+            Resumes the operations accepted before the instance manager
+            stopped, in the order they were accepted, and fails the ones
+            older than command_ttl. Called before consuming the queues, so
+            they run before any new command of their device.
+            Parameters:
+                dispatcher: runs the resumed operations.
+        """
+        if self.operation_service is None:
+            return
+        now = datetime.utcnow()
+        operations = await self.operation_service.get_accepted_operations()
+        for operation in operations:
+            age = (now - operation.created_at).total_seconds()
+            if self.command_ttl and age > self.command_ttl:
+                error = CommandExpired(operation.device_id, age)
+                await self.__finish_operation(
+                    operation, ResponseStatus.Expired, error.message)
+                continue
+            logger.info(
+                f"Resuming operation {operation.id} "
+                f"of device {operation.device_id}")
+            dispatcher.submit(
+                operation.device_id, self.run_operation, operation)
+
+    async def __finish_operation(
+            self,
+            operation: Operation,
+            status: ResponseStatus,
+            response_message: str
+    ):
+        if status == ResponseStatus.Ok:
+            operation_status = OperationStatus.READY
+        else:
+            operation_status = OperationStatus.FAILED
+        if not await self.operation_service.finish(
+                operation, operation_status, response_message):
+            logger.warning(f"Operation {operation.id} was already finished.")
+            return
+        await self.send(
+            response_status=status,
+            response_message=response_message,
+            device_id=operation.device_id,
+            action=Action[operation.action]
+        )
+
+    def message_key(self, received_message):
+        """
+            Returns:
+                The device id of the message, its commands run in order.
+                None for messages without it, which run in order together.
+        """
+        try:
+            return json.loads(received_message.body.decode())["device_id"]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def lane(self, entry: DispatchEntry) -> str:
+        """
+            Returns:
+                The lane of the command: STARTs wait for a container to boot,
+                so they run in their own lane and the STOP, PAUSE and REMOVE
+                commands of other devices are not delayed by them.
+        """
+        if self.__entry_action(entry) == Action.START:
+            return START_LANE
+        return CONTROL_LANE
+
+    def supersedes(
+            self,
+            incoming: DispatchEntry,
+            pending: DispatchEntry
+    ) -> bool:
+        """
+            Whether a command not run yet is made useless by a command received
+            after it for the same device, only the last command counts.
+            A pending REMOVE is only superseded by another REMOVE, so a START
+            received after it still starts a new instance with its stream url.
+            A pending START is only superseded by a REMOVE or another START,
+            so a STOP or PAUSE received after it still finds the instance
+            it creates.
+            Parameters:
+                incoming: entry of the command just received.
+                pending: entry of a command received before, not started yet.
+        """
+        incoming_action = self.__entry_action(incoming)
+        pending_action = self.__entry_action(pending)
+        if incoming_action is None or pending_action is None:
+            return False
+        if incoming_action == Action.REMOVE:
+            return True
+        if pending_action == Action.REMOVE:
+            return False
+        if pending_action == Action.START:
+            return incoming_action == Action.START
+        return True
+
+    async def on_superseded(self, entry: DispatchEntry):
+        """
+            Acknowledges a superseded command without running it.
+            Parameters:
+                entry: entry of the superseded command.
+        """
+        if isinstance(entry.args[0], Operation):
+            # Accepted on delivery or resumed, already acknowledged
+            await self.__finish_operation(
+                entry.args[0],
+                ResponseStatus.Superseded,
+                "Superseded by a later command"
+            )
+            return
+        received_message = entry.args[0]
+        input_message = self.__build_message_dto(received_message)
+        is_shared = entry.job == self.process_shared_messages
+        if not is_shared or await self.instance_service.validate_instance(
+                input_message.device_id):
+            await self.send(
+                response_status=ResponseStatus.Superseded,
+                response_message="Superseded by a later command",
+                device_id=input_message.device_id,
+                action=input_message.action
+            )
+        await received_message.ack()
+
+    async def accept_unique_start(self, received_message):
+        return await self._accept_start(received_message, False)
+
+    async def accept_shared_start(self, received_message):
+        return await self._accept_start(received_message, True)
+
+    async def _accept_start(
+            self,
+            received_message,
+            is_shared: bool = False
+    ) -> Optional[Tuple[Callable[[Operation], Awaitable[None]], Operation]]:
+        """
+            Accepts a START as soon as it is delivered: it is stored as an
+            operation, answered as accepted and acknowledged, so the STARTs
+            waiting for their device or their lane never hold the prefetch
+            window the STOP, PAUSE and REMOVE commands are delivered through.
+            Parameters:
+                received_message: message received from RabbitMQ.
+                is_shared: whether it was received from the shared queue.
+            Returns:
+                The job running the operation and the operation. None for the
+                other commands and the STARTs that are invalid, expired, for
+                another instance manager or not stored, processed when their
+                turn comes.
+        """
+        if (self.operation_service is None
+                or self.__peek_action(received_message) != Action.START):
+            return None
+        try:
+            input_message = self.__build_message_dto(received_message)
+            self.__check_expiry(input_message)
+            if is_shared and not await self.instance_service.validate_instance(
+                    input_message.device_id):
+                return None
+            operation = await self.operation_service.accept(input_message)
+        except (KeyError, json.decoder.JSONDecodeError, AppError,
+                InternalError):
+            return None
+        try:
+            await self.send(
+                response_status=ResponseStatus.Accepted,
+                response_message=f"Accepted as operation {operation.id}",
+                device_id=input_message.device_id,
+                action=input_message.action
+            )
+            await received_message.ack()
+        except Exception:
+            # Stored, so the operation still runs
+            logger.exception(f"Error acknowledging operation {operation.id}.")
+        return self.run_operation, operation
 
     async def process_shared_messages(
             self,
@@ -113,13 +365,15 @@ class MessageHandler:
             device_id = input_message.device_id
             action = input_message.action
 
-            if not is_shared:
-                await self.__process_unique_message(input_message)
-            else:
-                try:
-                    await self.__process_shared_message(input_message, device_id, received_message.ack)
-                except EndMessageProcessing:
-                    return
+            try:
+                if not is_shared:
+                    await self.__process_unique_message(
+                        input_message, received_message.ack)
+                else:
+                    await self.__process_shared_message(
+                        input_message, device_id, received_message.ack)
+            except EndMessageProcessing:
+                return
 
             await self.send(
                 response_status=ResponseStatus.Ok,
@@ -158,12 +412,62 @@ class MessageHandler:
         message_dto = InputMessage(
             action=Action[message_dict["action"]],
             device_id=message_dict["device_id"],
-            device_stream_url=message_dict.get("device_stream_url")
+            device_stream_url=message_dict.get("device_stream_url"),
+            sent_at=self.__sent_at(input_message, message_dict)
         )
 
         logger.info(f"Received message: {message_dto}")
         return message_dto
 
+    def __entry_action(self, entry: DispatchEntry) -> Optional[Action]:
+        command = entry.args[0]
+        if isinstance(command, Operation):
+            return Action[command.action]
+        return self.__peek_action(command)
+
+    def __peek_action(self, input_message) -> Optional[Action]:
+        try:
+            return Action[json.loads(input_message.body.decode())["action"]]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def __sent_at(self, input_message, message_dict) -> Optional[datetime]:
+        """
+            Returns:
+                The AMQP timestamp of the message, or else the timestamp of the
+                body, seconds since the epoch or ISO 8601. None without them.
+        """
+        sent_at = getattr(input_message, "timestamp", None)
+        if sent_at is None:
+            body_timestamp = message_dict.get("timestamp")
+            if isinstance(body_timestamp, (int, float)):
+                sent_at = datetime.fromtimestamp(
+                    body_timestamp, tz=timezone.utc)
+            elif isinstance(body_timestamp, str):
+                try:
+                    sent_at = datetime.fromisoformat(body_timestamp)
+                except ValueError:
+                    logger.warning(
+                        f"Invalid message timestamp {body_timestamp}, "
+                        f"the command does not expire.")
+        if sent_at is not None and sent_at.tzinfo is None:
+            sent_at = sent_at.replace(tzinfo=timezone.utc)
+        return sent_at
+
+    def __check_expiry(self, input_message: InputMessage):
+        """
+            Throws:
+                CommandExpired: If the command was sent more than command_ttl
+                    seconds ago.
+        """
+        if not self.command_ttl or input_message.sent_at is None:
+            return
+        age = (
+            datetime.now(timezone.utc) - input_message.sent_at
+        ).total_seconds()
+        if age > self.command_ttl:
+            raise CommandExpired(input_message.device_id, age)
+
     def __message_code_mapper(self, status):
         mapper = {
             ResponseStatus.Ok: 2000,
@@ -171,13 +475,18 @@ class MessageHandler:
             ResponseStatus.NotFound: 4004,
             ResponseStatus.Conflict: 4009,
             ResponseStatus.InternalError: 5000,
-            ResponseStatus.InconsistentContainerState: 5001
+            ResponseStatus.InconsistentContainerState: 5001,
+            ResponseStatus.Superseded: 4091,
+            ResponseStatus.Expired: 4080,
+            ResponseStatus.Accepted: 2020
         }
         return mapper[status]
 
     def __app_error_status_mapper(self, error):
         mapper = {
             InstanceNotFound: ResponseStatus.NotFound,
-            InstanceAlreadyExists: ResponseStatus.Conflict
+            InstanceAlreadyExists: ResponseStatus.Conflict,
+            CommandExpired: ResponseStatus.Expired,
+            InternalError: ResponseStatus.InternalError
         }
         return mapper[error.__class__]
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aio_pika
+from psycopg_pool import ConnectionPool
+
+from src.database.transaction import transaction_sync
+from src.image_processor.event_publisher import (
+    METRICS_EVENT,
+    PROCESSED_STREAM_EVENT
+)
+from src.image_processor.metric.metric_dao import MetricDAOFactory
+from src.image_processor.metric.metric_spool import coalesce_events
+from src.image_processor.processed_stream.processed_stream import (
+    ProcessedStream
+)
+from src.image_processor.processed_stream.processed_stream_dao import (
+    ProcessedStreamDAOFactory
+)
+from src.rabbitmq.async_rabbitmq_manager import AsyncRabbitMQManager
+
+"""
+Ingest of the metric and processed stream events published by the workers,
+written in batches by the instance manager, so the database connections do
+not grow with the number of workers.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def decode_events(
+        bodies: List[dict]
+) -> Tuple[dict, dict, dict, Dict[int, Optional[str]]]:
+    """
+        Merges the events of a batch, in the order they were published.
+        Returns:
+            The intervals to insert, the intervals to close and the devices
+            whose open intervals must be closed, as MetricWriter keeps them,
+            and the latest processed stream url of each device.
+    """
+    metric_events, processed_streams = [], {}
+    for body in bodies:
+        if body.get("type") == METRICS_EVENT:
+            metric_events += body["events"]
+        elif body.get("type") == PROCESSED_STREAM_EVENT:
+            processed_streams[body["device_id"]] = body["stream_url"]
+        else:
+            logger.warning(f"Unknown event {body.get('type')}. Discarding...")
+    return (*coalesce_events(metric_events), processed_streams)
+
+
+class MetricIngestConsumer:
+    """
+        Consumes the events of a durable queue bound to the exchange the
+        workers publish to, and writes them every flush_interval seconds, or
+        once batch_size are waiting, in a single transaction.
+        The events are acknowledged once written and retried on the next
+        flush otherwise, while the broker keeps the following ones.
+        After max_batch_failures failed flushes in a row, or once the
+        flushes failed for max_failure_seconds, the events are written one
+        at a time, and the ones that still fail are moved to the dead letter
+        queue, so a single bad event does not stall the metrics of every
+        worker. When every event fails and the database does not answer
+        either, it is unavailable and the batch is kept.
+    """
+
+    def __init__(
+            self,
+            rabbit_manager: AsyncRabbitMQManager,
+            conn_manager: ConnectionPool,
+            exchange_name: str,
+            queue_name: str,
+            batch_size: int = 1000,
+            flush_interval: float = 1,
+            max_batch_failures: int = 3,
+            max_failure_seconds: float = 30,
+            metric_dao_factory: MetricDAOFactory = None,
+            processed_stream_dao_factory: ProcessedStreamDAOFactory = None
+    ):
+        self.rabbit_manager = rabbit_manager
+        self.conn_manager = conn_manager
+        self.exchange_name = exchange_name
+        self.queue_name = queue_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_batch_failures = max_batch_failures
+        self.max_failure_seconds = max_failure_seconds
+        # The events that can not be written are kept for inspection
+        self.dead_letter_queue_name = f"{queue_name}.dead"
+        self.metric_dao_factory = metric_dao_factory or MetricDAOFactory()
+        self.processed_stream_dao_factory = (
+            processed_stream_dao_factory or ProcessedStreamDAOFactory()
+        )
+        self.written = 0
+        self.dead_lettered = 0
+        self._failures = 0
+        self._failing_since = None
+        # Exchange routing to the dead letter queue, set once consuming
+        self._dead_letters = None
+        # (message, decoded body) pairs, in the order they were delivered
+        self._pending = []
+        self._full = asyncio.Event()
+
+    def write(self, bodies: List[dict]):
+        """Writes the events in a single transaction."""
+        starts, closes, stale, processed_streams = decode_events(bodies)
+        with transaction_sync(self.conn_manager) as cursor:
+            metrics_dao = self.metric_dao_factory.create_dao(cursor)
+            # Before the inserts, which could be closed too otherwise
+            for device_id, end_time in stale.items():
+                metrics_dao.close_unfinished_metrics(device_id, end_time)
+            metrics_dao.start_metrics(list(starts.values()))
+            metrics_dao.close_metrics(list(closes.values()))
+            processed_dao = self.processed_stream_dao_factory.create_dao(
+                cursor)
+            for device_id, stream_url in processed_streams.items():
+                processed_dao.update_processed_stream(ProcessedStream(
+                    device_id=device_id,
+                    stream_url=stream_url
+                ))
+
+    def database_available(self) -> bool:
+        try:
+            with self.conn_manager.connection() as connection:
+                connection.execute("SELECT 1")
+        except Exception:
+            return False
+        return True
+
+    async def on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        try:
+            body = json.loads(message.body)
+        except json.decoder.JSONDecodeError:
+            body = None
+        if not isinstance(body, dict):
+            logger.warning("Invalid metric event. Discarding...")
+            body = None
+        self._pending.append((message, body))
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self) -> bool:
+        """
+            Writes the pending events.
+            Returns:
+                True if they were written, False if they are kept for
+                the next flush.
+        """
+        self._full.clear()
+        batch = list(self._pending)
+        if not batch:
+            return True
+        bodies = [body for _, body in batch if body is not None]
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.write, bodies)
+        except Exception as e:
+            self._failures += 1
+            if self._failing_since is None:
+                self._failing_since = time.monotonic()
+            failing = time.monotonic() - self._failing_since
+            if (self._failures < self.max_batch_failures
+                    and failing < self.max_failure_seconds):
+                logger.error(
+                    f"Error writing {len(batch)} metric events, "
+                    f"retrying: {e}")
+                return False
+            logger.error(
+                f"Error writing {len(batch)} metric events "
+                f"{self._failures} times, "
+                f"for {failing:.0f} seconds, writing them one at a time: {e}"
+            )
+            if not await self.__write_each(batch):
+                return False
+        else:
+            # Acknowledges every message of the channel delivered up to it
+            await batch[-1][0].ack(multiple=True)
+            self.written += len(batch)
+        self._failures = 0
+        self._failing_since = None
+        del self._pending[:len(batch)]
+        return True
+
+    async def __write_each(self, batch) -> bool:
+        """
+            Writes the events of the batch one at a time, acknowledging the
+            written ones and moving the others to the dead letter queue.
+            Returns:
+                False if every event failed as the database is unavailable,
+                none of them is settled then.
+        """
+        loop = asyncio.get_running_loop()
+        failed = []
+        for message, body in batch:
+            if body is None:
+                continue
+            try:
+                await loop.run_in_executor(None, self.write, [body])
+            except Exception:
+                failed.append(message)
+        every_failed = len(failed) == sum(
+            body is not None for _, body in batch)
+        # A single bad event fails alone too, while the database answers
+        if failed and every_failed and not await loop.run_in_executor(
+                None, self.database_available):
+            logger.error("The database is unavailable, retrying the batch...")
+            return False
+        for message, _ in batch:
+            if message in failed:
+                logger.error(
+                    f"Metric event {message.body[:200]} can not be written. "
+                    "Dead lettering..."
+                )
+                # Published rather than rejected, the queue was declared
+                # without dead letter arguments, which can not be changed
+                await self._dead_letters.publish(
+                    aio_pika.Message(
+                        body=message.body,
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                    ),
+                    routing_key=self.dead_letter_queue_name
+                )
+            await message.ack()
+        self.written += len(batch) - len(failed)
+        self.dead_lettered += len(failed)
+        return True
+
+    async def consume(self):
+        async with self.rabbit_manager.channel_pool.acquire() as channel:
+            # The unacknowledged events of a batch stay in memory
+            await channel.set_qos(prefetch_count=self.batch_size)
+            exchange = await channel.declare_exchange(
+                self.exchange_name,
+                aio_pika.ExchangeType.TOPIC,
+                durable=True
+            )
+            await channel.declare_queue(
+                self.dead_letter_queue_name,
+                durable=True
+            )
+            self._dead_letters = channel.default_exchange
+            queue = await channel.declare_queue(self.queue_name, durable=True)
+            await queue.bind(exchange, routing_key="#")
+            await queue.consume(self.on_message)
+            logger.info(
+                f"Consuming the metric events of {self.exchange_name}...")
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                await self.flush()
@@ -1,17 +1,30 @@
 import asyncio
 import logging
 from src.instance_manager.instance.instance_service import InstanceService
+from src.instance_manager.operation.operation_service import OperationService
 from src.rabbitmq.async_rabbitmq_manager import AsyncRabbitMQManager
+from src.rabbitmq.constants import CONTROL_LANE, START_LANE
+from src.rabbitmq.keyed_dispatcher import KeyedDispatcher
 from src.rabbitmq.message_handler import MessageHandler
+from src.rabbitmq.metric_ingest import MetricIngestConsumer
 from src.rabbitmq.rabbitmq_client import AsyncRabbitMQClient
 import uuid
+from psycopg_pool import ConnectionPool
 
 logger = logging.getLogger(__name__)
 
 
 async def consume_control_messages(
-        consumer_info, instance_service: InstanceService
+        consumer_info,
+        instance_service: InstanceService,
+        operation_service: OperationService = None
 ) -> None:
+    """
+        Parameters:
+            operation_service: when given, STARTs are accepted and
+                acknowledged as soon as they are delivered and their outcome
+                is notified later.
+    """
     logger.info("Starting RabbitMQ consumer...")
     logger.debug(f"Connection info: {consumer_info}")
 
@@ -26,13 +39,28 @@ async def consume_control_messages(
     logger.debug(f"RabbitMQ Built URL: {rabbit_url}")
 
     connection_manager = AsyncRabbitMQManager(rabbit_url)
-    rabbit_client = AsyncRabbitMQClient(connection_manager)
+    # Shared by both queues, so the commands of a device run one at a time
+    dispatcher = KeyedDispatcher(lanes={
+        START_LANE: consumer_info["command_concurrency"],
+        CONTROL_LANE: consumer_info["control_concurrency"]
+    })
+    rabbit_client = AsyncRabbitMQClient(
+        connection_manager,
+        dispatcher,
+        consumer_info["command_prefetch"]
+    )
     message_handler = MessageHandler(
         rbt_ack_status_queue_name,
         rbt_controller_queue_name,
         rabbit_client,
         instance_service,
+        consumer_info["command_ttl"],
+        operation_service
     )
+    # Pending commands of a device are collapsed to the last one
+    dispatcher.supersedes = message_handler.supersedes
+    dispatcher.on_superseded = message_handler.on_superseded
+    dispatcher.lane_of = message_handler.lane
 
     receive_queue_name = str(uuid.uuid4())
     queue_name = await rabbit_client.register_queue(
@@ -41,13 +69,54 @@ async def consume_control_messages(
     )
     logger.info("Created dedicated queue...")
 
+    # Before any new command, so the commands of a device keep their order
+    await message_handler.resume_operations(dispatcher)
+
     await asyncio.gather(
         rabbit_client.start_consumer(
             ctl_queue_name=rbt_controller_queue_name,
-            async_message_handler=message_handler.process_unique_messages
+            async_message_handler=message_handler.process_unique_messages,
+            message_key=message_handler.message_key,
+            on_delivery=message_handler.accept_unique_start
         ),
         rabbit_client.start_consumer(
             ctl_queue_name=queue_name,
-            async_message_handler=message_handler.process_shared_messages
-     )
+            async_message_handler=message_handler.process_shared_messages,
+            message_key=message_handler.message_key,
+            on_delivery=message_handler.accept_shared_start
+        ),
+        dispatcher.report()
+    )
+
+
+async def consume_metric_events(
+        consumer_info, ingest_info, conn_manager: ConnectionPool
+) -> None:
+    """
+        Writes the metric events the workers publish instead of connecting
+        to the database themselves.
+        Parameters:
+            ingest_info: the batch size and flush interval of the writes.
+            conn_manager: the pool of the writes, one connection is enough.
+    """
+    logger.info("Starting metric events consumer...")
+    rbt_user = consumer_info["user"]
+    rbt_pass = consumer_info["password"]
+    rbt_host = consumer_info["host"]
+    rbt_port = consumer_info["port"]
+
+    rabbit_url = f"amqp://{rbt_user}:{rbt_pass}@{rbt_host}:{rbt_port}/"
+    connection_manager = AsyncRabbitMQManager(rabbit_url)
+    ingest_consumer = MetricIngestConsumer(
+        connection_manager,
+        conn_manager,
+        consumer_info["metrics_exchange"],
+        consumer_info["metrics_queue"],
+        ingest_info["batch_size"],
+        ingest_info["flush_interval"],
+        ingest_info["max_batch_failures"],
+        ingest_info["max_failure_seconds"]
     )
+    async with connection_manager.connection_pool, \
+            connection_manager.channel_pool:
+        await ingest_consumer.consume()
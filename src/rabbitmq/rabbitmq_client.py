@@ -1,26 +1,40 @@
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import functools
 import json
 import logging
+from typing import Awaitable, Callable, Hashable, Optional, Tuple
 import aio_pika
 
-from rabbitmq.constants import QUEUE_PREFIX
+from src.rabbitmq.constants import QUEUE_PREFIX
 from src.rabbitmq.async_rabbitmq_manager import AsyncRabbitMQManager
+from src.rabbitmq.keyed_dispatcher import KeyedDispatcher
 
 logger = logging.getLogger(__name__)
 
 
 class AsyncRabbitMQClient:
-    def __init__(self, async_manager: AsyncRabbitMQManager, pool_workers=5):
+    def __init__(
+            self,
+            async_manager: AsyncRabbitMQManager,
+            dispatcher: KeyedDispatcher = None,
+            prefetch_count: int = 10
+    ):
+        """
+            Parameters:
+                dispatcher: runs the message handlers, in order per key.
+                prefetch_count: messages delivered and not acknowledged yet
+                                at most, per consumer.
+        """
         self.manager = async_manager
-        self.consumer_pool = ThreadPoolExecutor(max_workers=pool_workers)
-        self.loop = asyncio.get_event_loop()
+        if dispatcher is None:
+            dispatcher = KeyedDispatcher()
+        self.dispatcher = dispatcher
+        self.prefetch_count = prefetch_count
 
     async def __consume(
             self,
             ctl_queue_name,
-            async_message_handler
+            async_message_handler,
+            message_key,
+            on_delivery=None
             ) -> None:
         """
             Consumes messages from the RabbitMQ queue.
@@ -30,26 +44,72 @@ class AsyncRabbitMQClient:
                 ctl_queue_name (str): The name of the queue to consume from.
                 async_message_handler (function): The function to call when a
                     message is received.
+                message_key (function): The key the messages are ordered by.
+                on_delivery (function): Run on each message once delivered,
+                    before it waits for its key.
         """
         async with self.manager.channel_pool.acquire() as channel:
-            await channel.set_qos(10)  # quality of service for the channel
+            # Messages waiting in the dispatcher are not acknowledged yet
+            await channel.set_qos(self.prefetch_count)
 
             queue = await channel.get_queue(ctl_queue_name, ensure=True)
 
+            # The delivery hooks of different keys run concurrently, so a
+            # slow one does not delay the messages of the other keys. The
+            # prefetch bounds them, their messages are not acknowledged yet.
+            deliveries = KeyedDispatcher(max_concurrency=self.prefetch_count)
             async with queue.iterator() as queue_iter:
                 async for message in queue_iter:
-                    self.loop.run_in_executor(
-                        self.consumer_pool,
-                        functools.partial(
-                            self.loop.create_task,
-                            async_message_handler(message)
+                    key = message_key(message)
+                    if on_delivery is None:
+                        self.dispatcher.submit(
+                            key,
+                            async_message_handler,
+                            message
                         )
+                        continue
+                    deliveries.submit(
+                        key,
+                        self.__deliver,
+                        key,
+                        async_message_handler,
+                        on_delivery,
+                        message
                     )
+            await deliveries.join()
+
+    async def __deliver(
+            self,
+            key,
+            async_message_handler,
+            on_delivery,
+            message
+            ) -> None:
+        """
+            Runs the delivery hook of the message, then submits the job it
+            returned, or else the handler, after the messages of the key
+            delivered before.
+        """
+        job, args = async_message_handler, (message,)
+        try:
+            delivered_job = await on_delivery(message)
+        except Exception:
+            logger.exception("Error on delivery, handling the message as is")
+            delivered_job = None
+        if delivered_job is not None:
+            job, *args = delivered_job
+        self.dispatcher.submit(key, job, *args)
 
     async def start_consumer(
             self,
             ctl_queue_name,
-            async_message_handler
+            async_message_handler,
+            message_key: Callable[
+                [aio_pika.IncomingMessage], Hashable
+            ] = lambda message: None,
+            on_delivery: Optional[Callable[
+                [aio_pika.IncomingMessage], Awaitable[Optional[Tuple]]
+            ]] = None
             ):
         """
             Starts the RabbitMQ consumer.
@@ -57,10 +117,25 @@ class AsyncRabbitMQClient:
                 ctl_queue_name (str): The name of the queue to consume from.
                 async_message_handler (function): The function to call when a
                     message is received.
+                message_key (function): Messages with the same key are handled
+                    one at a time, in the order they were received, all of
+                    them by default.
+                on_delivery (function): Run on each message as soon as it is
+                    delivered, in the order of the queue for the messages
+                    of a key and concurrently for different keys. Returns
+                    the job and the arguments to submit instead of the
+                    handler and the message, or None to submit them. A
+                    message it acknowledges no longer holds the prefetch
+                    window while it waits.
         """
         async with self.manager.connection_pool, self.manager.channel_pool:
             task = self.manager.event_loop.create_task(
-                self.__consume(ctl_queue_name, async_message_handler)
+                self.__consume(
+                    ctl_queue_name,
+                    async_message_handler,
+                    message_key,
+                    on_delivery
+                )
             )
             await task
 
@@ -0,0 +1,81 @@
+import pytest
+
+from src.image_processor.benchmark_report import (
+    compare,
+    load_results,
+    percentile,
+    save_results,
+    summarize_latencies,
+    summarize_run
+)
+from src.image_processor.file_streamer import FileStreamer, NullStreamer
+
+
+def run(fps, p95_ms, **config):
+    return {
+        "config": {"weights": "yolov5s.pt", "imgsz": 640, **config},
+        "frames": 100,
+        "fps": fps,
+        "stages": {"inference": {"p95": p95_ms}}
+    }
+
+
+def test_percentiles_interpolate():
+    samples = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(samples, 0) == 1.0
+    assert percentile(samples, 50) == 2.5
+    assert percentile(samples, 100) == 4.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summaries_are_in_milliseconds():
+    summary = summarize_latencies([0.001 * i for i in range(1, 101)])
+    assert summary["count"] == 100
+    assert summary["mean"] == pytest.approx(50.5)
+    assert summary["p50"] == pytest.approx(50.5)
+    assert summary["p99"] == pytest.approx(99.01)
+
+    result = summarize_run({"imgsz": 320}, 50, 2.0, {"nms": [0.002, 0.004]})
+    assert result["fps"] == 25
+    assert result["stages"]["nms"]["p50"] == pytest.approx(3.0)
+
+
+def test_compare_detects_regressions():
+    baseline = [run(100, 10), run(50, 20, imgsz=320)]
+    results = [run(95, 10.5), run(40, 20, imgsz=320), run(10, 1, batch_size=4)]
+
+    comparisons = compare(results, baseline, max_regression=0.1)
+
+    # The run missing from the baseline is not compared
+    assert len(comparisons) == 2
+    assert not comparisons[0]["regressed"]
+    assert comparisons[0]["p95_ratios"]["inference"] == pytest.approx(1.05)
+    assert comparisons[1]["regressed"]
+    assert comparisons[1]["fps_ratio"] == pytest.approx(0.8)
+
+
+def test_compare_detects_latency_regressions():
+    comparisons = compare([run(100, 15)], [run(100, 10)], max_regression=0.1)
+    assert comparisons[0]["regressed"]
+
+
+def test_results_round_trip(tmp_path):
+    path = str(tmp_path / "results.json")
+    save_results(path, [run(100, 10)])
+    assert load_results(path) == [run(100, 10)]
+
+
+def test_null_streamer_counts_frames():
+    streamer = NullStreamer("null://", 4, 2)
+    streamer.start_stream()
+    for _ in range(3):
+        streamer.next_frame(None)
+    streamer.stop_stream()
+    assert streamer.stats() == {"written": 3}
+
+
+def test_file_streamer_encodes_as_fast_as_possible():
+    command = FileStreamer("/tmp/out.mp4", 4, 2)._command()
+    assert "-re" not in command
+    assert command[-2:] == ["-y", "/tmp/out.mp4"]
+    assert "rtsp" not in command
@@ -0,0 +1,85 @@
+import sys
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.image_processor.buffered_streamer import (  # noqa: E402
+    BufferedStreamerRTSP
+)
+
+
+class FakeStreamer(BufferedStreamerRTSP):
+    """Runs a python process in place of ffmpeg."""
+
+    def __init__(self, script, **kwargs):
+        super().__init__("rtsp://localhost/test", 4, 2, **kwargs)
+        self.script = script
+
+    def _command(self):
+        return [sys.executable, "-c", self.script]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def frame():
+    return np.zeros((2, 4, 3), np.uint8)
+
+
+def test_frames_are_written():
+    streamer = FakeStreamer("import sys; sys.stdin.buffer.read()")
+    streamer.start_stream()
+    for _ in range(3):
+        streamer.next_frame(frame())
+        assert wait_for(lambda: len(streamer._frames) == 0)
+
+    assert wait_for(lambda: streamer.written == 3)
+    streamer.stop_stream()
+    assert streamer.stats() == {"written": 3, "dropped": 0, "restarts": 0}
+
+
+def test_frames_are_dropped_when_the_encoder_stalls():
+    streamer = FakeStreamer("import time; time.sleep(60)", queue_size=2)
+    streamer.start_stream()
+    start = time.monotonic()
+    # Fills the pipe buffer, next_frame must not block
+    for _ in range(10000):
+        streamer.next_frame(frame())
+
+    assert time.monotonic() - start < 5
+    assert streamer.dropped > 0
+    streamer.stop_stream()
+
+
+def test_encoder_is_restarted_when_it_exits():
+    streamer = FakeStreamer("pass", min_backoff=0.01)
+    streamer.start_stream()
+
+    assert wait_for(lambda: streamer.restarts >= 2)
+    streamer.stop_stream()
+
+
+def test_backoff_grows_while_the_encoder_dies_after_a_frame():
+    # Reads a single frame, then exits
+    streamer = FakeStreamer(
+        "import sys; sys.stdin.buffer.read(24)",
+        min_backoff=0.01
+    )
+    streamer.start_stream()
+
+    def restarted(restarts):
+        def condition():
+            streamer.next_frame(frame())
+            return streamer.restarts >= restarts
+        return condition
+
+    assert wait_for(restarted(4))
+    assert streamer.written > 0
+    assert streamer._backoff >= 0.08
+    streamer.stop_stream()
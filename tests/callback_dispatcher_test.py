@@ -0,0 +1,61 @@
+import threading
+import time
+
+from src.image_processor.callback_dispatcher import CoalescingDispatcher
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_only_the_latest_arguments_run():
+    dispatcher = CoalescingDispatcher(interval=60)
+    calls = []
+    unblock = threading.Event()
+    dispatcher.submit(unblock.wait)
+    for count in range(100):
+        dispatcher.submit_latest("metric", calls.append, count)
+    unblock.set()
+    dispatcher.shutdown(wait=True)
+
+    assert calls == [99]
+    assert dispatcher.stats() == {"executed": 2, "coalesced": 99}
+
+
+def test_keys_run_at_most_once_per_interval():
+    dispatcher = CoalescingDispatcher(interval=0.2)
+    calls = []
+    dispatcher.submit_latest("metric", calls.append, 1)
+    assert wait_for(lambda: calls == [1])
+
+    started = time.monotonic()
+    dispatcher.submit_latest("metric", calls.append, 2)
+    assert wait_for(lambda: calls == [1, 2])
+    assert time.monotonic() - started >= 0.15
+
+    # Other keys are not delayed
+    dispatcher.submit_latest("other", calls.append, 3)
+    assert wait_for(lambda: calls == [1, 2, 3])
+    dispatcher.shutdown()
+
+
+def test_submitted_callbacks_run_in_order():
+    dispatcher = CoalescingDispatcher(interval=60)
+    calls = []
+    for event in ("started", "metric", "stopped"):
+        dispatcher.submit(calls.append, event)
+    dispatcher.shutdown(wait=True)
+    assert calls == ["started", "metric", "stopped"]
+
+
+def test_failing_callbacks_do_not_stop_the_dispatcher():
+    dispatcher = CoalescingDispatcher()
+    calls = []
+    dispatcher.submit(lambda: 1 / 0)
+    dispatcher.submit(calls.append, "next")
+    dispatcher.shutdown(wait=True)
+    assert calls == ["next"]
+    assert dispatcher.executed == 2
@@ -0,0 +1,102 @@
+import pytest
+
+from src.image_processor.metric.count_smoother import (
+    DwellSmoother,
+    MajoritySmoother,
+    MaxSmoother,
+    PassthroughSmoother,
+    SmoothingMode,
+    build_count_smoother
+)
+from src.image_processor.metric.metrics_service import DetectionMetricsService
+from src.image_processor.worker_metrics import StreamMetrics
+
+FLICKER = [3, 2, 3, 2, 3, 2, 3, 3]
+
+
+def smooth(smoother, counts):
+    # One count per second, as throttled by the callbacks
+    return [
+        smoother.update(count, now=float(t))
+        for t, count in enumerate(counts)
+    ]
+
+
+def test_passthrough_keeps_every_change():
+    smoother = PassthroughSmoother()
+    assert smooth(smoother, FLICKER) == FLICKER
+    assert smoother.stats() == {"raw_transitions": 6, "emitted_transitions": 6}
+
+
+def test_dwell_ignores_short_changes():
+    smoother = DwellSmoother(min_dwell=2)
+    assert smooth(smoother, FLICKER + [5, 5, 5]) == (
+        FLICKER[:1] * len(FLICKER) + [3, 3, 5]
+    )
+    assert smoother.stats() == {"raw_transitions": 7, "emitted_transitions": 1}
+
+
+def test_majority_of_the_window():
+    smoother = MajoritySmoother(window=3)
+    assert smooth(smoother, FLICKER + [1, 1, 1]) == [
+        3, 3, 3, 2, 3, 2, 3, 3, 3, 1, 1
+    ]
+
+
+def test_majority_ties_keep_the_saved_count():
+    smoother = MajoritySmoother(window=4)
+    assert smooth(smoother, [2, 3, 3, 2]) == [2, 2, 3, 3]
+
+
+def test_max_of_the_window():
+    smoother = MaxSmoother(window=3)
+    assert smooth(smoother, [1, 4, 1, 1, 1, 2]) == [1, 4, 4, 4, 1, 2]
+
+
+@pytest.mark.parametrize("mode, smoother_class", [
+    (SmoothingMode.NONE, PassthroughSmoother),
+    (SmoothingMode.DWELL, DwellSmoother),
+    (SmoothingMode.MAJORITY, MajoritySmoother),
+    (SmoothingMode.MAX, MaxSmoother),
+])
+def test_build_count_smoother(mode, smoother_class):
+    assert isinstance(build_count_smoother(mode), smoother_class)
+
+
+@pytest.mark.parametrize("window, min_dwell", [(0, 3), (-1, 3), (5, -1)])
+def test_invalid_smoothing_settings_are_rejected(window, min_dwell):
+    with pytest.raises(ValueError):
+        build_count_smoother(SmoothingMode.MAX, window, min_dwell)
+
+
+def test_window_keeps_the_latest_count():
+    smoother = MaxSmoother(window=0)
+    assert smooth(smoother, [1, 4, 2]) == [1, 4, 2]
+
+
+class FakeWriter:
+    def __init__(self):
+        self.started = []
+
+    def close_stale(self, device_id, end_time):
+        pass
+
+    def start_metric(self, metric):
+        self.started.append(metric.count)
+
+    def close_metric(self, metric):
+        pass
+
+
+def test_service_saves_smoothed_counts():
+    writer, stream_metrics = FakeWriter(), StreamMetrics(1)
+    smoother = DwellSmoother(min_dwell=60)
+    metrics_service = DetectionMetricsService(
+        None, None, 1, writer, smoother, stream_metrics
+    )
+    for count in FLICKER:
+        metrics_service.save_metric(count)
+
+    assert writer.started == [3]
+    assert stream_metrics.counters["count_changes"] == 6
+    assert stream_metrics.counters["count_changes_saved"] == 0
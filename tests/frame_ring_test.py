@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from src.image_processor.frame_ring import (  # noqa: E402
+    FrameRing,
+    SharedFrameGrabber,
+    own_frame
+)
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing((4, 6, 3), 3)
+    yield ring
+    ring.close()
+
+
+def write(ring, value):
+    sequence, slot = ring.acquire()
+    slot[:] = value
+    ring.commit(sequence)
+    return sequence
+
+
+def test_empty_ring(ring):
+    assert ring.latest() == (-1, None)
+
+
+def test_readers_see_the_latest_frame_without_copies(ring):
+    reader = FrameRing(ring.shape, ring.slots, ring.name)
+    try:
+        write(ring, 1)
+        sequence = write(ring, 2)
+
+        read_sequence, frame = reader.latest()
+        assert read_sequence == sequence
+        assert (frame == 2).all()
+
+        # The frame is a view of the slot
+        write(ring, 3)
+        write(ring, 4)
+        write(ring, 5)
+        assert not reader.is_current(read_sequence)
+        assert (frame == 5).all()
+    finally:
+        reader.close()
+
+
+def test_slots_are_reused_in_order(ring):
+    sequences = [write(ring, value) for value in range(5)]
+
+    assert sequences == [0, 1, 2, 3, 4]
+    assert ring.is_current(4) and ring.is_current(2)
+    assert not ring.is_current(1)
+
+
+def test_own_frame_outlives_the_slot(ring):
+    write(ring, 1)
+    sequence, frame = ring.latest()
+    copied = own_frame(ring, sequence, frame)
+    assert copied is not frame and (copied == 1).all()
+
+    for value in (2, 3, 4):
+        write(ring, value)
+    assert (frame == 4).all() and (copied == 1).all()
+    assert own_frame(ring, sequence, frame) is None
+
+
+def test_own_frame_without_ring():
+    frame = np.zeros((2, 2))
+    assert own_frame(object(), 0, frame) is frame
+
+
+def test_grabber_decodes_in_another_process(tmp_path):
+    video = str(tmp_path / "video.avi")
+    writer = cv2.VideoWriter(
+        video, cv2.VideoWriter_fourcc(*"MJPG"), 10, (32, 24))
+    for value in range(5):
+        writer.write(np.full((24, 32, 3), value * 50, np.uint8))
+    writer.release()
+
+    grabber = SharedFrameGrabber(video, slots=4, reconnect_delay=10)
+    grabber.start()
+    try:
+        deadline = time.monotonic() + 10
+        sequence, frame = grabber.latest()
+        while sequence < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+            sequence, frame = grabber.latest()
+
+        assert sequence == 4
+        assert frame.shape == (24, 32, 3)
+        assert abs(int(frame.mean()) - 200) < 10
+    finally:
+        grabber.stop()
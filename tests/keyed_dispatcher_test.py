@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from src.rabbitmq.keyed_dispatcher import KeyedDispatcher
+
+
+def test_jobs_of_a_key_run_in_order():
+    async def run():
+        dispatcher = KeyedDispatcher(max_concurrency=4)
+        events = []
+
+        async def job(name, delay):
+            events.append(("start", name))
+            await asyncio.sleep(delay)
+            events.append(("end", name))
+
+        dispatcher.submit(1, job, "START", 0.02)
+        dispatcher.submit(1, job, "STOP", 0)
+        await dispatcher.join()
+        return events
+
+    assert asyncio.run(run()) == [
+        ("start", "START"), ("end", "START"),
+        ("start", "STOP"), ("end", "STOP")
+    ]
+
+
+def test_keys_run_concurrently_up_to_the_limit():
+    async def run():
+        dispatcher = KeyedDispatcher(max_concurrency=2)
+        running, peak = 0, 0
+
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        for key in range(5):
+            dispatcher.submit(key, job)
+        await dispatcher.join()
+        return peak, dispatcher.stats()
+
+    peak, stats = asyncio.run(run())
+    assert peak == 2
+    assert all(
+        key_stats["executed"] == 1 and key_stats["depth"] == 0
+        for key_stats in stats.values()
+    )
+    # The last keys waited for a slot
+    assert stats[4]["max_wait"] > 0
+
+
+def test_failing_job_does_not_stop_the_key():
+    async def run():
+        dispatcher = KeyedDispatcher()
+        done = []
+
+        async def fail():
+            raise RuntimeError("docker unavailable")
+
+        async def succeed():
+            done.append(True)
+
+        dispatcher.submit(1, fail)
+        dispatcher.submit(1, succeed)
+        assert dispatcher.depth(1) == 2
+        await dispatcher.join()
+        return done, dispatcher.stats()[1]["executed"]
+
+    assert asyncio.run(run()) == ([True], 2)
+
+
+def test_at_least_one_job_must_run():
+    with pytest.raises(ValueError):
+        KeyedDispatcher(max_concurrency=0)
+
+
+def test_pending_jobs_are_superseded_by_a_later_job():
+    async def run():
+        superseded, ran = [], []
+
+        async def job(action, delay=0):
+            await asyncio.sleep(delay)
+            ran.append(action)
+
+        async def notify(entry):
+            superseded.append(entry.args[0])
+
+        dispatcher = KeyedDispatcher(
+            supersedes=lambda incoming, pending: (
+                pending.args[0] != "REMOVE" or incoming.args[0] == "REMOVE"
+            ),
+            on_superseded=notify
+        )
+        # The running job is not superseded, only the pending ones
+        dispatcher.submit(1, job, "START", 0.01)
+        await asyncio.sleep(0)
+        dispatcher.submit(1, job, "PAUSE")
+        dispatcher.submit(1, job, "REMOVE")
+        dispatcher.submit(1, job, "START")
+        dispatcher.submit(1, job, "STOP")
+        await dispatcher.join()
+        return ran, superseded, dispatcher.stats()[1]
+
+    ran, superseded, stats = asyncio.run(run())
+    assert ran == ["START", "REMOVE", "STOP"]
+    assert superseded == ["PAUSE", "START"]
+    assert (
+        stats["executed"], stats["superseded"], stats["depth"]
+    ) == (3, 2, 0)
+
+
+def test_lanes_do_not_wait_for_each_other():
+    async def run():
+        dispatcher = KeyedDispatcher(
+            lanes={"start": 1, "control": 1},
+            lane_of=lambda entry: (
+                "start" if entry.args[0] == "START" else "control"
+            )
+        )
+        events = []
+
+        async def job(action, device, delay=0):
+            await asyncio.sleep(delay)
+            events.append((action, device))
+
+        dispatcher.submit(1, job, "START", 1, 0.05)
+        dispatcher.submit(2, job, "START", 2, 0.05)
+        dispatcher.submit(3, job, "STOP", 3)
+        # Still after the START of its own device
+        dispatcher.submit(1, job, "STOP", 1)
+        await dispatcher.join()
+        return events, dispatcher.lane_stats()
+
+    events, lanes = asyncio.run(run())
+    assert events == [("STOP", 3), ("START", 1), ("STOP", 1), ("START", 2)]
+    assert lanes["start"]["executed"] == 2
+    assert lanes["control"]["executed"] == 2
+    assert lanes["control"]["max_wait"] < lanes["start"]["max_wait"]
+    assert lanes["start"]["avg_run"] >= 0.05
+
+
+def test_unknown_lane_is_refused():
+    async def run():
+        dispatcher = KeyedDispatcher(
+            lanes={"start": 1}, lane_of=lambda entry: "control"
+        )
+
+        async def job():
+            pass
+
+        dispatcher.submit(1, job)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
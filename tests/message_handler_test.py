@@ -0,0 +1,442 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from datetime import datetime
+
+from src.instance_manager.instance.exceptions import InstanceNotFound
+from src.instance_manager.instance.instance import Instance, InstanceStatus
+from src.instance_manager.instance.instance_service import InstanceService
+from src.instance_manager.operation.operation import Operation, OperationStatus
+from src.rabbitmq.constants import CONTROL_LANE, START_LANE
+from src.rabbitmq.keyed_dispatcher import KeyedDispatcher
+from src.rabbitmq.message_handler import MessageHandler
+from src.rabbitmq.rabbitmq_client import AsyncRabbitMQClient
+
+
+class FakeMessage:
+    def __init__(self, body, timestamp=None):
+        self.body = json.dumps(body).encode()
+        self.timestamp = timestamp
+        self.acked = False
+        self.rejected = False
+
+    async def ack(self):
+        self.acked = True
+
+    async def reject(self, requeue=False):
+        self.rejected = True
+
+
+class FakeRabbitMQClient:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, routing_key, exchange_name, message):
+        self.sent.append(message)
+
+
+class FakeInstanceService:
+    """Keeps the status of the instances it started."""
+
+    def __init__(self, instances=None):
+        self.instances = dict(instances or {})
+        self.started = []
+
+    async def start_instance(self, instance, stream_url):
+        self.started.append((instance.id, stream_url))
+        self.instances[instance.id] = "ACTIVE"
+
+    async def stop_instance(self, instance_id):
+        self.__update(instance_id, "INACTIVE")
+
+    async def pause_instance(self, instance_id):
+        self.__update(instance_id, "PAUSED")
+
+    async def remove_instance(self, instance_id):
+        self.__update(instance_id, None)
+        del self.instances[instance_id]
+
+    async def validate_instance(self, instance_id):
+        return instance_id in self.instances
+
+    def __update(self, instance_id, status):
+        if instance_id not in self.instances:
+            raise InstanceNotFound(instance_id)
+        self.instances[instance_id] = status
+
+
+def command(action, device_id=1, **body):
+    return FakeMessage({"action": action, "device_id": device_id, **body})
+
+
+def dispatch(handler, *messages):
+    """Receives the messages at once, before any of them runs."""
+    async def run():
+        dispatcher = KeyedDispatcher(
+            supersedes=handler.supersedes,
+            on_superseded=handler.on_superseded
+        )
+        for message in messages:
+            dispatcher.submit(
+                handler.message_key(message),
+                handler.process_unique_messages,
+                message
+            )
+        await dispatcher.join()
+
+    asyncio.run(run())
+    return [
+        (ack["action"], ack["code"]) for ack in handler.rabbitmq_client.sent
+    ]
+
+
+def make_handler(service, command_ttl=0):
+    return MessageHandler(
+        "ack_queue",
+        "controller_queue",
+        FakeRabbitMQClient(),
+        service,
+        command_ttl
+    )
+
+
+def test_stop_after_start_of_an_absent_instance():
+    service = FakeInstanceService()
+
+    acks = dispatch(
+        make_handler(service),
+        command("START", device_stream_url="rtsp://camera"),
+        command("STOP")
+    )
+
+    assert acks == [("START", 2000), ("STOP", 2000)]
+    assert service.instances == {1: "INACTIVE"}
+
+
+def test_pause_after_start_of_an_absent_instance():
+    service = FakeInstanceService()
+
+    acks = dispatch(
+        make_handler(service),
+        command("START", device_stream_url="rtsp://camera"),
+        command("PAUSE")
+    )
+
+    assert acks == [("START", 2000), ("PAUSE", 2000)]
+    assert service.instances == {1: "PAUSED"}
+
+
+def test_backlog_collapses_to_the_last_start():
+    service = FakeInstanceService()
+    messages = [
+        command("START", device_stream_url="rtsp://camera/1"),
+        command("PAUSE"),
+        command("START", device_stream_url="rtsp://camera/2"),
+        command("STOP")
+    ]
+
+    acks = dispatch(make_handler(service), *messages)
+
+    assert sorted(acks) == [
+        ("PAUSE", 4091), ("START", 2000), ("START", 4091), ("STOP", 2000)
+    ]
+    assert service.started == [(1, "rtsp://camera/2")]
+    assert service.instances == {1: "INACTIVE"}
+    assert all(message.acked for message in messages)
+
+
+def test_remove_supersedes_every_pending_command():
+    service = FakeInstanceService({1: "ACTIVE"})
+
+    acks = dispatch(
+        make_handler(service),
+        command("START", device_stream_url="rtsp://camera"),
+        command("REMOVE")
+    )
+
+    assert sorted(acks) == [("REMOVE", 2000), ("START", 4091)]
+    assert service.instances == {}
+
+
+def test_expired_command_is_not_run():
+    service = FakeInstanceService({1: "ACTIVE"})
+    message = command("STOP", timestamp=time.time() - 120)
+
+    acks = dispatch(make_handler(service, command_ttl=60), message)
+
+    assert acks == [("STOP", 4080)]
+    assert service.instances == {1: "ACTIVE"}
+    assert message.acked
+
+
+class FakeConnectionManager:
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield None
+
+
+class FakeInstanceDAOFactory:
+    def __init__(self, instances):
+        self.instances = instances
+
+    def create_dao(self, cursor):
+        return self
+
+    async def get_instance(self, instance_id):
+        return self.instances.get(instance_id)
+
+    async def update_instance(self, instance):
+        self.instances[instance.id] = instance
+        return 1
+
+
+class FakeStreamAssigner:
+    def __init__(self, devices):
+        self.devices = dict(devices)
+
+    async def assign(self, device_id, stream_url):
+        self.devices[device_id] = stream_url
+
+    async def release(self, device_id):
+        del self.devices[device_id]
+
+    async def retarget(self, device_id, stream_url):
+        return False
+
+    async def find_worker(self, device_id):
+        return "worker" if device_id in self.devices else None
+
+
+def test_shared_start_after_pause_with_multi_stream_workers():
+    created_at = datetime(2024, 1, 1)
+    instances = {1: Instance(1, InstanceStatus.ACTIVE, created_at, created_at)}
+    assigner = FakeStreamAssigner({1: "rtsp://camera"})
+    service = InstanceService(
+        FakeConnectionManager(),
+        FakeInstanceDAOFactory(instances),
+        None,
+        None,
+        assigner
+    )
+    handler = make_handler(service)
+
+    async def run():
+        # Released from its worker once paused, still owned by the manager
+        await handler.process_shared_messages(command("PAUSE"))
+        assert assigner.devices == {}
+        await handler.process_shared_messages(
+            command("START", device_stream_url="rtsp://camera"))
+
+    asyncio.run(run())
+    acks = [(ack["action"], ack["code"])
+            for ack in handler.rabbitmq_client.sent]
+    assert acks == [("PAUSE", 2000), ("START", 2000)]
+    assert instances[1].status == InstanceStatus.ACTIVE
+    assert assigner.devices == {1: "rtsp://camera"}
+
+
+class FakeOperationService:
+    def __init__(self):
+        self.operations = {}
+
+    async def accept(self, message):
+        now = datetime.utcnow()
+        operation = Operation(
+            len(self.operations) + 1,
+            message.device_id,
+            message.action.name,
+            message.device_stream_url,
+            OperationStatus.ACCEPTED,
+            now,
+            now
+        )
+        self.operations[operation.id] = operation
+        return operation
+
+    async def finish(self, operation, status, message=None):
+        self.operations[operation.id] = replace(
+            operation, status=status, message=message)
+        return True
+
+
+class BootingInstanceService(FakeInstanceService):
+    """Its instances only start once booted is set."""
+
+    def __init__(self, instances=None):
+        super().__init__(instances)
+        self.booted = asyncio.Event()
+
+    async def start_instance(self, instance, stream_url):
+        await self.booted.wait()
+        await super().start_instance(instance, stream_url)
+
+
+class FakeQueue:
+    """
+        Delivers its messages while fewer than the prefetch count are not
+        acknowledged, like the broker.
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.prefetch_count = None
+
+    @asynccontextmanager
+    async def iterator(self):
+        yield self.__deliver()
+
+    def __unacked(self, delivered):
+        return sum(not m.acked for m in self.messages[:delivered])
+
+    async def __deliver(self):
+        for delivered, message in enumerate(self.messages):
+            while self.__unacked(delivered) >= self.prefetch_count:
+                await asyncio.sleep(0.01)
+            yield message
+
+
+class FakeChannelPool:
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def set_qos(self, prefetch_count):
+        self.queue.prefetch_count = prefetch_count
+
+    async def get_queue(self, name, ensure=True):
+        return self.queue
+
+
+class FakeRabbitMQManager:
+    def __init__(self, queue):
+        self.connection_pool = self.channel_pool = FakeChannelPool(queue)
+        self.event_loop = asyncio.get_running_loop()
+
+
+def test_stop_is_delivered_while_prefetch_many_starts_wait():
+    prefetch_count = 2
+    service = BootingInstanceService({9: "ACTIVE"})
+    handler = MessageHandler(
+        "ack_queue", "controller_queue", FakeRabbitMQClient(), service,
+        operation_service=FakeOperationService()
+    )
+    starts = [
+        command("START", device_id, device_stream_url="rtsp://camera")
+        for device_id in range(prefetch_count + 2)
+    ]
+    stop = command("STOP", 9)
+
+    async def stopped():
+        while not stop.acked:
+            await asyncio.sleep(0.01)
+
+    async def run():
+        dispatcher = KeyedDispatcher(
+            lanes={START_LANE: 1, CONTROL_LANE: 1}, lane_of=handler.lane
+        )
+        client = AsyncRabbitMQClient(
+            FakeRabbitMQManager(FakeQueue(starts + [stop])),
+            dispatcher,
+            prefetch_count
+        )
+        await asyncio.wait_for(
+            client.start_consumer(
+                "controller_queue",
+                handler.process_unique_messages,
+                handler.message_key,
+                handler.accept_unique_start
+            ),
+            1
+        )
+        # The STARTs still wait for the first container to boot
+        await asyncio.wait_for(stopped(), 1)
+        assert service.started == []
+        service.booted.set()
+        await dispatcher.join()
+
+    asyncio.run(run())
+    acks = [
+        (ack["device_id"], ack["action"], ack["code"])
+        for ack in handler.rabbitmq_client.sent
+    ]
+    assert acks[:len(starts)] == [
+        (device_id, "START", 2020) for device_id in range(len(starts))
+    ]
+    assert (9, "STOP", 2000) in acks
+    assert acks.index((9, "STOP", 2000)) < acks.index((0, "START", 2000))
+    assert service.instances[9] == "INACTIVE"
+    assert sorted(device_id for device_id, _ in service.started) == list(
+        range(len(starts)))
+    assert all(message.acked for message in starts)
+
+
+class SlowOperationService(FakeOperationService):
+    """Stores the operations once stored is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.stored = asyncio.Event()
+
+    async def accept(self, message):
+        await self.stored.wait()
+        return await super().accept(message)
+
+
+def test_stop_is_not_delayed_by_a_slow_start_delivery():
+    service = FakeInstanceService({9: "ACTIVE"})
+    operation_service = SlowOperationService()
+    handler = MessageHandler(
+        "ack_queue", "controller_queue", FakeRabbitMQClient(), service,
+        operation_service=operation_service
+    )
+    start = command("START", 1, device_stream_url="rtsp://camera")
+    stop = command("STOP", 9)
+
+    async def stopped():
+        while not stop.acked:
+            await asyncio.sleep(0.01)
+
+    async def run():
+        dispatcher = KeyedDispatcher(
+            lanes={START_LANE: 1, CONTROL_LANE: 1},
+            lane_of=handler.lane
+        )
+        client = AsyncRabbitMQClient(
+            FakeRabbitMQManager(FakeQueue([start, stop])), dispatcher, 10)
+        consumer = asyncio.get_running_loop().create_task(
+            client.start_consumer(
+                "controller_queue",
+                handler.process_unique_messages,
+                handler.message_key,
+                handler.accept_unique_start
+            )
+        )
+        # The START is still being stored
+        await asyncio.wait_for(stopped(), 1)
+        assert not start.acked
+        assert service.instances[9] == "INACTIVE"
+
+        operation_service.stored.set()
+        await asyncio.wait_for(consumer, 1)
+        await dispatcher.join()
+
+    asyncio.run(run())
+    acks = [(ack["device_id"], ack["action"], ack["code"])
+            for ack in handler.rabbitmq_client.sent]
+    assert acks == [(9, "STOP", 2000), (1, "START", 2020), (1, "START", 2000)]
+    assert start.acked
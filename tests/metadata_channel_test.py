@@ -0,0 +1,64 @@
+import socket
+
+import pytest
+
+from src.image_processor.metadata_channel import (
+    UdpMetadataPublisher,
+    build_metadata,
+    decode_metadata,
+    encode_metadata
+)
+
+
+def test_build_metadata():
+    metadata = build_metadata(
+        7,
+        42,
+        1700000000000,
+        (720, 1280, 3),
+        [[10.0, 20.0, 110.0, 220.0, 0.8766, 0.0],
+         [300.4, 40.6, 350.0, 90.0, 0.5, 2.0]],
+        {0: "person", 1: "bicycle", 2: "car"}
+    )
+
+    assert metadata == {
+        "d": 7,
+        "s": 42,
+        "t": 1700000000000,
+        "w": 1280,
+        "h": 720,
+        "b": [[10, 20, 110, 220, 0, 877], [300, 40, 350, 90, 2, 500]],
+        "n": {"0": "person", "2": "car"}
+    }
+
+
+def test_encode_is_compact_and_decodes():
+    metadata = build_metadata(1, 0, 0, (480, 640, 3), [], {0: "person"})
+    data = encode_metadata(metadata)
+
+    assert b" " not in data
+    assert decode_metadata(data) == metadata
+
+
+@pytest.fixture
+def receiver():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(5)
+    yield receiver
+    receiver.close()
+
+
+def test_udp_publisher_sends_datagrams(receiver):
+    publisher = UdpMetadataPublisher(*receiver.getsockname())
+    metadata = build_metadata(
+        3, 1, 5, (480, 640, 3), [[1, 2, 3, 4, 0.9, 0]], {0: "person"})
+    try:
+        publisher.publish(metadata)
+        data, _ = receiver.recvfrom(65536)
+    finally:
+        publisher.close()
+
+    assert decode_metadata(data) == metadata
+    assert publisher.sent == 1
+    assert publisher.failed == 0
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+from src.database.migrator import load_migrations
+from src.image_processor.metric.detection_metric import DetectionMetric
+from src.image_processor.metric.metric_dao import MetricDAO
+
+
+class FakeCopy:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+
+class FakeCursor:
+    def __init__(self):
+        self.queries = []
+        self.copied = []
+
+    def execute(self, query, params=None):
+        self.queries.append(" ".join(query.split()))
+
+    @contextmanager
+    def copy(self, query):
+        self.queries.append(" ".join(query.split()))
+        yield FakeCopy(self.copied)
+
+
+def test_started_metrics_are_upserted():
+    cursor = FakeCursor()
+    start_time = datetime(2024, 1, 1)
+
+    MetricDAO(cursor).start_metrics([DetectionMetric(1, start_time, None, 3)])
+
+    assert cursor.copied == [(1, start_time, None, 3)]
+    assert cursor.queries[1].startswith("COPY metric_staging")
+    assert cursor.queries[2].endswith(
+        "ON CONFLICT (deviceid, start_time) "
+        "DO UPDATE SET end_time = EXCLUDED.end_time;"
+    )
+
+
+def test_no_metric_is_not_copied():
+    cursor = FakeCursor()
+
+    MetricDAO(cursor).start_metrics([])
+
+    assert cursor.queries == []
+
+
+def test_intervals_are_unique_by_device_and_start():
+    migration = load_migrations()[3]
+    assert migration.version == 4
+    assert (
+        "CREATE UNIQUE INDEX IF NOT EXISTS metric_device_start_key"
+        in migration.sql
+    )
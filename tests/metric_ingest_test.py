@@ -0,0 +1,272 @@
+import asyncio
+import json
+
+from src.image_processor.event_publisher import (
+    BrokerMetricSink,
+    BrokerProcessedStreamService,
+    PROCESSED_STREAM_EVENT
+)
+from src.image_processor.metric.metric_writer import MetricWriter
+from src.image_processor.metric.metrics_service import DetectionMetricsService
+from src.rabbitmq.metric_ingest import MetricIngestConsumer
+from tests.metric_writer_test import (
+    FakeConnectionPool,
+    FakeMetricDAOFactory,
+    counts
+)
+
+
+class FakePublisher:
+    """Keeps the published events, failing them while fail is set."""
+
+    def __init__(self):
+        self.events = []
+        self.fail = False
+
+    def publish(self, routing_key, event):
+        if self.fail:
+            raise ConnectionError("broker unavailable")
+        # Sent as JSON
+        self.events.append(json.loads(json.dumps(event)))
+
+
+class FakeProcessedStreamDAO:
+    def __init__(self, urls):
+        self.urls = urls
+
+    def update_processed_stream(self, processed_stream):
+        self.urls[processed_stream.device_id] = processed_stream.stream_url
+
+
+class FakeProcessedStreamDAOFactory:
+    def __init__(self):
+        self.urls = {}
+
+    def create_dao(self, cursor):
+        return FakeProcessedStreamDAO(self.urls)
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((routing_key, json.loads(message.body)))
+
+
+class FakeMessage:
+    def __init__(self, body):
+        self.body = json.dumps(body).encode()
+        self.acked = False
+        self.rejected = False
+
+    async def ack(self, multiple=False):
+        self.acked = True
+
+    async def reject(self, requeue=False):
+        self.rejected = True
+
+
+def consumer(
+        pool,
+        metric_dao_factory,
+        processed_dao_factory=None,
+        batch_size=1000
+):
+    ingest = MetricIngestConsumer(
+        None,
+        pool,
+        "metrics_exchange",
+        "metrics_ingest",
+        batch_size,
+        metric_dao_factory=metric_dao_factory,
+        processed_stream_dao_factory=(
+            processed_dao_factory or FakeProcessedStreamDAOFactory()
+        )
+    )
+    ingest._dead_letters = FakeExchange()
+    return ingest
+
+
+def publish_counts(publisher, counts_by_device):
+    writer = MetricWriter(None, None, sink=BrokerMetricSink(publisher))
+    for device_id, device_counts in counts_by_device.items():
+        metrics_service = DetectionMetricsService(
+            None, None, device_id, writer)
+        for count in device_counts:
+            metrics_service.save_metric(count)
+        writer.flush()
+    return writer
+
+
+def test_published_metrics_are_written_as_the_database_writer_would():
+    publisher = FakePublisher()
+    publish_counts(publisher, {1: [1, 2], 2: [5]})
+    publish_counts(publisher, {1: [3]})
+
+    pool, dao_factory = FakeConnectionPool(), FakeMetricDAOFactory()
+    consumer(pool, dao_factory).write(publisher.events)
+
+    # The second worker of device 1 closed the interval the first left open
+    assert counts(dao_factory) == [
+        (1, 1, False), (1, 2, False), (2, 5, True), (1, 3, True)
+    ]
+    assert pool.transactions == 1
+
+
+def test_failed_publish_is_retried_by_the_writer():
+    publisher = FakePublisher()
+    publisher.fail = True
+    writer = publish_counts(publisher, {1: [1, 2]})
+    assert writer.pending() == 2
+
+    publisher.fail = False
+    assert writer.flush()
+    assert writer.pending() == 0
+    assert len(publisher.events) == 1
+
+
+def test_latest_processed_stream_is_written():
+    publisher = FakePublisher()
+    BrokerProcessedStreamService(publisher, 1).save_processed_stream(
+        "rtsp://host/1/detected")
+    BrokerProcessedStreamService(publisher, 1).save_processed_stream(None)
+    BrokerProcessedStreamService(publisher, 2).save_processed_stream(
+        "rtsp://host/2/detected")
+    assert publisher.events[0]["type"] == PROCESSED_STREAM_EVENT
+
+    processed_dao_factory = FakeProcessedStreamDAOFactory()
+    ingest = consumer(
+        FakeConnectionPool(), FakeMetricDAOFactory(), processed_dao_factory)
+    ingest.write(publisher.events)
+
+    assert processed_dao_factory.urls == {1: None, 2: "rtsp://host/2/detected"}
+
+
+def test_events_are_acked_once_written():
+    async def run():
+        publisher = FakePublisher()
+        publish_counts(publisher, {1: [1, 2]})
+        pool, dao_factory = FakeConnectionPool(), FakeMetricDAOFactory()
+        ingest = consumer(pool, dao_factory, batch_size=2)
+        messages = [FakeMessage(event) for event in publisher.events]
+        messages.append(FakeMessage("invalid"))
+        for message in messages:
+            await ingest.on_message(message)
+        assert ingest._full.is_set()
+
+        pool.fail = True
+        assert not await ingest.flush()
+        assert not messages[-1].acked
+        assert dao_factory.rows == {}
+
+        pool.fail = False
+        assert await ingest.flush()
+        assert messages[-1].acked
+        assert ingest.written == 2
+        assert counts(dao_factory) == [(1, 1, False), (1, 2, True)]
+
+    asyncio.run(run())
+
+
+class RefusingProcessedStreamDAOFactory(FakeProcessedStreamDAOFactory):
+    """Refuses the processed streams of deleted devices."""
+
+    def __init__(self, deleted):
+        super().__init__()
+        self.deleted = deleted
+
+    def create_dao(self, cursor):
+        dao = super().create_dao(cursor)
+        update = dao.update_processed_stream
+
+        def update_processed_stream(processed_stream):
+            if processed_stream.device_id in self.deleted:
+                raise ValueError(
+                    f"device {processed_stream.device_id} does not exist")
+            update(processed_stream)
+
+        dao.update_processed_stream = update_processed_stream
+        return dao
+
+
+def test_bad_event_is_dead_lettered_after_repeated_failures():
+    async def run():
+        publisher = FakePublisher()
+        publish_counts(publisher, {1: [1, 2]})
+        BrokerProcessedStreamService(publisher, 99).save_processed_stream(
+            "rtsp://host/99/detected")
+        BrokerProcessedStreamService(publisher, 2).save_processed_stream(
+            "rtsp://host/2/detected")
+        processed_dao_factory = RefusingProcessedStreamDAOFactory({99})
+        dao_factory = FakeMetricDAOFactory()
+        ingest = consumer(
+            FakeConnectionPool(), dao_factory, processed_dao_factory)
+        ingest.max_batch_failures = 2
+        messages = [FakeMessage(event) for event in publisher.events]
+        for message in messages:
+            await ingest.on_message(message)
+
+        assert not await ingest.flush()
+        assert not any(
+            message.acked or message.rejected for message in messages)
+
+        assert await ingest.flush()
+        assert all(message.acked for message in messages)
+        assert ingest._dead_letters.published == [
+            ("metrics_ingest.dead", publisher.events[1])
+        ]
+        assert (ingest.written, ingest.dead_lettered) == (2, 1)
+        assert counts(dao_factory) == [(1, 1, False), (1, 2, True)]
+        assert processed_dao_factory.urls == {2: "rtsp://host/2/detected"}
+        assert ingest._pending == []
+
+    asyncio.run(run())
+
+
+def test_batch_is_kept_when_every_event_fails():
+    async def run():
+        publisher = FakePublisher()
+        publish_counts(publisher, {1: [1, 2]})
+        pool = FakeConnectionPool()
+        ingest = consumer(pool, FakeMetricDAOFactory())
+        ingest.max_batch_failures = 1
+        messages = [FakeMessage(event) for event in publisher.events]
+        for message in messages:
+            await ingest.on_message(message)
+
+        pool.fail = True
+        assert not await ingest.flush()
+        assert not any(
+            message.acked or message.rejected for message in messages)
+        assert len(ingest._pending) == len(messages)
+
+    asyncio.run(run())
+
+
+def test_lone_bad_event_is_dead_lettered_once_failing_for_long():
+    async def run():
+        publisher = FakePublisher()
+        BrokerProcessedStreamService(publisher, 99).save_processed_stream(
+            "rtsp://host/99/detected")
+        ingest = consumer(
+            FakeConnectionPool(),
+            FakeMetricDAOFactory(),
+            RefusingProcessedStreamDAOFactory({99})
+        )
+        ingest.max_batch_failures = 100
+        ingest.max_failure_seconds = 0.05
+        message = FakeMessage(publisher.events[0])
+        await ingest.on_message(message)
+
+        assert not await ingest.flush()
+        await asyncio.sleep(0.05)
+        # The database still answers, the event is the problem
+        assert await ingest.flush()
+        assert message.acked
+        assert ingest._dead_letters.published == [
+            ("metrics_ingest.dead", publisher.events[0])
+        ]
+        assert ingest._pending == []
+
+    asyncio.run(run())
@@ -0,0 +1,157 @@
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import psycopg
+import pytest
+
+from src.config import DATABASE_SECTION, get_environment_type, parse_config
+from src.database.metric_rollups import MetricRollupJob
+from src.database.migrator import apply_migrations, load_migrations
+
+
+class FakeAsyncPool:
+    """Answers the rollup functions, caught up after the given steps."""
+
+    def __init__(self, steps=1):
+        self.steps = steps
+        self.calls = []
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield self
+
+    async def execute(self, query, params=None):
+        self.calls.append((query.split("(")[0].split()[-1], params))
+
+    async def fetchone(self):
+        name = self.calls[-1][0]
+        if name == "metric_rollup_advance":
+            self.steps -= 1
+            return (self.steps <= 0,)
+        return (0,)
+
+
+def test_rollups_catch_up_step_by_step():
+    pool = FakeAsyncPool(steps=3)
+    job = MetricRollupJob(pool, lag=60, max_step_hours=1)
+
+    asyncio.run(job.run_once())
+
+    assert [name for name, _ in pool.calls] == (
+        ["metric_rollup_advance"] * 3 + ["metric_rollup_expire"]
+    )
+    assert pool.calls[0][1] == (timedelta(seconds=60), timedelta(hours=1))
+
+
+def test_zero_retention_keeps_the_buckets():
+    pool = FakeAsyncPool()
+    job = MetricRollupJob(
+        pool,
+        minute_retention_days=7,
+        hour_retention_days=0,
+        day_retention_days=0
+    )
+
+    asyncio.run(job.expire())
+
+    assert pool.calls == [
+        ("metric_rollup_expire", (timedelta(days=7), None, None))
+    ]
+
+
+def test_rollups_migration_follows_the_partitions():
+    versions = [migration.version for migration in load_migrations()]
+    assert versions[:2] == [1, 2]
+
+
+@pytest.fixture
+def database():
+    """A schema of the configured database with the migrations applied."""
+    try:
+        url = parse_config(get_environment_type())[DATABASE_SECTION]["URL"]
+    except (EnvironmentError, KeyError):
+        pytest.skip("No database configured")
+    schema = f"metric_rollups_test_{uuid.uuid4().hex}"
+    with psycopg.connect(url, autocommit=True) as connection:
+        connection.execute(f"CREATE SCHEMA {schema}")
+        connection.execute(f"SET search_path TO {schema}")
+        try:
+            apply_migrations(connection)
+            yield connection
+        finally:
+            connection.execute(f"DROP SCHEMA {schema} CASCADE")
+
+
+def insert(connection, start_time, minutes, count=1):
+    connection.execute(
+        "INSERT INTO metric (deviceid, start_time, end_time, peoplecount)"
+        " VALUES (1, %s, %s, %s)",
+        (start_time, start_time + timedelta(minutes=minutes), count)
+    )
+
+
+def advance(connection):
+    connection.execute(
+        "SELECT metric_rollup_advance(interval '0', interval '1 day')"
+    )
+
+
+def covered_minutes(connection, unit):
+    row = connection.execute(
+        f"SELECT sum(covered_seconds) FROM metric_rollup_{unit}"
+    ).fetchone()
+    return row[0] / 60
+
+
+def test_interval_written_behind_the_watermark_is_rolled_up(database):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    insert(database, now - timedelta(minutes=20), 10)
+    advance(database)
+
+    # Replayed by a spool, it ended before the watermark
+    insert(database, now - timedelta(minutes=40), 10, count=4)
+    advance(database)
+
+    assert covered_minutes(database, "minute") == 20
+    assert covered_minutes(database, "hour") == 20
+    assert covered_minutes(database, "day") == 20
+
+
+def test_late_interval_keeps_its_partition_until_rolled_up(database):
+    day = (datetime.utcnow() - timedelta(days=3)).replace(
+        hour=12, minute=0, second=0, microsecond=0)
+    database.execute("SELECT metric_create_partition(%s)", (day.date(),))
+    insert(database, datetime.utcnow() - timedelta(minutes=20), 10)
+    advance(database)
+
+    insert(database, day, 10)
+    dropped = database.execute(
+        "SELECT metric_drop_partitions(interval '1 day')").fetchone()[0]
+    assert dropped == 0
+
+    advance(database)
+    dropped = database.execute(
+        "SELECT metric_drop_partitions(interval '1 day')").fetchone()[0]
+    assert dropped == 1
+    assert covered_minutes(database, "minute") == 20
+
+
+def test_closed_interval_is_not_reopened(database):
+    start_time = datetime.utcnow().replace(second=0, microsecond=0)
+    insert(database, start_time - timedelta(minutes=20), 10)
+    # A start written again by a crashed writer
+    database.execute(
+        "INSERT INTO metric (deviceid, start_time, end_time, peoplecount)"
+        " VALUES (1, %s, NULL, 1) ON CONFLICT (deviceid, start_time)"
+        " DO UPDATE SET end_time = EXCLUDED.end_time",
+        (start_time - timedelta(minutes=20),)
+    )
+    advance(database)
+
+    assert covered_minutes(database, "minute") == 10
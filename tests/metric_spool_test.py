@@ -0,0 +1,159 @@
+import os
+
+import pytest
+
+from src.image_processor.metric.metric_spool import (
+    MetricSpool,
+    SpooledMetricWriter,
+    compact_events
+)
+from src.image_processor.metric.metrics_service import (
+    DetectionMetricsService
+)
+from tests.metric_writer_test import (
+    FakeConnectionPool,
+    FakeMetricDAOFactory,
+    counts
+)
+
+
+@pytest.fixture
+def pool():
+    return FakeConnectionPool()
+
+
+@pytest.fixture
+def dao_factory():
+    return FakeMetricDAOFactory()
+
+
+def writer(pool, dao_factory, directory, **kwargs):
+    return SpooledMetricWriter(
+        pool, dao_factory, MetricSpool(str(directory), **kwargs)
+    )
+
+
+def save(metrics_writer, counts_by_device):
+    for device_id, device_counts in counts_by_device.items():
+        metrics_service = DetectionMetricsService(
+            None, None, device_id, metrics_writer
+        )
+        for count in device_counts:
+            metrics_service.save_metric(count)
+
+
+def test_spooled_metrics_are_written_in_order(pool, dao_factory, tmp_path):
+    metrics_writer = writer(pool, dao_factory, tmp_path)
+    save(metrics_writer, {1: [1, 2], 2: [5]})
+
+    assert metrics_writer.flush()
+    assert counts(dao_factory) == [(1, 1, False), (1, 2, True), (2, 5, True)]
+    assert metrics_writer.pending() == 0
+
+
+def test_outages_keep_the_metrics_on_disk(pool, dao_factory, tmp_path):
+    metrics_writer = writer(pool, dao_factory, tmp_path)
+    pool.fail = True
+    save(metrics_writer, {1: [1, 2, 3]})
+    assert not metrics_writer.flush()
+    assert metrics_writer.pending() > 0
+
+    pool.fail = False
+    assert metrics_writer.flush()
+    assert counts(dao_factory) == [(1, 1, False), (1, 2, False), (1, 3, True)]
+
+
+def test_metrics_left_by_a_crashed_worker_are_written(
+        pool, dao_factory, tmp_path
+):
+    save(writer(pool, dao_factory, tmp_path), {1: [4]})
+
+    metrics_writer = writer(pool, dao_factory, tmp_path)
+    save(metrics_writer, {1: [6]})
+    assert metrics_writer.flush()
+    assert counts(dao_factory) == [(1, 4, False), (1, 6, True)]
+
+
+def test_batches_are_limited(pool, dao_factory, tmp_path):
+    metrics_writer = SpooledMetricWriter(
+        pool, dao_factory, MetricSpool(str(tmp_path)), max_pending=2
+    )
+    save(metrics_writer, {1: [1, 2, 3]})
+
+    assert metrics_writer.flush()
+    # stale, then a start and a close per change
+    assert pool.transactions == 3
+    assert counts(dao_factory) == [(1, 1, False), (1, 2, False), (1, 3, True)]
+
+
+def test_segments_roll_and_are_deleted(pool, dao_factory, tmp_path):
+    metrics_writer = writer(pool, dao_factory, tmp_path, segment_bytes=100)
+    save(metrics_writer, {1: list(range(10))})
+    assert len(os.listdir(tmp_path / "1")) > 2
+
+    metrics_writer.flush()
+    segments = [
+        name for name in os.listdir(tmp_path / "1") if name.endswith(".seg")
+    ]
+    assert len(segments) == 1
+    assert len(counts(dao_factory)) == 10
+
+
+def test_oversized_spools_are_compacted(pool, dao_factory, tmp_path):
+    metrics_writer = writer(pool, dao_factory, tmp_path, max_bytes=700)
+    pool.fail = True
+    save(metrics_writer, {1: list(range(10))})
+    metrics_writer.flush()
+
+    # Closed intervals are kept as single events, the oldest dropped to fit
+    assert metrics_writer.spool.size(1) <= 700
+    assert metrics_writer.spool.dropped > 0
+    pool.fail = False
+    metrics_writer.flush()
+    assert counts(dao_factory)[0][1] > 0
+    assert counts(dao_factory)[-1] == (1, 9, True)
+
+
+def test_compaction_merges_closed_intervals():
+    events = [
+        {"e": "stale", "d": 1, "s": None, "t": "2024-01-01T00:00:00", "c": 0},
+        {"e": "start", "d": 1, "s": "2024-01-01T00:00:00", "t": None, "c": 2},
+        {
+            "e": "close", "d": 1, "s": "2024-01-01T00:00:00",
+            "t": "2024-01-01T00:00:05", "c": 2
+        },
+        {"e": "start", "d": 1, "s": "2024-01-01T00:00:05", "t": None, "c": 3},
+    ]
+    compacted, dropped = compact_events(events)
+    assert [event["e"] for event in compacted] == ["stale", "start", "start"]
+    assert compacted[1]["t"] == "2024-01-01T00:00:05"
+    assert dropped == 0
+
+    compacted, dropped = compact_events(events, max_bytes=150)
+    # The closed interval goes first, the stale intervals are always closed
+    assert [(event["e"], event["c"]) for event in compacted] == [
+        ("stale", 0), ("start", 3)
+    ]
+    assert dropped == 1
+
+
+def test_batch_written_again_after_a_crash_is_not_duplicated(
+        pool, dao_factory, tmp_path
+):
+    crashed_writer = writer(pool, dao_factory, tmp_path)
+    save(crashed_writer, {1: [4, 6]})
+
+    def crash(positions):
+        raise RuntimeError("worker killed")
+
+    # Written to the database, not consumed from the spool
+    crashed_writer.spool.commit = crash
+    with pytest.raises(RuntimeError):
+        crashed_writer.flush()
+    assert counts(dao_factory) == [(1, 4, False), (1, 6, True)]
+
+    metrics_writer = writer(pool, dao_factory, tmp_path)
+    save(metrics_writer, {1: [7]})
+    assert metrics_writer.flush()
+    assert counts(dao_factory) == [(1, 4, False), (1, 6, False), (1, 7, True)]
+    assert metrics_writer.pending() == 0
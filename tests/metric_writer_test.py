@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+
+import psycopg
+import pytest
+
+from src.image_processor.metric.metric_writer import MetricWriter
+from src.image_processor.metric.metrics_service import DetectionMetricsService
+from src.image_processor.pipeline import DropPolicy
+
+
+class FakeConnectionPool:
+    """Counts the transactions, failing them while fail is set."""
+
+    def __init__(self):
+        self.transactions = 0
+        self.fail = False
+
+    @contextmanager
+    def connection(self):
+        if self.fail:
+            raise psycopg.OperationalError("database unavailable")
+        self.transactions += 1
+        yield self
+
+    def execute(self, query):
+        pass
+
+    @contextmanager
+    def cursor(self):
+        yield None
+
+
+class FakeMetricDAO:
+    """Keeps the METRIC rows in memory."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def start_metrics(self, metrics):
+        for metric in metrics:
+            self.rows[(metric.deviceid, metric.start_time)] = [
+                metric.count, metric.end_time
+            ]
+
+    def close_metrics(self, metrics):
+        for metric in metrics:
+            if (metric.deviceid, metric.start_time) in self.rows:
+                row = self.rows[(metric.deviceid, metric.start_time)]
+                row[1] = metric.end_time
+
+    def close_unfinished_metrics(self, device_id, end_time):
+        for (deviceid, _), row in self.rows.items():
+            if deviceid == device_id and row[1] is None:
+                row[1] = end_time
+
+
+class FakeMetricDAOFactory:
+    def __init__(self):
+        self.rows = {}
+
+    def create_dao(self, cursor):
+        return FakeMetricDAO(self.rows)
+
+
+@pytest.fixture
+def pool():
+    return FakeConnectionPool()
+
+
+@pytest.fixture
+def dao_factory():
+    return FakeMetricDAOFactory()
+
+
+def service(pool, dao_factory, writer, device_id=1):
+    return DetectionMetricsService(pool, dao_factory, device_id, writer)
+
+
+def counts(dao_factory):
+    return [
+        (key[0], count, end_time is None)
+        for key, (count, end_time) in dao_factory.rows.items()
+    ]
+
+
+def test_only_count_changes_are_written(pool, dao_factory):
+    writer = MetricWriter(pool, dao_factory)
+    metrics_service = service(pool, dao_factory, writer)
+    for count in (2, 2, 2, 3, 3):
+        metrics_service.save_metric(count)
+
+    assert pool.transactions == 0
+    assert writer.flush()
+    assert pool.transactions == 1
+    # The first interval was closed before being written
+    assert counts(dao_factory) == [(1, 2, False), (1, 3, True)]
+
+
+def test_intervals_written_earlier_are_closed(pool, dao_factory):
+    writer = MetricWriter(pool, dao_factory)
+    first = service(pool, dao_factory, writer, 1)
+    second = service(pool, dao_factory, writer, 2)
+    first.save_metric(1)
+    second.save_metric(5)
+    writer.flush()
+    first.save_metric(0)
+    writer.flush()
+
+    assert pool.transactions == 2
+    assert counts(dao_factory) == [(1, 1, False), (2, 5, True), (1, 0, True)]
+
+
+def test_intervals_left_open_are_closed(pool, dao_factory):
+    writer = MetricWriter(pool, dao_factory)
+    service(pool, dao_factory, writer).save_metric(4)
+    writer.flush()
+
+    # A new worker of the same device
+    service(pool, dao_factory, writer).save_metric(4)
+    writer.flush()
+    assert counts(dao_factory) == [(1, 4, False), (1, 4, True)]
+
+
+def test_failed_flushes_are_retried(pool, dao_factory):
+    writer = MetricWriter(pool, dao_factory)
+    metrics_service = service(pool, dao_factory, writer)
+    metrics_service.save_metric(1)
+    pool.fail = True
+    assert not writer.flush()
+    metrics_service.save_metric(2)
+    assert writer.pending() == 2
+
+    pool.fail = False
+    assert writer.flush()
+    assert counts(dao_factory) == [(1, 1, False), (1, 2, True)]
+    assert writer.pending() == 0
+
+
+@pytest.mark.parametrize("policy, kept", [
+    (DropPolicy.KEEP_LATEST, [(2, 0, True), (3, 0, True)]),
+    (DropPolicy.DROP_INCOMING, [(1, 0, True), (2, 0, True)]),
+])
+def test_overflow_policy(pool, dao_factory, policy, kept):
+    writer = MetricWriter(pool, dao_factory, max_pending=2, drop_policy=policy)
+    for device_id in (1, 2, 3):
+        service(pool, dao_factory, writer, device_id).save_metric(0)
+
+    assert writer.dropped == 1
+    writer.flush()
+    assert counts(dao_factory) == kept
+
+
+def test_saving_never_blocks():
+    with pytest.raises(ValueError):
+        MetricWriter(
+            FakeConnectionPool(),
+            FakeMetricDAOFactory(),
+            drop_policy=DropPolicy.BLOCK
+        )
+
+
+def test_stop_writes_pending_metrics(pool, dao_factory):
+    writer = MetricWriter(pool, dao_factory, flush_interval=60)
+    writer.start()
+    service(pool, dao_factory, writer).save_metric(7)
+    writer.stop()
+    assert counts(dao_factory) == [(1, 7, True)]
@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+
+import pytest
+
+from src.database.migrator import Migration, apply_migrations, load_migrations
+
+
+class FakeCursor:
+    """Records the statements, answering the applied versions."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        self.connection.statements.append((query.strip(), params))
+        if query.startswith("INSERT INTO schema_migrations"):
+            self.connection.applied.add(params[0])
+
+    def fetchall(self):
+        return [(version,) for version in sorted(self.connection.applied)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, applied=()):
+        self.applied = set(applied)
+        self.statements = []
+        self.transactions = 0
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    @contextmanager
+    def transaction(self):
+        self.transactions += 1
+        yield
+
+
+def write(directory, file_name, sql="SELECT 1;"):
+    (directory / file_name).write_text(sql)
+
+
+def test_migrations_are_loaded_by_version(tmp_path):
+    write(tmp_path, "0010_second.sql")
+    write(tmp_path, "0002_first.sql")
+    write(tmp_path, "README.md")
+
+    migrations = load_migrations(str(tmp_path))
+    assert [(m.version, m.name) for m in migrations] == [
+        (2, "first"), (10, "second")
+    ]
+
+
+def test_duplicated_version_is_refused(tmp_path):
+    write(tmp_path, "0001_first.sql")
+    write(tmp_path, "1_other.sql")
+
+    with pytest.raises(ValueError):
+        load_migrations(str(tmp_path))
+
+
+def test_project_migrations_load():
+    migrations = load_migrations()
+    assert migrations[0].version == 1
+    assert "PARTITION BY RANGE (start_time)" in migrations[0].sql
+
+
+def test_only_pending_migrations_are_applied():
+    connection = FakeConnection(applied={1})
+    migrations = [
+        Migration(1, "first", "CREATE TABLE a ();"),
+        Migration(2, "second", "CREATE TABLE b ();")
+    ]
+
+    applied = apply_migrations(connection, migrations)
+
+    assert [migration.version for migration in applied] == [2]
+    assert connection.applied == {1, 2}
+    assert connection.transactions == 1
+    queries = [query for query, _ in connection.statements]
+    assert "CREATE TABLE a ();" not in queries
+    assert "CREATE TABLE b ();" in queries
+    # The lock is released
+    assert queries[-1].startswith("SELECT pg_advisory_unlock")
+
+    assert apply_migrations(connection, migrations) == []
@@ -0,0 +1,118 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src.docker_manager.exceptions import ModelExportError
+from src.docker_manager.model_cache import (
+    MANIFEST_FILE,
+    ModelBackend,
+    ModelCache,
+    is_compatible_version
+)
+
+
+@pytest.fixture
+def model_cache(tmp_path):
+    weights = tmp_path / "yolov5s.pt"
+    weights.write_bytes(b"weights")
+    return ModelCache(str(tmp_path / "cache"), str(weights), "image", "v7.0")
+
+
+def add_entry(
+        model_cache,
+        backend,
+        imgsz,
+        yolov5_version,
+        weights_sha256=None,
+        comparison=None
+):
+    prefix = model_cache.key_prefix(backend, imgsz, False)
+    entry = Path(model_cache.cache_dir, f"{prefix}-{yolov5_version}")
+    entry.mkdir()
+    with open(entry / MANIFEST_FILE, "w") as manifest:
+        json.dump({
+            "weights_sha256": weights_sha256 or model_cache.weights_hash,
+            "yolov5_version": yolov5_version,
+            "comparison": comparison
+        }, manifest)
+    return entry
+
+
+def comparison(count_agreement):
+    return {
+        "frames": 10,
+        "count_agreement": count_agreement,
+        "map50_delta": -0.01,
+        "fp32_ms": 100.0,
+        "int8_ms": 40.0
+    }
+
+
+def test_compatible_versions():
+    assert is_compatible_version("v7.0", "v7.1")
+    assert not is_compatible_version("v6.2", "v7.0")
+
+
+def test_key_depends_on_every_input(model_cache):
+    keys = {
+        model_cache.key_prefix(ModelBackend.ONNX, (640, 640), False),
+        model_cache.key_prefix(ModelBackend.ONNX, (480, 640), False),
+        model_cache.key_prefix(ModelBackend.OPENVINO, (640, 640), False),
+        model_cache.key_prefix(ModelBackend.ONNX, (640, 640), True),
+    }
+    assert len(keys) == 4
+
+
+def test_lookup_reuses_compatible_exports(model_cache):
+    assert model_cache.lookup(ModelBackend.ONNX, (640, 640), False) is None
+
+    entry = add_entry(model_cache, ModelBackend.ONNX, (640, 640), "v7.1")
+    exported_model = model_cache.get_or_build(ModelBackend.ONNX, (640, 640))
+
+    assert exported_model.weights.endswith(f"{entry.name}/yolov5s.onnx")
+    assert exported_model.imgsz == (640, 640)
+
+
+def test_lookup_ignores_incompatible_exports(model_cache):
+    add_entry(model_cache, ModelBackend.ONNX, (640, 640), "v6.2")
+    add_entry(model_cache, ModelBackend.OPENVINO, (640, 640), "v7.0", "other")
+
+    assert model_cache.lookup(ModelBackend.ONNX, (640, 640), False) is None
+    assert model_cache.lookup(ModelBackend.OPENVINO, (640, 640), False) \
+        is None
+
+
+def test_torchscript_has_no_dynamic_batch(model_cache):
+    with pytest.raises(ModelExportError):
+        model_cache.get_or_build(ModelBackend.TORCHSCRIPT, (640, 640), True)
+
+    exported_model = model_cache.select(
+        [ModelBackend.TORCHSCRIPT], (640, 640), True)
+    assert exported_model.backend == ModelBackend.PYTORCH
+    assert exported_model.weights == "yolov5s.pt"
+
+
+def test_int8_needs_calibration_frames(model_cache):
+    with pytest.raises(ModelExportError):
+        model_cache.get_or_build(ModelBackend.ONNX_INT8, (640, 640))
+
+
+def test_int8_is_rejected_below_count_agreement(model_cache, tmp_path):
+    calibration_dir = tmp_path / "calibration"
+    calibration_dir.mkdir()
+    (calibration_dir / "frame.jpg").write_bytes(b"frame")
+    model_cache.calibration_dir = str(calibration_dir)
+    model_cache.min_count_agreement = 0.95
+
+    add_entry(
+        model_cache, ModelBackend.ONNX_INT8, (640, 640), "v7.0",
+        comparison=comparison(0.9)
+    )
+    exported_model = model_cache.select(
+        [ModelBackend.ONNX_INT8, ModelBackend.PYTORCH], (640, 640))
+    assert exported_model.backend == ModelBackend.PYTORCH
+
+    model_cache.min_count_agreement = 0.9
+    exported_model = model_cache.select([ModelBackend.ONNX_INT8], (640, 640))
+    assert exported_model.weights.endswith("yolov5s_int8.onnx")
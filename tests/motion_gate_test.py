@@ -0,0 +1,40 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from src.image_processor.motion_gate import MotionGate  # noqa: E402
+
+
+def frame(value=0):
+    return np.full((240, 320, 3), value, dtype=np.uint8)
+
+
+def test_static_scene_is_skipped():
+    gate = MotionGate(threshold=0.01, max_skipped_frames=100)
+
+    assert gate.should_infer(frame())
+    assert not any(gate.should_infer(frame()) for _ in range(10))
+    assert gate.stats() == {"executed": 1, "skipped": 10}
+
+
+def test_changed_scene_is_inferred():
+    gate = MotionGate(threshold=0.01)
+    gate.should_infer(frame())
+
+    moved = frame()
+    moved[100:200, 100:200] = 255
+    assert gate.should_infer(moved)
+
+
+def test_inference_is_forced_every_max_skipped_frames():
+    gate = MotionGate(threshold=0.01, max_skipped_frames=3)
+
+    decisions = [gate.should_infer(frame()) for _ in range(9)]
+    assert decisions == [True, False, False, False, True,
+                         False, False, False, True]
+
+
+def test_zero_threshold_disables_the_gate():
+    gate = MotionGate(threshold=0)
+    assert all(gate.should_infer(frame()) for _ in range(5))
@@ -0,0 +1,309 @@
+import json
+
+import pytest
+
+from src.image_processor.exceptions import (
+    StreamAlreadyAssigned,
+    StreamNotAssigned,
+    WorkerCapacityExceeded
+)
+from src.image_processor.multi_stream import DeviceStream, MultiStreamWorker
+from src.image_processor.worker_control import (
+    WorkerCommand,
+    WorkerControlServer
+)
+from src.image_processor.worker_metrics import WorkerMetrics
+
+
+class FakeGrabber:
+    def __init__(self):
+        self.sequence = -1
+        self.frame = None
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def latest(self):
+        return self.sequence, self.frame
+
+
+def stream_factory(device_id, source, options):
+    return DeviceStream(
+        device_id=device_id,
+        source=source,
+        options=options,
+        destination_stream_url=f"rtsp://localhost/{device_id}/detected",
+        grabber=FakeGrabber()
+    )
+
+
+@pytest.fixture
+def worker():
+    worker = MultiStreamWorker(2, stream_factory)
+    yield worker
+    worker.close()
+
+
+def test_add_and_remove_streams(worker):
+    worker.add_stream(1, "rtsp://camera/1")
+    worker.add_stream(2, "rtsp://camera/2")
+
+    assert worker.status() == {
+        "max_streams": 2,
+        "device_ids": [1, 2],
+        "sources": {"1": "rtsp://camera/1", "2": "rtsp://camera/2"},
+        "motion_gate": {},
+        "streamer": {},
+        "callbacks": {
+            "1": {"executed": 0, "coalesced": 0},
+            "2": {"executed": 0, "coalesced": 0}
+        }
+    }
+    assert worker.streams[1].grabber.started
+
+    worker.remove_stream(1)
+    assert worker.status()["device_ids"] == [2]
+
+
+def test_worker_capacity(worker):
+    worker.add_stream(1, "rtsp://camera/1")
+    with pytest.raises(StreamAlreadyAssigned):
+        worker.add_stream(1, "rtsp://camera/1")
+
+    worker.add_stream(2, "rtsp://camera/2")
+    with pytest.raises(WorkerCapacityExceeded):
+        worker.add_stream(3, "rtsp://camera/3")
+
+
+def test_remove_unknown_stream(worker):
+    with pytest.raises(StreamNotAssigned):
+        worker.remove_stream(1)
+
+
+def test_next_batch_only_returns_new_frames(worker):
+    worker.add_stream(1, "rtsp://camera/1")
+    worker.add_stream(2, "rtsp://camera/2")
+    assert worker.next_batch() == []
+
+    grabber = worker.streams[1].grabber
+    grabber.sequence, grabber.frame = 0, "frame-0"
+    batch = worker.next_batch()
+    returned = [(s.device_id, sequence, frame) for s, sequence, frame in batch]
+    assert returned == [(1, 0, "frame-0")]
+
+    assert worker.next_batch() == []
+
+
+def test_ring_frames_are_copied_or_dropped(worker):
+    worker.add_stream(1, "rtsp://camera/1")
+    stream = worker.streams[1]
+    frame = ["pixels"]
+    assert worker.own_frame(stream, 0, frame) is frame
+    assert worker.is_current(stream, 0)
+
+    stream.grabber.is_current = lambda sequence: sequence == 1
+    copied = worker.own_frame(stream, 1, frame)
+    assert copied == frame and copied is not frame
+    assert worker.own_frame(stream, 0, frame) is None
+    assert not worker.is_current(stream, 0)
+
+
+def test_state_is_restored(tmp_path):
+    state_file = str(tmp_path / "worker.streams.json")
+    worker = MultiStreamWorker(2, stream_factory, state_file=state_file)
+    worker.add_stream(1, "rtsp://camera/1", {"motion_threshold": 0})
+
+    with open(state_file) as state:
+        assert json.load(state) == {
+            "1": {
+                "source": "rtsp://camera/1",
+                "options": {"motion_threshold": 0}
+            }
+        }
+
+    restored_worker = MultiStreamWorker(2, stream_factory, state_file)
+    restored_worker.restore()
+    assert restored_worker.status()["device_ids"] == [1]
+    assert restored_worker.streams[1].options == {"motion_threshold": 0}
+
+
+def test_control_commands(worker):
+    server = WorkerControlServer("unused.sock", worker.handlers())
+
+    response = server.dispatch(
+        b'{"command": "ASSIGN", "device_id": 1, "source": "rtsp://c/1"}')
+    assert response["ok"] is True
+    assert response["device_ids"] == [1]
+
+    response = server.dispatch(b'{"command": "RELEASE", "device_id": 2}')
+    assert response["ok"] is False
+
+    response = server.dispatch(b'{"command": "UNKNOWN"}')
+    assert response == {"ok": False, "error": "Invalid command"}
+
+
+def test_unrendered_frames_only_publish_metrics(worker):
+    worker.add_stream(1, "rtsp://camera/1")
+    stream = worker.streams[1]
+    metrics = []
+    stream.on_metric_detected = metrics.append
+
+    worker.publish(stream, None, {"person": 2})
+    stream.callback_executor.shutdown(wait=True)
+
+    assert stream.streamer is None
+    assert metrics == [{"person": 2}]
+
+
+class FakeRelay:
+    def __init__(self):
+        self.started = False
+
+    def start_stream(self):
+        self.started = True
+
+    def stop_stream(self):
+        self.started = False
+
+
+def test_preset_streamer_starts_with_the_stream():
+    relay = FakeRelay()
+    started = []
+
+    def relay_factory(device_id, source, options):
+        stream = stream_factory(device_id, source, options)
+        stream.streamer = relay
+        stream.on_stream_started = lambda: started.append(device_id)
+        return stream
+
+    worker = MultiStreamWorker(1, relay_factory)
+    worker.add_stream(1, "rtsp://camera/1")
+    stream = worker.streams[1]
+    worker.publish(stream, None, {"person": 1})
+    worker.close()
+
+    assert started == [1]
+    assert stream.streamer is relay
+    assert not relay.started
+
+
+def test_metrics_follow_the_streams():
+    worker = MultiStreamWorker(2, stream_factory, metrics=WorkerMetrics())
+    worker.add_stream(1, "rtsp://camera/1")
+    stream = worker.streams[1]
+    stream.on_metric_detected = lambda detections_info: None
+
+    worker.publish(stream, None, {"person": 1})
+    stream.callback_executor.shutdown(wait=True)
+    metrics = worker.handlers()[WorkerCommand.METRICS]({})["metrics"]
+    assert metrics["1"]["latency"]["callback"]["count"] == 1
+
+    worker.remove_stream(1)
+    assert worker.handlers()[WorkerCommand.METRICS]({}) == {"metrics": {}}
+
+
+class FakeStreamer:
+    def __init__(self, destination_uri, width, height, framerate):
+        self.destination_uri = destination_uri
+        self.width = width
+        self.height = height
+        self.frames = 0
+        self.stopped = False
+
+    def start_stream(self):
+        pass
+
+    def next_frame(self, frame):
+        self.frames += 1
+
+    def stop_stream(self):
+        self.stopped = True
+
+
+class FakeFrame:
+    def __init__(self, width, height):
+        self.shape = (height, width, 3)
+
+
+def source_stream_factory(device_id, source, options):
+    """Builds the processed stream url from the source path, like
+    transmit.py."""
+    path = source.split('/', 3)[3]
+    return DeviceStream(
+        device_id=device_id,
+        source=source,
+        options=options,
+        destination_stream_url=f"rtsp://localhost/{path}/detected",
+        grabber=FakeGrabber()
+    )
+
+
+@pytest.fixture
+def retarget_worker():
+    worker = MultiStreamWorker(
+        2, source_stream_factory, streamer_factory=FakeStreamer)
+    yield worker
+    worker.close()
+
+
+def test_retarget_keeps_the_streamer(retarget_worker):
+    retarget_worker.add_stream(1, "rtsp://camera/cam1")
+    old_stream = retarget_worker.streams[1]
+    retarget_worker.publish(old_stream, FakeFrame(640, 480), {})
+    streamer = old_stream.streamer
+
+    retarget_worker.retarget_stream(1, "rtsp://other-camera/cam1")
+
+    stream = retarget_worker.streams[1]
+    assert stream is not old_stream
+    assert stream.grabber.started and not old_stream.grabber.started
+    assert stream.streamer is streamer and not streamer.stopped
+    assert retarget_worker.status()["sources"] == {
+        "1": "rtsp://other-camera/cam1"
+    }
+
+    retarget_worker.publish(stream, FakeFrame(640, 480), {})
+    assert streamer.frames == 2
+    retarget_worker.publish(stream, FakeFrame(1280, 720), {})
+    assert streamer.stopped
+    assert (stream.streamer.width, stream.streamer.height) == (1280, 720)
+
+
+def test_retarget_to_another_output(retarget_worker):
+    started, stopped = [], []
+
+    retarget_worker.add_stream(1, "rtsp://camera/cam1")
+    old_stream = retarget_worker.streams[1]
+    old_stream.on_stream_stopped = lambda: stopped.append(1)
+    retarget_worker.publish(old_stream, FakeFrame(640, 480), {})
+    streamer = old_stream.streamer
+
+    retarget_worker.retarget_stream(1, "rtsp://camera/cam2", new_device_id=2)
+    old_stream.callback_executor.shutdown(wait=True)
+
+    assert list(retarget_worker.streams) == [2]
+    assert streamer.stopped
+    assert stopped == [1]
+    new_stream = retarget_worker.streams[2]
+    assert new_stream.streamer is None
+
+    new_stream.on_stream_started = lambda: started.append(2)
+    retarget_worker.publish(new_stream, FakeFrame(640, 480), {})
+    new_stream.callback_executor.shutdown(wait=True)
+    assert started == [2]
+
+
+def test_retarget_unknown_or_taken_device(retarget_worker):
+    with pytest.raises(StreamNotAssigned):
+        retarget_worker.retarget_stream(1, "rtsp://camera/cam1")
+
+    retarget_worker.add_stream(1, "rtsp://camera/cam1")
+    retarget_worker.add_stream(2, "rtsp://camera/cam2")
+    with pytest.raises(StreamAlreadyAssigned):
+        retarget_worker.retarget_stream(
+            1, "rtsp://camera/cam3", new_device_id=2
+        )
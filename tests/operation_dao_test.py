@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime
+
+from src.database.migrator import load_migrations
+from src.instance_manager.operation.operation import Operation, OperationStatus
+from src.instance_manager.operation.operation_dao import OperationDAO
+
+
+class FakeAsyncCursor:
+    def __init__(self, rows=(), rowcount=1):
+        self.rows = list(rows)
+        self.rowcount = rowcount
+        self.calls = []
+
+    async def execute(self, query, params=None):
+        self.calls.append((" ".join(query.split()), params))
+
+    async def fetchone(self):
+        return self.rows[0]
+
+    async def fetchall(self):
+        return self.rows
+
+
+def test_accepted_operation_is_created():
+    cursor = FakeAsyncCursor(rows=[(42,)])
+    accepted_at = datetime(2024, 1, 1)
+    operation = Operation(
+        None, 1, "START", "rtsp://camera", OperationStatus.ACCEPTED,
+        accepted_at, accepted_at
+    )
+
+    assert asyncio.run(OperationDAO(cursor).create_operation(operation)) == 42
+    assert cursor.calls[0][1] == (
+        1, "START", "rtsp://camera", "ACCEPTED", accepted_at, accepted_at
+    )
+
+
+def test_only_accepted_operations_are_finished():
+    cursor = FakeAsyncCursor(rowcount=0)
+    finished_at = datetime(2024, 1, 1)
+
+    updated = asyncio.run(OperationDAO(cursor).finish_operation(
+        42, OperationStatus.READY, "Ready", finished_at))
+
+    assert updated == 0
+    query, params = cursor.calls[0]
+    assert query.endswith("WHERE id = %s AND status = 'ACCEPTED'")
+    assert params == ("READY", "Ready", finished_at, 42)
+
+
+def test_operations_are_read_in_accepted_order():
+    accepted_at = datetime(2024, 1, 1)
+    cursor = FakeAsyncCursor(rows=[
+        (
+            7, 2, "START", "rtsp://camera", "ACCEPTED",
+            accepted_at, accepted_at, None
+        )
+    ])
+
+    operations = asyncio.run(OperationDAO(cursor).get_operations_by_status(
+        OperationStatus.ACCEPTED))
+
+    assert operations == [Operation(
+        7, 2, "START", "rtsp://camera", OperationStatus.ACCEPTED,
+        accepted_at, accepted_at
+    )]
+    assert cursor.calls[0][0].endswith("ORDER BY id")
+
+
+def test_operation_migration_follows_the_rollups():
+    migrations = load_migrations()
+    assert [migration.version for migration in migrations][:3] == [1, 2, 3]
+    assert "CREATE TABLE IF NOT EXISTS operation" in migrations[2].sql
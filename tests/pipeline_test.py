@@ -0,0 +1,63 @@
+import queue
+
+import pytest
+
+from src.image_processor.pipeline import (
+    DropPolicy,
+    Pipeline,
+    PipelineStage,
+    StageQueue
+)
+
+
+def test_keep_latest_queue_drops_oldest_items():
+    stage_queue = StageQueue(2, DropPolicy.KEEP_LATEST)
+    for item in range(5):
+        assert stage_queue.put(item)
+
+    assert stage_queue.dropped == 3
+    assert [stage_queue.get(0), stage_queue.get(0)] == [3, 4]
+
+
+def test_drop_incoming_queue_keeps_oldest_items():
+    stage_queue = StageQueue(2, DropPolicy.DROP_INCOMING)
+    results = [stage_queue.put(item) for item in range(4)]
+
+    assert results == [True, True, False, False]
+    assert stage_queue.dropped == 2
+    assert [stage_queue.get(0), stage_queue.get(0)] == [0, 1]
+
+
+def test_empty_queue_times_out():
+    with pytest.raises(queue.Empty):
+        StageQueue().get(timeout=0.01)
+
+
+def test_pipeline_runs_every_stage():
+    results = []
+    first_queue = StageQueue(10, DropPolicy.BLOCK)
+    second_queue = StageQueue(10, DropPolicy.BLOCK)
+    pipeline = Pipeline([
+        PipelineStage("source", source=range(10), output_queue=first_queue),
+        PipelineStage("double", lambda x: x * 2, first_queue, second_queue),
+        PipelineStage("sink", results.append, second_queue),
+    ], report_interval=1)
+
+    pipeline.run()
+
+    assert results == [x * 2 for x in range(10)]
+    assert [stage.stats.processed for stage in pipeline.stages] == [10] * 3
+
+
+def test_pipeline_raises_stage_errors():
+    def fail(item):
+        raise ValueError("stage failed")
+
+    stage_queue = StageQueue(1)
+    pipeline = Pipeline([
+        PipelineStage("source", source=range(10), output_queue=stage_queue),
+        PipelineStage("sink", fail, stage_queue),
+    ], report_interval=1)
+
+    with pytest.raises(ValueError):
+        pipeline.run()
@@ -0,0 +1,98 @@
+import asyncio
+import socket
+
+from src.docker_manager.readiness_server import ReadinessServer
+from src.image_processor.readiness import ReadinessReporter, WorkerStage
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+
+def test_waits_for_the_final_stage(tmp_path):
+    socket_path = str(tmp_path / "readiness.sock")
+
+    async def scenario():
+        server = ReadinessServer(socket_path)
+        await server.start()
+        server.reset("worker-1")
+        waiter = asyncio.ensure_future(
+            server.wait("worker-1", WorkerStage.STREAMING_STARTED))
+
+        reporter = ReadinessReporter(socket_path, "worker-1")
+        reporter.report(WorkerStage.MODEL_LOADED)
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        assert server.workers["worker-1"].stages == {WorkerStage.MODEL_LOADED}
+
+        reporter.report(WorkerStage.STREAMING_STARTED)
+        result = await waiter
+        reporter.close()
+        await server.stop()
+        return result
+
+    assert run(scenario()) == (True, "")
+
+
+def test_fatal_error_fails_the_wait(tmp_path):
+    socket_path = str(tmp_path / "readiness.sock")
+
+    async def scenario():
+        server = ReadinessServer(socket_path)
+        await server.start()
+        reporter = ReadinessReporter(socket_path, "worker-1")
+        reporter.report(WorkerStage.FATAL_ERROR, "No feed")
+        reporter.report(WorkerStage.FATAL_ERROR, "Shutting down")
+        result = await server.wait("worker-1", WorkerStage.STREAMING_STARTED)
+        reporter.close()
+        await server.stop()
+        return result
+
+    assert run(scenario()) == (False, "No feed")
+
+
+def test_disconnect_before_final_stage_fails_the_wait(tmp_path):
+    socket_path = str(tmp_path / "readiness.sock")
+
+    async def scenario():
+        server = ReadinessServer(socket_path)
+        await server.start()
+        reporter = ReadinessReporter(socket_path, "worker-1")
+        reporter.report(WorkerStage.MODEL_LOADED)
+        reporter.close()
+        result = await server.wait("worker-1", WorkerStage.WORKER_READY)
+        await server.stop()
+        return result
+
+    success, error = run(scenario())
+    assert not success
+    assert "WORKER_READY" in error
+
+
+def test_reporter_without_manager_does_not_fail(tmp_path):
+    reporter = ReadinessReporter(str(tmp_path / "missing.sock"), "worker-1")
+    reporter.report(WorkerStage.MODEL_LOADED)
+    reporter.close()
+
+    ReadinessReporter().report(WorkerStage.MODEL_LOADED)
+
+
+def test_invalid_events_are_discarded(tmp_path):
+    socket_path = str(tmp_path / "readiness.sock")
+
+    async def scenario():
+        server = ReadinessServer(socket_path)
+        await server.start()
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+        client.sendall(
+            b'not json\n'
+            b'{"worker": "worker-1", "stage": "UNKNOWN"}\n'
+        )
+        client.sendall(b'{"worker": "worker-1", "stage": "WORKER_READY"}\n')
+        result = await server.wait("worker-1", WorkerStage.WORKER_READY)
+        client.close()
+        await server.stop()
+        return result
+
+    assert run(scenario()) == (True, "")
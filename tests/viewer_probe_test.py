@@ -0,0 +1,89 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from src.image_processor.viewer_probe import (
+    MediaServerViewerProbe,
+    ViewerProbe,
+    ViewerWatcher
+)
+
+
+class StubMediaServer(BaseHTTPRequestHandler):
+    """Answers like the MediaMTX control API."""
+    readers = {}
+
+    def do_GET(self):
+        path = self.path[len("/v3/paths/get/"):]
+        if path not in self.readers:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps({
+            "name": path,
+            "readers": [{"type": "rtspSession"}] * self.readers[path]
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_url():
+    server = HTTPServer(("127.0.0.1", 0), StubMediaServer)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+class FailingProbe(ViewerProbe):
+    def has_viewers(self, path):
+        raise ConnectionError("media server down")
+
+
+def test_media_server_probe(api_url):
+    StubMediaServer.readers = {"cam/detected": 2, "other/detected": 0}
+    probe = MediaServerViewerProbe(api_url)
+
+    assert probe.has_viewers("cam/detected")
+    assert not probe.has_viewers("other/detected")
+    assert not probe.has_viewers("unknown/detected")
+
+
+def test_unwatched_streams_render_at_idle_rate(api_url):
+    StubMediaServer.readers = {"cam/detected": 0}
+    watcher = ViewerWatcher(
+        MediaServerViewerProbe(api_url), "cam/detected", idle_fps=0.01)
+    assert watcher.should_render()
+
+    watcher.poll()
+    assert not watcher.watched
+    assert not watcher.should_render()
+
+    StubMediaServer.readers = {"cam/detected": 1}
+    watcher.poll()
+    assert watcher.should_render() and watcher.should_render()
+
+
+def test_no_idle_frames(api_url):
+    StubMediaServer.readers = {"cam/detected": 0}
+    watcher = ViewerWatcher(
+        MediaServerViewerProbe(api_url), "cam/detected", idle_fps=0)
+    watcher.poll()
+
+    assert not watcher.should_render()
+
+
+def test_failing_probe_keeps_rendering():
+    watcher = ViewerWatcher(FailingProbe(), "cam/detected", idle_fps=0)
+    watcher.poll()
+
+    assert watcher.watched
+    assert watcher.should_render()
@@ -0,0 +1,161 @@
+import asyncio
+
+from src.docker_manager.warm_pool import WarmWorkerPool
+
+
+class FakeDockerApi:
+    """Keeps the workers in memory, like the running worker containers."""
+
+    def __init__(self):
+        self.workers = {}
+        self.started = []
+        self.removed = []
+
+    async def run_worker(self, container_name, max_streams):
+        self.started.append(container_name)
+        self.workers[container_name] = {
+            "max_streams": max_streams,
+            "device_ids": []
+        }
+
+    async def list_workers(self):
+        return list(self.workers)
+
+    async def get_worker_status(self, container_name):
+        return self.workers[container_name]
+
+    async def assign_stream(
+        self, container_name, device_id, stream_url, options=None
+    ):
+        self.workers[container_name]["device_ids"].append(device_id)
+
+    async def release_stream(self, container_name, device_id):
+        self.workers[container_name]["device_ids"].remove(device_id)
+
+    async def remove_container(self, container_name, force=False):
+        self.removed.append(container_name)
+        del self.workers[container_name]
+
+
+def idle_workers(docker_api):
+    return [
+        name for name, status in docker_api.workers.items()
+        if not status["device_ids"]
+    ]
+
+
+async def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Condition not reached")
+
+
+def test_claims_use_warm_workers_and_refill():
+    async def scenario():
+        docker_api = FakeDockerApi()
+        pool = WarmWorkerPool(docker_api, 1, size=2, refill_interval=0.05)
+        await pool.start()
+        await wait_for(lambda: len(idle_workers(docker_api)) == 2)
+        warm_workers = list(docker_api.workers)
+
+        worker_name = await pool.assign(1, "rtsp://camera/1")
+        assert worker_name in warm_workers
+        await wait_for(lambda: len(idle_workers(docker_api)) == 2)
+
+        assert len(docker_api.started) == 3
+        assert pool.claims == 1
+        await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_released_workers_return_to_the_pool():
+    async def scenario():
+        docker_api = FakeDockerApi()
+        pool = WarmWorkerPool(docker_api, 1, size=1, refill_interval=0.05)
+        await pool.start()
+        await wait_for(lambda: len(idle_workers(docker_api)) == 1)
+
+        worker_name = await pool.assign(1, "rtsp://camera/1")
+        await wait_for(lambda: len(idle_workers(docker_api)) == 1)
+        await pool.release(1)
+
+        assert worker_name in docker_api.workers
+        assert docker_api.removed == []
+        await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_pool_shrinks_when_idle():
+    async def scenario():
+        docker_api = FakeDockerApi()
+        pool = WarmWorkerPool(
+            docker_api, 1, size=2, min_size=1,
+            idle_timeout=0.2, refill_interval=0.05
+        )
+        await pool.start()
+        await wait_for(lambda: len(idle_workers(docker_api)) == 2)
+
+        await wait_for(lambda: len(idle_workers(docker_api)) == 1)
+        assert pool.target_size() == 1
+        assert len(docker_api.removed) == 1
+        await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_multi_stream_workers_are_filled_first():
+    async def scenario():
+        docker_api = FakeDockerApi()
+        pool = WarmWorkerPool(docker_api, 2, size=1, refill_interval=0.05)
+        await pool.start()
+        await wait_for(lambda: len(idle_workers(docker_api)) == 1)
+
+        first = await pool.assign(1, "rtsp://camera/1")
+        await wait_for(lambda: len(idle_workers(docker_api)) == 1)
+        second = await pool.assign(2, "rtsp://camera/2")
+
+        assert first == second
+        await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_assigning_a_new_source_retargets_the_device():
+    async def scenario():
+        docker_api = FakeDockerApi()
+        retargets = []
+
+        async def retarget_stream(
+            container_name,
+            device_id,
+            stream_url,
+            new_device_id=None,
+            options=None
+        ):
+            retargets.append((container_name, device_id, stream_url))
+            sources = docker_api.workers[container_name]["sources"]
+            sources[str(device_id)] = stream_url
+
+        docker_api.retarget_stream = retarget_stream
+        pool = WarmWorkerPool(docker_api, 1, size=1, refill_interval=0.05)
+        await pool.start()
+        await wait_for(lambda: len(idle_workers(docker_api)) == 1)
+
+        worker_name = await pool.assign(1, "rtsp://camera/1")
+        docker_api.workers[worker_name]["sources"] = {"1": "rtsp://camera/1"}
+        assert not await pool.retarget(1, "rtsp://camera/1")
+        assert await pool.retarget(1, "rtsp://camera/2")
+        assert not await pool.retarget(2, "rtsp://camera/2")
+        assert await pool.assign(1, "rtsp://camera/3") == worker_name
+
+        assert retargets == [
+            (worker_name, 1, "rtsp://camera/2"),
+            (worker_name, 1, "rtsp://camera/3")
+        ]
+        await pool.stop()
+
+    asyncio.run(scenario())
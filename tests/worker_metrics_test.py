@@ -0,0 +1,94 @@
+import json
+import urllib.request
+
+import pytest
+
+from src.image_processor.pipeline import StageQueue
+from src.image_processor.worker_metrics import (
+    LatencyHistogram,
+    MetricsHttpServer,
+    StreamMetrics,
+    WorkerMetrics,
+    aggregate,
+    render_prometheus
+)
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = LatencyHistogram((10, 100))
+    for seconds in (0.005, 0.01, 0.05, 0.2):
+        histogram.observe(seconds)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum_ms == pytest.approx(265)
+    assert histogram.quantile(0.5) == 10
+    assert histogram.quantile(0.75) == 100
+    assert histogram.quantile(0.99) == float("inf")
+
+
+def test_stream_metrics_snapshot():
+    metrics = StreamMetrics(3, (10, 100))
+    queue = StageQueue(1)
+    queue.put(1)
+    queue.put(2)
+    metrics.track_queues(frames=queue)
+    metrics.increment("frames_in", 2)
+    metrics.increment("dropped")
+    metrics.timed("callback", lambda: None)()
+
+    snapshot = metrics.snapshot()
+
+    assert snapshot["counters"] == {
+        "frames_in": 2, "inferred": 0, "dropped": 2, "stale": 0, "streamed": 0,
+        "count_changes": 0, "count_changes_saved": 0
+    }
+    assert snapshot["queue_depth"] == {"frames": 1}
+    assert snapshot["latency"]["callback"]["count"] == 1
+    assert snapshot["latency"]["inference"]["count"] == 0
+
+
+def test_aggregate_sums_streams():
+    worker = WorkerMetrics((10,))
+    worker.for_device(1).observe("inference", 0.005)
+    worker.for_device(2).observe("inference", 0.02)
+    worker.for_device(2).increment("streamed")
+
+    total = aggregate(worker.snapshot().values())
+
+    assert total["latency"]["inference"]["counts"] == [1, 1]
+    assert total["counters"]["streamed"] == 1
+
+
+def test_render_prometheus():
+    worker = WorkerMetrics((10,))
+    worker.for_device(7).observe("nms", 0.002)
+    worker.for_device(7).increment("frames_in")
+
+    text = render_prometheus(worker.snapshot())
+
+    assert 'sensiflow_worker_frames_in_total{device_id="7"} 1' in text
+    assert ('sensiflow_worker_nms_seconds_bucket'
+            '{device_id="7",le="0.01"} 1') in text
+    assert ('sensiflow_worker_nms_seconds_bucket'
+            '{device_id="7",le="+Inf"} 1') in text
+    assert 'sensiflow_worker_nms_seconds_count{device_id="7"} 1' in text
+    assert text.count("# TYPE sensiflow_worker_nms_seconds histogram") == 1
+
+
+def test_http_server():
+    worker = WorkerMetrics()
+    worker.for_device(1).increment("inferred")
+    server = MetricsHttpServer(worker, 0, "127.0.0.1")
+    server.start()
+    try:
+        base_url = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(
+                f"{base_url}/metrics", timeout=5) as response:
+            assert (b'sensiflow_worker_inferred_total{device_id="1"} 1'
+                    in response.read())
+        with urllib.request.urlopen(
+                f"{base_url}/metrics.json", timeout=5) as response:
+            assert json.load(response)["1"]["counters"]["inferred"] == 1
+    finally:
+        server.stop()
@@ -32,18 +32,37 @@ Usage - formats:
 """
 
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import time
 from time import sleep
 import logging
 import src.config as config
 from src.config.app import get_worker_config
 from src.image_processor import callbacks
+from src.image_processor.frame_grabber import FrameGrabber
+from src.image_processor.frame_ring import SharedFrameGrabber, own_frame
+from src.image_processor.metadata_channel import UdpMetadataPublisher, build_metadata
+from src.image_processor.motion_gate import MotionGate
 from src.image_processor.metric.metric_dao import MetricDAOFactory
 from src.image_processor.metric.metrics_service import DetectionMetricsService
+from src.image_processor.metric.metric_writer import MetricWriter
+from src.image_processor.metric.metric_spool import MetricSpool, SpooledMetricWriter
+from src.image_processor.metric.count_smoother import SmoothingMode, build_count_smoother
 from src.image_processor.processed_stream.processed_stream_dao import ProcessedStreamDAOFactory
 from src.image_processor.processed_stream.processed_stream_service import ProcessedStreamService
+from src.image_processor.buffered_streamer import BufferedStreamerRTSP
+from src.image_processor.callback_dispatcher import CoalescingDispatcher
+from src.image_processor.event_publisher import BrokerEventPublisher, BrokerMetricSink, BrokerProcessedStreamService
+from src.image_processor.file_streamer import BufferedFileStreamer, FileStreamer, NullStreamer
 from src.image_processor.streamer_rtsp import StreamerRTSP
+from src.image_processor.multi_stream import DeviceStream, MultiStreamWorker
+from src.image_processor.passthrough import PassthroughStreamer
+from src.image_processor.readiness import ReadinessReporter, WorkerStage
+from src.image_processor.pipeline import DropPolicy, Pipeline, PipelineStage, StageQueue
+from src.image_processor.viewer_probe import MediaServerViewerProbe, ViewerWatcher
+from src.image_processor.worker_control import WorkerCommand, WorkerControlServer
+from src.image_processor.worker_metrics import MetricsHttpServer, StreamMetrics, WorkerMetrics
 from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
 from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadStreams
 from utils.general import (LOGGER, Profile, check_file, check_img_size, check_requirements,
                            increment_path, non_max_suppression, print_args, scale_boxes, strip_optimizer, xyxy2xywh)
@@ -54,8 +73,11 @@ import argparse
 import src.image_processor.logging_utils as logging_utils
 import os
 import sys
+from contextlib import nullcontext
 from pathlib import Path
+from urllib.parse import urlparse
 from psycopg_pool import ConnectionPool
+import numpy as np
 import torch
 
 FILE = Path(__file__).resolve()
@@ -65,6 +87,120 @@ if str(ROOT) not in sys.path:
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 FPS = 30
+MULTI_STREAM_IDLE_SLEEP = 0.005  # seconds to wait when no stream has new frames
+MULTI_STREAM_OPTIONS = ('max_streams', 'control_socket')
+VIEWER_OPTIONS = ('viewer_poll_interval', 'idle_fps')
+METADATA_OPTIONS = ('metadata_host', 'metadata_port')
+METRICS_OPTIONS = ('metrics_port', 'metrics_socket', 'metric_spool', 'metric_transport')
+READINESS_OPTIONS = ('readiness_socket', 'readiness_id')
+
+
+def throttle(iterable, fps):
+    """Yields the items of iterable at most fps times per second, 0 disables the limit."""
+    period = 1 / fps if fps > 0 else 0
+    next_time = time.monotonic()
+    for item in iterable:
+        yield item
+        next_time += period
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            sleep(delay)
+        else:
+            next_time = time.monotonic()
+
+
+def timed_frames(iterable, stream_metrics: StreamMetrics):
+    """Yields the items of iterable, observing how long each one was waited for as the decode wait."""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        stream_metrics.observe('decode_wait', time.perf_counter() - started)
+        stream_metrics.increment('frames_in')
+        yield item
+
+
+def observe_profiles(stream_metrics: StreamMetrics, dt, count=1):
+    """Observes the last preprocess, inference and NMS times of dt for count inferred frames."""
+    for stage, profile in zip(('preprocess', 'inference', 'nms'), dt):
+        stream_metrics.observe(stage, profile.dt)
+    stream_metrics.increment('inferred', count)
+
+
+def build_streamer(destination_stream_url, width, height, framerate, queue_size=2):
+    """
+    Streamer writing from its own thread, or in the caller thread if queue_size is 0.
+    null:// discards the frames and file://<path> encodes them to a video file instead of streaming them.
+    """
+    destination = urlparse(destination_stream_url)
+    if destination.scheme == 'null':
+        return NullStreamer()
+    if destination.scheme == 'file':
+        if queue_size > 0:
+            return BufferedFileStreamer(destination.path, width, height, framerate, queue_size)
+        return FileStreamer(destination.path, width, height, framerate)
+    if queue_size > 0:
+        return BufferedStreamerRTSP(destination_stream_url, width, height, framerate, queue_size)
+    return StreamerRTSP(destination_stream_url, width, height, framerate)
+
+
+def load_model(weights, device, dnn, data, half, imgsz):
+    """Loads the detection model and adjusts the inference size to its stride."""
+    device = select_device(device)
+    model = DetectMultiBackend(
+        weights, device=device, dnn=dnn, data=data, fp16=half)
+    imgsz = check_img_size(imgsz, s=model.stride)  # check image size
+    return model, imgsz
+
+
+def count_detections(det, names):
+    """Returns the number of detections per class name."""
+    detections_info = {}
+    for c in det[:, 5].unique():
+        n_tensor = (det[:, 5] == c).sum()  # detections per class
+        class_name = names[int(c)]
+        n_detections = n_tensor.item()
+        detections_info[class_name] = n_detections
+    return detections_info
+
+
+def publish_metadata(metadata_publisher, device_id, sequence, timestamp_ms, det, im_shape, im0, names):
+    """
+    Rescales the detections of one image to the original frame and publishes them on the metadata channel.
+    Returns the number of detections per class name.
+    """
+    if len(det):
+        det[:, :4] = scale_boxes(im_shape, det[:, :4], im0.shape).round()
+    metadata_publisher.publish(build_metadata(device_id, sequence, timestamp_ms, im0.shape, det.tolist(), names))
+    return count_detections(det, names)
+
+
+def annotate_detections(det, im_shape, im0, names, line_thickness=3, hide_labels=False, hide_conf=False):
+    """
+    Rescales the detections of one image to the original frame and draws them.
+    Returns the annotated frame and the number of detections per class name.
+    """
+    annotator = Annotator(
+        im0, line_width=line_thickness, example=str(names))
+
+    detections_info = count_detections(det, names)
+    if len(det):
+        # Rescale boxes from img_size to im0 size
+        det[:, :4] = scale_boxes(
+            im_shape, det[:, :4], im0.shape).round()
+
+        # Write results
+        for *xyxy, conf, cls in reversed(det):
+            # Detection bboxes
+            c = int(cls)  # integer class
+            label = None if hide_labels else (
+                names[c] if hide_conf else f'{names[c]} {conf:.2f}')
+            annotator.box_label(xyxy, label, color=colors(c, True))
+
+    return annotator.result(), detections_info
 
 
 @smart_inference_mode()
@@ -95,18 +231,38 @@ def run_inference_model(
         device_id=0,  # device id
         on_metric_detected=None,  # callback function to call when a detection is made
         on_stream_started=None,  # callback function to call when a stream is started
+        queue_size=2,  # frames buffered between pipeline stages
+        drop_policy='keep_latest',  # what to do when a stage falls behind: keep_latest, drop_incoming or block
+        stats_interval=10,  # seconds between pipeline throughput reports
+        motion_threshold=0.005,  # fraction of changed pixels needed to run the detector, 0 disables the gate
+        motion_pixel_threshold=25,  # grayscale difference for a pixel to count as changed
+        motion_max_skip=30,  # force a full inference at least every motion_max_skip frames
+        frame_ring_slots=8,  # frames of the shared memory ring filled by the decoder process, 0 decodes in threads
+        stream_queue_size=2,  # frames waiting to be encoded before dropping, 0 encodes in the encode stage thread
+        viewer_watcher=None,  # ViewerWatcher that skips annotating and encoding while nobody watches
+        output_mode='annotated',  # annotated re-encodes the video with the boxes, passthrough relays the source as is
+        metadata_publisher=None,  # MetadataPublisher the detections are sent to in passthrough mode
+        stream_metrics=None,  # StreamMetrics where the stage latencies and frame counters are recorded
+        readiness=None,  # ReadinessReporter the stages reached are reported to
 ):
     source = str(source)
+    readiness = readiness or ReadinessReporter()
     if destination_stream_url is None:
         logging_utils.logError(0, "Please provide a destination stream URL")
+        readiness.report(WorkerStage.FATAL_ERROR, "Please provide a destination stream URL")
         logging_utils.logShutdown()
         return
     streamer = None
-    callback_executor = ThreadPoolExecutor(max_workers=1)
+    # Only the latest detections are saved, at most once per second
+    callback_executor = CoalescingDispatcher(name=f"callbacks-{device_id}")
+    stream_metrics = stream_metrics or StreamMetrics(device_id)
+    timed_on_metric_detected = None if on_metric_detected is None \
+        else stream_metrics.timed('callback', on_metric_detected)
 
     is_file = Path(source).suffix[1:] in (IMG_FORMATS + VID_FORMATS)
     if is_file:
         logging_utils.logError(1, "File input is not supported")
+        readiness.report(WorkerStage.FATAL_ERROR, "File input is not supported")
         logging_utils.logShutdown()
         return
     is_url = source.lower().startswith(('rtsp://', 'rtsps://'))
@@ -122,18 +278,23 @@ def run_inference_model(
     save_dir.mkdir(parents=True, exist_ok=True)  # make dir
 
     # Load model
-    device = select_device(device)
-    model = DetectMultiBackend(
-        weights, device=device, dnn=dnn, data=data, fp16=half)
+    model, imgsz = load_model(weights, device, dnn, data, half, imgsz)
     stride, names, pt = model.stride, model.names, model.pt
-    imgsz = check_img_size(imgsz, s=stride)  # check image size
 
     logging_utils.logSuccess(1, "Loaded model")
+    readiness.report(WorkerStage.MODEL_LOADED)
 
+    stop_event = threading.Event()
+    frame_grabber = None
     try:
         # Dataloader
         bs = 1  # batch_size
-        if webcam:
+        if webcam and is_url and frame_ring_slots > 0:
+            # Decoded in another process into shared memory, frames are read without copies
+            frame_grabber = SharedFrameGrabber(source, frame_ring_slots)
+            frame_grabber.start()
+            dataset = ring_frames(frame_grabber, imgsz, stride, pt, stop_event)
+        elif webcam:
 
             dataset = LoadStreams(source, img_size=imgsz,
                                   stride=stride, auto=pt, vid_stride=vid_stride)
@@ -144,15 +305,30 @@ def run_inference_model(
 
 
         logging_utils.logSuccess(2, "Got feed from the input")
+        readiness.report(WorkerStage.INPUT_OPENED)
     except Exception as e:
         logging_utils.logError(2, "Failed to get feed from the input")  #TODO: exceptions are not caught here
+        readiness.report(WorkerStage.FATAL_ERROR, f"Failed to get feed from the input: {e}")
         logging_utils.logShutdown()
         raise e
 
     # Run inference
     model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
-    seen, _, dt = 0, [], (Profile(), Profile(), Profile())
-    for path, im, im0s, vid_cap, s in dataset:
+    seen, dt = 0, (Profile(), Profile(), Profile())
+    motion_gates = [MotionGate(motion_threshold, motion_pixel_threshold, motion_max_skip) for _ in range(bs)]
+    last_pred = None
+
+    @smart_inference_mode()
+    def infer(item):
+        nonlocal last_pred
+        path, im, im0s, vid_cap, s = item
+        captured_ms = int(time.time() * 1E3)
+        frames = im0s if webcam else [im0s]
+        changed = [gate.should_infer(frame) for gate, frame in zip(motion_gates, frames)]
+        if last_pred is not None and not any(changed):
+            # Static scene, reuse the last detections (cloned as they are rescaled in place)
+            return path, im.shape[-2:], im0s, s, [det.clone() for det in last_pred], None, captured_ms, vid_cap
+
         with dt[0]:
             im = torch.from_numpy(im).to(model.device)
             im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
@@ -161,9 +337,9 @@ def run_inference_model(
                 im = im[None]  # expand for batch dim
 
         with dt[1]:
-            visualize = increment_path(
+            visualize_path = increment_path(
                 save_dir / Path(path).stem, mkdir=True) if visualize else False
-            pred = model(im, augment=augment, visualize=visualize)
+            pred = model(im, augment=augment, visualize=visualize_path)
 
         # NMS
         with dt[2]:
@@ -172,71 +348,350 @@ def run_inference_model(
 
         # Second-stage classifier (optional)
         # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
+        observe_profiles(stream_metrics, dt, len(pred))
+        last_pred = [det.clone() for det in pred]
+        return path, im.shape[2:], im0s, s, pred, dt[1].dt, captured_ms, vid_cap
+
+    @smart_inference_mode()
+    def annotate_and_stream(item):
+        nonlocal seen, streamer
+        path, im_shape, im0s, s, pred, inference_dt, captured_ms, vid_cap = item
 
         # Process predictions
         for i, det in enumerate(pred):  # per image
             seen += 1
             if webcam:  # batch_size >= 1
-                p, im0, frame = path[i], im0s[i].copy(), dataset.count
+                p, im0 = path[i], im0s[i]
                 s += f'{i}: '
             else:
-                p, im0, frame = path, im0s.copy(), getattr(dataset, 'frame', 0)
+                p, im0 = path, im0s.copy()
+            # Without viewers only the detections are counted for the metrics
+            render = not passthrough and (viewer_watcher is None or viewer_watcher.should_render())
+            if frame_grabber is not None:
+                # A view of a ring slot (vid_cap holds the sequences), the decoder reuses it once it laps the ring:
+                # copied before being drawn on and queued to the streamer, dropped if it was already reused
+                if render:
+                    im0 = own_frame(frame_grabber, vid_cap[i], im0)
+                elif not frame_grabber.is_current(vid_cap[i]):
+                    im0 = None
+                if im0 is None:
+                    stream_metrics.increment('stale')
+                    continue
+            elif webcam:
+                im0 = im0.copy()
             # Setup streamer
             if streamer is None:
-                streamer = StreamerRTSP(
-                    destination_stream_url, im0.shape[1], im0.shape[0], FPS)
+                if passthrough:
+                    # The source is relayed as is, the detections go to the metadata channel
+                    streamer = PassthroughStreamer(source, destination_stream_url)
+                else:
+                    streamer = build_streamer(
+                        destination_stream_url, im0.shape[1], im0.shape[0], FPS, stream_queue_size)
                 logging_utils.logSuccess(3, "Streamer object created")
                 streamer.start_stream()
                 callback_executor.submit(on_stream_started)
                 logging_utils.logSuccess(4, "Streamer object started")
+                readiness.report(WorkerStage.STREAMING_STARTED)
+
+            s += '%gx%g ' % im_shape  # print string
+            annotate_started = time.perf_counter()
+            if passthrough:
+                detections_info = publish_metadata(
+                    metadata_publisher, device_id, seen, captured_ms, det, im_shape, im0, names)
+            elif render:
+                im0, detections_info = annotate_detections(
+                    det, im_shape, im0, names, line_thickness, hide_labels, hide_conf)
+            else:
+                detections_info = count_detections(det, names)
+            stream_metrics.observe('annotate', time.perf_counter() - annotate_started)
+
+            # Print time (inference-only)
+            for class_name, n_detections in detections_info.items():
+                s += f"{n_detections} {class_name}{'s' * (n_detections > 1)}, "
 
-            s += '%gx%g ' % im.shape[2:]  # print string
-            annotator = Annotator(
-                im0, line_width=line_thickness, example=str(names))
-
-            detections_info = {}
-            if len(det):
-                # Rescale boxes from img_size to im0 size
-                det[:, :4] = scale_boxes(
-                    im.shape[2:], det[:, :4], im0.shape).round()
-
-                for c in det[:, 5].unique():
-                    n_tensor = (det[:, 5] == c).sum()  # detections per class
-                    class_name = names[int(c)]
-                    n_detections = n_tensor.item()
-                    detections_info[class_name] = n_detections
-                # Write results
-                for *xyxy, conf, cls in reversed(det):
-                    # Detection bboxes
-                    c = int(cls)  # integer class
-                    label = None if hide_labels else (
-                        names[c] if hide_conf else f'{names[c]} {conf:.2f}')
-                    annotator.box_label(xyxy, label, color=colors(c, True))
-
-                # Print time (inference-only)
-                for class_name, n_detections in detections_info.items():
-                    s += f"{n_detections} {class_name}{'s' * (n_detections > 1)}, "
-
-            if on_metric_detected is not None:
-                callback_executor.submit(
-                    on_metric_detected, detections_info)
+            if timed_on_metric_detected is not None:
+                callback_executor.submit_latest('metric', timed_on_metric_detected, detections_info)
 
             # Stream results
-            im0 = annotator.result()
-            streamer.next_frame(im0)
+            if render:
+                encode_started = time.perf_counter()
+                streamer.next_frame(im0)
+                stream_metrics.observe('encode_write', time.perf_counter() - encode_started)
+                stream_metrics.increment('streamed')
 
         LOGGER.info(
-            f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
-
-    t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
-    LOGGER.info(
-        f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
+            f"{s}{'' if len(det) else '(no detections), '}"
+            f"{'(reused detections)' if inference_dt is None else f'{inference_dt * 1E3:.1f}ms'}")
+
+    passthrough = output_mode == 'passthrough'
+    if passthrough and metadata_publisher is None:
+        raise ValueError('Passthrough mode needs a metadata publisher')
+
+    # Capture, inference and annotate+encode run concurrently, connected by bounded queues
+    frames_queue = StageQueue(queue_size, DropPolicy[drop_policy.upper()])
+    predictions_queue = StageQueue(queue_size, DropPolicy[drop_policy.upper()])
+    stream_metrics.track_queues(frames=frames_queue, predictions=predictions_queue)
+    if viewer_watcher is not None:
+        viewer_watcher.start()
+    try:
+        Pipeline([
+            PipelineStage('capture',
+                          source=timed_frames(
+                              dataset if frame_grabber else throttle(dataset, max(dataset.fps) if webcam else 0),
+                              stream_metrics),
+                          output_queue=frames_queue),
+            PipelineStage('inference', infer, frames_queue, predictions_queue),
+            PipelineStage('encode', annotate_and_stream, predictions_queue),
+        ], report_interval=stats_interval, stop_event=stop_event).run()
+    finally:
+        if frame_grabber is not None:
+            frame_grabber.stop()
+        if streamer is not None:
+            streamer.stop_stream()
+        if viewer_watcher is not None:
+            viewer_watcher.stop()
+        # Saves the last detections
+        callback_executor.shutdown(wait=True)
+
+    if seen:
+        t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
+        LOGGER.info(
+            f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
+    for gate in motion_gates:
+        LOGGER.info(f"Motion gate: {gate.executed} inferences executed, {gate.skipped} skipped")
+    LOGGER.info(f"Callbacks: {callback_executor.executed} executed, {callback_executor.coalesced} coalesced")
 
     if update:
         # update model (to fix SourceChangeWarning)
         strip_optimizer(weights[0])
 
 
+def ring_frames(grabber: SharedFrameGrabber, imgsz, stride, auto, stop_event: threading.Event):
+    """
+    Yields the new frames of the grabber in the format of LoadStreams until stop_event is set.
+    The frames are views of the ring slots, their sequences are yielded in place of the capture.
+    """
+    last_sequence = -1
+    while not stop_event.is_set():
+        sequence, frame = grabber.latest()
+        if frame is None or sequence == last_sequence:
+            sleep(MULTI_STREAM_IDLE_SLEEP)
+            continue
+        last_sequence = sequence
+        im = letterbox(frame, imgsz, stride=stride, auto=auto)[0].transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        yield [grabber.source], np.ascontiguousarray(im)[None], [frame], [sequence], ''
+
+
+def worker_batches(worker: MultiStreamWorker, stop_event: threading.Event):
+    """
+    Yields the batches of new frames of the worker streams until stop_event is set.
+    The time waited for each batch is observed as the decode wait of its streams.
+    """
+    started = time.perf_counter()
+    while not stop_event.is_set():
+        batch = worker.next_batch()
+        if batch:
+            waited = time.perf_counter() - started
+            for stream, _, _ in batch:
+                if stream.metrics is not None:
+                    stream.metrics.observe('decode_wait', waited)
+                    stream.metrics.increment('frames_in')
+            yield batch
+            started = time.perf_counter()
+        else:
+            sleep(MULTI_STREAM_IDLE_SLEEP)
+
+
+def run_multi_stream_inference(
+        model,
+        worker: MultiStreamWorker,
+        imgsz=(480, 640),  # inference size (height, width)
+        conf_thres=0.25,  # confidence threshold
+        iou_thres=0.45,  # NMS IOU threshold
+        max_det=1000,  # maximum detections per image
+        classes=None,  # filter by class: --class 0, or --class 0 2 3
+        agnostic_nms=False,  # class-agnostic NMS
+        line_thickness=3,  # bounding box thickness (pixels)
+        hide_labels=False,  # hide labels
+        hide_conf=False,  # hide confidences
+        queue_size=2,  # batches buffered between pipeline stages
+        drop_policy='keep_latest',  # what to do when a stage falls behind: keep_latest, drop_incoming or block
+        stats_interval=10,  # seconds between pipeline throughput reports
+        stop_event=None,  # threading.Event that stops the pipeline when set
+):
+    """
+    Runs the detection model over the latest frame of every stream served by the worker.
+    The frames are letterboxed to the same size so they are inferred in a single batch,
+    and the detections are fanned out to each device's streamer and callbacks.
+    """
+    names = model.names
+    model.warmup(imgsz=(1 if model.pt or model.triton else worker.max_streams, 3, *imgsz))  # warmup
+    seen, dt = 0, (Profile(), Profile(), Profile())
+    stop_event = stop_event or threading.Event()
+
+    @smart_inference_mode()
+    def infer(batch):
+        captured_ms = int(time.time() * 1E3)
+        # Only the streams whose scene changed go through the detector
+        pending = [(i, frame) for i, (stream, _, frame) in enumerate(batch) if worker.needs_inference(stream, frame)]
+        detections = {}
+        if pending:
+            with dt[0]:
+                im = np.stack([
+                    letterbox(frame, imgsz, stride=model.stride, auto=False)[0].transpose((2, 0, 1))[::-1]
+                    for _, frame in pending
+                ])  # HWC to CHW, BGR to RGB
+                im = torch.from_numpy(np.ascontiguousarray(im)).to(model.device)
+                im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
+                im /= 255  # 0 - 255 to 0.0 - 1.0
+
+            with dt[1]:
+                pred = model(im)
+
+            with dt[2]:
+                pred = non_max_suppression(
+                    pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+
+            for (i, _), det in zip(pending, pred):
+                batch[i][0].last_detections = det.clone()
+                detections[i] = det
+                if batch[i][0].metrics is not None:
+                    observe_profiles(batch[i][0].metrics, dt)
+            LOGGER.info(f"Batch of {len(pending)}/{len(batch)} streams, {dt[1].dt * 1E3:.1f}ms")
+
+        # Detections are cloned as they are rescaled in place
+        pred = [detections[i] if i in detections else stream.last_detections.clone()
+                for i, (stream, _, _) in enumerate(batch)]
+        return batch, tuple(imgsz), pred, captured_ms
+
+    @smart_inference_mode()
+    def annotate_and_publish(item):
+        nonlocal seen
+        batch, im_shape, pred, captured_ms = item
+        for (stream, sequence, frame), det in zip(batch, pred):
+            seen += 1
+            render = stream.metadata_publisher is None and worker.should_render(stream)
+            # Frames of a ring are copied before being drawn on and queued to the streamer,
+            # and dropped if the decoder reused their slot while they were inferred
+            if render:
+                frame = worker.own_frame(stream, sequence, frame)
+            elif not worker.is_current(stream, sequence):
+                frame = None
+            if frame is None:
+                if stream.metrics is not None:
+                    stream.metrics.increment('stale')
+                continue
+            annotate_started = time.perf_counter()
+            if stream.metadata_publisher is not None:
+                # Passthrough stream, the source is relayed and only the detections are sent
+                im0, detections_info = None, publish_metadata(
+                    stream.metadata_publisher, stream.device_id, seen, captured_ms, det, im_shape, frame, names)
+            elif render:
+                im0, detections_info = annotate_detections(
+                    det, im_shape, frame, names, line_thickness, hide_labels, hide_conf)
+            else:
+                im0, detections_info = None, count_detections(det, names)
+            if stream.metrics is not None:
+                stream.metrics.observe('annotate', time.perf_counter() - annotate_started)
+            try:
+                worker.publish(stream, im0, detections_info)
+            except Exception as e:
+                LOGGER.error(f"Error publishing frame of device {stream.device_id}: {e}")
+
+    batches_queue = StageQueue(queue_size, DropPolicy[drop_policy.upper()])
+    predictions_queue = StageQueue(queue_size, DropPolicy[drop_policy.upper()])
+    Pipeline([
+        PipelineStage('capture', source=worker_batches(worker, stop_event), output_queue=batches_queue),
+        PipelineStage('inference', infer, batches_queue, predictions_queue),
+        PipelineStage('encode', annotate_and_publish, predictions_queue),
+    ], report_interval=stats_interval, stop_event=stop_event).run()
+
+    if seen:
+        t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
+        LOGGER.info(
+            f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
+
+
+def run_multi_stream_worker(opt, stream_factory, metrics=None, readiness=None):
+    """
+    Loads the model once and serves the device streams assigned through the control socket.
+    Blocks until the process is terminated.
+    """
+    readiness = readiness or ReadinessReporter()
+    model, imgsz = load_model(opt.weights, opt.device, opt.dnn, opt.data, opt.half, opt.imgsz)
+    logging_utils.logSuccess(1, "Loaded model")
+    readiness.report(WorkerStage.MODEL_LOADED)
+
+    worker = MultiStreamWorker(
+        opt.max_streams,
+        stream_factory,
+        state_file=str(Path(opt.control_socket).with_suffix('.streams.json')),
+        framerate=FPS,
+        streamer_factory=lambda *args: build_streamer(*args, queue_size=opt.stream_queue_size),
+        metrics=metrics
+    )
+    control_server = WorkerControlServer(opt.control_socket, worker.handlers())
+    try:
+        worker.restore()
+        control_server.start()
+        logging_utils.logSuccess(2, "Worker ready to receive streams")
+        readiness.report(WorkerStage.WORKER_READY)
+        run_multi_stream_inference(
+            model,
+            worker,
+            imgsz=imgsz,
+            conf_thres=opt.conf_thres,
+            iou_thres=opt.iou_thres,
+            max_det=opt.max_det,
+            classes=opt.classes,
+            agnostic_nms=opt.agnostic_nms,
+            line_thickness=opt.line_thickness,
+            hide_labels=opt.hide_labels,
+            hide_conf=opt.hide_conf,
+            queue_size=opt.queue_size,
+            drop_policy=opt.drop_policy,
+            stats_interval=opt.stats_interval
+        )
+    finally:
+        control_server.stop()
+        worker.close()
+        logging_utils.logShutdown()
+
+
+def build_destination_urls(media_server_cfg, source):
+    """
+    Builds the url of the processed stream of the given source on the media server.
+    Returns the public url and the url with the write credentials.
+    """
+    source_path = source.split("/", 3)[3]
+    if media_server_cfg['secure'] == "True":
+        destination_port = media_server_cfg['rtsps_port']
+        protocol = "rtsps"
+    else:
+        destination_port = media_server_cfg['rtsp_port']
+        protocol = "rtsp"
+
+    destination_stream_url = f"{protocol}://{media_server_cfg['destination_host']}:{destination_port}/{source_path}/detected"
+
+    destination_authed_stream_url = destination_stream_url.replace(f"{protocol}://", f"{protocol}://{media_server_cfg['write_user']}:{media_server_cfg['write_password']}@")
+    return destination_stream_url, destination_authed_stream_url
+
+
+def build_viewer_watcher(media_server_cfg, destination_stream_url, opt):
+    """
+    Builds the watcher of the viewers of the processed stream,
+    None if the media server API is not configured, so the stream is always rendered.
+    """
+    if not media_server_cfg['api_url']:
+        return None
+    return ViewerWatcher(
+        MediaServerViewerProbe(media_server_cfg['api_url']),
+        urlparse(destination_stream_url).path.lstrip('/'),
+        opt.viewer_poll_interval,
+        opt.idle_fps
+    )
+
+
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--weights', nargs='+', type=str,
@@ -284,7 +739,51 @@ def parse_opt():
     parser.add_argument('--vid-stride', type=int, default=1,
                         help='video frame-rate stride')
     parser.add_argument('--device-id', type=int, default=-1,
-                        help='device\'s id where the metrics and processed stream are sent to', required=True)
+                        help='device\'s id where the metrics and processed stream are sent to')
+    parser.add_argument('--queue-size', type=int, default=2,
+                        help='frames buffered between the capture, inference and encode stages')
+    parser.add_argument('--drop-policy', type=str, default='keep_latest',
+                        choices=['keep_latest', 'drop_incoming', 'block'],
+                        help='what to do when a stage falls behind, keep_latest always infers on the newest frame')
+    parser.add_argument('--stats-interval', type=float, default=10,
+                        help='seconds between pipeline throughput reports')
+    parser.add_argument('--motion-threshold', type=float, default=0.005,
+                        help='fraction of changed pixels needed to run the detector, 0 disables the motion gate')
+    parser.add_argument('--motion-pixel-threshold', type=int, default=25,
+                        help='grayscale difference (0-255) for a pixel to count as changed')
+    parser.add_argument('--motion-max-skip', type=int, default=30,
+                        help='force a full inference at least every N frames')
+    parser.add_argument('--frame-ring-slots', type=int, default=8,
+                        help='frames kept in the shared memory ring filled by a decoder process, 0 decodes in threads')
+    parser.add_argument('--stream-queue-size', type=int, default=2,
+                        help='frames waiting to be encoded before the oldest are dropped, 0 writes to ffmpeg synchronously')
+    parser.add_argument('--viewer-poll-interval', type=float, default=2,
+                        help='seconds between checks of the processed stream viewers on the media server')
+    parser.add_argument('--idle-fps', type=float, default=1,
+                        help='frames encoded per second while nobody watches, keeping the stream published')
+    parser.add_argument('--output-mode', type=str, default='annotated', choices=['annotated', 'passthrough'],
+                        help='annotated re-encodes the video with the boxes drawn, '
+                             'passthrough relays the source and sends the boxes on the metadata channel')
+    parser.add_argument('--metadata-host', type=str, default=None,
+                        help='host the detections are sent to in passthrough mode, overrides the worker config')
+    parser.add_argument('--metadata-port', type=int, default=None,
+                        help='UDP port the detections are sent to in passthrough mode, overrides the worker config')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='port of the HTTP endpoint serving the worker metrics on /metrics, 0 disables it')
+    parser.add_argument('--metrics-socket', type=str, default=None,
+                        help='unix socket answering the METRICS control command of a single stream worker')
+    parser.add_argument('--metric-spool', type=str, default=None,
+                        help='directory the metrics are spooled to before being saved, kept in memory if unset')
+    parser.add_argument('--metric-transport', type=str, default='database', choices=['database', 'broker'],
+                        help='database to save the metrics and processed streams, broker to publish them to the manager')
+    parser.add_argument('--readiness-socket', type=str, default=None,
+                        help='unix socket of the manager the stages reached by the worker are reported to')
+    parser.add_argument('--readiness-id', type=str, default=None,
+                        help='name the worker reports its stages under, the container name')
+    parser.add_argument('--max-streams', type=int, default=1,
+                        help='maximum number of device streams served by a multi-stream worker')
+    parser.add_argument('--control-socket', type=str, default=None,
+                        help='unix socket to receive stream assignments on, enables the multi-stream worker mode')
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
@@ -292,10 +791,21 @@ def parse_opt():
 
 
 async def main(opt):
+    readiness = ReadinessReporter(opt.readiness_socket, opt.readiness_id)
+    try:
+        await serve(opt, readiness)
+    except Exception as e:
+        readiness.report(WorkerStage.FATAL_ERROR, str(e))
+        raise
+    finally:
+        readiness.close()
+
+
+async def serve(opt, readiness):
     check_requirements(exclude=('tensorboard', 'thop'))
 
     device_id = opt.device_id
-    if device_id == -1:
+    if device_id == -1 and opt.control_socket is None:
         print("Please provide a device id to send the metrics and processed stream to")
         exit(1)
 
@@ -309,58 +819,184 @@ async def main(opt):
     )
 
     media_server_cfg = worker_cfg["MEDIA_SERVER"]
+    worker_metrics = WorkerMetrics()
+    metrics_server = MetricsHttpServer(worker_metrics, opt.metrics_port) if opt.metrics_port else None
+    if metrics_server is not None:
+        metrics_server.start()
+    metadata_channel_cfg = worker_cfg["METADATA_CHANNEL"]
+    metadata_publisher = UdpMetadataPublisher(
+        opt.metadata_host or metadata_channel_cfg['host'],
+        opt.metadata_port or metadata_channel_cfg['port']
+    )
+    metric_writer_cfg = worker_cfg["METRIC_WRITER"]
+    event_publisher = None
+    if opt.metric_transport == 'broker':
+        rabbitmq_cfg = worker_cfg["RABBITMQ"]
+        event_publisher = BrokerEventPublisher(
+            f"amqp://{rabbitmq_cfg['user']}:{rabbitmq_cfg['password']}"
+            f"@{rabbitmq_cfg['host']}:{rabbitmq_cfg['port']}/",
+            rabbitmq_cfg['metrics_exchange']
+        )
 
-    source_path = opt.source.split("/", 3)[3]
-    print(media_server_cfg['secure'])
-    if media_server_cfg['secure'] == "True":
-        destination_port = media_server_cfg['rtsps_port']
-        protocol = "rtsps"
-    else:
-        destination_port = media_server_cfg['rtsp_port']
-        protocol = "rtsp"
+    def open_connection_manager():
+        if event_publisher is not None:
+            # The manager writes the published events, no connection is needed
+            return nullcontext()
+        logging.info("Connecting to %s", database_url)
+        return ConnectionPool(database_url, min_size=5)
+
+    def build_processed_service(connection_manager, processed_device_id):
+        if event_publisher is not None:
+            return BrokerProcessedStreamService(event_publisher, processed_device_id)
+        return ProcessedStreamService(
+            connection_manager,
+            ProcessedStreamDAOFactory(),
+            processed_device_id
+        )
 
+    def build_metric_writer(connection_manager):
+        sink = BrokerMetricSink(event_publisher) if event_publisher is not None else None
+        if opt.metric_spool is not None:
+            # Survives database outages and worker crashes
+            return SpooledMetricWriter(
+                connection_manager,
+                MetricDAOFactory(),
+                MetricSpool(
+                    opt.metric_spool,
+                    metric_writer_cfg['spool_segment_bytes'],
+                    metric_writer_cfg['spool_max_bytes']
+                ),
+                metric_writer_cfg['flush_interval'],
+                metric_writer_cfg['max_pending'],
+                sink
+            )
+        return MetricWriter(
+            connection_manager,
+            MetricDAOFactory(),
+            metric_writer_cfg['flush_interval'],
+            metric_writer_cfg['max_pending'],
+            DropPolicy[metric_writer_cfg['overflow_policy'].upper()],
+            sink
+        )
+    smoothing_cfg = worker_cfg["METRIC_SMOOTHING"]
 
+    def build_metrics_service(connection_manager, metric_writer, metrics_device_id):
+        # Each device smooths its own counts
+        return DetectionMetricsService(
+            connection_manager,
+            MetricDAOFactory(),
+            metrics_device_id,
+            metric_writer,
+            build_count_smoother(
+                SmoothingMode[smoothing_cfg['mode'].upper()],
+                smoothing_cfg['window'],
+                smoothing_cfg['min_dwell']
+            ),
+            worker_metrics.for_device(metrics_device_id)
+        )
 
-    destination_stream_url = f"{protocol}://{media_server_cfg['destination_host']}:{destination_port}/{source_path}/detected"
+    if opt.control_socket is not None:
+        with open_connection_manager() as connection_manager:
+            # Shared by the streams, so the metrics of all of them are written together
+            metric_writer = build_metric_writer(connection_manager)
+            metric_writer.start()
+
+            def stream_factory(stream_device_id, source, options):
+                stream_url, authed_stream_url = build_destination_urls(media_server_cfg, source)
+                passthrough = options.get('output_mode', opt.output_mode) == 'passthrough'
+                processed_service = build_processed_service(connection_manager, stream_device_id)
+                return DeviceStream(
+                    device_id=stream_device_id,
+                    source=source,
+                    destination_stream_url=authed_stream_url,
+                    grabber=SharedFrameGrabber(source, opt.frame_ring_slots)
+                    if opt.frame_ring_slots > 0 else FrameGrabber(source),
+                    options=options,
+                    motion_gate=MotionGate(
+                        options.get('motion_threshold', opt.motion_threshold),
+                        options.get('motion_pixel_threshold', opt.motion_pixel_threshold),
+                        options.get('motion_max_skip', opt.motion_max_skip)
+                    ),
+                    on_metric_detected=callbacks.get_on_metric_received_callback(
+                        build_metrics_service(connection_manager, metric_writer, stream_device_id)),
+                    on_stream_started=callbacks.get_on_stream_started_callback(
+                        processed_service, stream_url),
+                    on_stream_stopped=callbacks.get_on_stream_stopped_callback(
+                        processed_service),
+                    viewer_watcher=None if passthrough else build_viewer_watcher(media_server_cfg, stream_url, opt),
+                    streamer=PassthroughStreamer(source, authed_stream_url) if passthrough else None,
+                    metadata_publisher=metadata_publisher if passthrough else None
+                )
+
+            try:
+                run_multi_stream_worker(opt, stream_factory, worker_metrics, readiness)
+            finally:
+                metric_writer.stop()
+                metadata_publisher.close()
+                if event_publisher is not None:
+                    event_publisher.close()
+                if metrics_server is not None:
+                    metrics_server.stop()
+        return
 
-    destination_authed_stream_url = destination_stream_url.replace(f"{protocol}://", f"{protocol}://{media_server_cfg['write_user']}:{media_server_cfg['write_password']}@")
+    print(media_server_cfg['secure'])
+    destination_stream_url, destination_authed_stream_url = build_destination_urls(
+        media_server_cfg, opt.source)
 
     logging.info("Destination URL: %s", destination_stream_url)
-    logging.info("Connecting to %s", database_url)
 
 
 
-    with ConnectionPool(database_url, min_size=5) as connection_manager:
+    with open_connection_manager() as connection_manager:
 
-        metrics_service = DetectionMetricsService(
-            connection_manager,
-            MetricDAOFactory(),
-            device_id
-        )
+        metric_writer = build_metric_writer(connection_manager)
+        metric_writer.start()
+        metrics_service = build_metrics_service(connection_manager, metric_writer, device_id)
 
-        processed_service = ProcessedStreamService(
-            connection_manager,
-            ProcessedStreamDAOFactory(),
-            device_id
-        )
+        processed_service = build_processed_service(connection_manager, device_id)
 
         on_metric_detected = callbacks.get_on_metric_received_callback(
             metrics_service)
         on_detection_started = callbacks.get_on_stream_started_callback(
             processed_service,destination_stream_url)
+        # The manager reads the metrics through the socket it would send the control commands to
+        metrics_control_server = None
+        if opt.metrics_socket is not None:
+            metrics_control_server = WorkerControlServer(opt.metrics_socket, {
+                WorkerCommand.METRICS: lambda request: {"metrics": worker_metrics.snapshot()}
+            })
+            metrics_control_server.start()
+
         # Blocks the main thread, calling the callback functions in another
-        run_inference_model(
-            **vars(opt),
-            on_metric_detected=on_metric_detected,
-            on_stream_started=on_detection_started,
-            destination_stream_url=destination_authed_stream_url
-        )
+        try:
+            run_inference_model(
+                **{k: v for k, v in vars(opt).items()
+                   if k not in MULTI_STREAM_OPTIONS + VIEWER_OPTIONS + METADATA_OPTIONS + METRICS_OPTIONS
+                   + READINESS_OPTIONS},
+                stream_metrics=worker_metrics.for_device(device_id),
+                readiness=readiness,
+                viewer_watcher=None if opt.output_mode == 'passthrough'
+                else build_viewer_watcher(media_server_cfg, destination_stream_url, opt),
+                metadata_publisher=metadata_publisher,
+                on_metric_detected=on_metric_detected,
+                on_stream_started=on_detection_started,
+                destination_stream_url=destination_authed_stream_url
+            )
+        finally:
+            metric_writer.stop()
+            metadata_publisher.close()
+            if metrics_control_server is not None:
+                metrics_control_server.stop()
+            if metrics_server is not None:
+                metrics_server.stop()
         try:
             # Make sure the processed stream url is not on the database as it is not being used anymore
             processed_service.save_processed_stream(None)
 
         except Exception as e:
             logging.error("Error making db consistent: %s", e)
+        if event_publisher is not None:
+            event_publisher.close()
     logging.info("Finished closing connection pool.")
 
 if __name__ == '__main__':